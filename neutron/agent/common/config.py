@@ -29,6 +29,14 @@ ROOT_HELPER_OPTS = [
                help=_('Root helper application.')),
 ]
 
+ROOT_HELPER_DAEMON_OPTS = [
+    cfg.StrOpt('root_helper_daemon',
+               help=_('Root helper daemon application to use when possible. '
+                      'When set, privileged commands are sent to a single '
+                      'long-lived helper process instead of spawning a new '
+                      'root helper for every command.')),
+]
+
 AGENT_STATE_OPTS = [
     cfg.FloatOpt('report_interval', default=30,
                  help=_('Seconds between nodes reporting state to server; '
@@ -36,6 +44,13 @@ AGENT_STATE_OPTS = [
                         'is half or less than agent_down_time.')),
 ]
 
+DEVICE_PROCESSING_OPTS = [
+    cfg.IntOpt('device_processing_workers', default=4,
+               help=_('The maximum number of networks whose devices are '
+                      'processed concurrently by the L2 agent. Devices of '
+                      'a same network are always processed in order.')),
+]
+
 INTERFACE_DRIVER_OPTS = [
     cfg.StrOpt('interface_driver',
                help=_("The driver used to manage the virtual interface.")),
@@ -78,12 +93,17 @@ def register_root_helper(conf):
     # The first call is to ensure backward compatibility
     conf.register_opts(ROOT_HELPER_OPTS)
     conf.register_opts(ROOT_HELPER_OPTS, 'AGENT')
+    conf.register_opts(ROOT_HELPER_DAEMON_OPTS, 'AGENT')
 
 
 def register_agent_state_opts_helper(conf):
     conf.register_opts(AGENT_STATE_OPTS, 'AGENT')
 
 
+def register_device_processing_opts_helper(conf):
+    conf.register_opts(DEVICE_PROCESSING_OPTS, 'AGENT')
+
+
 def register_interface_driver_opts_helper(conf):
     conf.register_opts(INTERFACE_DRIVER_OPTS)
 
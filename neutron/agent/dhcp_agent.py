@@ -13,14 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import os
 import sys
+import time
 
 import eventlet
 eventlet.monkey_patch()
 
 import netaddr
 from oslo.config import cfg
+from oslo import messaging
 
 from neutron.agent.common import config
 from neutron.agent.linux import dhcp
@@ -37,6 +40,7 @@ from neutron.common import utils
 from neutron import context
 from neutron import manager
 from neutron.openstack.common import importutils
+from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
 from neutron.openstack.common import service
@@ -60,16 +64,31 @@ class DhcpAgent(manager.Manager):
                            "enable_isolated_metadata = True")),
         cfg.IntOpt('num_sync_threads', default=4,
                    help=_('Number of threads to use during sync process.')),
+        cfg.IntOpt('num_event_threads', default=4,
+                   help=_('Number of threads processing the events of '
+                          'different networks concurrently.')),
         cfg.StrOpt('metadata_proxy_socket',
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.FloatOpt('reload_allocations_delay', default=0,
+                     help=_('Number of seconds to wait before reloading the '
+                            'allocations of a network after a port event, '
+                            'so that the events received meanwhile are '
+                            'applied with a single reload. 0 reloads the '
+                            'allocations on each event.')),
     ]
 
     def __init__(self, host=None):
         super(DhcpAgent, self).__init__(host=host)
         self.needs_resync_reasons = []
+        # The networks to fetch and reconfigure on the next resync, even if
+        # they did not change
+        self.needs_resync_network_ids = set()
         self.conf = cfg.CONF
+        self._event_queue = NetworkEventQueue(self.conf.num_event_threads)
+        # The ids of the networks waiting for their allocations reload
+        self._pending_reloads = set()
         self.cache = NetworkCache()
         self.root_helper = config.get_root_helper(self.conf)
         self.dhcp_driver_cls = importutils.import_class(self.conf.dhcp_driver)
@@ -136,7 +155,7 @@ class DhcpAgent(manager.Manager):
                           'that the network and/or its subnet(s) still exist.')
                         % {'net_id': network.id, 'action': action})
         except Exception as e:
-            self.schedule_resync(e)
+            self.schedule_resync(e, network.id)
             if (isinstance(e, n_rpc.RemoteError)
                 and e.exc_type == 'NetworkNotFound'
                 or isinstance(e, exceptions.NetworkNotFound)):
@@ -145,36 +164,58 @@ class DhcpAgent(manager.Manager):
                 LOG.exception(_('Unable to %(action)s dhcp for %(net_id)s.')
                               % {'net_id': network.id, 'action': action})
 
-    def schedule_resync(self, reason):
+    def schedule_resync(self, reason, network_id=None):
         """Schedule a resync for a given reason."""
         self.needs_resync_reasons.append(reason)
+        if network_id:
+            self.needs_resync_network_ids.add(network_id)
 
     @utils.synchronized('dhcp-agent')
     def sync_state(self):
-        """Sync the local DHCP state with Neutron."""
+        """Sync the local DHCP state with Neutron.
+
+        Only the networks whose digest differs from the server one, and the
+        networks which failed to be configured, are fetched and configured.
+        The queued events are held until the fetched networks are configured
+        so that the events received meanwhile are applied after them.
+        """
         LOG.info(_('Synchronizing state'))
         pool = eventlet.GreenPool(cfg.CONF.num_sync_threads)
         known_network_ids = set(self.cache.get_network_ids())
+        resync_network_ids = self.needs_resync_network_ids
+        self.needs_resync_network_ids = set()
 
+        self._event_queue.pause()
         try:
-            active_networks = self.plugin_rpc.get_active_networks_info()
-            active_network_ids = set(network.id for network in active_networks)
+            digests = self.cache.get_digests()
+            for network_id in resync_network_ids:
+                digests.pop(network_id, None)
+            active_network_ids, active_networks = (
+                self.plugin_rpc.get_active_networks_delta(digests))
+            LOG.debug(_('%(changed)d of the %(active)d active networks '
+                        'changed'), {'changed': len(active_networks),
+                                     'active': len(active_network_ids)})
             for deleted_id in known_network_ids - active_network_ids:
                 try:
-                    self.disable_dhcp_helper(deleted_id)
+                    self._process_network_event(
+                        deleted_id, self.disable_dhcp_helper, deleted_id)
                 except Exception as e:
                     self.schedule_resync(e)
                     LOG.exception(_('Unable to sync network state on deleted '
                                     'network %s'), deleted_id)
 
             for network in active_networks:
-                pool.spawn(self.safe_configure_dhcp_for_network, network)
+                pool.spawn(self._process_network_event, network.id,
+                           self.safe_configure_dhcp_for_network, network)
             pool.waitall()
             LOG.info(_('Synchronizing state complete'))
 
         except Exception as e:
             self.schedule_resync(e)
+            self.needs_resync_network_ids.update(resync_network_ids)
             LOG.exception(_('Unable to sync network state.'))
+        finally:
+            self._event_queue.resume()
 
     @utils.exception_logger()
     def _periodic_resync_helper(self):
@@ -202,7 +243,7 @@ class DhcpAgent(manager.Manager):
                 LOG.warn(_('Network %s has been deleted.'), network_id)
             return network
         except Exception as e:
-            self.schedule_resync(e)
+            self.schedule_resync(e, network_id)
             LOG.exception(_('Network %s info call failed.'), network_id)
 
     def enable_dhcp_helper(self, network_id):
@@ -274,62 +315,117 @@ class DhcpAgent(manager.Manager):
         else:
             self.disable_dhcp_helper(network.id)
 
-    @utils.synchronized('dhcp-agent')
+    def _queue_network_event(self, network_id, key, func, *args):
+        """Queue the processing of an event of a network.
+
+        A pending event of the network with the same key is replaced.
+        """
+        self._event_queue.add(network_id, key, self._process_network_event,
+                              network_id, func, *args)
+
+    def _process_network_event(self, network_id, func, *args):
+        # The events of a network are also serialized with its sync
+        with lockutils.lock('dhcp-network-%s' % network_id):
+            func(*args)
+
     def network_create_end(self, context, payload):
         """Handle the network.create.end notification event."""
         network_id = payload['network']['id']
-        self.enable_dhcp_helper(network_id)
+        self._queue_network_event(network_id, 'network',
+                                  self.enable_dhcp_helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def network_update_end(self, context, payload):
         """Handle the network.update.end notification event."""
         network_id = payload['network']['id']
         if payload['network']['admin_state_up']:
-            self.enable_dhcp_helper(network_id)
+            helper = self.enable_dhcp_helper
         else:
-            self.disable_dhcp_helper(network_id)
+            helper = self.disable_dhcp_helper
+        self._queue_network_event(network_id, 'network', helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def network_delete_end(self, context, payload):
         """Handle the network.delete.end notification event."""
-        self.disable_dhcp_helper(payload['network_id'])
+        network_id = payload['network_id']
+        self._queue_network_event(network_id, 'network',
+                                  self.disable_dhcp_helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def subnet_update_end(self, context, payload):
         """Handle the subnet.update.end notification event."""
         network_id = payload['subnet']['network_id']
-        self.refresh_dhcp_helper(network_id)
+        self._queue_network_event(network_id, 'refresh',
+                                  self.refresh_dhcp_helper, network_id)
 
     # Use the update handler for the subnet create event.
     subnet_create_end = subnet_update_end
 
-    @utils.synchronized('dhcp-agent')
     def subnet_delete_end(self, context, payload):
         """Handle the subnet.delete.end notification event."""
         subnet_id = payload['subnet_id']
         network = self.cache.get_network_by_subnet_id(subnet_id)
         if network:
-            self.refresh_dhcp_helper(network.id)
+            self._queue_network_event(network.id, 'refresh',
+                                      self.refresh_dhcp_helper, network.id)
 
-    @utils.synchronized('dhcp-agent')
     def port_update_end(self, context, payload):
         """Handle the port.update.end notification event."""
         updated_port = dhcp.DictModel(payload['port'])
-        network = self.cache.get_network_by_id(updated_port.network_id)
-        if network:
-            self.cache.put_port(updated_port)
-            self.call_driver('reload_allocations', network)
+        self._queue_network_event(updated_port.network_id,
+                                  ('port', updated_port.id),
+                                  self._port_update, updated_port)
 
     # Use the update handler for the port create event.
     port_create_end = port_update_end
 
-    @utils.synchronized('dhcp-agent')
     def port_delete_end(self, context, payload):
         """Handle the port.delete.end notification event."""
-        port = self.cache.get_port_by_id(payload['port_id'])
+        port_id = payload['port_id']
+        key = ('port', port_id)
+        port = self.cache.get_port_by_id(port_id)
+        if port:
+            network_id = port.network_id
+        else:
+            # The port may only be known by a pending update
+            network_id = self._event_queue.get_network_id(key)
+        if network_id:
+            self._queue_network_event(network_id, key,
+                                      self._port_delete, port_id)
+
+    def _port_update(self, updated_port):
+        network = self.cache.get_network_by_id(updated_port.network_id)
+        if network:
+            self.cache.put_port(updated_port)
+            self._schedule_reload(network)
+
+    def _port_delete(self, port_id):
+        port = self.cache.get_port_by_id(port_id)
         if port:
             network = self.cache.get_network_by_id(port.network_id)
             self.cache.remove_port(port)
+            self._schedule_reload(network)
+
+    def _schedule_reload(self, network):
+        """Reload the allocations of a network, possibly later.
+
+        The reload is queued after the pending events of the network. With a
+        reload_allocations_delay, the events of a network received before
+        the delay expires are applied with a single reload.
+        """
+        delay = self.conf.reload_allocations_delay
+        if delay <= 0:
+            self._reload_pending(network.id)
+        elif network.id not in self._pending_reloads:
+            self._pending_reloads.add(network.id)
+            eventlet.spawn_after(delay, self._reload_pending, network.id)
+
+    def _reload_pending(self, network_id):
+        self._pending_reloads.discard(network_id)
+        self._queue_network_event(network_id, 'reload',
+                                  self._reload_allocations, network_id)
+
+    def _reload_allocations(self, network_id):
+        # The network may have been updated or deleted meanwhile
+        network = self.cache.get_network_by_id(network_id)
+        if network:
             self.call_driver('reload_allocations', network)
 
     def enable_isolated_metadata_proxy(self, network):
@@ -386,6 +482,97 @@ class DhcpAgent(manager.Manager):
         pm.disable()
 
 
+class NetworkEventQueue(object):
+    """Queue of the events to process for each network.
+
+    The events of a network are processed one at a time, in the order they
+    were queued, while the events of different networks are processed
+    concurrently by a bounded pool of green threads. An event replaces the
+    pending event of its network with the same key and moves after the other
+    pending events, so that a burst of events is processed once. The queue
+    can be paused, events are then queued but not processed until it is
+    resumed.
+    """
+
+    def __init__(self, size):
+        self._pool = eventlet.GreenPool(size)
+        # The pending events of each network, by key
+        self._events = {}
+        # The networks with pending events that no worker is processing
+        self._ready = collections.deque()
+        self._paused = False
+        self._processed = 0
+        self._total_latency = 0
+        self._max_latency = 0
+
+    def add(self, network_id, key, func, *args):
+        events = self._events.get(network_id)
+        if events is None:
+            events = self._events[network_id] = collections.OrderedDict()
+            self._ready.append(network_id)
+        events.pop(key, None)
+        events[key] = (func, args, time.time())
+        if (not self._paused and network_id in self._ready and
+            self._pool.free()):
+            self._pool.spawn_n(self._process)
+
+    def pause(self):
+        """Stop processing events, the events being processed complete."""
+        self._paused = True
+
+    def resume(self):
+        """Process the events queued while the queue was paused."""
+        self._paused = False
+        for i in range(min(len(self._ready), self._pool.free())):
+            self._pool.spawn_n(self._process)
+
+    def get_network_id(self, key):
+        """Returns the network of a pending event, None if unknown."""
+        for network_id, events in self._events.iteritems():
+            if key in events:
+                return network_id
+
+    def _process(self):
+        while self._ready and not self._paused:
+            network_id = self._ready.popleft()
+            events = self._events[network_id]
+            while events and not self._paused:
+                key, (func, args, queued_at) = events.popitem(last=False)
+                latency = time.time() - queued_at
+                self._processed += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                try:
+                    func(*args)
+                except Exception:
+                    LOG.exception(_('Unable to process the %(key)s event of '
+                                    'network %(net_id)s'),
+                                  {'key': key, 'net_id': network_id})
+            if events:
+                # Paused, the network is processed first on resume
+                self._ready.appendleft(network_id)
+            else:
+                del self._events[network_id]
+
+    def get_state(self):
+        """Returns the number of pending events and the latency of the
+        events processed since the previous call.
+        """
+        avg_latency = 0
+        if self._processed:
+            avg_latency = self._total_latency / self._processed
+        state = {
+            'pending_events': sum(len(events)
+                                  for events in self._events.values()),
+            'processed_events': self._processed,
+            'event_avg_latency': round(avg_latency, 3),
+            'event_max_latency': round(self._max_latency, 3)}
+        self._processed = 0
+        self._total_latency = 0
+        self._max_latency = 0
+        return state
+
+
 class DhcpPluginApi(n_rpc.RpcProxy):
     """Agent side of the dhcp rpc API.
 
@@ -393,6 +580,7 @@ class DhcpPluginApi(n_rpc.RpcProxy):
         1.0 - Initial version.
         1.1 - Added get_active_networks_info, create_dhcp_port,
               and update_dhcp_port methods.
+        1.2 - Added get_active_networks_delta.
 
     """
 
@@ -412,6 +600,26 @@ class DhcpPluginApi(n_rpc.RpcProxy):
                                            host=self.host))
         return [dhcp.NetModel(self.use_namespaces, n) for n in networks]
 
+    def get_active_networks_delta(self, digests):
+        """Make a remote process call to retrieve the changed networks.
+
+        Returns the ids of all the active networks, and the info of the
+        active networks whose digest differs from the given one.
+        """
+        try:
+            delta = self.call(self.context,
+                              self.make_msg('get_active_networks_delta',
+                                            digests=digests,
+                                            host=self.host),
+                              version='1.2')
+        except messaging.UnsupportedVersion:
+            # The server has not been upgraded yet, fetch all the networks
+            networks = self.get_active_networks_info()
+            return set(network.id for network in networks), networks
+        return (set(delta['network_ids']),
+                [dhcp.NetModel(self.use_namespaces, n)
+                 for n in delta['networks']])
+
     def get_network_info(self, network_id):
         """Make a remote process call to retrieve network info."""
         network = self.call(self.context,
@@ -535,6 +743,11 @@ class NetworkCache(object):
                 if port.id == port_id:
                     return port
 
+    def get_digests(self):
+        """Returns the DHCP configuration digest of each network."""
+        return dict((network.id, utils.get_dhcp_network_digest(network))
+                    for network in self.cache.values())
+
     def get_state(self):
         net_ids = self.get_network_ids()
         num_nets = len(net_ids)
@@ -572,8 +785,9 @@ class DhcpAgentWithStateReport(DhcpAgent):
 
     def _report_state(self):
         try:
-            self.agent_state.get('configurations').update(
-                self.cache.get_state())
+            configurations = self.agent_state.get('configurations')
+            configurations.update(self.cache.get_state())
+            configurations.update(self._event_queue.get_state())
             ctx = context.get_admin_context_without_session()
             self.state_rpc.report_state(ctx, self.agent_state, self.use_call)
             self.use_call = False
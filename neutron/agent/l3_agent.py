@@ -74,6 +74,9 @@ FLOATING_IP_CIDR_SUFFIX = '/32'
 # Lower value is higher priority
 PRIORITY_RPC = 0
 PRIORITY_SYNC_ROUTERS_TASK = 1
+# The routers without floating IPs are processed last by a full sync
+PRIORITY_SYNC_ACTIVE_ROUTERS = 2
+PRIORITY_SYNC_IDLE_ROUTERS = 3
 DELETE_ROUTER = 1
 
 
@@ -88,6 +91,7 @@ class L3PluginApi(n_rpc.RpcProxy):
               - get_agent_gateway_port
               Needed by the agent when operating in DVR/DVR_SNAT mode
         1.3 - Get the list of activated services
+        1.5 - Get the ids of the routers to sync
 
     """
 
@@ -104,6 +108,12 @@ class L3PluginApi(n_rpc.RpcProxy):
                          self.make_msg('sync_routers', host=self.host,
                                        router_ids=router_ids))
 
+    def get_router_ids(self, context):
+        """Make a remote process call to retrieve the ids of the routers."""
+        return self.call(context,
+                         self.make_msg('get_router_ids', host=self.host),
+                         version='1.5')
+
     def get_external_network_id(self, context):
         """Make a remote process call to retrieve the external network id.
 
@@ -416,6 +426,9 @@ class RouterProcessingQueue(object):
     def add(self, update):
         self._queue.put(update)
 
+    def qsize(self):
+        return self._queue.qsize()
+
     def each_update_to_next_router(self):
         """Grabs the next router from the queue and processes
 
@@ -497,6 +510,14 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.IntOpt('num_router_threads', default=8,
+                   help=_('Number of threads processing the routers '
+                          'concurrently.')),
+        cfg.IntOpt('sync_routers_chunk_size', default=0,
+                   help=_('Number of routers to fetch per request during a '
+                          'full sync. The routers of a chunk are processed '
+                          'while the next chunk is fetched. 0 fetches all '
+                          'the routers in a single request.')),
     ]
 
     def __init__(self, host, conf=None):
@@ -524,6 +545,9 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         self.plugin_rpc = L3PluginApi(topics.L3PLUGIN, host)
         self.fullsync = True
         self.sync_progress = False
+        # The progress of the last full sync
+        self.sync_routers_total = 0
+        self.sync_routers_fetched = 0
 
         # Get the list of service plugins from Neutron Server
         # This is the first place where we contact neutron-server on startup
@@ -1837,7 +1861,7 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
 
     def _process_routers_loop(self):
         LOG.debug("Starting _process_routers_loop")
-        pool = eventlet.GreenPool(size=8)
+        pool = eventlet.GreenPool(size=self.conf.num_router_threads)
         while True:
             pool.spawn_n(self._process_router_update)
 
@@ -1867,16 +1891,16 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         try:
             router_ids = self._router_ids()
             timestamp = timeutils.utcnow()
-            routers = self.plugin_rpc.get_routers(
-                context, router_ids)
-
-            LOG.debug(_('Processing :%r'), routers)
-            for r in routers:
-                update = RouterUpdate(r['id'],
-                                      PRIORITY_SYNC_ROUTERS_TASK,
-                                      router=r,
-                                      timestamp=timestamp)
-                self._queue.add(update)
+            routers = []
+            for chunk in self._fetch_routers(context, router_ids):
+                LOG.debug(_('Processing :%r'), chunk)
+                for r in chunk:
+                    update = RouterUpdate(r['id'],
+                                          self._get_sync_priority(r),
+                                          router=r,
+                                          timestamp=timestamp)
+                    self._queue.add(update)
+                routers.extend(chunk)
             self.fullsync = False
             LOG.debug(_("_sync_routers_task successfully completed"))
         except n_rpc.RPCException:
@@ -1904,6 +1928,47 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
                 ids_to_keep = curr_router_ids | prev_router_ids
                 self._cleanup_namespaces(namespaces, ids_to_keep)
 
+    def _fetch_routers(self, context, router_ids):
+        """Fetch the routers to sync, by chunks of sync_routers_chunk_size.
+
+        Yields each chunk as soon as it is fetched, so that its routers are
+        processed while the next chunk is fetched.
+        """
+        chunk_size = self.conf.sync_routers_chunk_size
+        self.sync_routers_total = self.sync_routers_fetched = 0
+        if chunk_size > 0 and router_ids is None:
+            try:
+                router_ids = self.plugin_rpc.get_router_ids(context)
+            except messaging.UnsupportedVersion:
+                LOG.warning(_LW('Fetching the routers by chunks requires a '
+                                'server upgrade.'))
+                chunk_size = 0
+        if chunk_size <= 0 or router_ids is None:
+            routers = self.plugin_rpc.get_routers(context, router_ids)
+            self.sync_routers_total = self.sync_routers_fetched = len(routers)
+            yield routers
+            return
+
+        self.sync_routers_total = len(router_ids)
+        for i in range(0, len(router_ids), chunk_size):
+            routers = self.plugin_rpc.get_routers(
+                context, router_ids[i:i + chunk_size])
+            self.sync_routers_fetched += len(routers)
+            yield routers
+
+    def _get_sync_priority(self, router):
+        """Returns the priority of a router processed by a full sync.
+
+        The routers with floating IPs are processed first, then the routers
+        with active interfaces.
+        """
+        if router.get(l3_constants.FLOATINGIP_KEY):
+            return PRIORITY_SYNC_ROUTERS_TASK
+        if any(port.get('status') == l3_constants.PORT_STATUS_ACTIVE
+               for port in router.get(l3_constants.INTERFACE_KEY, [])):
+            return PRIORITY_SYNC_ACTIVE_ROUTERS
+        return PRIORITY_SYNC_IDLE_ROUTERS
+
     def after_start(self):
         eventlet.spawn_n(self._process_routers_loop)
         LOG.info(_("L3 agent started"))
@@ -1986,6 +2051,9 @@ class L3NATAgentWithStateReport(L3NATAgent):
         configurations['ex_gw_ports'] = num_ex_gw_ports
         configurations['interfaces'] = num_interfaces
         configurations['floating_ips'] = num_floating_ips
+        configurations['sync_routers_total'] = self.sync_routers_total
+        configurations['sync_routers_fetched'] = self.sync_routers_fetched
+        configurations['router_updates_pending'] = self._queue.qsize()
         try:
             self.state_rpc.report_state(self.context, self.agent_state,
                                         self.use_call)
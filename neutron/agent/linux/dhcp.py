@@ -57,6 +57,11 @@ OPTS = [
         'dnsmasq_lease_max',
         default=(2 ** 24),
         help=_('Limit number of leases to prevent a denial-of-service.')),
+    cfg.BoolOpt('dhcp_incremental_reload', default=False,
+                help=_("Keep the host entries of each network in memory, "
+                       "only rebuild the entries of the ports which changed "
+                       "and only rewrite the dnsmasq config files and signal "
+                       "dnsmasq when their contents changed.")),
 ]
 
 IPV4 = 4
@@ -314,6 +319,11 @@ class Dnsmasq(DhcpLocalProcess):
     NEUTRON_RELAY_SOCKET_PATH_KEY = 'NEUTRON_RELAY_SOCKET_PATH'
     MINIMUM_VERSION = 2.63
 
+    # The host entries and config files of each network, kept across the
+    # driver instances when dhcp_incremental_reload is set
+    _network_states = {}
+    _conf_files_changed = False
+
     @classmethod
     def check_version(cls):
         ver = 0
@@ -425,6 +435,27 @@ class Dnsmasq(DhcpLocalProcess):
                                       self.network.namespace)
         ip_wrapper.netns.execute(cmd)
 
+    def _get_network_state(self):
+        """Returns the host entries and config files of the network."""
+        state = {'subnets': None, 'ports': {}, 'files': {}}
+        if self.conf.dhcp_incremental_reload:
+            state = self._network_states.setdefault(self.network.id, state)
+        return state
+
+    def _remove_config_files(self):
+        self._network_states.pop(self.network.id, None)
+        super(Dnsmasq, self)._remove_config_files()
+
+    def _write_conf_file(self, kind, contents):
+        """Writes a config file unless it already holds contents."""
+        name = self.get_conf_file_name(kind)
+        files = self._get_network_state()['files']
+        if files.get(kind) != contents:
+            utils.replace_file(name, contents)
+            files[kind] = contents
+            self._conf_files_changed = True
+        return name
+
     def reload_allocations(self):
         """Rebuild the dnsmasq config and signal the dnsmasq to reload."""
 
@@ -435,10 +466,15 @@ class Dnsmasq(DhcpLocalProcess):
                         'turned off DHCP: %s'), self.network.id)
             return
 
+        self._conf_files_changed = False
         self._release_unused_leases()
         self._output_hosts_file()
         self._output_addn_hosts_file()
         self._output_opts_file()
+        if not self._conf_files_changed and self.active:
+            LOG.debug(_('Allocations of network %s are unchanged'),
+                      self.network.id)
+            return
         if self.active:
             cmd = ['kill', '-HUP', self.pid]
             utils.execute(cmd, self.root_helper)
@@ -458,23 +494,91 @@ class Dnsmasq(DhcpLocalProcess):
             name,  # Canonical hostname in the format 'hostname[.domain]'.
         )
         """
-        v6_nets = dict((subnet.id, subnet) for subnet in
-                       self.network.subnets if subnet.ip_version == 6)
+        v6_nets = self._get_v6_nets()
         for port in self.network.ports:
-            for alloc in port.fixed_ips:
-                # Note(scollins) Only create entries that are
-                # associated with the subnet being managed by this
-                # dhcp agent
-                if alloc.subnet_id in v6_nets:
-                    addr_mode = v6_nets[alloc.subnet_id].ipv6_address_mode
-                    if addr_mode != constants.DHCPV6_STATEFUL:
-                        continue
-                hostname = 'host-%s' % alloc.ip_address.replace(
-                    '.', '-').replace(':', '-')
-                fqdn = hostname
-                if self.conf.dhcp_domain:
-                    fqdn = '%s.%s' % (fqdn, self.conf.dhcp_domain)
-                yield (port, alloc, hostname, fqdn)
+            for host in self._iter_port_hosts(port, v6_nets):
+                yield host
+
+    def _get_v6_nets(self):
+        return dict((subnet.id, subnet) for subnet in
+                    self.network.subnets if subnet.ip_version == 6)
+
+    def _iter_port_hosts(self, port, v6_nets):
+        """Iterate over the hosts of a port, see _iter_hosts."""
+        for alloc in port.fixed_ips:
+            # Note(scollins) Only create entries that are
+            # associated with the subnet being managed by this
+            # dhcp agent
+            if alloc.subnet_id in v6_nets:
+                addr_mode = v6_nets[alloc.subnet_id].ipv6_address_mode
+                if addr_mode != constants.DHCPV6_STATEFUL:
+                    continue
+            hostname = 'host-%s' % alloc.ip_address.replace(
+                '.', '-').replace(':', '-')
+            fqdn = hostname
+            if self.conf.dhcp_domain:
+                fqdn = '%s.%s' % (fqdn, self.conf.dhcp_domain)
+            yield (port, alloc, hostname, fqdn)
+
+    def _get_host_entries(self):
+        """Returns the host entries of the ports of the network.
+
+        Each entry holds the lines of a port in the hosts file, its lines in
+        the additional hosts file and its leases. In incremental mode, only
+        the entries of the ports which changed since the previous call are
+        rebuilt.
+        """
+        state = self._get_network_state()
+        v6_nets = self._get_v6_nets()
+        subnets = sorted((subnet.id, subnet.ipv6_address_mode)
+                         for subnet in v6_nets.values())
+        if state['subnets'] != subnets:
+            state['subnets'] = subnets
+            state['ports'] = {}
+        old_entries = state['ports']
+        entries = []
+        for port in self.network.ports:
+            key = (port.mac_address,
+                   tuple((alloc.subnet_id, alloc.ip_address)
+                         for alloc in port.fixed_ips),
+                   bool(getattr(port, 'extra_dhcp_opts', False)))
+            entry = old_entries.get(port.id)
+            if not entry or entry[0] != key:
+                entry = (key,) + self._make_port_host_entry(port, v6_nets)
+            entries.append((port.id, entry))
+        state['ports'] = dict(entries)
+        return [entry for port_id, entry in entries]
+
+    def _make_port_host_entry(self, port, v6_nets):
+        host_lines = []
+        addn_host_lines = []
+        leases = []
+        for (port, alloc, hostname, fqdn) in self._iter_port_hosts(port,
+                                                                   v6_nets):
+            host_lines.append(self._format_host_line(port, alloc, fqdn))
+            # It is compulsory to write the `fqdn` before the `hostname` in
+            # order to obtain it in PTR responses.
+            addn_host_lines.append('%s\t%s %s\n' %
+                                   (alloc.ip_address, fqdn, hostname))
+            leases.append((alloc.ip_address, port.mac_address))
+        return ''.join(host_lines), ''.join(addn_host_lines), leases
+
+    def _format_host_line(self, port, alloc, name):
+        # (dzyu) Check if it is legal ipv6 address, if so, need wrap
+        # it with '[]' to let dnsmasq to distinguish MAC address from
+        # IPv6 address.
+        ip_address = alloc.ip_address
+        if netaddr.valid_ipv6(ip_address):
+            ip_address = '[%s]' % ip_address
+
+        LOG.debug(_('Adding %(mac)s : %(name)s : %(ip)s'),
+                  {"mac": port.mac_address, "name": name,
+                   "ip": ip_address})
+
+        if getattr(port, 'extra_dhcp_opts', False):
+            return ('%s,%s,%s,%s%s\n' %
+                    (port.mac_address, name, ip_address, 'set:', port.id))
+        return '%s,%s,%s\n' % (port.mac_address, name, ip_address)
 
     def _output_hosts_file(self):
         """Writes a dnsmasq compatible dhcp hosts file.
@@ -492,31 +596,11 @@ class Dnsmasq(DhcpLocalProcess):
         should receive a dhcp lease, the hosts resolution in itself is
         defined by the `_output_addn_hosts_file` method.
         """
-        buf = six.StringIO()
         filename = self.get_conf_file_name('host')
 
         LOG.debug(_('Building host file: %s'), filename)
-        for (port, alloc, hostname, name) in self._iter_hosts():
-            # (dzyu) Check if it is legal ipv6 address, if so, need wrap
-            # it with '[]' to let dnsmasq to distinguish MAC address from
-            # IPv6 address.
-            ip_address = alloc.ip_address
-            if netaddr.valid_ipv6(ip_address):
-                ip_address = '[%s]' % ip_address
-
-            LOG.debug(_('Adding %(mac)s : %(name)s : %(ip)s'),
-                      {"mac": port.mac_address, "name": name,
-                       "ip": ip_address})
-
-            if getattr(port, 'extra_dhcp_opts', False):
-                buf.write('%s,%s,%s,%s%s\n' %
-                          (port.mac_address, name, ip_address,
-                           'set:', port.id))
-            else:
-                buf.write('%s,%s,%s\n' %
-                          (port.mac_address, name, ip_address))
-
-        utils.replace_file(filename, buf.getvalue())
+        self._write_conf_file('host', ''.join(
+            entry[1] for entry in self._get_host_entries()))
         LOG.debug(_('Done building host file %s'), filename)
         return filename
 
@@ -530,8 +614,14 @@ class Dnsmasq(DhcpLocalProcess):
         return leases
 
     def _release_unused_leases(self):
-        filename = self.get_conf_file_name('host')
-        old_leases = self._read_hosts_file_leases(filename)
+        old_entries = self._get_network_state()['ports']
+        if old_entries:
+            # The leases of the hosts file the entries were written to
+            old_leases = set(lease for entry in old_entries.values()
+                             for lease in entry[3])
+        else:
+            filename = self.get_conf_file_name('host')
+            old_leases = self._read_hosts_file_leases(filename)
 
         new_leases = set()
         for port in self.network.ports:
@@ -551,14 +641,8 @@ class Dnsmasq(DhcpLocalProcess):
         Each line in this file is in the same form as a standard /etc/hosts
         file.
         """
-        buf = six.StringIO()
-        for (port, alloc, hostname, fqdn) in self._iter_hosts():
-            # It is compulsory to write the `fqdn` before the `hostname` in
-            # order to obtain it in PTR responses.
-            buf.write('%s\t%s %s\n' % (alloc.ip_address, fqdn, hostname))
-        addn_hosts = self.get_conf_file_name('addn_hosts')
-        utils.replace_file(addn_hosts, buf.getvalue())
-        return addn_hosts
+        return self._write_conf_file('addn_hosts', ''.join(
+            entry[2] for entry in self._get_host_entries()))
 
     def _output_opts_file(self):
         """Write a dnsmasq compatible options file."""
@@ -671,9 +755,7 @@ class Dnsmasq(DhcpLocalProcess):
                                 Dnsmasq._convert_to_literal_addrs(ip_version,
                                                                   vx_ips))))
 
-        name = self.get_conf_file_name('opts')
-        utils.replace_file(name, '\n'.join(options))
-        return name
+        return self._write_conf_file('opts', '\n'.join(options))
 
     def _make_subnet_interface_ip_map(self):
         ip_dev = ip_lib.IPDevice(
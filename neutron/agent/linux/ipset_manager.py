@@ -13,48 +13,81 @@
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
+from neutron.openstack.common import excutils
+
+
+SWAP_SUFFIX = '-new'
 
 
 class IpsetManager(object):
-    """Wrapper for ipset."""
+    """Wrapper for ipset.
+
+    The manager keeps the members of the sets it manages in memory. Member
+    changes are computed against this state and queued, then all the queued
+    changes are applied by a single 'ipset restore -exist' process on apply.
+    """
 
     def __init__(self, execute=None, root_helper=None, namespace=None):
         self.execute = execute or linux_utils.execute
         self.root_helper = root_helper
         self.namespace = namespace
+        # set name -> set of member ips, as they will be once applied
+        self.ipset_sets = {}
+        self._pending_input = []
 
-    @utils.synchronized('ipset', external=True)
-    def create_ipset_chain(self, chain_name, ethertype):
-        cmd = ['ipset', 'create', '-exist', chain_name, 'hash:ip', 'family',
-               self._get_ipset_chain_type(ethertype)]
-        self._apply(cmd)
-
-    @utils.synchronized('ipset', external=True)
-    def add_member_to_ipset_chain(self, chain_name, member_ip):
-        cmd = ['ipset', 'add', '-exist', chain_name, member_ip]
-        self._apply(cmd)
+    def set_exists(self, set_name):
+        return set_name in self.ipset_sets
 
-    @utils.synchronized('ipset', external=True)
-    def refresh_ipset_chain_by_name(self, chain_name, member_ips, ethertype):
-        new_chain_name = chain_name + '-new'
-        chain_type = self._get_ipset_chain_type(ethertype)
-        process_input = ["create %s hash:ip family %s" % (new_chain_name,
-                                                          chain_type)]
-        for ip in member_ips:
-            process_input.append("add %s %s" % (new_chain_name, ip))
+    def set_members(self, set_name, ethertype, member_ips):
+        """Queue the changes needed for set_name to hold member_ips."""
+        member_ips = set(member_ips)
+        current_ips = self.ipset_sets.get(set_name)
+        if current_ips is None:
+            # The set may exist with stale members (i.e. after an agent
+            # restart): build it aside and swap it with the existing one.
+            new_set_name = set_name + SWAP_SUFFIX
+            chain_type = self._get_ipset_chain_type(ethertype)
+            self._pending_input.append("create %s hash:ip family %s" %
+                                       (set_name, chain_type))
+            self._pending_input.append("create %s hash:ip family %s" %
+                                       (new_set_name, chain_type))
+            self._pending_input.extend("add %s %s" % (new_set_name, ip)
+                                       for ip in sorted(member_ips))
+            self._pending_input.append("swap %s %s" % (new_set_name,
+                                                       set_name))
+            self._pending_input.append("destroy %s" % new_set_name)
+        else:
+            self._pending_input.extend("add %s %s" % (set_name, ip)
+                                       for ip in sorted(member_ips -
+                                                        current_ips))
+            self._pending_input.extend("del %s %s" % (set_name, ip)
+                                       for ip in sorted(current_ips -
+                                                        member_ips))
+        self.ipset_sets[set_name] = member_ips
 
-        self._restore_ipset_chains(process_input)
-        self._swap_ipset_chains(new_chain_name, chain_name)
-        self._destroy_ipset_chain(new_chain_name)
+    def destroy_sets(self, set_names):
+        """Queue the destruction of set_names.
 
-    @utils.synchronized('ipset', external=True)
-    def del_ipset_chain_member(self, chain_name, member_ip):
-        cmd = ['ipset', 'del', chain_name, member_ip]
-        self._apply(cmd)
+        The sets must not be referenced by iptables rules anymore when the
+        changes are applied.
+        """
+        for set_name in set_names:
+            if self.ipset_sets.pop(set_name, None) is not None:
+                self._pending_input.append("destroy %s" % set_name)
 
     @utils.synchronized('ipset', external=True)
-    def destroy_ipset_chain_by_name(self, chain_name):
-        self._destroy_ipset_chain(chain_name)
+    def apply(self):
+        """Apply all the queued changes with one ipset process."""
+        if not self._pending_input:
+            return
+        process_input, self._pending_input = self._pending_input, []
+        try:
+            self._restore_ipset_chains(process_input)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The state of the sets is unknown now, rebuild them
+                # entirely on their next update.
+                self.ipset_sets.clear()
 
     def _apply(self, cmd, input=None):
         input = '\n'.join(input) if input else None
@@ -72,11 +105,3 @@ class IpsetManager(object):
     def _restore_ipset_chains(self, process_input):
         cmd = ['ipset', 'restore', '-exist']
         self._apply(cmd, process_input)
-
-    def _swap_ipset_chains(self, src_chain, dest_chain):
-        cmd = ['ipset', 'swap', src_chain, dest_chain]
-        self._apply(cmd)
-
-    def _destroy_ipset_chain(self, chain_name):
-        cmd = ['ipset', 'destroy', chain_name]
-        self._apply(cmd)
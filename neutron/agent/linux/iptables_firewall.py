@@ -38,8 +38,6 @@ IPSET_DIRECTION = {INGRESS_DIRECTION: 'src',
                    EGRESS_DIRECTION: 'dst'}
 LINUX_DEV_LEN = 14
 IPSET_CHAIN_LEN = 20
-IPSET_CHANGE_BULK_THRESHOLD = 10
-IPSET_ADD_BULK_THRESHOLD = 5
 
 
 class IptablesFirewallDriver(firewall.FirewallDriver):
@@ -66,7 +64,6 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         # List of security group member ips for ports residing on this host
         self.sg_members = {}
         self.pre_sg_members = None
-        self.ipset_chains = {}
         self.enable_ipset = cfg.CONF.SECURITYGROUP.enable_ipset
 
     @property
@@ -87,7 +84,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self.filtered_ports[port['device']] = port
         # each security group has it own chains
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def update_port_filter(self, port):
         LOG.debug(_("Updating device (%s) filter"), port['device'])
@@ -98,7 +95,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def remove_port_filter(self, port):
         LOG.debug(_("Removing device (%s) filter"), port['device'])
@@ -109,6 +106,12 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._remove_chains()
         self.filtered_ports.pop(port['device'], None)
         self._setup_chains()
+        self._apply()
+
+    def _apply(self):
+        # The sets must exist before the rules referencing them are applied
+        if self.enable_ipset:
+            self.ipset.apply()
         self.iptables.apply()
 
     def _setup_chains(self):
@@ -347,57 +350,14 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def _get_cur_sg_member_ips(self, sg_id, ethertype):
         return self.sg_members.get(sg_id, {}).get(ethertype, [])
 
-    def _get_pre_sg_member_ips(self, sg_id, ethertype):
-        return self.pre_sg_members.get(sg_id, {}).get(ethertype, [])
-
-    def _get_new_sg_member_ips(self, sg_id, ethertype):
-        add_member_ips = (set(self._get_cur_sg_member_ips(sg_id, ethertype)) -
-                          set(self._get_pre_sg_member_ips(sg_id, ethertype)))
-        return list(add_member_ips)
-
-    def _get_deleted_sg_member_ips(self, sg_id, ethertype):
-        del_member_ips = (set(self._get_pre_sg_member_ips(sg_id, ethertype)) -
-                          set(self._get_cur_sg_member_ips(sg_id, ethertype)))
-        return list(del_member_ips)
-
-    def _bulk_set_ips_to_chain(self, chain_name, member_ips, ethertype):
-        self.ipset.refresh_ipset_chain_by_name(chain_name, member_ips,
-                                               ethertype)
-        self.ipset_chains[chain_name] = member_ips
-
-    def _add_ips_to_ipset_chain(self, chain_name, add_ips):
-        for ip in add_ips:
-            if ip not in self.ipset_chains[chain_name]:
-                self.ipset.add_member_to_ipset_chain(chain_name, ip)
-                self.ipset_chains[chain_name].append(ip)
-
-    def _del_ips_from_ipset_chain(self, chain_name, del_ips):
-        if chain_name in self.ipset_chains:
-            for del_ip in del_ips:
-                if del_ip in self.ipset_chains[chain_name]:
-                    self.ipset.del_ipset_chain_member(chain_name, del_ip)
-                    self.ipset_chains[chain_name].remove(del_ip)
-
     def _update_ipset_chain_member(self, security_group_ids):
         for sg_id in security_group_ids or []:
             for ethertype in ['IPv4', 'IPv6']:
-                add_ips = self._get_new_sg_member_ips(sg_id, ethertype)
-                del_ips = self._get_deleted_sg_member_ips(sg_id, ethertype)
                 cur_member_ips = self._get_cur_sg_member_ips(sg_id, ethertype)
                 chain_name = ethertype + sg_id[:IPSET_CHAIN_LEN]
-                if chain_name not in self.ipset_chains and cur_member_ips:
-                    self.ipset_chains[chain_name] = []
-                    self.ipset.create_ipset_chain(
-                        chain_name, ethertype)
-                    self._bulk_set_ips_to_chain(chain_name,
-                                                cur_member_ips, ethertype)
-                elif (len(add_ips) + len(del_ips)
-                      < IPSET_CHANGE_BULK_THRESHOLD):
-                    self._add_ips_to_ipset_chain(chain_name, add_ips)
-                    self._del_ips_from_ipset_chain(chain_name, del_ips)
-                else:
-                    self._bulk_set_ips_to_chain(chain_name,
-                                                cur_member_ips, ethertype)
+                if cur_member_ips or self.ipset.set_exists(chain_name):
+                    self.ipset.set_members(chain_name, ethertype,
+                                           cur_member_ips)
 
     def _generate_ipset_chain(self, sg_rule, remote_gid):
         iptables_rules = []
@@ -415,7 +375,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         # the length of ipset chain name require less than 31
         # characters
         ipset_chain_name = (ethertype + remote_gid[:IPSET_CHAIN_LEN])
-        if ipset_chain_name in self.ipset_chains:
+        if self.ipset.set_exists(ipset_chain_name):
             args += ['-m set', '--match-set',
                      ipset_chain_name,
                      IPSET_DIRECTION[direction]]
@@ -537,12 +497,9 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             if remove_chain_id in self.sg_members:
                 self.sg_members.pop(remove_chain_id, None)
             if self.enable_ipset:
-                for ethertype in ['IPv4', 'IPv6']:
-                    removed_chain = (
-                        ethertype + remove_chain_id[:IPSET_CHAIN_LEN])
-                    if removed_chain in self.ipset_chains:
-                        self.ipset.destroy_ipset_chain_by_name(removed_chain)
-                        self.ipset_chains.pop(removed_chain, None)
+                self.ipset.destroy_sets(
+                    [ethertype + remove_chain_id[:IPSET_CHAIN_LEN]
+                     for ethertype in ['IPv4', 'IPv6']])
 
         # Remove unused security group rules
         for remove_group_id in need_removed_security_groups:
@@ -554,8 +511,13 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self._defer_apply = False
             self._remove_chains_apply(self._pre_defer_filtered_ports)
             self._setup_chains_apply(self.filtered_ports)
+            if self.enable_ipset:
+                self.ipset.apply()
             self.iptables.defer_apply_off()
             self._remove_unused_security_group_info()
+            if self.enable_ipset:
+                # Destroy the sets no longer referenced by any rule
+                self.ipset.apply()
             self._pre_defer_filtered_ports = None
 
 
@@ -21,6 +21,9 @@
 import inspect
 import os
 import re
+import time
+
+from oslo.config import cfg
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
@@ -30,6 +33,21 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+OPTS = [
+    cfg.BoolOpt('iptables_incremental_apply', default=False,
+                help=_("Apply only the chains owned by the agent which "
+                       "changed since the previous apply, through "
+                       "iptables-restore --noflush, instead of saving and "
+                       "restoring the whole ruleset. Packet and byte "
+                       "counters of rewritten chains are reset.")),
+    cfg.IntOpt('iptables_full_apply_interval', default=300,
+               help=_("When iptables_incremental_apply is enabled, the "
+                      "number of seconds after which the next apply saves "
+                      "and restores the whole ruleset again, in order to "
+                      "repair any external modification.")),
+]
+cfg.CONF.register_opts(OPTS)
+
 
 # NOTE(vish): Iptables supports chain names of up to 28 characters,  and we
 #             add up to 12 characters to binary_name which is used as a prefix,
@@ -58,6 +76,32 @@ def get_chain_name(chain_name, wrap=True):
         return chain_name[:MAX_CHAIN_LEN_NOWRAP]
 
 
+def _strip_packets_bytes(line):
+    # strip any [packet:byte] counts at start or end of lines
+    if line.startswith(':'):
+        # it's a chain, for example, ":neutron-billing - [0:0]"
+        line = line.split(':')[1]
+        line = line.split(' - [', 1)[0]
+    elif line.startswith('['):
+        # it's a rule, for example, "[0:0] -A neutron-billing..."
+        line = line.split('] ', 1)[1]
+    line = line.strip()
+    return line
+
+
+def _get_line_key(line):
+    # Chains and rules are identified by their text without counters,
+    # chains keep their ':' prefix to never clash with another line.
+    if line.startswith(':'):
+        return ':' + _strip_packets_bytes(line)
+    return _strip_packets_bytes(line)
+
+
+def _index_last_entries(lines):
+    """Map the key of each line to the last line having this key."""
+    return dict((_get_line_key(line), line) for line in lines)
+
+
 class IptablesRule(object):
     """An iptables rule.
 
@@ -293,6 +337,10 @@ class IptablesManager(object):
         self.namespace = namespace
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
+        # Image of the rules of the last successful apply and time of the
+        # last full apply, per command, used by incremental apply
+        self._applied_images = {}
+        self._last_full_apply = {}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -403,46 +451,147 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            all_tables = self.execute(args, root_helper=self.root_helper)
-            all_lines = all_tables.split('\n')
-            # Traverse tables in sorted order for predictable dump output
-            for table_name in sorted(tables):
-                table = tables[table_name]
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
-
-            args = ['%s-restore' % (cmd,), '-c']
+            image = self._get_image(tables)
+            if self._can_apply_incrementally(cmd, tables, image):
+                try:
+                    self._apply_incremental(cmd, image)
+                    continue
+                except RuntimeError:
+                    LOG.exception(_("Incremental apply of %s rules failed, "
+                                    "applying the whole ruleset"), cmd)
+            self._applied_images.pop(cmd, None)
+            self._apply_full(cmd, tables)
+            self._applied_images[cmd] = image
+            self._last_full_apply[cmd] = time.time()
+        LOG.debug(_("IPTablesManager.apply completed with success"))
+
+    def _get_image(self, tables):
+        """Return an image of the rules to apply for a set of tables.
+
+        The image contains, for each table, the rules of each chain owned by
+        this manager (wrapped chains) and the unwrapped chains and rules,
+        which are shared with other components.
+        """
+        image = {}
+        for table_name, table in tables.iteritems():
+            wrapped = dict(('%s-%s' % (self.wrap_name, chain), [])
+                           for chain in table.chains)
+            top_rules, bot_rules = [], []
+            for rule in table.rules:
+                if rule.wrap:
+                    (top_rules if rule.top else bot_rules).append(rule)
+            for rule in top_rules + bot_rules:
+                chain = '%s-%s' % (self.wrap_name, rule.chain)
+                wrapped.setdefault(chain, []).append(str(rule))
+            for chain, rules in wrapped.iteritems():
+                # As with a full apply, the last duplicate rule is kept
+                seen_rules = set()
+                unique_rules = []
+                for rule_str in reversed(rules):
+                    if rule_str not in seen_rules:
+                        seen_rules.add(rule_str)
+                        unique_rules.append(rule_str)
+                unique_rules.reverse()
+                wrapped[chain] = unique_rules
+            unwrapped = (sorted(table.unwrapped_chains),
+                         [(str(rule), rule.top) for rule in table.rules
+                          if not rule.wrap])
+            image[table_name] = (wrapped, unwrapped)
+        return image
+
+    def _can_apply_incrementally(self, cmd, tables, image):
+        if not cfg.CONF.iptables_incremental_apply:
+            return False
+        applied_image = self._applied_images.get(cmd)
+        if applied_image is None or set(applied_image) != set(image):
+            return False
+        if (time.time() - self._last_full_apply.get(cmd, 0) >
+                cfg.CONF.iptables_full_apply_interval):
+            return False
+        for table_name, table in tables.iteritems():
+            if table.remove_rules or table.remove_chains:
+                return False
+            # Unwrapped chains are shared with other components, their
+            # rules must be merged with the current ruleset by a full apply
+            if image[table_name][1] != applied_image[table_name][1]:
+                return False
+        return True
+
+    def _apply_incremental(self, cmd, image):
+        """Apply only the chains which changed since the previous apply.
+
+        Declaring a chain in iptables-restore --noflush input flushes it, so
+        each changed chain is declared and then filled with its rules. Our
+        removed chains are flushed and deleted after all the other chains
+        have been rewritten, as the rules jumping to them are gone by then.
+        """
+        applied_image = self._applied_images[cmd]
+        lines = []
+        for table_name in sorted(image):
+            wrapped = image[table_name][0]
+            applied_wrapped = applied_image[table_name][0]
+            changed = sorted(chain for chain, rules in wrapped.iteritems()
+                             if applied_wrapped.get(chain) != rules)
+            removed = sorted(chain for chain in applied_wrapped
+                             if chain not in wrapped)
+            if not changed and not removed:
+                continue
+            lines.append('*%s' % table_name)
+            lines.extend(':%s - [0:0]' % chain for chain in changed)
+            for chain in changed:
+                lines.extend(wrapped[chain])
+            lines.extend(':%s - [0:0]' % chain for chain in removed)
+            lines.extend('-X %s' % chain for chain in removed)
+            lines.append('COMMIT')
+
+        if lines:
+            args = ['%s-restore' % (cmd,), '-n']
             if self.namespace:
                 args = ['ip', 'netns', 'exec', self.namespace] + args
-            try:
-                self.execute(args, process_input='\n'.join(all_lines),
-                             root_helper=self.root_helper)
-            except RuntimeError as r_error:
-                with excutils.save_and_reraise_exception():
-                    try:
-                        line_no = int(re.search(
-                            'iptables-restore: line ([0-9]+?) failed',
-                            str(r_error)).group(1))
-                        context = IPTABLES_ERROR_LINES_OF_CONTEXT
-                        log_start = max(0, line_no - context)
-                        log_end = line_no + context
-                    except AttributeError:
-                        # line error wasn't found, print all lines instead
-                        log_start = 0
-                        log_end = len(all_lines)
-                    log_lines = ('%7d. %s' % (idx, l)
-                                 for idx, l in enumerate(
-                                     all_lines[log_start:log_end],
-                                     log_start + 1)
-                                 )
-                    LOG.error(_("IPTablesManager.apply failed to apply the "
-                                "following set of iptables rules:\n%s"),
-                              '\n'.join(log_lines))
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+            self.execute(args, process_input='\n'.join(lines) + '\n',
+                         root_helper=self.root_helper)
+        self._applied_images[cmd] = image
+
+    def _apply_full(self, cmd, tables):
+        args = ['%s-save' % (cmd,), '-c']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        all_tables = self.execute(args, root_helper=self.root_helper)
+        all_lines = all_tables.split('\n')
+        # Traverse tables in sorted order for predictable dump output
+        for table_name in sorted(tables):
+            table = tables[table_name]
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                all_lines[start:end], table, table_name)
+
+        args = ['%s-restore' % (cmd,), '-c']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        try:
+            self.execute(args, process_input='\n'.join(all_lines),
+                         root_helper=self.root_helper)
+        except RuntimeError as r_error:
+            with excutils.save_and_reraise_exception():
+                try:
+                    line_no = int(re.search(
+                        'iptables-restore: line ([0-9]+?) failed',
+                        str(r_error)).group(1))
+                    context = IPTABLES_ERROR_LINES_OF_CONTEXT
+                    log_start = max(0, line_no - context)
+                    log_end = line_no + context
+                except AttributeError:
+                    # line error wasn't found, print all lines instead
+                    log_start = 0
+                    log_end = len(all_lines)
+                log_lines = ('%7d. %s' % (idx, l)
+                             for idx, l in enumerate(
+                                 all_lines[log_start:log_end],
+                                 log_start + 1)
+                             )
+                LOG.error(_("IPTablesManager.apply failed to apply the "
+                            "following set of iptables rules:\n%s"),
+                          '\n'.join(log_lines))
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -473,13 +622,6 @@ class IptablesManager(object):
 
         return rules_index
 
-    def _find_last_entry(self, filter_list, match_str):
-        # find a matching entry, starting from the bottom
-        for s in reversed(filter_list):
-            s = s.strip()
-            if match_str in s:
-                return s
-
     def _modify_rules(self, current_lines, table, table_name):
         # Chains are stored as sets to avoid duplicates.
         # Sort the output chains here to make their order predictable.
@@ -503,30 +645,27 @@ class IptablesManager(object):
             (old_filter if self.wrap_name in line else
              new_filter).append(line.strip())
 
-        rules_index = self._find_rules_index(new_filter)
+        # Index both lists on the chains and rules without their
+        # [packet:byte] counts, the last entry taking precedence.
+        old_entries = _index_last_entries(old_filter)
+        new_entries = _index_last_entries(new_filter)
 
         all_chains = [':%s' % name for name in unwrapped_chains]
         all_chains += [':%s-%s' % (self.wrap_name, name) for name in chains]
 
         # Iterate through all the chains, trying to find an existing
         # match.
+        our_keys = set()
         our_chains = []
         for chain in all_chains:
             chain_str = str(chain).strip()
+            key = _get_line_key(chain_str)
+            our_keys.add(key)
 
-            old = self._find_last_entry(old_filter, chain_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, chain_str)
-            new_filter = [s for s in new_filter if chain_str not in s.strip()]
-
-            # if no old or duplicates, use original chain
-            if old or dup:
-                chain_str = str(old or dup)
-            else:
-                # add-on the [packet:bytes]
-                chain_str += ' - [0:0]'
-
-            our_chains += [chain_str]
+            # if no old or duplicates, add-on the [packet:bytes]
+            our_chains.append(old_entries.get(key) or
+                              new_entries.get(key) or
+                              chain_str + ' - [0:0]')
 
         # Iterate through all the rules, trying to find an existing
         # match.
@@ -534,110 +673,56 @@ class IptablesManager(object):
         bot_rules = []
         for rule in rules:
             rule_str = str(rule).strip()
-            # Further down, we weed out duplicates from the bottom of the
-            # list, so here we remove the dupes ahead of time.
-
-            old = self._find_last_entry(old_filter, rule_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, rule_str)
-            new_filter = [s for s in new_filter if rule_str not in s.strip()]
-
-            # if no old or duplicates, use original rule
-            if old or dup:
-                rule_str = str(old or dup)
-                # backup one index so we write the array correctly
-                if not old:
-                    rules_index -= 1
-            else:
-                # add-on the [packet:bytes]
-                rule_str = '[0:0] ' + rule_str
+            key = _get_line_key(rule_str)
+            our_keys.add(key)
+
+            # if no old or duplicates, add-on the [packet:bytes]
+            rule_str = (old_entries.get(key) or
+                        new_entries.get(key) or
+                        '[0:0] ' + rule_str)
 
             if rule.top:
                 # rule.top == True means we want this rule to be at the top.
-                our_rules += [rule_str]
+                our_rules.append(rule_str)
             else:
-                bot_rules += [rule_str]
+                bot_rules.append(rule_str)
 
         our_rules += bot_rules
 
+        # Our chains and rules replace their duplicates in new_filter.
+        new_filter = [line for line in new_filter
+                      if _get_line_key(line) not in our_keys]
+
+        rules_index = self._find_rules_index(new_filter)
         new_filter[rules_index:rules_index] = our_rules
         new_filter[rules_index:rules_index] = our_chains
 
-        def _strip_packets_bytes(line):
-            # strip any [packet:byte] counts at start or end of lines
-            if line.startswith(':'):
-                # it's a chain, for example, ":neutron-billing - [0:0]"
-                line = line.split(':')[1]
-                line = line.split(' - [', 1)[0]
-            elif line.startswith('['):
-                # it's a rule, for example, "[0:0] -A neutron-billing..."
-                line = line.split('] ', 1)[1]
-            line = line.strip()
-            return line
-
-        seen_chains = set()
-
-        def _weed_out_duplicate_chains(line):
-            # ignore [packet:byte] counts at end of lines
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                if line in seen_chains:
-                    return False
-                else:
-                    seen_chains.add(line)
-
-            # Leave it alone
-            return True
-
-        seen_rules = set()
-
-        def _weed_out_duplicate_rules(line):
-            if line.startswith('['):
-                line = _strip_packets_bytes(line)
-                if line in seen_rules:
-                    return False
-                else:
-                    seen_rules.add(line)
-
-            # Leave it alone
-            return True
-
-        def _weed_out_removes(line):
-            # We need to find exact matches here
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
-            elif line.startswith('['):
-                line = _strip_packets_bytes(line)
-                for rule in remove_rules:
-                    rule_str = _strip_packets_bytes(str(rule))
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
-
-            # Leave it alone
-            return True
+        remove_keys = set(':' + name for name in remove_chains)
+        remove_keys.update(_get_line_key(str(rule)) for rule in remove_rules)
 
         # We filter duplicates.  Go through the chains and rules, letting
         # the *last* occurrence take precedence since it could have a
         # non-zero [packet:byte] count we want to preserve.  We also filter
         # out anything in the "remove" list.
-        new_filter.reverse()
-        new_filter = [line for line in new_filter
-                      if _weed_out_duplicate_chains(line) and
-                      _weed_out_duplicate_rules(line) and
-                      _weed_out_removes(line)]
-        new_filter.reverse()
+        seen_keys = set()
+        filtered = []
+        for line in reversed(new_filter):
+            if line.startswith(':') or line.startswith('['):
+                key = _get_line_key(line)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                if key in remove_keys:
+                    remove_keys.discard(key)
+                    continue
+            filtered.append(line)
+        filtered.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
-        return new_filter
+        return filtered
 
     def _get_traffic_counters_cmd_tables(self, chain, wrap=True):
         name = get_chain_name(chain, wrap)
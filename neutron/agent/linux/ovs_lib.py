@@ -19,6 +19,7 @@ import operator
 from oslo.config import cfg
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import excutils
@@ -103,6 +104,18 @@ class BaseOVS(object):
     def port_exists(self, port_name):
         return bool(self.get_bridge_name_for_port_name(port_name))
 
+    @property
+    def ovsdb_replica(self):
+        """Return the in-memory OVSDB replica if reads can be served by it.
+
+        None is returned when the native OVSDB interface is disabled or not
+        yet synchronized, in which case ovs-vsctl must be used.
+        """
+        if ovsdb_client.is_enabled():
+            replica = ovsdb_client.get_replica()
+            if replica.is_ready:
+                return replica
+
 
 class OVSBridge(BaseOVS):
     def __init__(self, br_name, root_helper):
@@ -144,22 +157,32 @@ class OVSBridge(BaseOVS):
         self.destroy()
         self.create()
 
+    def _add_port_cmd(self, port_name):
+        return ["--", "--may-exist", "add-port", self.br_name, port_name]
+
+    def _delete_port_cmd(self, port_name):
+        return ["--", "--if-exists", "del-port", self.br_name, port_name]
+
+    def _set_db_attribute_cmd(self, table_name, record, column, value):
+        return ["set", table_name, record, "%s=%s" % (column, value)]
+
+    def _clear_db_attribute_cmd(self, table_name, record, column):
+        return ["clear", table_name, record, column]
+
     def add_port(self, port_name):
-        self.run_vsctl(["--", "--may-exist", "add-port", self.br_name,
-                        port_name])
+        self.run_vsctl(self._add_port_cmd(port_name))
         return self.get_port_ofport(port_name)
 
     def delete_port(self, port_name):
-        self.run_vsctl(["--", "--if-exists", "del-port", self.br_name,
-                        port_name])
+        self.run_vsctl(self._delete_port_cmd(port_name))
 
     def set_db_attribute(self, table_name, record, column, value):
-        args = ["set", table_name, record, "%s=%s" % (column, value)]
-        self.run_vsctl(args)
+        self.run_vsctl(self._set_db_attribute_cmd(table_name, record,
+                                                  column, value))
 
     def clear_db_attribute(self, table_name, record, column):
-        args = ["clear", table_name, record, column]
-        self.run_vsctl(args)
+        self.run_vsctl(self._clear_db_attribute_cmd(table_name, record,
+                                                    column))
 
     def run_ofctl(self, cmd, args, process_input=None):
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
@@ -216,10 +239,13 @@ class OVSBridge(BaseOVS):
     def deferred(self, **kwargs):
         return DeferredOVSBridge(self, **kwargs)
 
-    def add_tunnel_port(self, port_name, remote_ip, local_ip,
-                        tunnel_type=constants.TYPE_GRE,
-                        vxlan_udp_port=constants.VXLAN_UDP_PORT,
-                        dont_fragment=True):
+    def deferred_vsctl(self):
+        return DeferredVsctlOVSBridge(self)
+
+    def _add_tunnel_port_cmd(self, port_name, remote_ip, local_ip,
+                             tunnel_type=constants.TYPE_GRE,
+                             vxlan_udp_port=constants.VXLAN_UDP_PORT,
+                             dont_fragment=True):
         vsctl_command = ["--", "--may-exist", "add-port", self.br_name,
                          port_name]
         vsctl_command.extend(["--", "set", "Interface", port_name,
@@ -234,7 +260,16 @@ class OVSBridge(BaseOVS):
                               "options:local_ip=%s" % local_ip,
                               "options:in_key=flow",
                               "options:out_key=flow"])
-        self.run_vsctl(vsctl_command)
+        return vsctl_command
+
+    def add_tunnel_port(self, port_name, remote_ip, local_ip,
+                        tunnel_type=constants.TYPE_GRE,
+                        vxlan_udp_port=constants.VXLAN_UDP_PORT,
+                        dont_fragment=True):
+        self.run_vsctl(self._add_tunnel_port_cmd(port_name, remote_ip,
+                                                 local_ip, tunnel_type,
+                                                 vxlan_udp_port,
+                                                 dont_fragment))
         ofport = self.get_port_ofport(port_name)
         if (tunnel_type == constants.TYPE_VXLAN and
                 ofport == INVALID_OFPORT):
@@ -261,6 +296,43 @@ class OVSBridge(BaseOVS):
         if output:
             return output.rstrip("\n\r")
 
+    def db_list(self, table, records=None, columns=None, check_error=True):
+        """Return the rows of an OVSDB table with a single ovs-vsctl call.
+
+        Each row is returned as a dict keyed by column name, with OVSDB maps
+        converted to dicts and OVSDB sets converted to lists. If records is
+        given, only rows whose name is in records are returned.
+        """
+        args = ['--format=json', '--']
+        if columns:
+            if records is not None and 'name' not in columns:
+                columns = ['name'] + list(columns)
+            args.append('--columns=%s' % ','.join(columns))
+        args.extend(['list', table])
+        result = self.run_vsctl(args, check_error=check_error)
+        if not result:
+            return []
+        json_result = jsonutils.loads(result)
+        headings = json_result['headings']
+        rows = []
+        for data in json_result['data']:
+            values = map(ovsdb_client.ovsdb_value_to_py, data)
+            row = dict(zip(headings, values))
+            if records is None or row.get('name') in records:
+                rows.append(row)
+        return rows
+
+    def get_ports_attributes(self, table, columns=None):
+        """Return rows of table for all the ports of this bridge.
+
+        The port names and rows are fetched with two ovs-vsctl calls,
+        whatever the number of ports on the bridge.
+        """
+        port_names = self.get_port_name_list()
+        if not port_names:
+            return []
+        return self.db_list(table, records=set(port_names), columns=columns)
+
     def db_str_to_map(self, full_str):
         list = full_str.strip("{}").split(", ")
         ret = {}
@@ -294,12 +366,13 @@ class OVSBridge(BaseOVS):
     # returns a VIF object for each VIF port
     def get_vif_ports(self):
         edge_ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids",
-                                           check_error=True)
-            ofport = self.db_get_val("Interface", name, "ofport",
-                                     check_error=True)
+        rows = self.get_ports_attributes(
+            'Interface', columns=['name', 'external_ids', 'ofport'])
+        for row in rows:
+            name = row['name']
+            external_ids = row['external_ids']
+            # The ofport is a string, as read by db_get_val
+            ofport = str(row['ofport'])
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 p = VifPort(name, ofport, external_ids["iface-id"],
                             external_ids["attached-mac"], self)
@@ -315,43 +388,54 @@ class OVSBridge(BaseOVS):
 
         return edge_ports
 
-    def get_vif_port_set(self):
+    def _get_interface_rows(self):
+        replica = self.ovsdb_replica
+        if replica:
+            return (replica.get_port_name_list(self.br_name),
+                    replica.rows('Interface'))
         port_names = self.get_port_name_list()
+        rows = self.db_list('Interface',
+                            columns=['name', 'external_ids', 'ofport'])
+        return port_names, rows
+
+    def get_vif_port_set(self):
         edge_ports = set()
-        args = ['--format=json', '--', '--columns=name,external_ids,ofport',
-                'list', 'Interface']
-        result = self.run_vsctl(args, check_error=True)
-        if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
-            if name not in port_names:
+        port_names, rows = self._get_interface_rows()
+        for row in rows:
+            if row['name'] not in port_names:
                 continue
-            external_ids = dict(row[1][1])
+            port_id = self.get_vif_port_id_from_row(row)
+            if port_id:
+                edge_ports.add(port_id)
+        return edge_ports
+
+    def get_vif_port_id_from_row(self, row, check_ofport=True):
+        """Return the Neutron port id of the VIF described by an Interface row.
+
+        None is returned if the interface is not a VIF or, unless
+        check_ofport is False, if it is not ready or failed.
+        """
+        external_ids = row['external_ids']
+        if check_ofport:
             # Do not consider VIFs which aren't yet ready
             # This can happen when ofport values are either [] or ["set", []]
             # We will therefore consider only integer values for ofport
-            ofport = row[2]
+            ofport = row['ofport']
             try:
                 int_ofport = int(ofport)
             except (ValueError, TypeError):
                 LOG.warn(_("Found not yet ready openvswitch port: %s"), row)
-            else:
-                if int_ofport > 0:
-                    if ("iface-id" in external_ids and
-                        "attached-mac" in external_ids):
-                        edge_ports.add(external_ids['iface-id'])
-                    elif ("xs-vif-uuid" in external_ids and
-                          "attached-mac" in external_ids):
-                        # if this is a xenserver and iface-id is not
-                        # automatically synced to OVS from XAPI, we grab it
-                        # from XAPI directly
-                        iface_id = self.get_xapi_iface_id(
-                            external_ids["xs-vif-uuid"])
-                        edge_ports.add(iface_id)
-                else:
-                    LOG.warn(_("Found failed openvswitch port: %s"), row)
-        return edge_ports
+                return
+            if int_ofport <= 0:
+                LOG.warn(_("Found failed openvswitch port: %s"), row)
+                return
+        if "iface-id" in external_ids and "attached-mac" in external_ids:
+            return external_ids['iface-id']
+        elif ("xs-vif-uuid" in external_ids and
+              "attached-mac" in external_ids):
+            # if this is a xenserver and iface-id is not automatically
+            # synced to OVS from XAPI, we grab it from XAPI directly
+            return self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
 
     def get_port_tag_dict(self):
         """Get a dict of port names and associated vlan tags.
@@ -368,22 +452,51 @@ class OVSBridge(BaseOVS):
         in the "Interface" table queried by the get_vif_port_set() method.
 
         """
-        port_names = self.get_port_name_list()
-        args = ['--format=json', '--', '--columns=name,tag', 'list', 'Port']
-        result = self.run_vsctl(args, check_error=True)
+        replica = self.ovsdb_replica
+        if replica:
+            port_names = replica.get_port_name_list(self.br_name)
+            rows = replica.rows('Port')
+        else:
+            port_names = self.get_port_name_list()
+            rows = self.db_list('Port', columns=['name', 'tag'])
         port_tag_dict = {}
-        if not result:
-            return port_tag_dict
-        for name, tag in jsonutils.loads(result)['data']:
-            if name not in port_names:
+        for row in rows:
+            if row['name'] not in port_names:
                 continue
-            # 'tag' can be [u'set', []] or an integer
-            if isinstance(tag, list):
-                tag = tag[1]
-            port_tag_dict[name] = tag
+            # 'tag' is either an empty set or an integer
+            port_tag_dict[row['name']] = row['tag']
         return port_tag_dict
 
+    def _get_vif_port_by_id_from_replica(self, replica, port_id):
+        for row in replica.rows('Interface'):
+            if row['external_ids'].get('iface-id') != port_id:
+                continue
+            port_name = row['name']
+            switch = replica.get_bridge_for_iface(port_name)
+            if switch != self.br_name:
+                LOG.info(_("Port: %(port_name)s is on %(switch)s,"
+                           " not on %(br_name)s"), {'port_name': port_name,
+                                                    'switch': switch,
+                                                    'br_name': self.br_name})
+                return
+            ofport = row['ofport']
+            # ofport must be integer otherwise return None
+            if not isinstance(ofport, int) or ofport == -1:
+                LOG.warn(_("ofport: %(ofport)s for VIF: %(vif)s is not a "
+                           "positive integer"), {'ofport': ofport,
+                                                 'vif': port_id})
+                return
+            vif_mac = row['external_ids'].get('attached-mac')
+            if vif_mac is None:
+                LOG.warn(_("Unable to find the MAC address of VIF: %s"),
+                         port_id)
+                return
+            return VifPort(port_name, ofport, port_id, vif_mac, self)
+
     def get_vif_port_by_id(self, port_id):
+        replica = self.ovsdb_replica
+        if replica:
+            return self._get_vif_port_by_id_from_replica(replica, port_id)
         args = ['--format=json', '--', '--columns=external_ids,name,ofport',
                 'find', 'Interface',
                 'external_ids:iface-id="%s"' % port_id]
@@ -523,6 +636,71 @@ class DeferredOVSBridge(object):
                           self.br.br_name)
 
 
+class DeferredVsctlOVSBridge(object):
+    '''Deferred ovs-vsctl commands for an OVSBridge.
+
+    This class wraps add_port, add_tunnel_port, delete_port, set_db_attribute
+    and clear_db_attribute calls to an OVSBridge and defers their application
+    until apply_commands call, where they are run as a single ovs-vsctl
+    transaction. As the commands are deferred, add_port and add_tunnel_port
+    do not return the ofport of the created port.
+    This class can be used as a context, in such case apply_commands is called
+    on __exit__ except if an exception is raised.
+    This class is not thread-safe, that's why for every use a new instance
+    must be implemented.
+    '''
+
+    def __init__(self, br):
+        self.br = br
+        self.commands = []
+
+    def _add_command(self, command):
+        # Each command must be separated from the previous one with '--'
+        if command[0] != '--':
+            command = ['--'] + command
+        self.commands.append(command)
+
+    def add_port(self, port_name):
+        self._add_command(self.br._add_port_cmd(port_name))
+
+    def delete_port(self, port_name):
+        self._add_command(self.br._delete_port_cmd(port_name))
+
+    def add_tunnel_port(self, port_name, remote_ip, local_ip,
+                        tunnel_type=constants.TYPE_GRE,
+                        vxlan_udp_port=constants.VXLAN_UDP_PORT,
+                        dont_fragment=True):
+        self._add_command(self.br._add_tunnel_port_cmd(
+            port_name, remote_ip, local_ip, tunnel_type, vxlan_udp_port,
+            dont_fragment))
+
+    def set_db_attribute(self, table_name, record, column, value):
+        self._add_command(self.br._set_db_attribute_cmd(
+            table_name, record, column, value))
+
+    def clear_db_attribute(self, table_name, record, column):
+        self._add_command(self.br._clear_db_attribute_cmd(
+            table_name, record, column))
+
+    def apply_commands(self):
+        commands = self.commands
+        self.commands = []
+        if not commands:
+            return
+        self.br.run_vsctl(list(itertools.chain.from_iterable(commands)),
+                          check_error=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply_commands()
+        else:
+            LOG.exception(_("OVS commands could not be applied on bridge %s"),
+                          self.br.br_name)
+
+
 def get_bridge_for_iface(root_helper, iface):
     args = ["ovs-vsctl", "--timeout=%d" % cfg.CONF.ovs_vsctl_timeout,
             "iface-to-br", iface]
@@ -0,0 +1,371 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process OVSDB JSON-RPC client (RFC 7047).
+
+The client connects to the local ovsdb-server, monitors the Bridge, Port and
+Interface tables of the Open_vSwitch database and keeps a replica of their
+rows in memory, so that reads done by ovs_lib on every agent iteration do
+not need to spawn ovs-vsctl.
+"""
+
+import re
+import threading
+
+import eventlet
+from eventlet.green import socket
+from oslo.config import cfg
+
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+OVSDB_INTERFACE_VSCTL = 'vsctl'
+OVSDB_INTERFACE_NATIVE = 'native'
+
+OPTS = [
+    cfg.StrOpt('ovsdb_interface',
+               default=OVSDB_INTERFACE_VSCTL,
+               help=_("The interface used to read the local OVSDB: "
+                      "'vsctl' spawns ovs-vsctl for each read, 'native' "
+                      "keeps an in-memory replica of the Bridge, Port and "
+                      "Interface tables over an OVSDB connection.")),
+    cfg.StrOpt('ovsdb_connection',
+               default='unix:/var/run/openvswitch/db.sock',
+               help=_("The connection string for the native OVSDB "
+                      "interface, either unix:<path> or tcp:<ip>:<port>.")),
+]
+cfg.CONF.register_opts(OPTS)
+
+DATABASE = 'Open_vSwitch'
+MONITORED_TABLES = {
+    'Bridge': ['name', 'ports'],
+    'Port': ['name', 'interfaces', 'tag'],
+    'Interface': ['name', 'external_ids', 'ofport'],
+}
+
+# Seconds between two attempts to reconnect to ovsdb-server, the interval
+# doubles after each failed attempt up to MAX_RECONNECT_INTERVAL
+RECONNECT_INTERVAL = 2
+MAX_RECONNECT_INTERVAL = 60
+RECV_SIZE = 65536
+
+# Actions of the Interface events recorded by the replica and the monitors
+ROW_UPDATED = 'update'
+ROW_DELETED = 'delete'
+
+
+def ovsdb_value_to_py(value):
+    """Convert an OVSDB json encoded value to a python value.
+
+    See RFC 7047 and man ovs-vsctl(8) for the encoding details: maps are
+    converted to dicts, sets to lists and uuids to strings.
+    """
+    if isinstance(value, list) and len(value) == 2:
+        kind, data = value
+        if kind == 'map':
+            return dict((k, ovsdb_value_to_py(v)) for k, v in data)
+        if kind == 'set':
+            return [ovsdb_value_to_py(v) for v in data]
+        if kind in ('uuid', 'named-uuid'):
+            return data
+    return value
+
+
+def _as_list(value):
+    # A set with a single element is encoded by OVSDB as the element itself
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+class OvsdbClientError(Exception):
+    pass
+
+
+class JsonMessageStream(object):
+    """Split a stream of concatenated JSON-RPC messages.
+
+    The data is scanned once as it is fed, keeping the nesting depth and
+    the string state between feeds, so that each message is decoded only
+    once it is complete however many reads it takes to receive it.
+    """
+
+    _SPECIAL_CHARS = re.compile(r'[][{}"\\]')
+
+    def __init__(self):
+        self._chunks = []
+        self._depth = 0
+        self._in_string = False
+        # Whether the first character of the next data is escaped
+        self._escaped = False
+
+    def feed(self, data):
+        """Return the messages completed by data."""
+        messages = []
+        start = 0
+        # Index of the character escaped by a backslash in a string
+        escaped_index = 0 if self._escaped else -1
+        for match in self._SPECIAL_CHARS.finditer(data):
+            index = match.start()
+            if index == escaped_index:
+                continue
+            char = match.group()
+            if self._in_string:
+                if char == '"':
+                    self._in_string = False
+                elif char == '\\':
+                    escaped_index = index + 1
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._chunks.append(data[start:index + 1])
+                    messages.append(jsonutils.loads(''.join(self._chunks)))
+                    self._chunks = []
+                    start = index + 1
+        self._escaped = escaped_index == len(data)
+        rest = data[start:]
+        if self._depth or rest.strip():
+            self._chunks.append(rest)
+        return messages
+
+
+class OvsdbReplica(object):
+    """Replica of the Bridge, Port and Interface tables of the local OVSDB.
+
+    The replica is populated by a 'monitor' request and then kept up to date
+    by the 'update' notifications sent by ovsdb-server. Lookups done on the
+    replica are in-memory only and never block on ovsdb-server.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection or cfg.CONF.ovsdb_connection
+        self.tables = dict((table, {}) for table in MONITORED_TABLES)
+        self.is_ready = False
+        self._interface_updated = True
+        # None until the replica is synchronized, as the events received
+        # while it is not do not reflect all the changes.
+        self._interface_events = None
+        self._sock = None
+        self._thread = None
+        self._stopped = False
+        self._next_id = 1
+        self._monitor_id = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+        self._disconnect()
+
+    def _connect(self):
+        kind, _sep, address = self.connection.partition(':')
+        if kind == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        elif kind == 'tcp':
+            host, _sep, port = address.rpartition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((host, int(port)))
+        else:
+            raise OvsdbClientError(_("Unsupported OVSDB connection %s") %
+                                   self.connection)
+        self._sock = sock
+
+    def _disconnect(self):
+        self.is_ready = False
+        # Anything may have changed while we were not monitoring
+        self._interface_updated = True
+        self._interface_events = None
+        for table in self.tables.values():
+            table.clear()
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+            self._sock = None
+
+    def _send(self, msg):
+        self._sock.sendall(jsonutils.dumps(msg))
+
+    def _run(self):
+        interval = RECONNECT_INTERVAL
+        failing = False
+        while not self._stopped:
+            try:
+                self._connect()
+                self._monitor()
+                self._read_messages()
+            except Exception:
+                # Only the loss of the connection is logged, not each of
+                # the failed attempts to restore it
+                if self.is_ready or not failing:
+                    LOG.exception(_("Lost connection to OVSDB %s, falling "
+                                    "back to ovs-vsctl until it is "
+                                    "restored"), self.connection)
+                    interval = RECONNECT_INTERVAL
+                else:
+                    LOG.debug("Unable to connect to OVSDB %(connection)s, "
+                              "retrying in %(interval)d seconds",
+                              {'connection': self.connection,
+                               'interval': interval})
+                failing = True
+            self._disconnect()
+            if not self._stopped:
+                eventlet.sleep(interval)
+                interval = min(interval * 2, MAX_RECONNECT_INTERVAL)
+
+    def _monitor(self):
+        requests = dict((table, {'columns': columns})
+                        for table, columns in MONITORED_TABLES.items())
+        self._monitor_id = self._next_id
+        self._next_id += 1
+        self._send({'method': 'monitor',
+                    'params': [DATABASE, None, requests],
+                    'id': self._monitor_id})
+
+    def _read_messages(self):
+        stream = JsonMessageStream()
+        while not self._stopped:
+            data = self._sock.recv(RECV_SIZE)
+            if not data:
+                raise OvsdbClientError(_("Connection closed by OVSDB"))
+            for msg in stream.feed(data):
+                self._handle_message(msg)
+
+    def _handle_message(self, msg):
+        method = msg.get('method')
+        if method == 'echo':
+            self._send({'id': msg['id'], 'result': msg['params'],
+                        'error': None})
+        elif method == 'update':
+            self.apply_table_updates(msg['params'][1])
+        elif msg.get('id') == self._monitor_id:
+            if msg.get('error'):
+                raise OvsdbClientError(_("OVSDB monitor request failed: "
+                                         "%s") % msg['error'])
+            self.apply_table_updates(msg['result'])
+            self.is_ready = True
+            LOG.debug("OVSDB replica of %s is ready", self.connection)
+
+    def apply_table_updates(self, table_updates):
+        for table_name, row_updates in table_updates.items():
+            table = self.tables.setdefault(table_name, {})
+            is_interface = table_name == 'Interface'
+            for uuid, row_update in row_updates.items():
+                new = row_update.get('new')
+                if new is None:
+                    old = table.pop(uuid, None)
+                    if is_interface and old is not None:
+                        self._record_interface_event(ROW_DELETED, old)
+                else:
+                    row = dict((column, ovsdb_value_to_py(value))
+                               for column, value in new.items())
+                    old = table.get(uuid)
+                    table[uuid] = row
+                    if is_interface:
+                        if (old is not None and
+                                old['external_ids'] != row['external_ids']):
+                            # The interface may not be the same VIF anymore
+                            self._record_interface_event(ROW_DELETED, old)
+                        self._record_interface_event(ROW_UPDATED, row)
+            if is_interface and row_updates:
+                self._interface_updated = True
+
+    def _record_interface_event(self, action, row):
+        if self._interface_events is not None:
+            self._interface_events.append((action, row))
+
+    def consume_interface_updates(self):
+        """Indicate whether the Interface table changed since last call.
+
+        True is returned when the replica is not ready, in order to fail
+        open like SimpleInterfaceMonitor does.
+        """
+        updated = self._interface_updated or not self.is_ready
+        self._interface_updated = False
+        return updated
+
+    def consume_interface_events(self):
+        """Return the Interface events recorded since last call.
+
+        Events are (action, row) tuples in the order they were received,
+        action being ROW_UPDATED or ROW_DELETED. None is returned when the
+        changes can not be known from the events, i.e. when the replica is
+        (or was, since last call) not synchronized with ovsdb-server.
+        """
+        events = self._interface_events
+        self._interface_events = [] if self.is_ready else None
+        return events
+
+    def rows(self, table):
+        return self.tables[table].values()
+
+    def _find_bridge(self, br_name):
+        for bridge in self.tables['Bridge'].values():
+            if bridge['name'] == br_name:
+                return bridge
+
+    def get_port_name_list(self, br_name):
+        bridge = self._find_bridge(br_name)
+        if bridge is None:
+            return []
+        ports = self.tables['Port']
+        return [ports[uuid]['name'] for uuid in _as_list(bridge['ports'])
+                if uuid in ports and ports[uuid]['name'] != br_name]
+
+    def get_bridge_for_iface(self, iface_name):
+        iface_uuids = set(uuid for uuid, row
+                          in self.tables['Interface'].items()
+                          if row['name'] == iface_name)
+        if not iface_uuids:
+            return
+        port_uuids = set(uuid for uuid, row in self.tables['Port'].items()
+                         if iface_uuids.intersection(
+                             _as_list(row['interfaces'])))
+        for bridge in self.tables['Bridge'].values():
+            if port_uuids.intersection(_as_list(bridge['ports'])):
+                return bridge['name']
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def is_enabled():
+    return cfg.CONF.ovsdb_interface == OVSDB_INTERFACE_NATIVE
+
+
+def get_replica():
+    """Return the process wide OVSDB replica, starting it if needed."""
+    global _replica
+    with _replica_lock:
+        if _replica is None:
+            _replica = OvsdbReplica()
+            _replica.start()
+        return _replica
@@ -15,6 +15,8 @@
 import eventlet
 
 from neutron.agent.linux import async_process
+from neutron.agent.linux import ovsdb_client
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 
 
@@ -57,18 +59,21 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
 
     The has_updates() method indicates whether changes to the ovsdb
     Interface table have been detected since the monitor started or
-    since the previous access.
+    since the previous access. The changes themselves are returned by
+    get_events().
     """
 
     def __init__(self, root_helper=None, respawn_interval=None):
         super(SimpleInterfaceMonitor, self).__init__(
             'Interface',
-            columns=['name', 'ofport'],
+            columns=['name', 'ofport', 'external_ids'],
             format='json',
             root_helper=root_helper,
             respawn_interval=respawn_interval,
         )
         self.data_received = False
+        # None until get_events() reported that a full scan is required
+        self._events = None
 
     @property
     def is_active(self):
@@ -85,7 +90,45 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
         the absence of updates at the expense of potential false
         positives.
         """
-        return bool(list(self.iter_stdout())) or not self.is_active
+        updates = list(self.iter_stdout())
+        for line in updates:
+            self._parse_update(line)
+        return bool(updates) or not self.is_active
+
+    def _parse_update(self, line):
+        if self._events is None:
+            return
+        try:
+            update = jsonutils.loads(line)
+            headings = update['headings']
+            for data in update['data']:
+                row = dict((column, ovsdb_client.ovsdb_value_to_py(value))
+                           for column, value in zip(headings, data))
+                action = row.pop('action')
+                if action in ('initial', 'insert', 'new'):
+                    self._events.append((ovsdb_client.ROW_UPDATED, row))
+                elif action == 'delete':
+                    self._events.append((ovsdb_client.ROW_DELETED, row))
+                elif (action == 'old' and
+                      isinstance(row.get('external_ids'), dict)):
+                    # Only the modified columns of 'old' rows are valued.
+                    # The interface may not be the same VIF anymore.
+                    self._events.append((ovsdb_client.ROW_DELETED, row))
+        except (ValueError, KeyError, TypeError):
+            LOG.warn(_("Unable to parse ovsdb monitor output: %s"), line)
+            self._events = None
+
+    def get_events(self):
+        """Return the Interface events detected by has_updates.
+
+        Events are (action, row) tuples in the order they were received,
+        action being ovsdb_client.ROW_UPDATED or ovsdb_client.ROW_DELETED.
+        None is returned when the changes can not be known from the events,
+        e.g. when the monitor was not active, and a full scan is required.
+        """
+        events = self._events
+        self._events = [] if self.is_active else None
+        return events
 
     def start(self, block=False, timeout=5):
         super(SimpleInterfaceMonitor, self).start()
@@ -96,6 +139,7 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
 
     def _kill(self, *args, **kwargs):
         self.data_received = False
+        self._events = None
         super(SimpleInterfaceMonitor, self)._kill(*args, **kwargs)
 
     def _read_stdout(self):
@@ -103,3 +147,46 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
         if data and not self.data_received:
             self.data_received = True
         return data
+
+
+class ReplicaInterfaceMonitor(object):
+    """Monitors the Interface table through the in-memory OVSDB replica.
+
+    This is the counterpart of SimpleInterfaceMonitor when the native OVSDB
+    interface is used: no 'ovsdb-client monitor' process is spawned, updates
+    are detected from the notifications received by the replica.
+    """
+
+    def __init__(self):
+        self._replica = None
+
+    def start(self, block=False, timeout=5):
+        self._replica = ovsdb_client.get_replica()
+        if block:
+            with eventlet.timeout.Timeout(timeout):
+                while not self._replica.is_ready:
+                    eventlet.sleep()
+
+    def stop(self):
+        # The replica is shared with ovs_lib and thus kept running.
+        self._replica = None
+
+    @property
+    def is_active(self):
+        return bool(self._replica and self._replica.is_ready)
+
+    @property
+    def has_updates(self):
+        """Indicate whether the ovsdb Interface table has been updated.
+
+        As SimpleInterfaceMonitor, True is returned if the replica is not
+        synchronized with ovsdb-server.
+        """
+        if not self._replica:
+            return True
+        return self._replica.consume_interface_updates()
+
+    def get_events(self):
+        if not self._replica:
+            return
+        return self._replica.consume_interface_events()
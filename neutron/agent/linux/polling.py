@@ -16,6 +16,7 @@ import contextlib
 
 import eventlet
 
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import ovsdb_monitor
 from neutron.plugins.openvswitch.common import constants
 
@@ -54,6 +55,14 @@ class BasePollingManager(object):
     def _is_polling_required(self):
         raise NotImplementedError()
 
+    def get_events(self):
+        """Return the interface events detected since the last polling.
+
+        None means that the changes are unknown and that all the ports
+        have to be scanned.
+        """
+        return None
+
     @property
     def is_polling_required(self):
         # Always consume the updates to minimize polling.
@@ -95,9 +104,12 @@ class InterfacePollingMinimizer(BasePollingManager):
                      constants.DEFAULT_OVSDBMON_RESPAWN)):
 
         super(InterfacePollingMinimizer, self).__init__()
-        self._monitor = ovsdb_monitor.SimpleInterfaceMonitor(
-            root_helper=root_helper,
-            respawn_interval=ovsdb_monitor_respawn_interval)
+        if ovsdb_client.is_enabled():
+            self._monitor = ovsdb_monitor.ReplicaInterfaceMonitor()
+        else:
+            self._monitor = ovsdb_monitor.SimpleInterfaceMonitor(
+                root_helper=root_helper,
+                respawn_interval=ovsdb_monitor_respawn_interval)
 
     def start(self):
         self._monitor.start()
@@ -110,3 +122,6 @@ class InterfacePollingMinimizer(BasePollingManager):
         # collect output.
         eventlet.sleep()
         return self._monitor.has_updates
+
+    def get_events(self):
+        return self._monitor.get_events()
@@ -20,9 +20,12 @@ import shlex
 import socket
 import struct
 import tempfile
+import threading
 
 from eventlet.green import subprocess
 from eventlet import greenthread
+from oslo.config import cfg
+from oslo.rootwrap import client
 
 from neutron.common import constants
 from neutron.common import utils
@@ -33,6 +36,41 @@ from neutron.openstack.common import log as logging
 LOG = logging.getLogger(__name__)
 
 
+class RootwrapDaemonHelper(object):
+    """Holds the client of the long-lived privileged command executor.
+
+    Every agent process shares a single rootwrap daemon client which is
+    lazily started the first time a privileged command is executed.
+    """
+    __client = None
+    __lock = threading.Lock()
+
+    def __new__(cls):
+        """There is no reason to instantiate this class."""
+        raise NotImplementedError()
+
+    @classmethod
+    def get_client(cls, root_helper_daemon):
+        with cls.__lock:
+            if cls.__client is None:
+                cls.__client = client.Client(
+                    shlex.split(root_helper_daemon))
+            return cls.__client
+
+    @classmethod
+    def reset(cls):
+        with cls.__lock:
+            cls.__client = None
+
+
+def get_root_helper_daemon():
+    """Return the configured root helper daemon command, if any."""
+    try:
+        return cfg.CONF.AGENT.root_helper_daemon
+    except (cfg.NoSuchOptError, cfg.NoSuchGroupError):
+        return None
+
+
 def create_process(cmd, root_helper=None, addl_env=None):
     """Create a process object for the given command.
 
@@ -57,30 +95,73 @@ def create_process(cmd, root_helper=None, addl_env=None):
     return obj, cmd
 
 
+def execute_rootwrap_daemon(cmd, root_helper_daemon, process_input=None,
+                            addl_env=None):
+    """Execute a privileged command through the rootwrap daemon.
+
+    The return value will be a tuple of the return code, stdout, stderr
+    and the list of command arguments that was sent to the daemon.
+    """
+    cmd = map(str, cmd)
+    LOG.debug(_("Running command (rootwrap daemon): %s"), cmd)
+    daemon_client = RootwrapDaemonHelper.get_client(root_helper_daemon)
+    returncode, _stdout, _stderr = daemon_client.execute(
+        cmd, env=addl_env, stdin=process_input)
+    return returncode, _stdout, _stderr, cmd
+
+
+def _execute_process(cmd, root_helper=None, process_input=None,
+                     addl_env=None):
+    obj, cmd = create_process(cmd, root_helper=root_helper,
+                              addl_env=addl_env)
+    _stdout, _stderr = (process_input and
+                        obj.communicate(process_input) or
+                        obj.communicate())
+    obj.stdin.close()
+    return obj.returncode, _stdout, _stderr, cmd
+
+
+def _execute(cmd, root_helper=None, process_input=None, addl_env=None):
+    root_helper_daemon = root_helper and get_root_helper_daemon()
+    if root_helper_daemon:
+        try:
+            return execute_rootwrap_daemon(cmd, root_helper_daemon,
+                                           process_input=process_input,
+                                           addl_env=addl_env)
+        except (EOFError, IOError, OSError):
+            # NOTE: the daemon could not be spawned or reached, the client
+            # already retried once with a new daemon. Drop the client so
+            # that it is respawned on the next call and fall back to the
+            # root helper for this command. Other errors are raised, the
+            # daemon may have run the command already.
+            LOG.exception(_("Unable to execute %s with the root helper "
+                            "daemon, falling back to the root helper"), cmd)
+            RootwrapDaemonHelper.reset()
+    return _execute_process(cmd, root_helper=root_helper,
+                            process_input=process_input, addl_env=addl_env)
+
+
 def execute(cmd, root_helper=None, process_input=None, addl_env=None,
             check_exit_code=True, return_stderr=False, log_fail_as_error=True,
             extra_ok_codes=None):
     try:
-        obj, cmd = create_process(cmd, root_helper=root_helper,
-                                  addl_env=addl_env)
-        _stdout, _stderr = (process_input and
-                            obj.communicate(process_input) or
-                            obj.communicate())
-        obj.stdin.close()
+        returncode, _stdout, _stderr, cmd = _execute(
+            cmd, root_helper=root_helper, process_input=process_input,
+            addl_env=addl_env)
         m = _("\nCommand: %(cmd)s\nExit code: %(code)s\nStdout: %(stdout)r\n"
-              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': obj.returncode,
+              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': returncode,
                                        'stdout': _stdout, 'stderr': _stderr}
 
         extra_ok_codes = extra_ok_codes or []
-        if obj.returncode and obj.returncode in extra_ok_codes:
-            obj.returncode = None
+        if returncode and returncode in extra_ok_codes:
+            returncode = None
 
-        if obj.returncode and log_fail_as_error:
+        if returncode and log_fail_as_error:
             LOG.error(m)
         else:
             LOG.debug(m)
 
-        if obj.returncode and check_exit_code:
+        if returncode and check_exit_code:
             raise RuntimeError(m)
     finally:
         # NOTE(termie): this appears to be necessary to let the subprocess
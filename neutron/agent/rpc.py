@@ -80,6 +80,8 @@ class PluginApi(n_rpc.RpcProxy):
         1.3 - get_device_details rpc signature upgrade to obtain 'host' and
               return value to include fixed_ips and device_owner for
               the device port
+        1.4 - update_device_list rpc to update the status of a list of
+              devices at once
     '''
 
     BASE_RPC_API_VERSION = '1.1'
@@ -126,6 +128,43 @@ class PluginApi(n_rpc.RpcProxy):
                          self.make_msg('update_device_up', device=device,
                                        agent_id=agent_id, host=host))
 
+    def update_device_list(self, context, devices_up, devices_down,
+                           agent_id, host=None):
+        """Set the status of a list of devices to UP and another to DOWN.
+
+        Returns a dict listing the devices which were successfully updated
+        ('devices_up' and 'devices_down') and those which were not
+        ('failed_devices_up' and 'failed_devices_down').
+        """
+        try:
+            res = self.call(context,
+                            self.make_msg('update_device_list',
+                                          devices_up=devices_up,
+                                          devices_down=devices_down,
+                                          agent_id=agent_id,
+                                          host=host),
+                            version='1.4')
+        except messaging.UnsupportedVersion:
+            # The server has not been upgraded yet, update the devices
+            # one by one.
+            res = {'devices_up': [], 'failed_devices_up': [],
+                   'devices_down': [], 'failed_devices_down': []}
+            for status, devices, update in (
+                    ('up', devices_up, self.update_device_up),
+                    ('down', devices_down, self.update_device_down)):
+                for device in devices:
+                    try:
+                        update(context, device, agent_id, host)
+                    except Exception as e:
+                        LOG.debug("Failed to set status of %(device)s to "
+                                  "%(status)s: %(e)s",
+                                  {'device': device, 'status': status,
+                                   'e': e})
+                        res['failed_devices_%s' % status].append(device)
+                    else:
+                        res['devices_%s' % status].append(device)
+        return res
+
     def tunnel_sync(self, context, tunnel_ip, tunnel_type=None):
         return self.call(context,
                          self.make_msg('tunnel_sync', tunnel_ip=tunnel_ip,
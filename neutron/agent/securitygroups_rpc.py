@@ -14,6 +14,10 @@
 #    under the License.
 #
 
+import itertools
+import os
+
+import netaddr
 from oslo.config import cfg
 from oslo import messaging
 
@@ -21,12 +25,17 @@ from neutron.common import topics
 from neutron.openstack.common.gettextutils import _LW
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import uuidutils
 
 LOG = logging.getLogger(__name__)
 # history
 #   1.1 Support Security Group RPC
 SG_RPC_VERSION = "1.1"
 
+# Member updates carrying deltas are numbered by sender, one by server
+# process, so that agents can detect the updates they missed
+_member_update_senders = {}
+
 security_group_opts = [
     cfg.StrOpt(
         'firewall_driver',
@@ -46,6 +55,18 @@ security_group_opts = [
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
 
+def _get_member_update_sender():
+    """Return the sender id and the sequence of the current process.
+
+    They are created on first use, forked server workers get their own.
+    """
+    pid = os.getpid()
+    if pid not in _member_update_senders:
+        _member_update_senders[pid] = (uuidutils.generate_uuid(),
+                                       itertools.count(1))
+    return _member_update_senders[pid]
+
+
 #This is backward compatibility check for Havana
 def _is_valid_driver_combination():
     return ((cfg.CONF.SECURITYGROUP.enable_security_group and
@@ -128,13 +149,23 @@ class SecurityGroupAgentRpcCallbackMixin(object):
         """Callback for security group member update.
 
         :param security_groups: list of updated security_groups
+        :param member_deltas: optional, the member IP addresses 'added' and
+                              'removed' by security group
+        :param sender: the server which sent the member deltas
+        :param sequence: the sequence number of the member deltas
         """
         security_groups = kwargs.get('security_groups', [])
         LOG.debug(
             _("Security group member updated on remote: %s"), security_groups)
         if not self.sg_agent:
             return self._security_groups_agent_not_set()
-        self.sg_agent.security_groups_member_updated(security_groups)
+        member_deltas = kwargs.get('member_deltas')
+        if member_deltas is None:
+            self.sg_agent.security_groups_member_updated(security_groups)
+        else:
+            self.sg_agent.security_groups_member_deltas_updated(
+                security_groups, member_deltas, kwargs['sender'],
+                kwargs['sequence'])
 
     def security_groups_provider_updated(self, context, **kwargs):
         """Callback for security group provider update."""
@@ -166,6 +197,12 @@ class SecurityGroupAgentRpcMixin(object):
         self.devices_to_refilter = set()
         # Flag raised when a global refresh is needed
         self.global_refresh_firewall = False
+        # Member deltas received while refreshing firewall is deferred
+        self.pending_member_deltas = []
+        # Last member IP addresses passed to the firewall, by security group
+        self.sg_member_ips = {}
+        # Sequence number of the last member deltas received, by sender
+        self.member_update_sequences = {}
         self._use_enhanced_rpc = None
 
     @property
@@ -216,6 +253,7 @@ class SecurityGroupAgentRpcMixin(object):
         for sg_id, sg_rules in security_groups.items():
             self.firewall.update_security_group_rules(sg_id, sg_rules)
         for remote_sg_id, member_ips in security_group_member_ips.items():
+            self.sg_member_ips[remote_sg_id] = member_ips
             self.firewall.update_security_group_members(
                 remote_sg_id, member_ips)
 
@@ -233,6 +271,66 @@ class SecurityGroupAgentRpcMixin(object):
             security_groups,
             'security_group_source_groups')
 
+    def security_groups_member_deltas_updated(self, security_groups,
+                                              member_deltas, sender,
+                                              sequence):
+        LOG.info(_("Security group "
+                   "member updated %r"), security_groups)
+        last_sequence = self.member_update_sequences.get(sender)
+        self.member_update_sequences[sender] = max(last_sequence, sequence)
+        if sequence != (last_sequence or 0) + 1:
+            # Member updates were missed or received out of order, the
+            # members of the security groups are requested again
+            LOG.info(_("Unexpected member update %(sequence)s from "
+                       "%(sender)s, refreshing security groups %(sgs)r"),
+                     {'sequence': sequence, 'sender': sender,
+                      'sgs': security_groups})
+            self.security_groups_member_updated(security_groups)
+        elif not self.use_enhanced_rpc:
+            self.security_groups_member_updated(security_groups)
+        elif self.defer_refresh_firewall:
+            self.pending_member_deltas.append(member_deltas)
+        else:
+            self._apply_member_deltas([member_deltas])
+
+    def _apply_member_deltas(self, member_deltas_list):
+        """Update the firewall with the member IP addresses changes."""
+        source_groups = set()
+        for device in self.firewall.ports.values():
+            source_groups.update(
+                device.get('security_group_source_groups', []))
+        updated_member_ips = {}
+        unknown_groups = set()
+        for member_deltas in member_deltas_list:
+            for sg_id, deltas in member_deltas.items():
+                if sg_id not in source_groups:
+                    continue
+                if sg_id not in self.sg_member_ips:
+                    unknown_groups.add(sg_id)
+                    continue
+                member_ips = updated_member_ips.get(sg_id)
+                if member_ips is None:
+                    member_ips = dict(
+                        (ethertype, list(ips)) for ethertype, ips in
+                        self.sg_member_ips[sg_id].items())
+                    updated_member_ips[sg_id] = member_ips
+                for ip in deltas.get('added', []):
+                    ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+                    ips = member_ips.setdefault(ethertype, [])
+                    if ip not in ips:
+                        ips.append(ip)
+                for ip in deltas.get('removed', []):
+                    ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+                    if ip in member_ips.get(ethertype, []):
+                        member_ips[ethertype].remove(ip)
+        if updated_member_ips:
+            LOG.debug("Update members of security groups %s",
+                      updated_member_ips.keys())
+            with self.firewall.defer_apply():
+                self._update_security_group_info({}, updated_member_ips)
+        if unknown_groups:
+            self.security_groups_member_updated(unknown_groups)
+
     def _security_group_updated(self, security_groups, attribute):
         devices = []
         sec_grp_set = set(security_groups)
@@ -297,7 +395,8 @@ class SecurityGroupAgentRpcMixin(object):
                     security_groups, security_group_member_ips)
 
     def firewall_refresh_needed(self):
-        return self.global_refresh_firewall or self.devices_to_refilter
+        return (self.global_refresh_firewall or self.devices_to_refilter or
+                self.pending_member_deltas)
 
     def setup_port_filters(self, new_devices, updated_devices):
         """Configure port filters for devices.
@@ -318,8 +417,14 @@ class SecurityGroupAgentRpcMixin(object):
         # losing updates occurring during firewall refresh
         devices_to_refilter = self.devices_to_refilter
         global_refresh_firewall = self.global_refresh_firewall
+        pending_member_deltas = self.pending_member_deltas
         self.devices_to_refilter = set()
         self.global_refresh_firewall = False
+        self.pending_member_deltas = []
+        if pending_member_deltas and not global_refresh_firewall:
+            LOG.debug("Applying %d security group member updates",
+                      len(pending_member_deltas))
+            self._apply_member_deltas(pending_member_deltas)
         # TODO(salv-orlando): Avoid if possible ever performing the global
         # refresh providing a precise list of devices for which firewall
         # should be refreshed
@@ -354,13 +459,25 @@ class SecurityGroupAgentRpcApiMixin(object):
                          version=SG_RPC_VERSION,
                          topic=self._get_security_group_topic())
 
-    def security_groups_member_updated(self, context, security_groups):
-        """Notify member updated security groups."""
+    def security_groups_member_updated(self, context, security_groups,
+                                       member_deltas=None):
+        """Notify member updated security groups.
+
+        When member_deltas, the member IP addresses 'added' and 'removed' by
+        security group, are given, agents update their firewall with them
+        instead of requesting the members of the security groups.
+        """
         if not security_groups:
             return
+        kwargs = {'security_groups': security_groups}
+        if member_deltas is not None:
+            sender, sequence = _get_member_update_sender()
+            kwargs.update(member_deltas=member_deltas,
+                          sender=sender,
+                          sequence=next(sequence))
         self.fanout_cast(context,
                          self.make_msg('security_groups_member_updated',
-                                       security_groups=security_groups),
+                                       **kwargs),
                          version=SG_RPC_VERSION,
                          topic=self._get_security_group_topic())
 
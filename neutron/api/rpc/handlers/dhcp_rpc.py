@@ -37,7 +37,8 @@ class DhcpRpcCallback(n_rpc.RpcCallback):
     #     1.0 - Initial version.
     #     1.1 - Added get_active_networks_info, create_dhcp_port,
     #           and update_dhcp_port methods.
-    RPC_API_VERSION = '1.1'
+    #     1.2 - Added get_active_networks_delta.
+    RPC_API_VERSION = '1.2'
 
     def _get_active_networks(self, context, **kwargs):
         """Retrieve and return a list of the active networks."""
@@ -97,6 +98,26 @@ class DhcpRpcCallback(n_rpc.RpcCallback):
         """Returns all the networks/subnets/ports in system."""
         host = kwargs.get('host')
         LOG.debug(_('get_active_networks_info from %s'), host)
+        return self._get_active_networks_info(context, **kwargs)
+
+    def get_active_networks_delta(self, context, **kwargs):
+        """Returns the active networks which changed on the agent.
+
+        The agent sends the digests of the networks it knows. The ids of all
+        the active networks are returned, but the subnets and ports are only
+        returned for the networks whose digest differs.
+        """
+        host = kwargs.get('host')
+        digests = kwargs.get('digests') or {}
+        LOG.debug(_('get_active_networks_delta from %s'), host)
+        networks = self._get_active_networks_info(context, **kwargs)
+        changed = [network for network in networks
+                   if digests.get(network['id']) !=
+                   utils.get_dhcp_network_digest(network)]
+        return {'network_ids': [network['id'] for network in networks],
+                'networks': changed}
+
+    def _get_active_networks_info(self, context, **kwargs):
         networks = self._get_active_networks(context, **kwargs)
         plugin = manager.NeutronManager.get_plugin()
         filters = {'network_id': [network['id'] for network in networks]}
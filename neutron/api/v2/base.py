@@ -53,7 +53,8 @@ class Controller(object):
 
     def __init__(self, plugin, collection, resource, attr_info,
                  allow_bulk=False, member_actions=None, parent=None,
-                 allow_pagination=False, allow_sorting=False):
+                 allow_pagination=False, allow_sorting=False,
+                 list_batch_size=0):
         if member_actions is None:
             member_actions = []
         self._plugin = plugin
@@ -63,6 +64,7 @@ class Controller(object):
         self._allow_bulk = allow_bulk
         self._allow_pagination = allow_pagination
         self._allow_sorting = allow_sorting
+        self._list_batch_size = list_batch_size
         self._native_bulk = self._is_native_bulk_supported()
         self._native_pagination = self._is_native_pagination_supported()
         self._native_sorting = self._is_native_sorting_supported()
@@ -239,19 +241,15 @@ class Controller(object):
         if parent_id:
             kwargs[self._parent_id_name] = parent_id
         obj_getter = getattr(self._plugin, self._plugin_handlers[self.LIST])
+        if self._is_list_streamed(request, parent_id):
+            return self._stream_items(request, do_authz, obj_getter, kwargs,
+                                      fields_to_add)
         obj_list = obj_getter(request.context, **kwargs)
         obj_list = sorting_helper.sort(obj_list)
         obj_list = pagination_helper.paginate(obj_list)
         # Check authz
         if do_authz:
-            # FIXME(salvatore-orlando): obj_getter might return references to
-            # other resources. Must check authZ on them too.
-            # Omit items from list that should not be visible
-            obj_list = [obj for obj in obj_list
-                        if policy.check(request.context,
-                                        self._plugin_handlers[self.SHOW],
-                                        obj,
-                                        plugin=self._plugin)]
+            obj_list = self._authorized_items(request, obj_list)
         # Use the first element in the list for discriminating which attributes
         # should be filtered out because of authZ policies
         # fields_to_add contains a list of attributes added for request policy
@@ -271,6 +269,63 @@ class Controller(object):
             collection[self._collection + "_links"] = pagination_links
         return collection
 
+    def _authorized_items(self, request, obj_list):
+        """Omits the elements of a list which should not be visible."""
+        # FIXME(salvatore-orlando): obj_getter might return references to
+        # other resources. Must check authZ on them too.
+        policy.prefetch_parent_resources(
+            request.context, self._plugin_handlers[self.SHOW], obj_list)
+        return [obj for obj in obj_list
+                if policy.check(request.context,
+                                self._plugin_handlers[self.SHOW],
+                                obj,
+                                plugin=self._plugin)]
+
+    def _is_list_streamed(self, request, parent_id):
+        # The whole collection is listed, in the order of the primary key
+        return (self._list_batch_size > 0 and not parent_id and
+                self._native_pagination and self._native_sorting and
+                not any(param in request.GET for param in
+                        ('limit', 'marker', 'sort_key', 'page_reverse')))
+
+    def _stream_items(self, request, do_authz, obj_getter, kwargs,
+                      fields_to_add):
+        """Lists the elements of the requested entity in batches.
+
+        The batches are read with the native pagination of the plugin, the
+        first one right away so that its errors are reported as usual, the
+        others as the returned collection is serialized.
+        """
+        fields = kwargs['fields']
+        if fields and self._primary_key not in fields:
+            fields.append(self._primary_key)
+            fields_to_add.append(self._primary_key)
+        kwargs.update({'sorts': [(self._primary_key, True)],
+                       'limit': self._list_batch_size})
+        obj_list = obj_getter(request.context, **kwargs)
+
+        def _generate_items(obj_list):
+            fields_to_strip = None
+            while obj_list:
+                listed = obj_list
+                if do_authz:
+                    with policy.parent_resources_cache():
+                        listed = self._authorized_items(request, obj_list)
+                if listed and fields_to_strip is None:
+                    fields_to_strip = (
+                        (fields_to_add or []) +
+                        self._exclude_attributes_by_policy(
+                            request.context, listed[0]))
+                for obj in listed:
+                    yield self._filter_attributes(
+                        request.context, obj, fields_to_strip=fields_to_strip)
+                if len(obj_list) != self._list_batch_size:
+                    break
+                kwargs['marker'] = obj_list[-1][self._primary_key]
+                obj_list = obj_getter(request.context, **kwargs)
+
+        return {self._collection: _generate_items(obj_list)}
+
     def _item(self, request, id, do_authz=False, field_list=None,
               parent_id=None):
         """Retrieves and formats a single element of the requested entity."""
@@ -382,38 +437,55 @@ class Controller(object):
         if self._collection in body:
             # Have to account for bulk create
             items = body[self._collection]
-            deltas = {}
             bulk = True
         else:
             items = [body]
             bulk = False
         # Ensure policy engine is initialized
         policy.init()
+        if bulk:
+            policy.prefetch_parent_resources(
+                request.context, action,
+                [item[self._resource] for item in items])
+        deltas = {}
         for item in items:
             self._validate_network_tenant_ownership(request,
                                                     item[self._resource])
             policy.enforce(request.context,
                            action,
                            item[self._resource])
-            try:
-                tenant_id = item[self._resource]['tenant_id']
-                count = quota.QUOTAS.count(request.context, self._resource,
-                                           self._plugin, self._collection,
-                                           tenant_id)
-                if bulk:
-                    delta = deltas.get(tenant_id, 0) + 1
-                    deltas[tenant_id] = delta
-                else:
-                    delta = 1
-                kwargs = {self._resource: count + delta}
-            except exceptions.QuotaResourceUnknown as e:
-                # We don't want to quota this resource
-                LOG.debug(e)
-            else:
-                quota.QUOTAS.limit_check(request.context,
-                                         item[self._resource]['tenant_id'],
-                                         **kwargs)
+            tenant_id = item[self._resource]['tenant_id']
+            deltas[tenant_id] = deltas.get(tenant_id, 0) + 1
+        reservations = self._make_reservations(request.context, deltas)
+        try:
+            result = self._create(request, body, action, bulk, parent_id)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for reservation in reservations:
+                    quota.QUOTAS.cancel_reservation(request.context,
+                                                    reservation)
+        for reservation in reservations:
+            quota.QUOTAS.commit_reservation(request.context, reservation)
+        return result
 
+    def _make_reservations(self, context, deltas):
+        """Reserve the quota of the resources created for each tenant."""
+        reservations = []
+        try:
+            for tenant_id, delta in deltas.items():
+                reservations.append(quota.QUOTAS.make_reservation(
+                    context, tenant_id, {self._resource: delta},
+                    self._plugin, self._collection, tenant_id))
+        except exceptions.QuotaResourceUnknown as e:
+            # We don't want to quota this resource
+            LOG.debug(e)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for reservation in reservations:
+                    quota.QUOTAS.cancel_reservation(context, reservation)
+        return reservations
+
+    def _create(self, request, body, action, bulk, parent_id):
         def notify(create_result):
             notifier_method = self._resource + '.create.end'
             self._notifier.info(request.context,
@@ -474,6 +546,9 @@ class Controller(object):
 
         obj_deleter = getattr(self._plugin, action)
         obj_deleter(request.context, id, **kwargs)
+        if 'tenant_id' in obj:
+            quota.QUOTAS.mark_dirty(request.context, obj['tenant_id'],
+                                    [self._resource])
         notifier_method = self._resource + '.delete.end'
         self._notifier.info(request.context,
                             notifier_method,
@@ -675,10 +750,11 @@ class Controller(object):
 
 def create_resource(collection, resource, plugin, params, allow_bulk=False,
                     member_actions=None, parent=None, allow_pagination=False,
-                    allow_sorting=False):
+                    allow_sorting=False, list_batch_size=0):
     controller = Controller(plugin, collection, resource, params, allow_bulk,
                             member_actions=member_actions, parent=parent,
                             allow_pagination=allow_pagination,
-                            allow_sorting=allow_sorting)
+                            allow_sorting=allow_sorting,
+                            list_batch_size=list_batch_size)
 
     return wsgi_resource.Resource(controller, FAULT_MAP)
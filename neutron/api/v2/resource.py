@@ -28,6 +28,7 @@ from neutron.api.v2 import attributes
 from neutron.common import exceptions
 from neutron.openstack.common import gettextutils
 from neutron.openstack.common import log as logging
+from neutron import policy
 from neutron import wsgi
 
 
@@ -84,7 +85,10 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
 
             method = getattr(controller, action)
 
-            result = method(request=request, **args)
+            # Parent resources of the policy checks are fetched once per
+            # request
+            with policy.parent_resources_cache():
+                result = method(request=request, **args)
         except (exceptions.NeutronException,
                 netaddr.AddrFormatError) as e:
             for fault in faults:
@@ -137,6 +141,11 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
             raise webob.exc.HTTPInternalServerError(**kwargs)
 
         status = action_status.get(action, 200)
+        if wsgi.is_streamed(result):
+            # The items of the lists are serialized as they are read
+            return webob.Response(request=request, status=status,
+                                  content_type=content_type,
+                                  app_iter=serializer.serialize_iter(result))
         body = serializer.serialize(result)
         # NOTE(jkoelker) Comply with RFC2616 section 9.7
         if status == 204:
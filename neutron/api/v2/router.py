@@ -86,7 +86,8 @@ class APIRouter(wsgi.Router):
             controller = base.create_resource(
                 collection, resource, plugin, params, allow_bulk=allow_bulk,
                 parent=parent, allow_pagination=allow_pagination,
-                allow_sorting=allow_sorting)
+                allow_sorting=allow_sorting,
+                list_batch_size=cfg.CONF.list_batch_size)
             path_prefix = None
             if parent:
                 path_prefix = "/%s/{%s_id}/%s" % (parent['collection_name'],
@@ -63,12 +63,24 @@ core_opts = [
                help=_("The maximum number of items returned in a single "
                       "response, value was 'infinite' or negative integer "
                       "means no limit")),
+    cfg.IntOpt('list_batch_size', default=0,
+               help=_("Number of networks, subnets or ports read from the "
+                      "database at a time when listing them without "
+                      "pagination, the response is then streamed to the "
+                      "client. 0 reads them all at once.")),
     cfg.IntOpt('max_dns_nameservers', default=5,
                help=_("Maximum number of DNS nameservers")),
     cfg.IntOpt('max_subnet_host_routes', default=20,
                help=_("Maximum number of host routes per subnet")),
     cfg.IntOpt('max_fixed_ips_per_port', default=5,
                help=_("Maximum number of fixed ips per port")),
+    cfg.StrOpt('ipam_driver',
+               default='neutron.db.ipam.AvailabilityRangeIpamDriver',
+               help=_("The driver used to find free IP addresses in the "
+                      "allocation pools of the subnets. "
+                      "neutron.db.ipam.FreeRangesIpamDriver keeps them in "
+                      "memory and allocates them randomly, without locking "
+                      "any row.")),
     cfg.IntOpt('dhcp_lease_duration', default=86400,
                deprecated_name='dhcp_lease_time',
                help=_("DHCP lease duration (in seconds). Use -1 to tell "
@@ -115,6 +127,14 @@ core_opts = [
     cfg.IntOpt('send_events_interval', default=2,
                help=_('Number of seconds between sending events to nova if '
                       'there are any events to send.')),
+    cfg.IntOpt('send_events_batch_size', default=100,
+               help=_('Maximum number of events sent to nova in a single '
+                      'request, 0 means no limit.')),
+    cfg.IntOpt('send_events_retries', default=3,
+               help=_('Number of times a request of events is retried when '
+                      'nova cannot be reached. The delay between retries '
+                      'starts at send_events_interval and doubles on each '
+                      'retry.')),
 ]
 
 core_cli_opts = [
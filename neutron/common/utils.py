@@ -34,6 +34,7 @@ from oslo.config import cfg
 
 from neutron.common import constants as q_const
 from neutron.openstack.common import excutils
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 
@@ -41,6 +42,10 @@ from neutron.openstack.common import log as logging
 TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 LOG = logging.getLogger(__name__)
 SYNCHRONIZED_PREFIX = 'neutron-'
+DHCP_SUBNET_FIELDS = ('id', 'cidr', 'gateway_ip', 'ip_version',
+                      'dns_nameservers', 'host_routes', 'ipv6_ra_mode',
+                      'ipv6_address_mode')
+DHCP_PORT_FIELDS = ('id', 'mac_address', 'device_owner', 'device_id')
 
 synchronized = lockutils.synchronized_with_prefix(SYNCHRONIZED_PREFIX)
 
@@ -357,3 +362,25 @@ def is_dvr_serviced(device_owner):
                                       q_const.DEVICE_OWNER_DHCP)
         return (device_owner.startswith('compute:') or
                 device_owner in dvr_serviced_device_owners)
+
+
+def get_dhcp_network_digest(network):
+    """Returns a digest of the DHCP configuration of a network.
+
+    Only the DHCP enabled subnets and the port fields used by the DHCP agent
+    are taken into account, in an order independent way, so that the digests
+    of a network computed by the server and by the DHCP agent match.
+    """
+    subnets = sorted(
+        [subnet.get(field) for field in DHCP_SUBNET_FIELDS]
+        for subnet in network.get('subnets') or []
+        if subnet.get('enable_dhcp'))
+    ports = sorted(
+        [port.get(field) for field in DHCP_PORT_FIELDS] +
+        [sorted([ip.get('subnet_id'), ip.get('ip_address')]
+                for ip in port.get('fixed_ips') or []),
+         sorted([opt['opt_name'], opt['opt_value']]
+                for opt in port.get('extra_dhcp_opts') or [])]
+        for port in network.get('ports') or [])
+    data = jsonutils.dumps([network['id'], subnets, ports], sort_keys=True)
+    return hashlib.sha1(data).hexdigest()
@@ -17,10 +17,11 @@ import random
 
 import netaddr
 from oslo.config import cfg
+from oslo.db import exception as db_exc
 from sqlalchemy import and_
 from sqlalchemy import event
-from sqlalchemy import orm
 from sqlalchemy.orm import exc
+from sqlalchemy import sql
 
 from neutron.api.v2 import attributes
 from neutron.common import constants
@@ -28,6 +29,7 @@ from neutron.common import exceptions as n_exc
 from neutron.common import ipv6_utils
 from neutron import context as ctx
 from neutron.db import common_db_mixin
+from neutron.db import ipam
 from neutron.db import models_v2
 from neutron.db import sqlalchemyutils
 from neutron.extensions import l3
@@ -50,6 +52,22 @@ LOG = logging.getLogger(__name__)
 # IP allocations being cleaned up by cascade.
 AUTO_DELETE_PORT_OWNERS = [constants.DEVICE_OWNER_DHCP]
 
+# Number of attempts to store the IP allocations of ports, an IPAM driver
+# may hand out an address concurrently allocated by another server
+IP_ALLOCATION_ATTEMPTS = 3
+
+# Attributes of the core resources which are the values of the model column
+# of the same name, see CommonDbMixin._get_collection
+NETWORK_COLUMN_FIELDS = frozenset(['id', 'name', 'tenant_id',
+                                   'admin_state_up', 'status', 'shared'])
+SUBNET_COLUMN_FIELDS = frozenset(['id', 'name', 'tenant_id', 'network_id',
+                                  'ip_version', 'cidr', 'gateway_ip',
+                                  'enable_dhcp', 'ipv6_ra_mode',
+                                  'ipv6_address_mode', 'shared'])
+PORT_COLUMN_FIELDS = frozenset(['id', 'name', 'network_id', 'tenant_id',
+                                'mac_address', 'admin_state_up', 'status',
+                                'device_id', 'device_owner'])
+
 
 class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         common_db_mixin.CommonDbMixin):
@@ -152,6 +170,56 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                   max_retries)
         raise n_exc.MacAddressGenerationFailure(net_id=network_id)
 
+    @staticmethod
+    def _generate_macs(context, network_id, count, reserved=()):
+        """Generate count MAC addresses unique on the network.
+
+        Each attempt checks all its candidates with a single query, the
+        reserved MAC addresses are never returned.
+        """
+        base_mac = cfg.CONF.base_mac.split(':')
+        max_retries = cfg.CONF.mac_generation_retries
+        mac_addresses = []
+        excluded = set(reserved)
+        for i in range(max_retries):
+            candidates = set()
+            while len(mac_addresses) + len(candidates) < count:
+                mac = [int(base_mac[0], 16), int(base_mac[1], 16),
+                       int(base_mac[2], 16), random.randint(0x00, 0xff),
+                       random.randint(0x00, 0xff), random.randint(0x00, 0xff)]
+                if base_mac[3] != '00':
+                    mac[3] = int(base_mac[3], 16)
+                mac_address = ':'.join(map(lambda x: "%02x" % x, mac))
+                if mac_address not in excluded:
+                    candidates.add(mac_address)
+            in_use = NeutronDbPluginV2._get_used_macs(context, network_id,
+                                                      candidates)
+            mac_addresses.extend(candidates - in_use)
+            if len(mac_addresses) == count:
+                LOG.debug(_("Generated %(count)s macs for network "
+                            "%(network_id)s"),
+                          {'count': count, 'network_id': network_id})
+                return mac_addresses
+            LOG.debug(_("Generated macs %(mac_addresses)s exist. Remaining "
+                        "attempts %(max_retries)s."),
+                      {'mac_addresses': sorted(in_use),
+                       'max_retries': max_retries - (i + 1)})
+            excluded.update(candidates)
+        LOG.error(_("Unable to generate mac addresses after %s attempts"),
+                  max_retries)
+        raise n_exc.MacAddressGenerationFailure(net_id=network_id)
+
+    @staticmethod
+    def _get_used_macs(context, network_id, mac_addresses):
+        """Return the mac_addresses used by ports of the network."""
+        if not mac_addresses:
+            return set()
+        mac_qry = context.session.query(models_v2.Port.mac_address)
+        mac_qry = mac_qry.filter(
+            models_v2.Port.network_id == network_id,
+            models_v2.Port.mac_address.in_(mac_addresses))
+        return set(mac_address for mac_address, in mac_qry)
+
     @staticmethod
     def _check_unique_mac(context, network_id, mac_address):
         mac_qry = context.session.query(models_v2.Port)
@@ -201,140 +269,34 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
 
     @staticmethod
     def _generate_ip(context, subnets):
-        try:
-            return NeutronDbPluginV2._try_generate_ip(context, subnets)
-        except n_exc.IpAddressGenerationFailure:
-            NeutronDbPluginV2._rebuild_availability_ranges(context, subnets)
-
-        return NeutronDbPluginV2._try_generate_ip(context, subnets)
-
-    @staticmethod
-    def _try_generate_ip(context, subnets):
-        """Generate an IP address.
-
-        The IP address will be generated from one of the subnets defined on
-        the network.
-        """
-        range_qry = context.session.query(
-            models_v2.IPAvailabilityRange).join(
-                models_v2.IPAllocationPool).with_lockmode('update')
-        for subnet in subnets:
-            ip_range = range_qry.filter_by(subnet_id=subnet['id']).first()
-            if not ip_range:
-                LOG.debug("All IPs from subnet %(subnet_id)s (%(cidr)s) "
-                          "allocated",
-                          {'subnet_id': subnet['id'],
-                           'cidr': subnet['cidr']})
-                continue
-            ip_address = ip_range['first_ip']
-            if ip_range['first_ip'] == ip_range['last_ip']:
-                # No more free indices on subnet => delete
-                LOG.debug("No more free IP's in slice. Deleting "
-                          "allocation pool.")
-                context.session.delete(ip_range)
-            else:
-                # increment the first free
-                new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
-                ip_range['first_ip'] = new_first_ip
-            LOG.debug("Allocated IP - %(ip_address)s from %(first_ip)s "
-                      "to %(last_ip)s",
-                      {'ip_address': ip_address,
-                       'first_ip': ip_address,
-                       'last_ip': ip_range['last_ip']})
-            return {'ip_address': ip_address,
-                    'subnet_id': subnet['id']}
-        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+        return ipam.get_driver().generate_ip(context, subnets)
 
     @staticmethod
-    def _rebuild_availability_ranges(context, subnets):
-        """Rebuild availability ranges.
-
-        This method is called only when there's no more IP available or by
-        _update_subnet_allocation_pools. Calling
-        _update_subnet_allocation_pools before calling this function deletes
-        the IPAllocationPools associated with the subnet that is updating,
-        which will result in deleting the IPAvailabilityRange too.
+    def _retry_ip_allocation(context, allocate_and_store):
+        """Call allocate_and_store until its IP allocations are stored.
+
+        IPAM drivers which do not lock the free addresses, such as
+        FreeRangesIpamDriver, may hand out an address that another server
+        is concurrently allocating. The conflict is detected when the
+        IPAllocation rows are flushed, the savepoint is then rolled back and
+        the addresses are allocated again.
         """
-        ip_qry = context.session.query(
-            models_v2.IPAllocation).with_lockmode('update')
-        # PostgreSQL does not support select...for update with an outer join.
-        # No join is needed here.
-        pool_qry = context.session.query(
-            models_v2.IPAllocationPool).options(
-                orm.noload('available_ranges')).with_lockmode('update')
-        for subnet in sorted(subnets):
-            LOG.debug(_("Rebuilding availability ranges for subnet %s")
-                      % subnet)
-
-            # Create a set of all currently allocated addresses
-            ip_qry_results = ip_qry.filter_by(subnet_id=subnet['id'])
-            allocations = netaddr.IPSet([netaddr.IPAddress(i['ip_address'])
-                                        for i in ip_qry_results])
-
-            for pool in pool_qry.filter_by(subnet_id=subnet['id']):
-                # Create a set of all addresses in the pool
-                poolset = netaddr.IPSet(netaddr.iter_iprange(pool['first_ip'],
-                                                             pool['last_ip']))
-
-                # Use set difference to find free addresses in the pool
-                available = poolset - allocations
-
-                # Generator compacts an ip set into contiguous ranges
-                def ipset_to_ranges(ipset):
-                    first, last = None, None
-                    for cidr in ipset.iter_cidrs():
-                        if last and last + 1 != cidr.first:
-                            yield netaddr.IPRange(first, last)
-                            first = None
-                        first, last = first if first else cidr.first, cidr.last
-                    if first:
-                        yield netaddr.IPRange(first, last)
-
-                # Write the ranges to the db
-                for ip_range in ipset_to_ranges(available):
-                    available_range = models_v2.IPAvailabilityRange(
-                        allocation_pool_id=pool['id'],
-                        first_ip=str(netaddr.IPAddress(ip_range.first)),
-                        last_ip=str(netaddr.IPAddress(ip_range.last)))
-                    context.session.add(available_range)
+        # A failed attempt only rolls back what allocate_and_store added
+        context.session.flush()
+        for attempt in range(IP_ALLOCATION_ATTEMPTS, 0, -1):
+            try:
+                with context.session.begin_nested():
+                    return allocate_and_store()
+            except db_exc.DBDuplicateEntry:
+                if attempt == 1:
+                    raise
+                LOG.debug("IP addresses concurrently allocated, remaining "
+                          "attempts %s", attempt - 1)
 
     @staticmethod
     def _allocate_specific_ip(context, subnet_id, ip_address):
         """Allocate a specific IP address on the subnet."""
-        ip = int(netaddr.IPAddress(ip_address))
-        range_qry = context.session.query(
-            models_v2.IPAvailabilityRange).join(
-                models_v2.IPAllocationPool).with_lockmode('update')
-        results = range_qry.filter_by(subnet_id=subnet_id)
-        for ip_range in results:
-            first = int(netaddr.IPAddress(ip_range['first_ip']))
-            last = int(netaddr.IPAddress(ip_range['last_ip']))
-            if first <= ip <= last:
-                if first == last:
-                    context.session.delete(ip_range)
-                    return
-                elif first == ip:
-                    new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
-                    ip_range['first_ip'] = new_first_ip
-                    return
-                elif last == ip:
-                    new_last_ip = str(netaddr.IPAddress(ip_address) - 1)
-                    ip_range['last_ip'] = new_last_ip
-                    return
-                else:
-                    # Adjust the original range to end before ip_address
-                    old_last_ip = ip_range['last_ip']
-                    new_last_ip = str(netaddr.IPAddress(ip_address) - 1)
-                    ip_range['last_ip'] = new_last_ip
-
-                    # Create a new second range for after ip_address
-                    new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
-                    new_ip_range = models_v2.IPAvailabilityRange(
-                        allocation_pool_id=ip_range['allocation_pool_id'],
-                        first_ip=new_first_ip,
-                        last_ip=old_last_ip)
-                    context.session.add(new_ip_range)
-                    return
+        ipam.get_driver().allocate_specific_ip(context, subnet_id, ip_address)
 
     @staticmethod
     def _check_unique_ip(context, network_id, subnet_id, ip_address):
@@ -956,7 +918,8 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                     sorts=sorts,
                                     limit=limit,
                                     marker_obj=marker_obj,
-                                    page_reverse=page_reverse)
+                                    page_reverse=page_reverse,
+                                    column_fields=NETWORK_COLUMN_FIELDS)
 
     def get_networks_count(self, context, filters=None):
         return self._get_collection_count(context, models_v2.Network,
@@ -1116,16 +1079,12 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         nexthop=rt['nexthop'])
                     context.session.add(route)
 
-            for pool in s['allocation_pools']:
-                ip_pool = models_v2.IPAllocationPool(subnet=subnet,
-                                                     first_ip=pool['start'],
-                                                     last_ip=pool['end'])
-                context.session.add(ip_pool)
-                ip_range = models_v2.IPAvailabilityRange(
-                    ipallocationpool=ip_pool,
-                    first_ip=pool['start'],
-                    last_ip=pool['end'])
-                context.session.add(ip_range)
+            ip_pools = [models_v2.IPAllocationPool(subnet=subnet,
+                                                   first_ip=pool['start'],
+                                                   last_ip=pool['end'])
+                        for pool in s['allocation_pools']]
+            context.session.add_all(ip_pools)
+            ipam.get_driver().create_subnet_pools(context, ip_pools)
 
         return self._make_subnet_dict(subnet)
 
@@ -1188,7 +1147,7 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             first_ip=p['start'], last_ip=p['end'],
             subnet_id=id) for p in s['allocation_pools']]
         context.session.add_all(new_pools)
-        NeutronDbPluginV2._rebuild_availability_ranges(context, [s])
+        ipam.get_driver().update_subnet_pools(context, s)
         #Gather new pools for result:
         result_pools = [{'start': pool['start'],
                          'end': pool['end']}
@@ -1266,6 +1225,7 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                     raise n_exc.SubnetInUse(subnet_id=id)
 
             context.session.delete(subnet)
+            ipam.get_driver().delete_subnet(context, id)
 
     def get_subnet(self, context, id, fields=None):
         subnet = self._get_subnet(context, id)
@@ -1281,14 +1241,173 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                     sorts=sorts,
                                     limit=limit,
                                     marker_obj=marker_obj,
-                                    page_reverse=page_reverse)
+                                    page_reverse=page_reverse,
+                                    column_fields=SUBNET_COLUMN_FIELDS)
 
     def get_subnets_count(self, context, filters=None):
         return self._get_collection_count(context, models_v2.Subnet,
                                           filters=filters)
 
     def create_port_bulk(self, context, ports):
-        return self._create_bulk('port', context, ports)
+        # Plugins overriding create_port rely on it being called for every
+        # port, the native bulk creation only replaces the one of this class.
+        # Such plugins may override create_port_bulk and build on
+        # _create_ports_bulk_db instead, as Ml2Plugin does.
+        create_port = getattr(self.create_port, '__func__', None)
+        if create_port is not NeutronDbPluginV2.create_port.__func__:
+            return self._create_bulk('port', context, ports)
+        return self._create_ports_bulk(context, ports['ports'])
+
+    def _create_ports_bulk(self, context, items):
+        """Create the ports of a bulk request in a single transaction."""
+        ports = [item['port'] for item in items]
+        context.session.begin(subtransactions=True)
+        try:
+            db_ports = self._create_ports_bulk_db(context, ports)
+            context.session.commit()
+        except Exception:
+            context.session.rollback()
+            with excutils.save_and_reraise_exception():
+                LOG.error(_("An exception occurred while creating "
+                            "the ports:%s"), ports)
+        return [self._make_port_dict(db_port, process_extensions=False)
+                for db_port in db_ports]
+
+    def _create_ports_bulk_db(self, context, ports):
+        """Store the ports of a bulk request, return their Port rows.
+
+        Must be called within a transaction. MAC and IP addresses are
+        generated for all the ports of a network at once and the ports are
+        stored with one flush, which the unit of work turns into batched
+        INSERTs. Ports with fixed_ips are allocated their addresses one by
+        one, as in create_port.
+        """
+        tenant_ids = []
+        for p in ports:
+            tenant_id = self._get_tenant_id_for_create(context, p)
+            if p.get('device_owner') == constants.DEVICE_OWNER_ROUTER_INTF:
+                self._enforce_device_owner_not_router_intf_or_device_id(
+                    context, p, tenant_id)
+            tenant_ids.append(tenant_id)
+
+        db_ports = [None] * len(ports)
+        # network id -> indexes of the ports that need IP addresses
+        auto_ips = {}
+        networks = {}
+        for index, p in enumerate(ports):
+            networks.setdefault(p['network_id'], []).append(index)
+        for network_id, indexes in networks.items():
+            # Ensure that the network exists.
+            self._get_network(context, network_id)
+            self._set_macs_for_ports(context, network_id,
+                                     [ports[i] for i in indexes])
+            auto_ips[network_id] = [
+                i for i in indexes
+                if ports[i]['fixed_ips'] is attributes.ATTR_NOT_SPECIFIED]
+
+        for index, p in enumerate(ports):
+            if p['fixed_ips'] is attributes.ATTR_NOT_SPECIFIED:
+                continue
+            ips = self._allocate_ips_for_port(context, {'port': p})
+            db_ports[index] = self._make_db_port(p, tenant_ids[index], ips)
+            # Flushed by the next queries, so that the following ports
+            # cannot request the same addresses
+            context.session.add(db_ports[index])
+
+        def allocate_auto_ips():
+            for network_id, indexes in auto_ips.items():
+                if not indexes:
+                    continue
+                net_ports = [ports[i] for i in indexes]
+                ips = self._allocate_ips_for_ports(context, network_id,
+                                                   net_ports)
+                for index, port_ips in zip(indexes, ips):
+                    db_ports[index] = self._make_db_port(
+                        ports[index], tenant_ids[index], port_ips)
+                    context.session.add(db_ports[index])
+        self._retry_ip_allocation(context, allocate_auto_ips)
+        return db_ports
+
+    def _set_macs_for_ports(self, context, network_id, ports):
+        """Check or generate the MAC addresses of the ports of a network."""
+        requested = [p['mac_address'] for p in ports
+                     if p['mac_address'] is not attributes.ATTR_NOT_SPECIFIED]
+        in_use = self._get_used_macs(context, network_id, requested)
+        seen = set()
+        for mac_address in requested:
+            if mac_address in in_use or mac_address in seen:
+                raise n_exc.MacAddressInUse(net_id=network_id,
+                                            mac=mac_address)
+            seen.add(mac_address)
+        generated = [p for p in ports
+                     if p['mac_address'] is attributes.ATTR_NOT_SPECIFIED]
+        if generated:
+            mac_addresses = self._generate_macs(context, network_id,
+                                                len(generated), seen)
+            for p, mac_address in zip(generated, mac_addresses):
+                p['mac_address'] = mac_address
+
+    def _allocate_ips_for_ports(self, context, network_id, ports):
+        """Allocate IP addresses for ports of a network without fixed_ips.
+
+        The addresses of each IP version are reserved for all the ports with
+        a single IPAM call.
+
+        :returns: the list of the IP addresses of each port.
+        """
+        filter = {'network_id': [network_id]}
+        subnets = self.get_subnets(context, filters=filter)
+        ips = [[] for p in ports]
+        v4 = [subnet for subnet in subnets if subnet['ip_version'] == 4]
+        v6 = []
+        for subnet in subnets:
+            if subnet['ip_version'] == 4:
+                continue
+            if not self._check_if_subnet_uses_eui64(subnet):
+                v6.append(subnet)
+                continue
+            ip_addresses = [
+                ipv6_utils.get_ipv6_addr_by_EUI64(
+                    subnet['cidr'], p['mac_address']).format()
+                for p in ports]
+            ip_qry = context.session.query(
+                models_v2.IPAllocation.ip_address).filter_by(
+                    network_id=network_id, subnet_id=subnet['id'])
+            ip_qry = ip_qry.filter(
+                models_v2.IPAllocation.ip_address.in_(ip_addresses))
+            in_use = ip_qry.first()
+            if in_use:
+                raise n_exc.IpAddressInUse(net_id=network_id,
+                                           ip_address=in_use[0])
+            for port_ips, ip_address in zip(ips, ip_addresses):
+                port_ips.append({'ip_address': ip_address,
+                                 'subnet_id': subnet['id']})
+        for version_subnets in (v4, v6):
+            if version_subnets:
+                results = ipam.get_driver().generate_ips(
+                    context, version_subnets, len(ports))
+                for port_ips, result in zip(ips, results):
+                    port_ips.append({'ip_address': result['ip_address'],
+                                     'subnet_id': result['subnet_id']})
+        return ips
+
+    @staticmethod
+    def _make_db_port(p, tenant_id, ips):
+        fixed_ips = [models_v2.IPAllocation(network_id=p['network_id'],
+                                            ip_address=ip['ip_address'],
+                                            subnet_id=ip['subnet_id'])
+                     for ip in ips]
+        return models_v2.Port(tenant_id=tenant_id,
+                              name=p['name'],
+                              id=p.get('id') or uuidutils.generate_uuid(),
+                              network_id=p['network_id'],
+                              mac_address=p['mac_address'],
+                              admin_state_up=p['admin_state_up'],
+                              status=p.get('status',
+                                           constants.PORT_STATUS_ACTIVE),
+                              device_id=p['device_id'],
+                              device_owner=p['device_owner'],
+                              fixed_ips=fixed_ips)
 
     def create_port(self, context, port):
         p = port['port']
@@ -1338,13 +1457,14 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             context.session.add(db_port)
 
             # Update the IP's for the port
-            ips = self._allocate_ips_for_port(context, port)
-            if ips:
+            def allocate_and_store_ips():
+                ips = self._allocate_ips_for_port(context, port)
                 for ip in ips:
                     ip_address = ip['ip_address']
                     subnet_id = ip['subnet_id']
                     NeutronDbPluginV2._store_ip_allocation(
                         context, ip_address, network_id, subnet_id, port_id)
+            self._retry_ip_allocation(context, allocate_and_store_ips)
 
         return self._make_port_dict(db_port, process_extensions=False)
 
@@ -1456,16 +1576,50 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def get_ports(self, context, filters=None, fields=None,
                   sorts=None, limit=None, marker=None,
                   page_reverse=False):
+        # The fixed_ips filter joins the ports with their fixed ips
+        by_columns = (fields and not (filters or {}).get('fixed_ips') and
+                      PORT_COLUMN_FIELDS.union(['fixed_ips']).issuperset(
+                          fields))
         marker_obj = self._get_marker_obj(context, 'port', limit, marker)
         query = self._get_ports_query(context, filters=filters,
                                       sorts=sorts, limit=limit,
                                       marker_obj=marker_obj,
                                       page_reverse=page_reverse)
-        items = [self._make_port_dict(c, fields) for c in query]
+        if by_columns:
+            items = self._get_port_column_dicts(context, query, fields)
+        else:
+            items = [self._make_port_dict(c, fields) for c in query]
         if limit and page_reverse:
             items.reverse()
         return items
 
+    def _get_port_column_dicts(self, context, query, fields):
+        """Returns the port dicts of fields read from their columns only.
+
+        The fixed ips, when requested, are read by a second query rather
+        than by loading the IP allocations of each port.
+        """
+        if 'fixed_ips' not in fields:
+            return self._get_column_dicts(query, models_v2.Port, fields)
+        IPAllocation = models_v2.IPAllocation
+        ports = self._get_column_dicts(
+            query, models_v2.Port,
+            [field for field in fields if field != 'fixed_ips'] + ['id'])
+        port_ids = query.with_entities(models_v2.Port.id).subquery()
+        fixed_ips = dict((port['id'], []) for port in ports)
+        for port_id, subnet_id, ip_address in context.session.query(
+                IPAllocation.port_id, IPAllocation.subnet_id,
+                IPAllocation.ip_address).filter(
+                    IPAllocation.port_id.in_(
+                        sql.select([port_ids.c.id]))):
+            fixed_ips[port_id].append({'subnet_id': subnet_id,
+                                       'ip_address': ip_address})
+        for port in ports:
+            port['fixed_ips'] = fixed_ips[port['id']]
+            if 'id' not in fields:
+                del port['id']
+        return ports
+
     def get_ports_count(self, context, filters=None):
         return self._get_ports_query(context, filters).count()
 
@@ -0,0 +1,597 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""IP address allocation backends of NeutronDbPluginV2.
+
+The backend is selected by the ipam_driver option. The IPAllocation table is
+always the reference of the allocated addresses, backends only differ in the
+way they find the free ones.
+"""
+
+import abc
+import bisect
+import collections
+import random
+
+import netaddr
+from oslo.config import cfg
+import six
+from sqlalchemy import event
+from sqlalchemy import orm
+
+from neutron.common import exceptions as n_exc
+from neutron.db import models_v2
+from neutron.openstack.common import importutils
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of random addresses tried before the free ranges of a subnet are
+# rebuilt from the database
+IP_GENERATION_RETRIES = 16
+
+# Session info keys of the addresses taken by FreeRangesIpamDriver in the
+# current transaction of the session
+_TAKEN_KEY = 'free_ranges_taken'
+_LISTENING_KEY = 'free_ranges_listening'
+
+_driver = None
+_driver_class = None
+
+
+def get_driver():
+    """Return the IPAM driver selected by the ipam_driver option."""
+    global _driver, _driver_class
+    if _driver is None or _driver_class != cfg.CONF.ipam_driver:
+        _driver_class = cfg.CONF.ipam_driver
+        _driver = importutils.import_object(_driver_class)
+        LOG.info(_('Loaded ipam_driver: %s.'), _driver_class)
+    return _driver
+
+
+@six.add_metaclass(abc.ABCMeta)
+class IpamDriver(object):
+    """Find and reserve the free addresses of the allocation pools.
+
+    All the methods are called within the transaction that stores or deletes
+    the corresponding IPAllocation rows.
+    """
+
+    @abc.abstractmethod
+    def create_subnet_pools(self, context, ip_pools):
+        """Called when the IPAllocationPool ip_pools of a subnet are added."""
+
+    @abc.abstractmethod
+    def update_subnet_pools(self, context, subnet):
+        """Called when the allocation pools of subnet are replaced."""
+
+    @abc.abstractmethod
+    def generate_ip(self, context, subnets):
+        """Reserve a free address of one of the subnets.
+
+        :returns: a dict with the ip_address and subnet_id keys.
+        :raises: IpAddressGenerationFailure
+        """
+
+    def generate_ips(self, context, subnets, count):
+        """Reserve count free addresses of the subnets.
+
+        Used by bulk port creation, drivers should override it to reserve
+        all the addresses at once.
+
+        :returns: a list of count dicts with the ip_address and subnet_id
+                  keys.
+        :raises: IpAddressGenerationFailure
+        """
+        return [self.generate_ip(context, subnets) for i in range(count)]
+
+    @abc.abstractmethod
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        """Reserve ip_address, which is not allocated yet, on the subnet."""
+
+    @abc.abstractmethod
+    def delete_subnet(self, context, subnet_id):
+        """Called when a subnet is deleted."""
+
+
+class AvailabilityRangeIpamDriver(IpamDriver):
+    """Free addresses kept as IPAvailabilityRange rows.
+
+    Addresses are taken from the first range of the subnet, which is locked
+    for update, and released addresses are only recycled once the ranges are
+    exhausted.
+    """
+
+    def create_subnet_pools(self, context, ip_pools):
+        for ip_pool in ip_pools:
+            ip_range = models_v2.IPAvailabilityRange(
+                ipallocationpool=ip_pool,
+                first_ip=ip_pool.first_ip,
+                last_ip=ip_pool.last_ip)
+            context.session.add(ip_range)
+
+    def update_subnet_pools(self, context, subnet):
+        self._rebuild_availability_ranges(context, [subnet])
+
+    def generate_ip(self, context, subnets):
+        try:
+            return self._try_generate_ip(context, subnets)
+        except n_exc.IpAddressGenerationFailure:
+            self._rebuild_availability_ranges(context, subnets)
+
+        return self._try_generate_ip(context, subnets)
+
+    def generate_ips(self, context, subnets, count):
+        try:
+            return self._try_generate_ips(context, subnets, count)
+        except n_exc.IpAddressGenerationFailure:
+            # All the ranges were consumed, the addresses taken from them
+            # are not stored yet and are taken again once rebuilt
+            self._rebuild_availability_ranges(context, subnets)
+
+        return self._try_generate_ips(context, subnets, count)
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        """Allocate a specific IP address on the subnet."""
+        ip = int(netaddr.IPAddress(ip_address))
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        results = range_qry.filter_by(subnet_id=subnet_id)
+        for ip_range in results:
+            first = int(netaddr.IPAddress(ip_range['first_ip']))
+            last = int(netaddr.IPAddress(ip_range['last_ip']))
+            if first <= ip <= last:
+                if first == last:
+                    context.session.delete(ip_range)
+                    return
+                elif first == ip:
+                    new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
+                    ip_range['first_ip'] = new_first_ip
+                    return
+                elif last == ip:
+                    new_last_ip = str(netaddr.IPAddress(ip_address) - 1)
+                    ip_range['last_ip'] = new_last_ip
+                    return
+                else:
+                    # Adjust the original range to end before ip_address
+                    old_last_ip = ip_range['last_ip']
+                    new_last_ip = str(netaddr.IPAddress(ip_address) - 1)
+                    ip_range['last_ip'] = new_last_ip
+
+                    # Create a new second range for after ip_address
+                    new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
+                    new_ip_range = models_v2.IPAvailabilityRange(
+                        allocation_pool_id=ip_range['allocation_pool_id'],
+                        first_ip=new_first_ip,
+                        last_ip=old_last_ip)
+                    context.session.add(new_ip_range)
+                    return
+
+    def delete_subnet(self, context, subnet_id):
+        pass
+
+    @staticmethod
+    def _try_generate_ip(context, subnets):
+        """Generate an IP address.
+
+        The IP address will be generated from one of the subnets defined on
+        the network.
+        """
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        for subnet in subnets:
+            ip_range = range_qry.filter_by(subnet_id=subnet['id']).first()
+            if not ip_range:
+                LOG.debug("All IPs from subnet %(subnet_id)s (%(cidr)s) "
+                          "allocated",
+                          {'subnet_id': subnet['id'],
+                           'cidr': subnet['cidr']})
+                continue
+            ip_address = ip_range['first_ip']
+            if ip_range['first_ip'] == ip_range['last_ip']:
+                # No more free indices on subnet => delete
+                LOG.debug("No more free IP's in slice. Deleting "
+                          "allocation pool.")
+                context.session.delete(ip_range)
+            else:
+                # increment the first free
+                new_first_ip = str(netaddr.IPAddress(ip_address) + 1)
+                ip_range['first_ip'] = new_first_ip
+            LOG.debug("Allocated IP - %(ip_address)s from %(first_ip)s "
+                      "to %(last_ip)s",
+                      {'ip_address': ip_address,
+                       'first_ip': ip_address,
+                       'last_ip': ip_range['last_ip']})
+            return {'ip_address': ip_address,
+                    'subnet_id': subnet['id']}
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    @staticmethod
+    def _try_generate_ips(context, subnets, count):
+        """Generate count IP addresses.
+
+        Consecutive addresses are taken from the ranges of the subnets, lowest
+        first, each range being updated once.
+        """
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        ips = []
+        for subnet in subnets:
+            ip_ranges = sorted(
+                range_qry.filter_by(subnet_id=subnet['id']),
+                key=lambda ip_range: netaddr.IPAddress(ip_range['first_ip']))
+            for ip_range in ip_ranges:
+                first = netaddr.IPAddress(ip_range['first_ip'])
+                last = netaddr.IPAddress(ip_range['last_ip'])
+                taken = min(int(last) - int(first) + 1, count - len(ips))
+                ips.extend({'ip_address': str(first + i),
+                            'subnet_id': subnet['id']}
+                           for i in range(taken))
+                if first + taken > last:
+                    context.session.delete(ip_range)
+                else:
+                    ip_range['first_ip'] = str(first + taken)
+                if len(ips) == count:
+                    LOG.debug("Allocated %(count)s IPs from subnets "
+                              "%(subnet_ids)s",
+                              {'count': count,
+                               'subnet_ids': [s['id'] for s in subnets]})
+                    return ips
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    @staticmethod
+    def _rebuild_availability_ranges(context, subnets):
+        """Rebuild availability ranges.
+
+        This method is called only when there's no more IP available or by
+        update_subnet_pools. Calling _update_subnet_allocation_pools before
+        calling this function deletes the IPAllocationPools associated with
+        the subnet that is updating, which will result in deleting the
+        IPAvailabilityRange too.
+        """
+        ip_qry = context.session.query(
+            models_v2.IPAllocation).with_lockmode('update')
+        # PostgreSQL does not support select...for update with an outer join.
+        # No join is needed here.
+        pool_qry = context.session.query(
+            models_v2.IPAllocationPool).options(
+                orm.noload('available_ranges')).with_lockmode('update')
+        for subnet in sorted(subnets):
+            LOG.debug(_("Rebuilding availability ranges for subnet %s")
+                      % subnet)
+
+            # Create a set of all currently allocated addresses
+            ip_qry_results = ip_qry.filter_by(subnet_id=subnet['id'])
+            allocations = netaddr.IPSet([netaddr.IPAddress(i['ip_address'])
+                                        for i in ip_qry_results])
+
+            for pool in pool_qry.filter_by(subnet_id=subnet['id']):
+                # Create a set of all addresses in the pool
+                poolset = netaddr.IPSet(netaddr.iter_iprange(pool['first_ip'],
+                                                             pool['last_ip']))
+
+                # Use set difference to find free addresses in the pool
+                available = poolset - allocations
+
+                # Generator compacts an ip set into contiguous ranges
+                def ipset_to_ranges(ipset):
+                    first, last = None, None
+                    for cidr in ipset.iter_cidrs():
+                        if last and last + 1 != cidr.first:
+                            yield netaddr.IPRange(first, last)
+                            first = None
+                        first, last = first if first else cidr.first, cidr.last
+                    if first:
+                        yield netaddr.IPRange(first, last)
+
+                # Write the ranges to the db
+                for ip_range in ipset_to_ranges(available):
+                    available_range = models_v2.IPAvailabilityRange(
+                        allocation_pool_id=pool['id'],
+                        first_ip=str(netaddr.IPAddress(ip_range.first)),
+                        last_ip=str(netaddr.IPAddress(ip_range.last)))
+                    context.session.add(available_range)
+
+
+class FreeRanges(object):
+    """Sorted and disjoint ranges of free addresses, as integers.
+
+    Looking up or taking an address is O(log n), n being the number of
+    ranges, which stays small as long as the allocated addresses are
+    clustered.
+    """
+
+    def __init__(self, pools, allocated):
+        """Build the free ranges.
+
+        :param pools: the (first, last) ranges of the allocation pools.
+        :param allocated: the allocated addresses.
+        """
+        self.pools = sorted(pools)
+        self._firsts = []
+        self._lasts = []
+        allocated = sorted(allocated)
+        for first, last in self.pools:
+            index = bisect.bisect_left(allocated, first)
+            for ip in allocated[index:]:
+                if ip > last:
+                    break
+                if ip > first:
+                    self._append(first, ip - 1)
+                first = ip + 1
+            if first <= last:
+                self._append(first, last)
+
+    def _append(self, first, last):
+        if self._lasts and self._lasts[-1] + 1 == first:
+            self._lasts[-1] = last
+        else:
+            self._firsts.append(first)
+            self._lasts.append(last)
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def _find(self, ip):
+        index = bisect.bisect_right(self._firsts, ip) - 1
+        if index >= 0 and ip <= self._lasts[index]:
+            return index
+
+    def __contains__(self, ip):
+        return self._find(ip) is not None
+
+    def take(self, ip):
+        """Remove ip from the free ranges, return False if it was not free."""
+        index = self._find(ip)
+        if index is None:
+            return False
+        first, last = self._firsts[index], self._lasts[index]
+        if first == last:
+            del self._firsts[index]
+            del self._lasts[index]
+        elif ip == first:
+            self._firsts[index] = ip + 1
+        elif ip == last:
+            self._lasts[index] = ip - 1
+        else:
+            self._lasts[index] = ip - 1
+            self._firsts.insert(index + 1, ip + 1)
+            self._lasts.insert(index + 1, last)
+        return True
+
+    def release(self, ip):
+        """Add ip back to the free ranges, return False if it was not taken.
+
+        Addresses outside of the pools are not added.
+        """
+        if ip in self or not any(first <= ip <= last
+                                 for first, last in self.pools):
+            return False
+        index = bisect.bisect_left(self._firsts, ip)
+        after_previous = index > 0 and self._lasts[index - 1] + 1 == ip
+        before_next = (index < len(self._firsts) and
+                       self._firsts[index] - 1 == ip)
+        if after_previous and before_next:
+            self._lasts[index - 1] = self._lasts[index]
+            del self._firsts[index]
+            del self._lasts[index]
+        elif after_previous:
+            self._lasts[index - 1] = ip
+        elif before_next:
+            self._firsts[index] = ip
+        else:
+            self._firsts.insert(index, ip)
+            self._lasts.insert(index, ip)
+        return True
+
+    def random(self):
+        """Return a random free address, None if there is none.
+
+        A range is picked first, then an address in this range, so that
+        concurrent allocations are spread over the whole pools.
+        """
+        if not self._firsts:
+            return
+        index = random.randrange(len(self._firsts))
+        return random.randint(self._firsts[index], self._lasts[index])
+
+
+class FreeRangesIpamDriver(IpamDriver):
+    """Free addresses kept in memory as FreeRanges.
+
+    The free ranges of a subnet are computed once from its allocation pools
+    and IPAllocation rows, then updated by this process only. Like
+    _generate_mac, an address is picked randomly and checked against the
+    IPAllocation table, so that no row is locked and concurrent allocations
+    do not contend. Addresses allocated by other servers are discovered by
+    this check, or by the IPAllocation primary key when both servers picked
+    the same address concurrently. As with availability ranges, released
+    addresses are only recycled when the ranges are rebuilt, once no free
+    address is found.
+
+    The addresses taken by a transaction which is rolled back are released,
+    and those taken by uncommitted transactions are kept taken when the
+    ranges are rebuilt.
+    """
+
+    def __init__(self):
+        # subnet id -> FreeRanges
+        self._free_ranges = {}
+        # subnet id -> addresses taken by the uncommitted transactions
+        self._uncommitted = collections.defaultdict(set)
+
+    def _take(self, session, subnet_id, free_ranges, ip):
+        """Take ip until the end of the transaction of session."""
+        if not free_ranges.take(ip):
+            return False
+        self._uncommitted[subnet_id].add(ip)
+        session.info.setdefault(_TAKEN_KEY, []).append((subnet_id, ip))
+        if not session.info.get(_LISTENING_KEY):
+            session.info[_LISTENING_KEY] = True
+            event.listen(session, 'after_commit', self._after_commit)
+            event.listen(session, 'after_transaction_end',
+                         self._after_transaction_end)
+        return True
+
+    def _forget(self, session, subnet_id, ips):
+        """Keep taken the ips allocated in the database."""
+        self._uncommitted[subnet_id].difference_update(ips)
+        taken = session.info.get(_TAKEN_KEY, [])
+        taken[:] = [(taken_subnet_id, ip) for taken_subnet_id, ip in taken
+                    if taken_subnet_id != subnet_id or ip not in ips]
+
+    def _after_commit(self, session):
+        if session.transaction.nested:
+            return
+        for subnet_id, ip in session.info.pop(_TAKEN_KEY, []):
+            self._uncommitted[subnet_id].discard(ip)
+
+    def _after_transaction_end(self, session, transaction):
+        if session.transaction is not None:
+            # Not the outermost transaction
+            return
+        # The addresses of a committed transaction are already forgotten
+        for subnet_id, ip in session.info.pop(_TAKEN_KEY, []):
+            self._uncommitted[subnet_id].discard(ip)
+            free_ranges = self._free_ranges.get(subnet_id)
+            if free_ranges is not None:
+                free_ranges.release(ip)
+
+    def create_subnet_pools(self, context, ip_pools):
+        pass
+
+    def update_subnet_pools(self, context, subnet):
+        self._free_ranges.pop(subnet['id'], None)
+
+    def delete_subnet(self, context, subnet_id):
+        self._free_ranges.pop(subnet_id, None)
+
+    @staticmethod
+    def _get_pools(context, subnet_id):
+        pool_qry = context.session.query(
+            models_v2.IPAllocationPool.first_ip,
+            models_v2.IPAllocationPool.last_ip).filter_by(subnet_id=subnet_id)
+        return sorted((int(netaddr.IPAddress(first_ip)),
+                       int(netaddr.IPAddress(last_ip)))
+                      for first_ip, last_ip in pool_qry)
+
+    def _build_free_ranges(self, context, subnet_id, pools):
+        LOG.debug("Building free IP ranges of subnet %s", subnet_id)
+        ip_qry = context.session.query(
+            models_v2.IPAllocation.ip_address).filter_by(subnet_id=subnet_id)
+        allocated = [int(netaddr.IPAddress(ip_address))
+                     for ip_address, in ip_qry]
+        # Availability ranges are not maintained by this driver, drop them
+        # so that they are rebuilt if AvailabilityRangeIpamDriver is used
+        # again
+        pool_ids = [pool_id for pool_id, in context.session.query(
+            models_v2.IPAllocationPool.id).filter_by(subnet_id=subnet_id)]
+        if pool_ids:
+            context.session.query(models_v2.IPAvailabilityRange).filter(
+                models_v2.IPAvailabilityRange.allocation_pool_id.in_(
+                    pool_ids)).delete(synchronize_session=False)
+        free_ranges = FreeRanges(pools, allocated)
+        # The addresses taken by uncommitted transactions are not stored yet
+        for ip in self._uncommitted.get(subnet_id, ()):
+            free_ranges.take(ip)
+        self._free_ranges[subnet_id] = free_ranges
+        return free_ranges
+
+    def _get_free_ranges(self, context, subnet_id):
+        # The pools may have been updated by another server
+        pools = self._get_pools(context, subnet_id)
+        free_ranges = self._free_ranges.get(subnet_id)
+        if free_ranges is None or free_ranges.pools != pools:
+            free_ranges = self._build_free_ranges(context, subnet_id, pools)
+        return free_ranges
+
+    @staticmethod
+    def _get_allocated(context, subnet_id, ip_addresses):
+        ip_qry = context.session.query(
+            models_v2.IPAllocation.ip_address).filter_by(subnet_id=subnet_id)
+        ip_qry = ip_qry.filter(
+            models_v2.IPAllocation.ip_address.in_(ip_addresses))
+        return set(ip_address for ip_address, in ip_qry)
+
+    def _try_generate_ips(self, context, subnet, free_ranges, count):
+        """Pick up to count free addresses of the subnet.
+
+        Each attempt checks all its candidates with a single query.
+        """
+        ip_addresses = []
+        for i in range(IP_GENERATION_RETRIES):
+            candidates = []
+            while len(ip_addresses) + len(candidates) < count:
+                ip = free_ranges.random()
+                if ip is None:
+                    break
+                self._take(context.session, subnet['id'], free_ranges, ip)
+                candidates.append(str(netaddr.IPAddress(ip)))
+            if not candidates:
+                break
+            allocated = self._get_allocated(context, subnet['id'], candidates)
+            if allocated:
+                self._forget(context.session, subnet['id'],
+                             set(int(netaddr.IPAddress(ip_address))
+                                 for ip_address in allocated))
+                LOG.debug("IPs %(ip_addresses)s of subnet %(subnet_id)s were "
+                          "allocated by another server",
+                          {'ip_addresses': sorted(allocated),
+                           'subnet_id': subnet['id']})
+            ip_addresses.extend(ip_address for ip_address in candidates
+                                if ip_address not in allocated)
+            if len(ip_addresses) == count:
+                break
+        return ip_addresses
+
+    def generate_ip(self, context, subnets):
+        return self.generate_ips(context, subnets, 1)[0]
+
+    def generate_ips(self, context, subnets, count):
+        ips = []
+        for subnet in subnets:
+            needed = count - len(ips)
+            free_ranges = self._get_free_ranges(context, subnet['id'])
+            ip_addresses = self._try_generate_ips(context, subnet,
+                                                  free_ranges, needed)
+            if len(ip_addresses) < needed:
+                # Recycle the addresses released by other servers
+                free_ranges = self._build_free_ranges(
+                    context, subnet['id'], free_ranges.pools)
+                ip_addresses += self._try_generate_ips(
+                    context, subnet, free_ranges, needed - len(ip_addresses))
+            if ip_addresses:
+                LOG.debug("Allocated IPs %(ip_addresses)s from subnet "
+                          "%(subnet_id)s",
+                          {'ip_addresses': ip_addresses,
+                           'subnet_id': subnet['id']})
+                ips.extend({'ip_address': ip_address,
+                            'subnet_id': subnet['id']}
+                           for ip_address in ip_addresses)
+            if len(ips) == count:
+                return ips
+            LOG.debug("All IPs from subnet %(subnet_id)s (%(cidr)s) "
+                      "allocated",
+                      {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        free_ranges = self._get_free_ranges(context, subnet_id)
+        self._take(context.session, subnet_id, free_ranges,
+                   int(netaddr.IPAddress(ip_address)))
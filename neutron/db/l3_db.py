@@ -972,20 +972,20 @@ class L3_NAT_dbonly_mixin(l3.RouterPluginBase):
         return gw_ports
 
     def get_sync_interfaces(self, context, router_ids, device_owners=None):
-        """Query router interfaces that relate to list of router_ids."""
+        """Query router interfaces that relate to list of router_ids.
+
+        The ports are joined to their router ports and loaded by a single
+        query, however many routers there are.
+        """
         device_owners = device_owners or [DEVICE_OWNER_ROUTER_INTF]
         if not router_ids:
             return []
-        qry = context.session.query(RouterPort)
+        qry = context.session.query(models_v2.Port).join(RouterPort)
         qry = qry.filter(
-            Router.id.in_(router_ids),
+            RouterPort.router_id.in_(router_ids),
             RouterPort.port_type.in_(device_owners)
         )
-
-        # TODO(markmcclain): This is suboptimal but was left to reduce
-        # changeset size since it is late in cycle
-        ports = [rp.port.id for rp in qry]
-        interfaces = self._core_plugin.get_ports(context, {'id': ports})
+        interfaces = [self._core_plugin._make_port_dict(port) for port in qry]
         if interfaces:
             self._populate_subnet_for_ports(context, interfaces)
         return interfaces
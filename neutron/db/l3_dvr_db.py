@@ -264,21 +264,9 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
 
     def get_snat_sync_interfaces(self, context, router_ids):
         """Query router interfaces that relate to list of router_ids."""
-        if not router_ids:
-            return []
-        qry = context.session.query(l3_db.RouterPort)
-        qry = qry.filter(
-            l3_db.RouterPort.router_id.in_(router_ids),
-            l3_db.RouterPort.port_type == DEVICE_OWNER_DVR_SNAT
-        )
-
-        # TODO(markmcclain): This is suboptimal but was left to reduce
-        # changeset size since it is late in cycle
-        ports = [rp.port.id for rp in qry]
-        interfaces = self._core_plugin.get_ports(context, {'id': ports})
+        interfaces = self.get_sync_interfaces(
+            context, router_ids, device_owners=[DEVICE_OWNER_DVR_SNAT])
         LOG.debug("Return the SNAT ports: %s", interfaces)
-        if interfaces:
-            self._populate_subnet_for_ports(context, interfaces)
         return interfaces
 
     def _build_routers_list(self, context, routers, gw_ports):
@@ -310,35 +298,47 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
 
     def _process_routers(self, context, routers):
         routers_dict = {}
+        snat_intfs_by_router_id = {}
+        # Query the SNAT ports of all the routers at once
+        gw_router_ids = [r['id'] for r in routers if r['gw_port_id']]
+        for intf in self.get_snat_sync_interfaces(context, gw_router_ids):
+            snat_intfs_by_router_id.setdefault(
+                intf['device_id'], []).append(intf)
         for router in routers:
             routers_dict[router['id']] = router
-            router_ids = [router['id']]
             if router['gw_port_id']:
-                snat_router_intfs = self.get_snat_sync_interfaces(context,
-                                                                  router_ids)
+                snat_router_intfs = snat_intfs_by_router_id.get(
+                    router['id'], [])
                 LOG.debug("SNAT ports returned: %s ", snat_router_intfs)
                 router[SNAT_ROUTER_INTF_KEY] = snat_router_intfs
         return routers_dict
 
     def _process_floating_ips(self, context, routers_dict, floating_ips):
+        # The FIP agent ports of a host are shared by its floating IPs
+        agent_intfs_by_host = {}
         for floating_ip in floating_ips:
             router = routers_dict.get(floating_ip['router_id'])
             if router:
                 router_floatingips = router.get(l3_const.FLOATINGIP_KEY, [])
                 floatingip_agent_intfs = []
                 if router['distributed']:
-                    floating_ip['host'] = self.get_vm_port_hostid(
-                        context, floating_ip['port_id'])
+                    if 'host' not in floating_ip:
+                        floating_ip['host'] = self.get_vm_port_hostid(
+                            context, floating_ip['port_id'])
                     LOG.debug("Floating IP host: %s", floating_ip['host'])
                     # if no VM there won't be an agent assigned
                     if not floating_ip['host']:
                         continue
-                    fip_agent = self._get_agent_by_type_and_host(
-                        context, l3_const.AGENT_TYPE_L3,
-                        floating_ip['host'])
-                    LOG.debug("FIP Agent : %s ", fip_agent['id'])
-                    floatingip_agent_intfs = self.get_fip_sync_interfaces(
-                        context, fip_agent['id'])
+                    if floating_ip['host'] not in agent_intfs_by_host:
+                        fip_agent = self._get_agent_by_type_and_host(
+                            context, l3_const.AGENT_TYPE_L3,
+                            floating_ip['host'])
+                        LOG.debug("FIP Agent : %s ", fip_agent['id'])
+                        agent_intfs_by_host[floating_ip['host']] = (
+                            self.get_fip_sync_interfaces(context,
+                                                         fip_agent['id']))
+                    floatingip_agent_intfs = agent_intfs_by_host[
+                        floating_ip['host']]
                     LOG.debug("FIP Agent ports: %s", floatingip_agent_intfs)
                 router_floatingips.append(floating_ip)
                 router[l3_const.FLOATINGIP_KEY] = router_floatingips
@@ -362,9 +362,17 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
             context, router_ids=router_ids, active=active,
             device_owners=[l3_const.DEVICE_OWNER_ROUTER_INTF,
                            DEVICE_OWNER_DVR_INTERFACE])
-        # Add the port binding host to the floatingip dictionary
+        # Add the port binding host to the floatingip dictionary, the ports
+        # of all the floating IPs are fetched at once
+        port_ids = [fip['port_id'] for fip in floating_ips]
+        ports = {}
+        if port_ids:
+            ports = dict((port['id'], port) for port in
+                         self._core_plugin.get_ports(context,
+                                                     {'id': port_ids}))
         for fip in floating_ips:
-            fip['host'] = self.get_vm_port_hostid(context, fip['port_id'])
+            fip['host'] = self.get_vm_port_hostid(context, fip['port_id'],
+                                                  ports.get(fip['port_id']))
         routers_dict = self._process_routers(context, routers)
         self._process_floating_ips(context, routers_dict, floating_ips)
         self._process_interfaces(routers_dict, interfaces)
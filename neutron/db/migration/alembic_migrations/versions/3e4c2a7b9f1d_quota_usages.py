@@ -0,0 +1,57 @@
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add quota usages and reservations
+
+Revision ID: 3e4c2a7b9f1d
+Revises: juno
+Create Date: 2014-10-20 10:12:41.331245
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e4c2a7b9f1d'
+down_revision = 'juno'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'quotausages',
+        sa.Column('tenant_id', sa.String(length=255), nullable=False),
+        sa.Column('resource', sa.String(length=255), nullable=False),
+        sa.Column('in_use', sa.Integer(), nullable=False),
+        sa.Column('dirty', sa.Boolean(), nullable=False),
+        sa.Column('synced_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('tenant_id', 'resource'),
+    )
+    op.create_table(
+        'quotareservations',
+        sa.Column('reservation_id', sa.String(length=36), nullable=False),
+        sa.Column('resource', sa.String(length=255), nullable=False),
+        sa.Column('tenant_id', sa.String(length=255), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('expiration', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('reservation_id', 'resource'),
+    )
+    op.create_index('ix_quotareservations_tenant_id_resource',
+                    'quotareservations', ['tenant_id', 'resource'])
+
+
+def downgrade():
+    op.drop_table('quotareservations')
+    op.drop_table('quotausages')
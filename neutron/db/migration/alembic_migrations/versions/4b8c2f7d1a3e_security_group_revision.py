@@ -0,0 +1,39 @@
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add security group revision
+
+Revision ID: 4b8c2f7d1a3e
+Revises: 3e4c2a7b9f1d
+Create Date: 2014-10-27 14:05:37.518211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b8c2f7d1a3e'
+down_revision = '3e4c2a7b9f1d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('securitygroups',
+                  sa.Column('revision', sa.Integer(), nullable=False,
+                            server_default='0'))
+
+
+def downgrade():
+    op.drop_column('securitygroups', 'revision')
@@ -13,11 +13,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
+from oslo.config import cfg
+from oslo.db import exception as db_exc
 import sqlalchemy as sa
 
 from neutron.common import exceptions
 from neutron.db import model_base
 from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from neutron.openstack.common import uuidutils
+
+
+LOG = logging.getLogger(__name__)
 
 
 class Quota(model_base.BASEV2, models_v2.HasId):
@@ -31,6 +41,31 @@ class Quota(model_base.BASEV2, models_v2.HasId):
     limit = sa.Column(sa.Integer)
 
 
+class QuotaUsage(model_base.BASEV2):
+    """Represent the number of resources in use by a tenant.
+
+    in_use is counted when the row is created, dirty or older than the
+    usage_resync_interval option, and updated as reservations are
+    committed.
+    """
+    tenant_id = sa.Column(sa.String(255), primary_key=True)
+    resource = sa.Column(sa.String(255), primary_key=True)
+    in_use = sa.Column(sa.Integer, nullable=False)
+    dirty = sa.Column(sa.Boolean, nullable=False, default=False)
+    synced_at = sa.Column(sa.DateTime, nullable=False)
+
+
+class QuotaReservation(model_base.BASEV2):
+    """Represent resources reserved for a request creating them."""
+    reservation_id = sa.Column(sa.String(36), primary_key=True)
+    resource = sa.Column(sa.String(255), primary_key=True)
+    tenant_id = sa.Column(sa.String(255), nullable=False)
+    amount = sa.Column(sa.Integer, nullable=False)
+    expiration = sa.Column(sa.DateTime, nullable=False)
+    __table_args__ = (sa.Index('ix_quotareservations_tenant_id_resource',
+                               'tenant_id', 'resource'),)
+
+
 class DbQuotaDriver(object):
     """Driver to perform necessary checks to enforce quotas and obtain quota
     information.
@@ -177,3 +212,159 @@ class DbQuotaDriver(object):
                  if quotas[key] >= 0 and quotas[key] < val]
         if overs:
             raise exceptions.OverQuota(overs=sorted(overs))
+
+    @staticmethod
+    def _sync_usages(context, tenant_id, resource_names, count, now,
+                     force=False):
+        """Return the usages of the resources, locked for update.
+
+        The usages which are missing, dirty or older than the
+        usage_resync_interval option are counted again, or all of them if
+        force is True, unless they were just counted.
+        """
+        resync_before = now - datetime.timedelta(
+            seconds=cfg.CONF.QUOTAS.usage_resync_interval)
+        usage_qry = context.session.query(QuotaUsage).filter(
+            QuotaUsage.tenant_id == tenant_id,
+            QuotaUsage.resource.in_(resource_names)).with_lockmode('update')
+        usages = dict((usage.resource, usage) for usage in usage_qry)
+        for resource in resource_names:
+            usage = usages.get(resource)
+            if usage is not None and (usage.synced_at == now or (
+                    not force and not usage.dirty and
+                    usage.synced_at > resync_before)):
+                continue
+            in_use = count(resource)
+            if usage is None:
+                usage = QuotaUsage(tenant_id=tenant_id, resource=resource)
+                context.session.add(usage)
+                usages[resource] = usage
+            usage.in_use = in_use
+            usage.dirty = False
+            usage.synced_at = now
+            LOG.debug("Synchronized usage of %(resource)s by tenant "
+                      "%(tenant_id)s: %(in_use)s",
+                      {'resource': resource, 'tenant_id': tenant_id,
+                       'in_use': usage.in_use})
+        return usages
+
+    @staticmethod
+    def _get_reserved(context, tenant_id, resource_names, now):
+        """Return the amounts of the resources in active reservations.
+
+        Expired reservations, left by requests which did not complete, are
+        deleted.
+        """
+        reservation_qry = context.session.query(QuotaReservation).filter(
+            QuotaReservation.tenant_id == tenant_id,
+            QuotaReservation.resource.in_(resource_names))
+        reservation_qry.filter(
+            QuotaReservation.expiration <= now).delete(
+                synchronize_session=False)
+        reserved_qry = context.session.query(
+            QuotaReservation.resource,
+            sa.func.sum(QuotaReservation.amount)).filter(
+                QuotaReservation.tenant_id == tenant_id,
+                QuotaReservation.resource.in_(resource_names)).group_by(
+                    QuotaReservation.resource)
+        return dict((resource, int(amount))
+                    for resource, amount in reserved_qry)
+
+    def make_reservation(self, context, tenant_id, resources, deltas, count):
+        """Reserve resources for a tenant.
+
+        The usage of the resources is locked while the reservation is made,
+        so that concurrent reservations do not exceed the quotas.
+
+        This method will raise a QuotaResourceUnknown exception if a
+        given resource is unknown, and an OverQuota exception if the deltas
+        would put resources over their quota.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id to reserve resources for.
+        :param resources: A dictionary of the registered resources.
+        :param deltas: A dictionary of the amounts to reserve, by resource.
+        :param count: A callable returning the number of resources in use,
+                      given a resource name.
+        :returns: the id of the reservation.
+        """
+
+        # Ensure no value is less than zero
+        unders = [key for key, val in deltas.items() if val < 0]
+        if unders:
+            raise exceptions.InvalidQuotaValue(unders=sorted(unders))
+
+        try:
+            return self._make_reservation(context, tenant_id, resources,
+                                          deltas, count)
+        except db_exc.DBDuplicateEntry:
+            # The usage was created by a concurrent reservation
+            return self._make_reservation(context, tenant_id, resources,
+                                          deltas, count)
+
+    def _make_reservation(self, context, tenant_id, resources, deltas, count):
+        quotas = self._get_quotas(context, tenant_id, resources, deltas.keys())
+        limited = [key for key in deltas if quotas[key] >= 0]
+        reservation_id = uuidutils.generate_uuid()
+        now = timeutils.utcnow()
+        with context.session.begin(subtransactions=True):
+            if limited:
+                usages = self._sync_usages(context, tenant_id, limited,
+                                           count, now)
+                reserved = self._get_reserved(context, tenant_id, limited,
+                                              now)
+
+                def get_overs():
+                    return [key for key in limited
+                            if usages[key].in_use + reserved.get(key, 0) +
+                            deltas[key] > quotas[key]]
+
+                overs = get_overs()
+                if overs:
+                    # Ensure the usage is not overestimated, e.g. because of
+                    # resources deleted without a quota update
+                    usages.update(self._sync_usages(
+                        context, tenant_id, overs, count, now, force=True))
+                    overs = get_overs()
+                if overs:
+                    raise exceptions.OverQuota(overs=sorted(overs))
+            expiration = now + datetime.timedelta(
+                seconds=cfg.CONF.QUOTAS.reservation_expiration)
+            for resource, amount in deltas.items():
+                context.session.add(QuotaReservation(
+                    reservation_id=reservation_id, resource=resource,
+                    tenant_id=tenant_id, amount=amount,
+                    expiration=expiration))
+        return reservation_id
+
+    @staticmethod
+    def commit_reservation(context, reservation_id):
+        """Add the amounts of a reservation to the usages."""
+        with context.session.begin(subtransactions=True):
+            reservation_qry = context.session.query(
+                QuotaReservation).filter_by(reservation_id=reservation_id)
+            for reservation in reservation_qry:
+                usage = context.session.query(QuotaUsage).filter_by(
+                    tenant_id=reservation.tenant_id,
+                    resource=reservation.resource).with_lockmode(
+                        'update').first()
+                if usage:
+                    usage.in_use += reservation.amount
+            reservation_qry.delete(synchronize_session=False)
+
+    @staticmethod
+    def cancel_reservation(context, reservation_id):
+        """Release the resources of a reservation."""
+        with context.session.begin(subtransactions=True):
+            context.session.query(QuotaReservation).filter_by(
+                reservation_id=reservation_id).delete(
+                    synchronize_session=False)
+
+    @staticmethod
+    def mark_dirty(context, tenant_id, resources):
+        """Have the usage of the resources counted on next reservation."""
+        with context.session.begin(subtransactions=True):
+            context.session.query(QuotaUsage).filter(
+                QuotaUsage.tenant_id == tenant_id,
+                QuotaUsage.resource.in_(resources)).update(
+                    {'dirty': True}, synchronize_session=False)
@@ -38,6 +38,8 @@ class SecurityGroup(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
 
     name = sa.Column(sa.String(255))
     description = sa.Column(sa.String(255))
+    # Bumped when the rules or the members of the group change
+    revision = sa.Column(sa.Integer, nullable=False, server_default='0')
 
 
 class SecurityGroupPortBinding(model_base.BASEV2):
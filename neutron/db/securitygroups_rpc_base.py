@@ -14,11 +14,14 @@
 #    under the License.
 
 import netaddr
+from oslo.config import cfg
+from sqlalchemy import event
 from sqlalchemy.orm import exc
 
 from neutron.common import constants as q_const
 from neutron.common import ipv6_utils as ipv6
 from neutron.common import utils
+from neutron.db import api as db_api
 from neutron.db import models_v2
 from neutron.db import securitygroups_db as sg_db
 from neutron.extensions import securitygroup as ext_sg
@@ -26,6 +29,16 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+security_group_server_opts = [
+    cfg.BoolOpt(
+        'enable_server_cache',
+        default=True,
+        help=_('Cache the rules and the member IP addresses of security '
+               'groups in the server to answer agents requests. Cached '
+               'entries are checked against the revision of their '
+               'security group in the database.'))
+]
+cfg.CONF.register_opts(security_group_server_opts, 'SECURITYGROUP')
 
 DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
                        'egress': 'dest_ip_prefix'}
@@ -33,9 +46,183 @@ DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
 DHCP_RULE_PORT = {4: (67, 68, q_const.IPv4), 6: (547, 546, q_const.IPv6)}
 
 
+_INVALIDATED_KEY = 'security_groups_invalidated'
+_LISTENING_KEY = 'security_groups_listening'
+
+
+RULE_KEYS = ('security_group_id', 'direction', 'ethertype', 'protocol',
+             'port_range_min', 'port_range_max', 'remote_ip_prefix',
+             'remote_group_id')
+
+
+class SecurityGroupInfoCache(object):
+    """Cache of the rules and member IP addresses of security groups.
+
+    Entries are stored with the revision of their security group, which is
+    bumped in the database when the rules or the members of the group
+    change, and are only used while the group has the same revision. The
+    revision is read before the cached data, so any server process can
+    invalidate the entries of the others.
+    """
+
+    def __init__(self):
+        self._rules = {}
+        self._member_ips = {}
+
+    def get_rules(self, context, sg_ids, revisions=None):
+        """Return the rules of security groups, as dicts, by group.
+
+        :param revisions: the revisions of the security groups, by group,
+        when the caller already read them.
+        """
+        return self._get(self._rules, self._select_rules,
+                         context, sg_ids, revisions)
+
+    def get_member_ips(self, context, sg_ids, revisions=None):
+        """Return the IP addresses of security group members, by group."""
+        return self._get(self._member_ips, self._select_member_ips,
+                         context, sg_ids, revisions)
+
+    def invalidate(self, context, sg_ids):
+        """Bump the revision of security groups whose rules or members changed.
+
+        It must be called in the transaction changing them or after it.
+        In a transaction, the revisions are bumped once it is committed, in
+        a short transaction of their own, so that the rows of groups shared
+        by many ports, like the default one, are not locked until then.
+        """
+        sg_ids = set(sg_ids or [])
+        if not sg_ids:
+            return
+        session = context.session
+        if session.transaction is None:
+            self._bump_revisions(session, sg_ids)
+            return
+        session.info.setdefault(_INVALIDATED_KEY, set()).update(sg_ids)
+        if not session.info.get(_LISTENING_KEY):
+            session.info[_LISTENING_KEY] = True
+            event.listen(session, 'after_commit', self._after_commit)
+            event.listen(session, 'after_transaction_end',
+                         self._after_transaction_end)
+
+    def _bump_revisions(self, session, sg_ids):
+        sg_ids = sorted(sg_ids)
+        with session.begin(subtransactions=True):
+            query = session.query(sg_db.SecurityGroup)
+            query = query.filter(sg_db.SecurityGroup.id.in_(sg_ids))
+            query.update({'revision': sg_db.SecurityGroup.revision + 1},
+                         synchronize_session=False)
+        for sg_id in sg_ids:
+            self._rules.pop(sg_id, None)
+            self._member_ips.pop(sg_id, None)
+
+    def _after_commit(self, session):
+        if session.transaction.nested:
+            return
+        sg_ids = session.info.pop(_INVALIDATED_KEY, None)
+        if not sg_ids:
+            return
+        # The committed session can not emit SQL anymore
+        try:
+            self._bump_revisions(db_api.get_session(), sg_ids)
+        except Exception:
+            LOG.exception(_("Failed to bump the revision of security "
+                            "groups %s"), sorted(sg_ids))
+            for sg_id in sg_ids:
+                self._rules.pop(sg_id, None)
+                self._member_ips.pop(sg_id, None)
+
+    def _after_transaction_end(self, session, transaction):
+        if session.transaction is not None:
+            # Not the outermost transaction
+            return
+        # Rolled back, the groups did not change
+        session.info.pop(_INVALIDATED_KEY, None)
+
+    def clear(self):
+        self._rules.clear()
+        self._member_ips.clear()
+
+    def _get(self, cache, select, context, sg_ids, revisions):
+        if not cfg.CONF.SECURITYGROUP.enable_server_cache:
+            return select(context, set(sg_ids))
+        if revisions is None:
+            revisions = self._select_revisions(context, sg_ids)
+        result = {}
+        missing = set()
+        for sg_id in sg_ids:
+            revision, value = cache.get(sg_id, (None, None))
+            if revision is not None and revision == revisions.get(sg_id):
+                result[sg_id] = value
+            else:
+                missing.add(sg_id)
+        if missing:
+            selected = select(context, missing)
+            result.update(selected)
+            for sg_id, value in selected.items():
+                # Deleted groups have no revision
+                if revisions.get(sg_id) is not None:
+                    cache[sg_id] = (revisions[sg_id], value)
+        return result
+
+    @staticmethod
+    def _select_revisions(context, sg_ids):
+        if not sg_ids:
+            return {}
+        query = context.session.query(sg_db.SecurityGroup.id,
+                                      sg_db.SecurityGroup.revision)
+        query = query.filter(sg_db.SecurityGroup.id.in_(set(sg_ids)))
+        return dict(query)
+
+    @staticmethod
+    def _select_rules(context, sg_ids):
+        rules_by_group = dict((sg_id, []) for sg_id in sg_ids)
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(
+            sg_db.SecurityGroupRule.security_group_id.in_(sg_ids))
+        for rule in query:
+            rules_by_group[rule['security_group_id']].append(
+                dict((key, rule[key]) for key in RULE_KEYS))
+        return rules_by_group
+
+    @staticmethod
+    def _select_member_ips(context, sg_ids):
+        ips_by_group = dict((sg_id, []) for sg_id in sg_ids)
+
+        ip_port = models_v2.IPAllocation.port_id
+        sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
+        sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
+
+        query = context.session.query(sg_binding_sgid,
+                                      models_v2.Port,
+                                      models_v2.IPAllocation.ip_address)
+        query = query.join(models_v2.IPAllocation,
+                           ip_port == sg_binding_port)
+        query = query.join(models_v2.Port,
+                           ip_port == models_v2.Port.id)
+        query = query.filter(sg_binding_sgid.in_(sg_ids))
+        for security_group_id, port, ip_address in query:
+            ips_by_group[security_group_id].append(ip_address)
+            # if there are allowed_address_pairs add them
+            if getattr(port, 'allowed_address_pairs', None):
+                for address_pair in port.allowed_address_pairs:
+                    ips_by_group[security_group_id].append(
+                        address_pair['ip_address'])
+        return ips_by_group
+
+
 class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
     """Mixin class to add agent-based security group implementation."""
 
+    @property
+    def security_group_info_cache(self):
+        # Mixins have no constructor, the cache is created on first use
+        try:
+            return self._security_group_info_cache
+        except AttributeError:
+            self._security_group_info_cache = SecurityGroupInfoCache()
+            return self._security_group_info_cache
+
     def get_port_from_device(self, device):
         """Get port dict from device name on an agent.
 
@@ -61,6 +248,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = self.create_security_group_rule_bulk_native(context,
                                                            bulk_rule)[0]
         sgids = [rule['security_group_id']]
+        self.security_group_info_cache.invalidate(context, sgids)
         self.notifier.security_groups_rule_updated(context, sgids)
         return rule
 
@@ -70,6 +258,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                       self).create_security_group_rule_bulk_native(
                           context, security_group_rule)
         sgids = set([r['security_group_id'] for r in rules])
+        self.security_group_info_cache.invalidate(context, sgids)
         self.notifier.security_groups_rule_updated(context, list(sgids))
         return rules
 
@@ -77,8 +266,14 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = self.get_security_group_rule(context, sgrid)
         super(SecurityGroupServerRpcMixin,
               self).delete_security_group_rule(context, sgrid)
-        self.notifier.security_groups_rule_updated(context,
-                                                   [rule['security_group_id']])
+        sgids = [rule['security_group_id']]
+        self.security_group_info_cache.invalidate(context, sgids)
+        self.notifier.security_groups_rule_updated(context, sgids)
+
+    def delete_security_group(self, context, id):
+        super(SecurityGroupServerRpcMixin,
+              self).delete_security_group(context, id)
+        self.security_group_info_cache.invalidate(context, [id])
 
     def update_security_group_on_port(self, context, id, port,
                                       original_port, updated_port):
@@ -102,6 +297,10 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                 context,
                 updated_port,
                 port_updates[ext_sg.SECURITYGROUPS])
+            self.security_group_info_cache.invalidate(
+                context,
+                set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+                set(port_updates[ext_sg.SECURITYGROUPS] or []))
             need_notify = True
         else:
             updated_port[ext_sg.SECURITYGROUPS] = (
@@ -122,6 +321,12 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                 original_port.get(ext_sg.SECURITYGROUPS),
                 updated_port.get(ext_sg.SECURITYGROUPS))):
             need_notify = True
+        if (need_notify or original_port.get('allowed_address_pairs') !=
+                updated_port.get('allowed_address_pairs')):
+            self.security_group_info_cache.invalidate(
+                context,
+                set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+                set(updated_port.get(ext_sg.SECURITYGROUPS) or []))
         return need_notify
 
     def notify_security_groups_member_updated(self, context, port):
@@ -135,6 +340,8 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         occurs and the plugin agent fetches the update provider
         rule in the other RPC call (security_group_rules_for_devices).
         """
+        self.security_group_info_cache.invalidate(
+            context, port.get(ext_sg.SECURITYGROUPS))
         if port['device_owner'] == q_const.DEVICE_OWNER_DHCP:
             self.notifier.security_groups_provider_updated(context)
         # For IPv6, provider rule need to be updated in case router
@@ -143,9 +350,32 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
             if any(netaddr.IPAddress(fixed_ip['ip_address']).version == 6
                    for fixed_ip in port['fixed_ips']):
                 self.notifier.security_groups_provider_updated(context)
-        else:
+        elif port.get(ext_sg.SECURITYGROUPS):
             self.notifier.security_groups_member_updated(
-                context, port.get(ext_sg.SECURITYGROUPS))
+                context, port[ext_sg.SECURITYGROUPS],
+                member_deltas=self._get_security_group_member_deltas(
+                    context, port))
+
+    def _get_security_group_member_deltas(self, context, port):
+        """Return the member IP addresses added or removed by a port.
+
+        The addresses of the port are added to its security groups when
+        it exists, i.e. it was created, and removed otherwise unless other
+        members of the security groups use them.
+        """
+        ips = set(fixed_ip['ip_address'] for fixed_ip in port['fixed_ips'])
+        ips.update(address_pair['ip_address'] for address_pair in
+                   port.get('allowed_address_pairs') or [])
+        sg_ids = port[ext_sg.SECURITYGROUPS]
+        query = context.session.query(models_v2.Port.id)
+        if query.filter_by(id=port['id']).first():
+            return dict((sg_id, {'added': sorted(ips), 'removed': []})
+                        for sg_id in sg_ids)
+        member_ips = self.security_group_info_cache.get_member_ips(
+            context, sg_ids)
+        return dict((sg_id, {'added': [],
+                             'removed': sorted(ips - set(member_ips[sg_id]))})
+                    for sg_id in sg_ids)
 
     def security_group_info_for_ports(self, context, ports):
         sg_info = {'devices': ports,
@@ -153,8 +383,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                    'sg_member_ips': {}}
         rules_in_db = self._select_rules_for_ports(context, ports)
         remote_security_group_info = {}
-        for (binding, rule_in_db) in rules_in_db:
-            port_id = binding['port_id']
+        for (port_id, rule_in_db) in rules_in_db:
             remote_gid = rule_in_db.get('remote_group_id')
             security_group_id = rule_in_db.get('security_group_id')
             ethertype = rule_in_db['ethertype']
@@ -211,48 +440,36 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                     sg_info['sg_member_ips'][sg_id][ethertype].append(ip)
         return sg_info
 
-    def _select_rules_for_ports(self, context, ports):
+    def _select_sg_ids_for_ports(self, context, ports):
         if not ports:
             return []
         sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
         sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
 
-        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
-
-        query = context.session.query(sg_db.SecurityGroupPortBinding,
-                                      sg_db.SecurityGroupRule)
-        query = query.join(sg_db.SecurityGroupRule,
-                           sgr_sgid == sg_binding_sgid)
+        # The group revisions validate the cached rules
+        query = context.session.query(sg_binding_port, sg_binding_sgid,
+                                      sg_db.SecurityGroup.revision)
+        query = query.join(sg_db.SecurityGroup,
+                           sg_db.SecurityGroup.id == sg_binding_sgid)
         query = query.filter(sg_binding_port.in_(ports.keys()))
         return query.all()
 
+    def _select_rules_for_ports(self, context, ports):
+        """Return (port_id, rule) pairs for the rules applied to ports."""
+        bindings = self._select_sg_ids_for_ports(context, ports)
+        revisions = dict((sg_id, revision)
+                         for port_id, sg_id, revision in bindings)
+        rules = self.security_group_info_cache.get_rules(
+            context, set(revisions), revisions)
+        return [(port_id, rule)
+                for port_id, sg_id, revision in bindings
+                for rule in rules[sg_id]]
+
     def _select_ips_for_remote_group(self, context, remote_group_ids):
-        ips_by_group = {}
         if not remote_group_ids:
-            return ips_by_group
-        for remote_group_id in remote_group_ids:
-            ips_by_group[remote_group_id] = []
-
-        ip_port = models_v2.IPAllocation.port_id
-        sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
-        sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
-
-        query = context.session.query(sg_binding_sgid,
-                                      models_v2.Port,
-                                      models_v2.IPAllocation.ip_address)
-        query = query.join(models_v2.IPAllocation,
-                           ip_port == sg_binding_port)
-        query = query.join(models_v2.Port,
-                           ip_port == models_v2.Port.id)
-        query = query.filter(sg_binding_sgid.in_(remote_group_ids))
-        for security_group_id, port, ip_address in query:
-            ips_by_group[security_group_id].append(ip_address)
-            # if there are allowed_address_pairs add them
-            if getattr(port, 'allowed_address_pairs', None):
-                for address_pair in port.allowed_address_pairs:
-                    ips_by_group[security_group_id].append(
-                        address_pair['ip_address'])
-        return ips_by_group
+            return {}
+        return self.security_group_info_cache.get_member_ips(
+            context, set(remote_group_ids))
 
     def _select_remote_group_ids(self, ports):
         remote_group_ids = []
@@ -417,8 +634,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
 
     def security_group_rules_for_ports(self, context, ports):
         rules_in_db = self._select_rules_for_ports(context, ports)
-        for (binding, rule_in_db) in rules_in_db:
-            port_id = binding['port_id']
+        for (port_id, rule_in_db) in rules_in_db:
             port = ports[port_id]
             direction = rule_in_db['direction']
             rule_dict = {
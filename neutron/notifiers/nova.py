@@ -56,6 +56,7 @@ class Notifier(object):
             extensions=[server_external_events])
         self.pending_events = []
         self._waiting_to_send = False
+        self.counters = {'queued': 0, 'sent': 0, 'dropped': 0}
 
     def queue_event(self, event):
         """Called to queue sending an event with the next batch of events.
@@ -73,7 +74,9 @@ class Notifier(object):
         wakes.
 
         If a thread is already alive and waiting, this call will simply queue
-        the event and return leaving it up to the thread to send it.
+        the event and return leaving it up to the thread to send it. The
+        thread only exits once no events are pending, so a single thread
+        sends the events, in order, even while nova calls are retried.
 
         :param event: the event that occurred.
         """
@@ -81,6 +84,7 @@ class Notifier(object):
             return
 
         self.pending_events.append(event)
+        self.counters['queued'] += 1
 
         if self._waiting_to_send:
             return
@@ -88,9 +92,14 @@ class Notifier(object):
         self._waiting_to_send = True
 
         def last_out_sends():
-            eventlet.sleep(cfg.CONF.send_events_interval)
-            self._waiting_to_send = False
-            self.send_events()
+            try:
+                while True:
+                    eventlet.sleep(cfg.CONF.send_events_interval)
+                    self.send_events()
+                    if not self.pending_events:
+                        break
+            finally:
+                self._waiting_to_send = False
 
         eventlet.spawn_n(last_out_sends)
 
@@ -210,13 +219,68 @@ class Notifier(object):
         self.queue_event(event)
         port._notify_event = None
 
+    @staticmethod
+    def _event_key(event):
+        return (event.get('server_uuid'), event.get('name'), event.get('tag'))
+
+    def _coalesce_events(self, events):
+        """Drop the events superseded by a later event of the same kind.
+
+        Nova only cares about the last network-changed event of a server
+        and about the last status of a vif, so only the last event of each
+        (server_uuid, name, tag) is kept, at the position it was queued.
+        """
+        seen = set()
+        coalesced = []
+        for event in reversed(events):
+            key = self._event_key(event)
+            if key not in seen:
+                seen.add(key)
+                coalesced.append(event)
+        coalesced.reverse()
+        return coalesced
+
     def send_events(self):
         if not self.pending_events:
             return
 
-        batched_events = self.pending_events
+        batched_events = self._coalesce_events(self.pending_events)
+        self.counters['dropped'] += (len(self.pending_events) -
+                                     len(batched_events))
         self.pending_events = []
 
+        batch_size = cfg.CONF.send_events_batch_size or len(batched_events)
+        for i in range(0, len(batched_events), batch_size):
+            if not self._send_events_with_retries(
+                    batched_events[i:i + batch_size]):
+                dropped = batched_events[i + batch_size:]
+                if dropped:
+                    self.counters['dropped'] += len(dropped)
+                    LOG.error(_("Dropping events nova was not notified "
+                                "of: %s"), dropped)
+                break
+        LOG.debug(_("Nova notifier counters: %s"), self.counters)
+
+    def _send_events_with_retries(self, batched_events):
+        """Send a batch of events, retrying with a backoff on failures.
+
+        :returns: False if nova could not be reached, True otherwise.
+        """
+        delay = cfg.CONF.send_events_interval
+        for attempt in range(cfg.CONF.send_events_retries + 1):
+            if attempt:
+                eventlet.sleep(delay)
+                delay *= 2
+            if self._send_event_batch(batched_events):
+                return True
+        self.counters['dropped'] += len(batched_events)
+        return False
+
+    def _send_event_batch(self, batched_events):
+        """Send a batch of events to nova.
+
+        :returns: False if the batch should be retried, True otherwise.
+        """
         LOG.debug(_("Sending events: %s"), batched_events)
         try:
             response = self.nclient.server_external_events.create(
@@ -224,14 +288,17 @@ class Notifier(object):
         except nova_exceptions.NotFound:
             LOG.warning(_("Nova returned NotFound for event: %s"),
                         batched_events)
+            self.counters['dropped'] += len(batched_events)
         except Exception:
             LOG.exception(_("Failed to notify nova on events: %s"),
                           batched_events)
+            return False
         else:
+            self.counters['sent'] += len(batched_events)
             if not isinstance(response, list):
                 LOG.error(_("Error response returned from nova: %s"),
                           response)
-                return
+                return True
             response_error = False
             for event in response:
                 try:
@@ -247,3 +314,4 @@ class Notifier(object):
             if response_error:
                 LOG.error(_("Error response returned from nova: %s"),
                           response)
+        return True
@@ -815,8 +815,8 @@ class NeutronRestProxyV2(NeutronRestProxyV2Base,
             if self.l3_plugin:
                 router_ids = self.l3_plugin.disassociate_floatingips(
                     context, port_id, do_notify=False)
-            self._delete_port_security_group_bindings(context, port_id)
             port = super(NeutronRestProxyV2, self).get_port(context, port_id)
+            self._delete_port_security_group_bindings(context, port_id)
             # Tenant ID must come from network in case the network is shared
             tenid = self._get_port_net_tenantid(context, port)
             self._delete_port(context, port_id)
@@ -825,6 +825,7 @@ class NeutronRestProxyV2(NeutronRestProxyV2Base,
         if self.l3_plugin:
             # now that we've left db transaction, we are safe to notify
             self.l3_plugin.notify_routers_updated(context, router_ids)
+        self.notify_security_groups_member_updated(context, port)
 
     @put_context_in_serverpool
     def create_subnet(self, context, subnet):
@@ -19,6 +19,7 @@
 # Based on the structure of the OpenVSwitch agent in the
 # Neutron OpenVSwitch Plugin.
 
+import collections
 import os
 import sys
 import time
@@ -763,6 +764,8 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
                  root_helper):
         self.polling_interval = polling_interval
         self.root_helper = root_helper
+        self.device_processing_workers = (
+            cfg.CONF.AGENT.device_processing_workers)
         self.setup_linux_bridge(interface_mappings)
         configurations = {'interface_mappings': interface_mappings}
         if self.br_mgr.vxlan_mode != lconst.VXLAN_NONE:
@@ -859,6 +862,42 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
         # If one of the above operations fails => resync with plugin
         return (resync_a | resync_b)
 
+    def _treat_device_added_updated(self, device_details):
+        """Plug a device, return its new status or None if unchanged."""
+        device = device_details['device']
+        LOG.debug("Port %s added", device)
+
+        if 'port_id' not in device_details:
+            LOG.info(_("Device %s not defined on plugin"), device)
+            return
+        LOG.info(_("Port %(device)s updated. Details: %(details)s"),
+                 {'device': device, 'details': device_details})
+        if not device_details['admin_state_up']:
+            self.remove_port_binding(device_details['network_id'],
+                                     device_details['port_id'])
+            return
+        # create the networking for the port
+        network_type = device_details.get('network_type')
+        if network_type:
+            segmentation_id = device_details.get('segmentation_id')
+        else:
+            # compatibility with pre-Havana RPC vlan_id encoding
+            vlan_id = device_details.get('vlan_id')
+            (network_type,
+             segmentation_id) = lconst.interpret_vlan_id(vlan_id)
+        if self.br_mgr.add_interface(device_details['network_id'],
+                                     network_type,
+                                     device_details['physical_network'],
+                                     segmentation_id,
+                                     device_details['port_id']):
+            return constants.PORT_STATUS_ACTIVE
+        return constants.PORT_STATUS_DOWN
+
+    def _treat_devices_group(self, devices_details):
+        return [(device_details['device'],
+                 self._treat_device_added_updated(device_details))
+                for device_details in devices_details]
+
     def treat_devices_added_updated(self, devices):
         try:
             devices_details_list = self.plugin_rpc.get_devices_details_list(
@@ -870,45 +909,32 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
             # resync is needed
             return True
 
+        # Devices of distinct networks are plugged concurrently, those of a
+        # same network in order, as the first one creates the bridge.
+        groups = collections.defaultdict(list)
         for device_details in devices_details_list:
-            device = device_details['device']
-            LOG.debug("Port %s added", device)
-
-            if 'port_id' in device_details:
-                LOG.info(_("Port %(device)s updated. Details: %(details)s"),
-                         {'device': device, 'details': device_details})
-                if device_details['admin_state_up']:
-                    # create the networking for the port
-                    network_type = device_details.get('network_type')
-                    if network_type:
-                        segmentation_id = device_details.get('segmentation_id')
-                    else:
-                        # compatibility with pre-Havana RPC vlan_id encoding
-                        vlan_id = device_details.get('vlan_id')
-                        (network_type,
-                         segmentation_id) = lconst.interpret_vlan_id(vlan_id)
-                    if self.br_mgr.add_interface(
-                        device_details['network_id'],
-                        network_type,
-                        device_details['physical_network'],
-                        segmentation_id,
-                        device_details['port_id']):
-
-                        # update plugin about port status
-                        self.plugin_rpc.update_device_up(self.context,
-                                                         device,
-                                                         self.agent_id,
-                                                         cfg.CONF.host)
-                    else:
-                        self.plugin_rpc.update_device_down(self.context,
-                                                           device,
-                                                           self.agent_id,
-                                                           cfg.CONF.host)
-                else:
-                    self.remove_port_binding(device_details['network_id'],
-                                             device_details['port_id'])
-            else:
-                LOG.info(_("Device %s not defined on plugin"), device)
+            groups[device_details.get('network_id')].append(device_details)
+        devices_up = []
+        devices_down = []
+        pool = eventlet.GreenPool(self.device_processing_workers)
+        for statuses in pool.imap(self._treat_devices_group,
+                                  groups.values()):
+            for device, status in statuses:
+                if status == constants.PORT_STATUS_ACTIVE:
+                    devices_up.append(device)
+                elif status == constants.PORT_STATUS_DOWN:
+                    devices_down.append(device)
+
+        # update plugin about port status
+        if devices_up or devices_down:
+            res = self.plugin_rpc.update_device_list(self.context,
+                                                     devices_up,
+                                                     devices_down,
+                                                     self.agent_id,
+                                                     cfg.CONF.host)
+            if res['failed_devices_up'] or res['failed_devices_down']:
+                # resync is needed
+                return True
         return False
 
     def treat_devices_removed(self, devices):
@@ -916,21 +942,21 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
         self.remove_devices_filter(devices)
         for device in devices:
             LOG.info(_("Attachment %s removed"), device)
-            details = None
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+        try:
+            res = self.plugin_rpc.update_device_list(self.context, [],
+                                                     list(devices),
+                                                     self.agent_id,
+                                                     cfg.CONF.host)
+        except Exception as e:
+            LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            resync = True
+        else:
+            if res['failed_devices_down']:
+                LOG.debug("port_removed failed for %s",
+                          res['failed_devices_down'])
                 resync = True
-            if details and details['exists']:
-                LOG.info(_("Port %s updated."), device)
-            else:
-                LOG.debug(_("Device %s not defined on plugin"), device)
-            self.br_mgr.remove_empty_bridges()
+        self.br_mgr.remove_empty_bridges()
         return resync
 
     def scan_devices(self, previous, sync):
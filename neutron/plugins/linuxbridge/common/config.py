@@ -70,4 +70,5 @@ cfg.CONF.register_opts(vxlan_opts, "VXLAN")
 cfg.CONF.register_opts(bridge_opts, "LINUX_BRIDGE")
 cfg.CONF.register_opts(agent_opts, "AGENT")
 config.register_agent_state_opts_helper(cfg.CONF)
+config.register_device_processing_opts_helper(cfg.CONF)
 config.register_root_helper(cfg.CONF)
@@ -69,6 +69,23 @@ def get_network_segments(session, network_id, filter_dynamic=False):
         return [_make_segment_dict(record) for record in records]
 
 
+def get_networks_segments(session, network_ids, filter_dynamic=False):
+    """Return a dict of the segments of each network in network_ids."""
+    result = dict((network_id, []) for network_id in network_ids)
+    if not network_ids:
+        return result
+    with session.begin(subtransactions=True):
+        query = (session.query(models.NetworkSegment).
+                 filter(models.NetworkSegment.network_id.in_(network_ids)))
+        if filter_dynamic is not None:
+            query = query.filter_by(is_dynamic=filter_dynamic)
+        records = query.all()
+
+        for record in records:
+            result[record.network_id].append(_make_segment_dict(record))
+        return result
+
+
 def get_segment_by_id(session, segment_id):
     with session.begin(subtransactions=True):
         try:
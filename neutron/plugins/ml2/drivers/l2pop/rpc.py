@@ -13,6 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import copy
+import threading
+
 from neutron.common import rpc as n_rpc
 from neutron.common import topics
 from neutron.openstack.common import log as logging
@@ -20,6 +24,57 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+# Fanout notifications waiting to be sent, per (green)thread
+_coalesced = threading.local()
+# The notifications whose fdb_entries are keyed by network
+MERGEABLE_METHODS = ('add_fdb_entries', 'remove_fdb_entries')
+
+
+def _merge_fdb_entries(fdb_entries, other_fdb_entries):
+    for network_id, other in other_fdb_entries.items():
+        entries = fdb_entries.get(network_id)
+        if entries is None:
+            fdb_entries[network_id] = copy.deepcopy(other)
+            continue
+        for agent_ip, other_ports in other['ports'].items():
+            ports = entries['ports'].setdefault(agent_ip, [])
+            ports.extend(port for port in other_ports if port not in ports)
+
+
+@contextlib.contextmanager
+def coalesce_fanout_notifications():
+    """Coalesce the fdb fanout notifications sent within the context.
+
+    Consecutive add_fdb_entries (or remove_fdb_entries) fanouts are merged
+    into a single one per network, and all of them are sent in order when
+    leaving the context, a failure to send one of them being logged.
+    Notifications targeting a given host are not delayed.
+    """
+    if getattr(_coalesced, 'pending', None) is not None:
+        # Already coalescing, the outermost context sends them
+        yield
+        return
+    _coalesced.pending = []
+    try:
+        yield
+    finally:
+        pending = _coalesced.pending
+        _coalesced.pending = None
+        for notifier, context, method, fdb_entries in pending:
+            if method in MERGEABLE_METHODS:
+                fanouts = [{network_id: entries}
+                           for network_id, entries in fdb_entries.items()]
+            else:
+                fanouts = [fdb_entries]
+            # A failing fanout must not prevent the others from being sent
+            for entries in fanouts:
+                try:
+                    notifier._notification_fanout(context, method, entries)
+                except Exception:
+                    LOG.exception(_("Failed to send the %(method)s fanout "
+                                    "notification for %(fdb_entries)s"),
+                                  {'method': method, 'fdb_entries': entries})
+
 
 class L2populationAgentNotifyAPI(n_rpc.RpcProxy):
     BASE_RPC_API_VERSION = '1.0'
@@ -33,6 +88,15 @@ class L2populationAgentNotifyAPI(n_rpc.RpcProxy):
                                                         topics.UPDATE)
 
     def _notification_fanout(self, context, method, fdb_entries):
+        pending = getattr(_coalesced, 'pending', None)
+        if pending is not None:
+            if (method in MERGEABLE_METHODS and pending and
+                    pending[-1][0] is self and pending[-1][2] == method):
+                _merge_fdb_entries(pending[-1][3], fdb_entries)
+            else:
+                pending.append((self, context, method,
+                                copy.deepcopy(fdb_entries)))
+            return
         LOG.debug(_('Fanout notify l2population agents at %(topic)s '
                     'the message %(method)s with %(fdb_entries)s'),
                   {'topic': self.topic,
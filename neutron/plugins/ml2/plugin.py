@@ -13,11 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import contextlib
 from eventlet import greenthread
 
 from oslo.config import cfg
 from oslo.db import exception as os_db_exception
+from six import moves
+import sqlalchemy as sa
 from sqlalchemy import exc as sql_exc
 from sqlalchemy.orm import exc as sa_exc
 
@@ -68,6 +71,8 @@ from neutron.plugins.ml2 import rpc
 LOG = log.getLogger(__name__)
 
 MAX_BIND_TRIES = 10
+# Maximum number of port id prefixes looked for by a single query
+MAX_PORT_PREFIXES_PER_QUERY = 100
 
 # REVISIT(rkukura): Move this and other network_type constants to
 # providernet.py?
@@ -777,26 +782,92 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
         with session.begin(subtransactions=True):
             self._ensure_default_security_group_on_port(context, port)
             sgids = self._get_security_groups_on_port(context, port)
-            dhcp_opts = port['port'].get(edo_ext.EXTRADHCPOPTS, [])
             result = super(Ml2Plugin, self).create_port(context, port)
-            self.extension_manager.process_create_port(session, attrs, result)
-            self._process_port_create_security_group(context, result, sgids)
             network = self.get_network(context, result['network_id'])
-            binding = db.add_port_binding(session, result['id'])
-            mech_context = driver_context.PortContext(self, context, result,
-                                                      network, binding)
-            new_host_port = self._get_host_port_if_changed(mech_context, attrs)
-            self._process_port_binding(mech_context, attrs)
+            mech_context, new_host_port = self._process_port_create(
+                context, attrs, result, sgids, network)
 
-            result[addr_pair.ADDRESS_PAIRS] = (
-                self._process_create_allowed_address_pairs(
-                    context, result,
-                    attrs.get(addr_pair.ADDRESS_PAIRS)))
-            self._process_port_create_extra_dhcp_opts(context, result,
-                                                      dhcp_opts)
-            self.mechanism_manager.create_port_precommit(mech_context)
+        return self._complete_port_create(context, mech_context,
+                                          new_host_port)
 
-        # Notification must be sent after the above transaction is complete
+    def create_port_bulk(self, context, ports):
+        """Create the ports of a bulk request in a single transaction.
+
+        The MAC and IP addresses of the ports are allocated by batch, as by
+        NeutronDbPluginV2, and the mechanism drivers are called for each
+        port. Should the postcommit or the binding of a port fail, all the
+        ports are deleted.
+        """
+        items = ports['ports']
+        session = context.session
+        created = []
+        with session.begin(subtransactions=True):
+            sgids = []
+            for item in items:
+                item['port']['status'] = const.PORT_STATUS_DOWN
+                self._ensure_default_security_group_on_port(context, item)
+                sgids.append(self._get_security_groups_on_port(context, item))
+            db_ports = self._create_ports_bulk_db(
+                context, [item['port'] for item in items])
+            networks = {}
+            for item, port_sgids, db_port in zip(items, sgids, db_ports):
+                result = self._make_port_dict(db_port,
+                                              process_extensions=False)
+                network_id = result['network_id']
+                if network_id not in networks:
+                    networks[network_id] = self.get_network(context,
+                                                            network_id)
+                created.append(self._process_port_create(
+                    context, item['port'], result, port_sgids,
+                    networks[network_id]))
+
+        results = []
+        try:
+            for mech_context, new_host_port in created:
+                results.append(self._complete_port_create(
+                    context, mech_context, new_host_port))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The failed port is already deleted
+                for mech_context, _new_host_port in created:
+                    port_id = mech_context.current['id']
+                    try:
+                        self.delete_port(context, port_id)
+                    except Exception:
+                        LOG.exception(_("Failed to delete port %s of the "
+                                        "bulk request"), port_id)
+        return results
+
+    def _process_port_create(self, context, attrs, result, sgids, network):
+        """Process the extensions and bindings of a port being created.
+
+        Called within the transaction storing the port, returns the
+        PortContext precommitted to the mechanism drivers and the host
+        port to notify to the l3 agents.
+        """
+        session = context.session
+        dhcp_opts = attrs.get(edo_ext.EXTRADHCPOPTS, [])
+        self.extension_manager.process_create_port(session, attrs, result)
+        self._process_port_create_security_group(context, result, sgids)
+        binding = db.add_port_binding(session, result['id'])
+        mech_context = driver_context.PortContext(self, context, result,
+                                                  network, binding)
+        new_host_port = self._get_host_port_if_changed(mech_context, attrs)
+        self._process_port_binding(mech_context, attrs)
+
+        result[addr_pair.ADDRESS_PAIRS] = (
+            self._process_create_allowed_address_pairs(
+                context, result,
+                attrs.get(addr_pair.ADDRESS_PAIRS)))
+        self._process_port_create_extra_dhcp_opts(context, result,
+                                                  dhcp_opts)
+        self.mechanism_manager.create_port_precommit(mech_context)
+        return mech_context, new_host_port
+
+    def _complete_port_create(self, context, mech_context, new_host_port):
+        result = mech_context.current
+        # Notification must be sent after the transaction storing the port
+        # is complete
         self._notify_l3_agent_new_port(context, new_host_port)
 
         try:
@@ -1075,6 +1146,170 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         return self._bind_port_if_needed(port_context)
 
+    def get_bound_ports_contexts(self, plugin_context, port_ids, host=None):
+        """Return a dict of bound port contexts keyed by port_ids items.
+
+        This is the bulk version of get_bound_port_context(): the ports with
+        their bindings and security groups, their networks, the segments of
+        these networks and the DVR bindings are each loaded by a single
+        query, whatever the number of full port ids. Port ids not matching
+        exactly one port are mapped to None.
+        """
+        result = dict((port_id, None) for port_id in port_ids)
+        if not port_ids:
+            return result
+        session = plugin_context.session
+        with session.begin(subtransactions=True):
+            ports_by_id = self._get_ports_by_id_or_prefix(session, result)
+            if not ports_by_id:
+                return result
+
+            networks, segments = self._get_networks_with_segments(
+                plugin_context,
+                set(port_db.network_id for port_db in ports_by_id.values()))
+
+            dvr_port_ids = [port_db.id for port_db in ports_by_id.values()
+                            if port_db.device_owner ==
+                            const.DEVICE_OWNER_DVR_INTERFACE]
+            dvr_bindings = {}
+            if dvr_port_ids:
+                dvr_bindings = dict(
+                    (binding.port_id, binding) for binding in
+                    session.query(models.DVRPortBinding).
+                    filter(models.DVRPortBinding.port_id.in_(dvr_port_ids),
+                           models.DVRPortBinding.host == host))
+
+            port_contexts = {}
+            for port_id, port_db in ports_by_id.items():
+                port = self._make_port_dict(port_db)
+                network = networks[port['network_id']]
+                network_segments = segments[port['network_id']]
+                if port['device_owner'] == const.DEVICE_OWNER_DVR_INTERFACE:
+                    binding = dvr_bindings.get(port['id'])
+                    if not binding:
+                        LOG.error(_("Binding info for DVR port %s not "
+                                    "found"), port_id)
+                        continue
+                    port_contexts[port_id] = driver_context.DvrPortContext(
+                        self, plugin_context, port, network, binding,
+                        segments=network_segments)
+                else:
+                    port_contexts[port_id] = driver_context.PortContext(
+                        self, plugin_context, port, network,
+                        port_db.port_binding, segments=network_segments)
+
+        for port_id, port_context in port_contexts.items():
+            result[port_id] = self._bind_port_if_needed(port_context)
+        return result
+
+    def _get_ports_by_id_or_prefix(self, session, port_ids):
+        """Return a dict of the port dbs keyed by the matching port_ids.
+
+        Device names only hold a prefix of the port ids, these prefixes
+        are looked for by chunks while the full port ids are looked for by
+        a single query.
+        """
+        full_ids = [port_id for port_id in port_ids
+                    if uuidutils.is_uuid_like(port_id)]
+        prefixes = [port_id for port_id in port_ids
+                    if not uuidutils.is_uuid_like(port_id)]
+        query = session.query(models_v2.Port)
+        port_dbs = {}
+        if full_ids:
+            for port_db in query.filter(models_v2.Port.id.in_(full_ids)):
+                port_dbs[port_db.id] = port_db
+        for i in moves.xrange(0, len(prefixes), MAX_PORT_PREFIXES_PER_QUERY):
+            chunk = prefixes[i:i + MAX_PORT_PREFIXES_PER_QUERY]
+            for port_db in query.filter(
+                    sa.or_(*[models_v2.Port.id.startswith(prefix)
+                             for prefix in chunk])):
+                port_dbs[port_db.id] = port_db
+
+        matches = collections.defaultdict(list)
+        prefix_set = set(prefixes)
+        lengths = set(len(prefix) for prefix in prefixes)
+        for port_db in port_dbs.values():
+            if port_db.id in port_ids:
+                matches[port_db.id].append(port_db)
+            for length in lengths:
+                if port_db.id[:length] in prefix_set:
+                    matches[port_db.id[:length]].append(port_db)
+        ports_by_id = {}
+        for port_id, port_id_matches in matches.items():
+            if len(port_id_matches) > 1:
+                LOG.error(_("Multiple ports have port_id starting "
+                            "with %s"), port_id)
+            else:
+                ports_by_id[port_id] = port_id_matches[0]
+        return ports_by_id
+
+    def _get_networks_with_segments(self, plugin_context, network_ids):
+        """Return the dicts of the networks and their segments by id."""
+        network_ids = list(network_ids)
+        segments = db.get_networks_segments(plugin_context.session,
+                                            network_ids)
+        networks = {}
+        for network in super(Ml2Plugin, self).get_networks(
+                plugin_context, filters={'id': network_ids}):
+            self.type_manager._extend_network_dict_provider(
+                plugin_context, network, segments[network['id']])
+            networks[network['id']] = network
+        return networks, segments
+
+    def update_ports_status(self, context, port_statuses, host=None):
+        """Update the status of several ports.
+
+        This is the bulk version of update_port_status(): port_statuses
+        maps full port ids to their new status. The ports and their
+        networks are loaded by a single query and the mechanism drivers
+        precommit all the updates in a single transaction.
+        """
+        if not port_statuses:
+            return
+        session = context.session
+        mech_contexts = []
+        dvr_port_ids = []
+        # REVISIT: Serialize this operation with a semaphore, see
+        # update_port_status()
+        with contextlib.nested(lockutils.lock('db-access'),
+                               session.begin(subtransactions=True)):
+            port_dbs = (session.query(models_v2.Port).
+                        filter(models_v2.Port.id.in_(port_statuses.keys())).
+                        all())
+            missing = set(port_statuses) - set(p.id for p in port_dbs)
+            for port_id in missing:
+                LOG.warning(_("Port %(port)s updated up by agent not found"),
+                            {'port': port_id})
+            port_dbs = [port_db for port_db in port_dbs
+                        if port_db.status != port_statuses[port_db.id] or
+                        port_db.device_owner ==
+                        const.DEVICE_OWNER_DVR_INTERFACE]
+            if not port_dbs:
+                return
+            networks, segments = self._get_networks_with_segments(
+                context, set(port_db.network_id for port_db in port_dbs))
+            for port_db in port_dbs:
+                if port_db.device_owner == const.DEVICE_OWNER_DVR_INTERFACE:
+                    # The status of DVR ports is tracked per host binding
+                    dvr_port_ids.append(port_db.id)
+                    continue
+                original_port = self._make_port_dict(port_db)
+                port_db.status = port_statuses[port_db.id]
+                updated_port = self._make_port_dict(port_db)
+                mech_context = driver_context.PortContext(
+                    self, context, updated_port,
+                    networks[port_db.network_id], port_db.port_binding,
+                    original_port=original_port,
+                    segments=segments[port_db.network_id])
+                self.mechanism_manager.update_port_precommit(mech_context)
+                mech_contexts.append(mech_context)
+
+        for mech_context in mech_contexts:
+            self.mechanism_manager.update_port_postcommit(mech_context)
+        for port_id in dvr_port_ids:
+            self.update_port_status(context, port_id, port_statuses[port_id],
+                                    host)
+
     def update_port_status(self, context, port_id, status, host=None):
         """
         Returns port_id (non-truncated uuid) if the port exists.
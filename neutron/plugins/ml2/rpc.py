@@ -25,6 +25,7 @@ from neutron import manager
 from neutron.openstack.common import log
 from neutron.plugins.common import constants as service_constants
 from neutron.plugins.ml2 import driver_api as api
+from neutron.plugins.ml2.drivers.l2pop import rpc as l2pop_rpc
 from neutron.plugins.ml2.drivers import type_tunnel
 # REVISIT(kmestery): Allow the type and mechanism drivers to supply the
 # mixins and eventually remove the direct dependencies on type_tunnel.
@@ -35,7 +36,7 @@ LOG = log.getLogger(__name__)
 class RpcCallbacks(n_rpc.RpcCallback,
                    type_tunnel.TunnelRpcCallbackMixin):
 
-    RPC_API_VERSION = '1.3'
+    RPC_API_VERSION = '1.4'
     # history
     #   1.0 Initial version (from openvswitch/linuxbridge)
     #   1.1 Support Security Group RPC
@@ -43,6 +44,7 @@ class RpcCallbacks(n_rpc.RpcCallback,
     #   1.3 get_device_details rpc signature upgrade to obtain 'host' and
     #       return value to include fixed_ips and device_owner for
     #       the device port
+    #   1.4 Support update_device_list
 
     def __init__(self, notifier, type_manager):
         self.setup_tunnel_callback_mixin(notifier, type_manager)
@@ -62,6 +64,12 @@ class RpcCallbacks(n_rpc.RpcCallback,
         port_context = plugin.get_bound_port_context(rpc_context,
                                                      port_id,
                                                      host)
+        return self._get_device_details(rpc_context, plugin, device, port_id,
+                                        port_context, agent_id, host)
+
+    def _get_device_details(self, rpc_context, plugin, device, port_id,
+                            port_context, agent_id, host,
+                            port_statuses=None):
         if not port_context:
             LOG.warning(_("Device %(device)s requested by agent "
                           "%(agent_id)s not found in database"),
@@ -84,10 +92,14 @@ class RpcCallbacks(n_rpc.RpcCallback,
         new_status = (q_const.PORT_STATUS_BUILD if port['admin_state_up']
                       else q_const.PORT_STATUS_DOWN)
         if port['status'] != new_status:
-            plugin.update_port_status(rpc_context,
-                                      port_id,
-                                      new_status,
-                                      host)
+            if port_statuses is None:
+                plugin.update_port_status(rpc_context,
+                                          port_id,
+                                          new_status,
+                                          host)
+            else:
+                # Updated by the caller for all the devices at once
+                port_statuses[port['id']] = new_status
 
         entry = {'device': device,
                  'network_id': port['network_id'],
@@ -104,14 +116,27 @@ class RpcCallbacks(n_rpc.RpcCallback,
         return entry
 
     def get_devices_details_list(self, rpc_context, **kwargs):
-        return [
-            self.get_device_details(
-                rpc_context,
-                device=device,
-                **kwargs
-            )
-            for device in kwargs.pop('devices', [])
-        ]
+        devices = kwargs.pop('devices', [])
+        if not devices:
+            return []
+        agent_id = kwargs.get('agent_id')
+        host = kwargs.get('host')
+        LOG.debug("Devices %(devices)s details requested by agent "
+                  "%(agent_id)s with host %(host)s",
+                  {'devices': devices, 'agent_id': agent_id, 'host': host})
+
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = [plugin._device_to_port_id(device) for device in devices]
+        port_contexts = plugin.get_bound_ports_contexts(rpc_context,
+                                                        port_ids, host)
+        port_statuses = {}
+        devices_details = [
+            self._get_device_details(rpc_context, plugin, device, port_id,
+                                     port_contexts[port_id], agent_id, host,
+                                     port_statuses)
+            for device, port_id in zip(devices, port_ids)]
+        plugin.update_ports_status(rpc_context, port_statuses, host)
+        return devices_details
 
     def update_device_down(self, rpc_context, **kwargs):
         """Device no longer exists on agent."""
@@ -169,6 +194,33 @@ class RpcCallbacks(n_rpc.RpcCallback,
             except exceptions.PortNotFound:
                 LOG.debug('Port %s not found during ARP update', port_id)
 
+    def update_device_list(self, rpc_context, **kwargs):
+        """Devices are up or no longer exist on agent.
+
+        The fdb fanouts resulting from the status changes are coalesced per
+        network. Returns the devices which were successfully updated and
+        those which were not.
+        """
+        devices_up = kwargs.pop('devices_up', [])
+        devices_down = kwargs.pop('devices_down', [])
+        res = {'devices_up': [], 'failed_devices_up': [],
+               'devices_down': [], 'failed_devices_down': []}
+        with l2pop_rpc.coalesce_fanout_notifications():
+            for status, devices, update in (
+                    ('up', devices_up, self.update_device_up),
+                    ('down', devices_down, self.update_device_down)):
+                for device in devices:
+                    try:
+                        update(rpc_context, device=device, **kwargs)
+                    except Exception:
+                        LOG.exception(_("Failed to set status of device "
+                                        "%(device)s to %(status)s"),
+                                      {'device': device, 'status': status})
+                        res['failed_devices_%s' % status].append(device)
+                    else:
+                        res['devices_%s' % status].append(device)
+        return res
+
 
 class AgentNotifierApi(n_rpc.RpcProxy,
                        dvr_rpc.DVRAgentRpcApiMixin,
@@ -14,7 +14,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import hashlib
+import itertools
 import signal
 import sys
 import time
@@ -30,6 +32,7 @@ from six import moves
 from neutron.agent import l2population_rpc
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import polling
 from neutron.agent.linux import utils
 from neutron.agent import rpc as agent_rpc
@@ -42,6 +45,7 @@ from neutron.common import rpc as n_rpc
 from neutron.common import topics
 from neutron.common import utils as q_utils
 from neutron import context
+from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
 from neutron.plugins.common import constants as p_const
@@ -139,6 +143,9 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                  minimize_polling=False,
                  ovsdb_monitor_respawn_interval=(
                      constants.DEFAULT_OVSDBMON_RESPAWN),
+                 port_full_scan_interval=(
+                     constants.DEFAULT_PORT_FULL_SCAN_INTERVAL),
+                 device_processing_workers=4,
                  arp_responder=False,
                  use_veth_interconnection=False):
         '''Constructor.
@@ -159,6 +166,12 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         :param ovsdb_monitor_respawn_interval: Optional, when using polling
                minimization, the number of seconds to wait before respawning
                the ovsdb monitor.
+        :param port_full_scan_interval: Optional, when using polling
+               minimization, the number of seconds between two scans of all
+               the ports of the integration bridge. In between, only the
+               interfaces reported by the ovsdb monitor are looked at.
+        :param device_processing_workers: Optional, the maximum number of
+               networks whose devices are wired concurrently.
         :param arp_responder: Optional, enable local ARP responder if it is
                supported.
         :param use_veth_interconnection: use veths instead of patch ports to
@@ -209,6 +222,15 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         self.polling_interval = polling_interval
         self.minimize_polling = minimize_polling
         self.ovsdb_monitor_respawn_interval = ovsdb_monitor_respawn_interval
+        self.port_full_scan_interval = port_full_scan_interval
+        self.device_processing_workers = device_processing_workers
+        self._last_full_scan = 0
+        # The port tags to set while devices are being treated, they are
+        # then set by a single ovs-vsctl transaction
+        self._port_tag_batch = None
+        # The devices whose status failed to be updated on the server, they
+        # are treated again by the next iterations
+        self.devices_to_retry = set()
 
         if tunnel_types:
             self.enable_tunneling = True
@@ -624,23 +646,21 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         :param device_owner: the string indicative of owner of this port
         :param ovs_restarted: indicates if this is called for an OVS restart.
         '''
-        if net_uuid not in self.local_vlan_map or ovs_restarted:
-            self.provision_local_vlan(net_uuid, network_type,
-                                      physical_network, segmentation_id)
-        lvm = self.local_vlan_map[net_uuid]
-        lvm.vif_ports[port.vif_id] = port
-
-        self.dvr_agent.bind_port_to_dvr(port, network_type, fixed_ips,
-                                        device_owner,
-                                        local_vlan_id=lvm.vlan)
+        # Devices are wired concurrently, the local vlans, the tunnel flows
+        # and the dvr state are shared by all of them
+        with lockutils.lock('ovs-agent-port-bound'):
+            if net_uuid not in self.local_vlan_map or ovs_restarted:
+                self.provision_local_vlan(net_uuid, network_type,
+                                          physical_network, segmentation_id)
+            lvm = self.local_vlan_map[net_uuid]
+            lvm.vif_ports[port.vif_id] = port
+
+            self.dvr_agent.bind_port_to_dvr(port, network_type, fixed_ips,
+                                            device_owner,
+                                            local_vlan_id=lvm.vlan)
 
         # Do not bind a port if it's already bound
-        cur_tag = self.int_br.db_get_val("Port", port.port_name, "tag")
-        if cur_tag != str(lvm.vlan):
-            self.int_br.set_db_attribute("Port", port.port_name, "tag",
-                                         str(lvm.vlan))
-            if port.ofport != -1:
-                self.int_br.delete_flows(in_port=port.ofport)
+        self._update_port_tag(port, str(lvm.vlan))
 
     def port_unbound(self, vif_id, net_uuid=None):
         '''Unbind port.
@@ -676,12 +696,49 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         :param port: a ovs_lib.VifPort object.
         '''
         # Don't kill a port if it's already dead
+        self._update_port_tag(port, DEAD_VLAN_TAG)
+
+    def _update_port_tag(self, port, tag):
+        """Set the vlan tag of a port if it is not already set.
+
+        While devices are treated, the tag is only recorded in the port tag
+        batch and is set later on by _apply_port_tags.
+        """
+        if self._port_tag_batch is not None:
+            self._port_tag_batch[port.port_name] = (port, tag)
+            return
         cur_tag = self.int_br.db_get_val("Port", port.port_name, "tag")
-        if cur_tag != DEAD_VLAN_TAG:
-            self.int_br.set_db_attribute("Port", port.port_name, "tag",
-                                         DEAD_VLAN_TAG)
-            self.int_br.add_flow(priority=2, in_port=port.ofport,
-                                 actions="drop")
+        if cur_tag != tag:
+            self.int_br.set_db_attribute("Port", port.port_name, "tag", tag)
+            self._port_tag_changed(self.int_br, port, tag)
+
+    def _port_tag_changed(self, br, port, tag):
+        if tag == DEAD_VLAN_TAG:
+            br.add_flow(priority=2, in_port=port.ofport, actions="drop")
+        elif port.ofport != -1:
+            br.delete_flows(in_port=port.ofport)
+
+    def _apply_port_tags(self, port_tags):
+        """Set the tags of the port tag batch which have changed.
+
+        The current tags are read at once and the new ones are set by a
+        single ovs-vsctl transaction, the flows of the ports are updated
+        once the tags are set.
+        """
+        if not port_tags:
+            return
+        cur_tags = self.int_br.get_port_tag_dict()
+        changed = [(port, tag) for port_name, (port, tag)
+                   in sorted(port_tags.iteritems())
+                   if str(cur_tags.get(port_name)) != tag]
+        if not changed:
+            return
+        with self.int_br.deferred_vsctl() as vsctl_br:
+            for port, tag in changed:
+                vsctl_br.set_db_attribute("Port", port.port_name, "tag", tag)
+        with self.int_br.deferred() as deferred_br:
+            for port, tag in changed:
+                self._port_tag_changed(deferred_br, port, tag)
 
     def setup_integration_br(self):
         '''Setup the integration bridge.
@@ -958,6 +1015,70 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         port_info['removed'] = registered_ports - cur_ports
         return port_info
 
+    def scan_ports_from_events(self, registered_ports, events,
+                               updated_ports=None):
+        """Compute the port changes from the ovsdb interface events.
+
+        This is the counterpart of scan_ports() used between full scans:
+        only the interfaces reported as inserted, modified or deleted by
+        the ovsdb monitor are looked at, the other ports of the integration
+        bridge are assumed to be unchanged.
+        """
+        cur_ports = set(registered_ports)
+        deleted_ports = set()
+        int_br_ports = None
+        for action, row in events:
+            if action == ovsdb_client.ROW_DELETED:
+                port_id = self.int_br.get_vif_port_id_from_row(
+                    row, check_ofport=False)
+                if port_id:
+                    cur_ports.discard(port_id)
+                    deleted_ports.add(port_id)
+                continue
+            if int_br_ports is None:
+                int_br_ports = set(self.int_br.get_port_name_list())
+            if row['name'] not in int_br_ports:
+                continue
+            port_id = self.int_br.get_vif_port_id_from_row(row)
+            if port_id:
+                cur_ports.add(port_id)
+            else:
+                # The interface is not ready or failed
+                port_id = self.int_br.get_vif_port_id_from_row(
+                    row, check_ofport=False)
+                cur_ports.discard(port_id)
+            deleted_ports.discard(port_id)
+        if updated_ports is None:
+            updated_ports = set()
+        # A new interface may have been plugged for a port before its old
+        # interface was deleted, such a port must be wired again
+        for port_id in deleted_ports:
+            if self.int_br.get_vif_port_by_id(port_id):
+                cur_ports.add(port_id)
+                updated_ports.add(port_id)
+        self.int_br_device_count = len(cur_ports)
+        port_info = {'current': cur_ports}
+        updated_ports.update(self.check_changed_vlans(registered_ports))
+        updated_ports &= cur_ports
+        if updated_ports:
+            port_info['updated'] = updated_ports
+        if cur_ports != registered_ports:
+            port_info['added'] = cur_ports - registered_ports
+            port_info['removed'] = registered_ports - cur_ports
+        return port_info
+
+    def _get_interface_events(self, polling_manager, full_scan_required):
+        """Return the ovsdb interface events or None if a full scan is due."""
+        # The events are always consumed, a full scan supersedes them
+        events = polling_manager.get_events()
+        now = time.time()
+        if (full_scan_required or self.port_full_scan_interval <= 0 or
+                now - self._last_full_scan >= self.port_full_scan_interval):
+            events = None
+        if events is None:
+            self._last_full_scan = now
+        return events
+
     def check_changed_vlans(self, registered_ports):
         """Return ports which have lost their vlan tag.
 
@@ -1078,6 +1199,41 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                     br.delete_flows(in_port=ofport)
                     self.tun_br_ofports[tunnel_type].pop(remote_ip, None)
 
+    def _treat_device_added_or_updated(self, details, ovs_restarted):
+        """Wire a device, return False if it was not found on the bridge."""
+        device = details['device']
+        LOG.debug("Processing port: %s", device)
+        port = self.int_br.get_vif_port_by_id(device)
+        if not port:
+            # The port disappeared and cannot be processed
+            LOG.info(_("Port %s was not found on the integration bridge "
+                       "and will therefore not be processed"), device)
+            return False
+
+        if 'port_id' in details:
+            LOG.info(_("Port %(device)s updated. Details: %(details)s"),
+                     {'device': device, 'details': details})
+            self.treat_vif_port(port, details['port_id'],
+                                details['network_id'],
+                                details['network_type'],
+                                details['physical_network'],
+                                details['segmentation_id'],
+                                details['admin_state_up'],
+                                details['fixed_ips'],
+                                details['device_owner'],
+                                ovs_restarted)
+            LOG.info(_("Configuration for device %s completed."), device)
+        else:
+            LOG.warn(_("Device %s not defined on plugin"), device)
+            if (port and port.ofport != -1):
+                self.port_dead(port)
+        return True
+
+    def _treat_devices_group(self, devices_details, ovs_restarted):
+        return [details for details in devices_details
+                if not self._treat_device_added_or_updated(details,
+                                                           ovs_restarted)]
+
     def treat_devices_added_or_updated(self, devices, ovs_restarted):
         skipped_devices = []
         try:
@@ -1088,47 +1244,49 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                 cfg.CONF.host)
         except Exception as e:
             raise DeviceListRetrievalError(devices=devices, error=e)
+        # Devices of distinct networks are wired concurrently, those of a
+        # same network in order, as the first one provisions the local vlan.
+        groups = collections.defaultdict(list)
         for details in devices_details_list:
-            device = details['device']
-            LOG.debug("Processing port: %s", device)
-            port = self.int_br.get_vif_port_by_id(device)
-            if not port:
-                # The port disappeared and cannot be processed
-                LOG.info(_("Port %s was not found on the integration bridge "
-                           "and will therefore not be processed"), device)
-                skipped_devices.append(device)
+            groups[details.get('network_id')].append(details)
+        self._port_tag_batch = {}
+        try:
+            pool = eventlet.GreenPool(self.device_processing_workers)
+            for skipped in pool.imap(self._treat_devices_group,
+                                     groups.values(),
+                                     itertools.repeat(ovs_restarted)):
+                skipped_devices.extend(details['device']
+                                       for details in skipped)
+        finally:
+            port_tags, self._port_tag_batch = self._port_tag_batch, None
+        self._apply_port_tags(port_tags)
+
+        # update plugin about port status, the devices whose status could
+        # not be updated are kept wired and treated again by the next
+        # iterations until their status is updated.
+        skipped = set(skipped_devices)
+        devices_up = []
+        devices_down = []
+        for details in devices_details_list:
+            if 'port_id' not in details or details['device'] in skipped:
                 continue
-
-            if 'port_id' in details:
-                LOG.info(_("Port %(device)s updated. Details: %(details)s"),
-                         {'device': device, 'details': details})
-                self.treat_vif_port(port, details['port_id'],
-                                    details['network_id'],
-                                    details['network_type'],
-                                    details['physical_network'],
-                                    details['segmentation_id'],
-                                    details['admin_state_up'],
-                                    details['fixed_ips'],
-                                    details['device_owner'],
-                                    ovs_restarted)
-                # update plugin about port status
-                # FIXME(salv-orlando): Failures while updating device status
-                # must be handled appropriately. Otherwise this might prevent
-                # neutron server from sending network-vif-* events to the nova
-                # API server, thus possibly preventing instance spawn.
-                if details.get('admin_state_up'):
-                    LOG.debug(_("Setting status for %s to UP"), device)
-                    self.plugin_rpc.update_device_up(
-                        self.context, device, self.agent_id, cfg.CONF.host)
-                else:
-                    LOG.debug(_("Setting status for %s to DOWN"), device)
-                    self.plugin_rpc.update_device_down(
-                        self.context, device, self.agent_id, cfg.CONF.host)
-                LOG.info(_("Configuration for device %s completed."), device)
+            if details.get('admin_state_up'):
+                devices_up.append(details['device'])
             else:
-                LOG.warn(_("Device %s not defined on plugin"), device)
-                if (port and port.ofport != -1):
-                    self.port_dead(port)
+                devices_down.append(details['device'])
+        if devices_up or devices_down:
+            LOG.debug("Setting status for %(up)s to UP and for %(down)s to "
+                      "DOWN", {'up': devices_up, 'down': devices_down})
+            res = self.plugin_rpc.update_device_list(
+                self.context, devices_up, devices_down, self.agent_id,
+                cfg.CONF.host)
+            failed_devices = (res.get('failed_devices_up', []) +
+                              res.get('failed_devices_down', []))
+            self.devices_to_retry.difference_update(devices_up + devices_down)
+            if failed_devices:
+                LOG.warn(_("Failed to update the status of devices %s"),
+                         failed_devices)
+                self.devices_to_retry.update(failed_devices)
         return skipped_devices
 
     def treat_ancillary_devices_added(self, devices):
@@ -1141,31 +1299,36 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         except Exception as e:
             raise DeviceListRetrievalError(devices=devices, error=e)
 
+        devices_up = []
         for details in devices_details_list:
             device = details['device']
             LOG.info(_("Ancillary Port %s added"), device)
+            devices_up.append(device)
 
-            # update plugin about port status
-            self.plugin_rpc.update_device_up(self.context,
-                                             device,
-                                             self.agent_id,
-                                             cfg.CONF.host)
+        # update plugin about port status
+        if devices_up:
+            self.plugin_rpc.update_device_list(self.context, devices_up, [],
+                                               self.agent_id, cfg.CONF.host)
 
     def treat_devices_removed(self, devices):
         resync = False
         self.sg_agent.remove_devices_filter(devices)
         for device in devices:
             LOG.info(_("Attachment %s removed"), device)
-            try:
-                self.plugin_rpc.update_device_down(self.context,
-                                                   device,
-                                                   self.agent_id,
-                                                   cfg.CONF.host)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
+        try:
+            res = self.plugin_rpc.update_device_list(self.context, [],
+                                                     list(devices),
+                                                     self.agent_id,
+                                                     cfg.CONF.host)
+        except Exception as e:
+            LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            return True
+        if res['failed_devices_down']:
+            LOG.debug("port_removed failed for %s",
+                      res['failed_devices_down'])
+            resync = True
+        for device in res['devices_down']:
             self.port_unbound(device)
         return resync
 
@@ -1318,8 +1481,16 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
     def _agent_has_updates(self, polling_manager):
         return (polling_manager.is_polling_required or
                 self.updated_ports or
+                self.devices_to_retry or
                 self.sg_agent.firewall_refresh_needed())
 
+    def _add_devices_to_retry(self, port_info):
+        # The devices which left the bridge are not retried
+        self.devices_to_retry &= port_info['current']
+        if self.devices_to_retry:
+            port_info['added'] = (port_info.get('added', set()) |
+                                  self.devices_to_retry)
+
     def _port_info_has_changes(self, port_info):
         return (port_info.get('added') or
                 port_info.get('removed') or
@@ -1340,6 +1511,7 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
         ancillary_ports = set()
         tunnel_sync = True
         ovs_restarted = False
+        full_scan = True
         while self.run_daemon_loop:
             start = time.time()
             port_stats = {'regular': {'added': 0,
@@ -1354,6 +1526,7 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                 ports.clear()
                 ancillary_ports.clear()
                 sync = False
+                full_scan = True
                 polling_manager.force_polling()
             ovs_restarted = self.check_ovs_restart()
             if ovs_restarted:
@@ -1388,7 +1561,16 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                     updated_ports_copy = self.updated_ports
                     self.updated_ports = set()
                     reg_ports = (set() if ovs_restarted else ports)
-                    port_info = self.scan_ports(reg_ports, updated_ports_copy)
+                    events = self._get_interface_events(
+                        polling_manager, full_scan or ovs_restarted)
+                    if events is None:
+                        port_info = self.scan_ports(reg_ports,
+                                                    updated_ports_copy)
+                    else:
+                        port_info = self.scan_ports_from_events(
+                            reg_ports, events, updated_ports_copy)
+                    self._add_devices_to_retry(port_info)
+                    full_scan = False
                     LOG.debug(_("Agent rpc_loop - iteration:%(iter_num)d - "
                                 "port information retrieved. "
                                 "Elapsed:%(elapsed).3f"),
@@ -1414,6 +1596,14 @@ class OVSNeutronAgent(n_rpc.RpcCallback,
                             len(port_info.get('updated', [])))
                         port_stats['regular']['removed'] = (
                             len(port_info.get('removed', [])))
+                        # The devices which were not found have been dropped
+                        # from the current ports, they will only be seen
+                        # again by a full scan
+                        treated_devices = (port_info.get('added', set()) |
+                                           port_info.get('updated', set()))
+                        if treated_devices - port_info['current']:
+                            full_scan = True
+                            polling_manager.force_polling()
                     ports = port_info['current']
                     # Treat ancillary devices if they exist
                     if self.ancillary_brs:
@@ -1496,6 +1686,8 @@ def create_agent_config_map(config):
         root_helper=config.AGENT.root_helper,
         polling_interval=config.AGENT.polling_interval,
         minimize_polling=config.AGENT.minimize_polling,
+        port_full_scan_interval=config.AGENT.port_full_scan_interval,
+        device_processing_workers=config.AGENT.device_processing_workers,
         tunnel_types=config.AGENT.tunnel_types,
         veth_mtu=config.AGENT.veth_mtu,
         enable_distributed_routing=config.AGENT.enable_distributed_routing,
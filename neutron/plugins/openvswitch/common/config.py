@@ -73,6 +73,13 @@ agent_opts = [
                default=constants.DEFAULT_OVSDBMON_RESPAWN,
                help=_("The number of seconds to wait before respawning the "
                       "ovsdb monitor after losing communication with it.")),
+    cfg.IntOpt('port_full_scan_interval',
+               default=constants.DEFAULT_PORT_FULL_SCAN_INTERVAL,
+               help=_("When minimize_polling is enabled, the agent only "
+                      "looks at the interfaces reported as changed by the "
+                      "ovsdb monitor and scans all the ports of the "
+                      "integration bridge every port_full_scan_interval "
+                      "seconds. Set to 0 to always scan all the ports.")),
     cfg.ListOpt('tunnel_types', default=DEFAULT_TUNNEL_TYPES,
                 help=_("Network types supported by the agent "
                        "(gre and/or vxlan).")),
@@ -100,4 +107,5 @@ agent_opts = [
 cfg.CONF.register_opts(ovs_opts, "OVS")
 cfg.CONF.register_opts(agent_opts, "AGENT")
 config.register_agent_state_opts_helper(cfg.CONF)
+config.register_device_processing_opts_helper(cfg.CONF)
 config.register_root_helper(cfg.CONF)
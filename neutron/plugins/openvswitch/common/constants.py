@@ -60,6 +60,10 @@ TUN_TABLE = {p_const.TYPE_GRE: GRE_TUN_TO_LV,
 # The default respawn interval for the ovsdb monitor
 DEFAULT_OVSDBMON_RESPAWN = 30
 
+# The default interval between two full scans of the integration bridge
+# ports when they are otherwise tracked from the ovsdb monitor events
+DEFAULT_PORT_FULL_SCAN_INTERVAL = 300
+
 # Represent invalid OF Port
 OFPORT_INVALID = -1
 
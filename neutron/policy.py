@@ -18,9 +18,11 @@ Policy engine for neutron.  Largely copied from nova.
 """
 
 import collections
+import contextlib
 import itertools
 import logging
 import re
+import threading
 
 from oslo.config import cfg
 
@@ -38,6 +40,12 @@ from neutron.openstack.common import policy
 LOG = log.getLogger(__name__)
 _POLICY_PATH = None
 _POLICY_CACHE = {}
+# (rule name, roles) -> rule compiled by _compile_rule. The cache is tied
+# to the rules it was built from, and emptied when they are set again.
+_COMPILED_RULES = {}
+_COMPILED_RULES_SOURCE = None
+# Parent resources of the current request, see parent_resources_cache
+_REQUEST_CACHE = threading.local()
 ADMIN_CTX_POLICY = 'context_is_admin'
 # Maps deprecated 'extension' policies to new-style policies
 DEPRECATED_POLICY_MAP = {
@@ -252,70 +260,163 @@ class OwnerCheck(policy.Check):
                 reason=err_reason)
         super(OwnerCheck, self).__init__(kind, match)
 
+    def _get_parent_resource(self):
+        """Return the parent resource, field and foreign key to look up."""
+        # target field is in the form resource:field
+        # however if they're not separated by a colon, use an underscore
+        # as a separator for backward compatibility
+
+        def do_split(separator):
+            parent_res, parent_field = self.target_field.split(
+                separator, 1)
+            return parent_res, parent_field
+
+        for separator in (':', '_'):
+            try:
+                parent_res, parent_field = do_split(separator)
+                break
+            except ValueError:
+                LOG.debug(_("Unable to find ':' as separator in %s."),
+                          self.target_field)
+        else:
+            # If we are here split failed with both separators
+            err_reason = (_("Unable to find resource name in %s") %
+                          self.target_field)
+            LOG.exception(err_reason)
+            raise exceptions.PolicyCheckError(
+                policy="%s:%s" % (self.kind, self.match),
+                reason=err_reason)
+        parent_foreign_key = attributes.RESOURCE_FOREIGN_KEYS.get(
+            "%ss" % parent_res, None)
+        if not parent_foreign_key:
+            err_reason = (_("Unable to verify match:%(match)s as the "
+                            "parent resource: %(res)s was not found") %
+                          {'match': self.match, 'res': parent_res})
+            LOG.exception(err_reason)
+            raise exceptions.PolicyCheckError(
+                policy="%s:%s" % (self.kind, self.match),
+                reason=err_reason)
+        return parent_res, parent_field, parent_foreign_key
+
     def __call__(self, target, creds):
         if self.target_field not in target:
             # policy needs a plugin check
-            # target field is in the form resource:field
-            # however if they're not separated by a colon, use an underscore
-            # as a separator for backward compatibility
-
-            def do_split(separator):
-                parent_res, parent_field = self.target_field.split(
-                    separator, 1)
-                return parent_res, parent_field
-
-            for separator in (':', '_'):
-                try:
-                    parent_res, parent_field = do_split(separator)
-                    break
-                except ValueError:
-                    LOG.debug(_("Unable to find ':' as separator in %s."),
-                              self.target_field)
-            else:
-                # If we are here split failed with both separators
-                err_reason = (_("Unable to find resource name in %s") %
-                              self.target_field)
-                LOG.exception(err_reason)
-                raise exceptions.PolicyCheckError(
-                    policy="%s:%s" % (self.kind, self.match),
-                    reason=err_reason)
-            parent_foreign_key = attributes.RESOURCE_FOREIGN_KEYS.get(
-                "%ss" % parent_res, None)
-            if not parent_foreign_key:
-                err_reason = (_("Unable to verify match:%(match)s as the "
-                                "parent resource: %(res)s was not found") %
-                              {'match': self.match, 'res': parent_res})
-                LOG.exception(err_reason)
-                raise exceptions.PolicyCheckError(
-                    policy="%s:%s" % (self.kind, self.match),
-                    reason=err_reason)
-            # NOTE(salv-orlando): This check currently assumes the parent
-            # resource is handled by the core plugin. It might be worth
-            # having a way to map resources to plugins so to make this
-            # check more general
-            # FIXME(ihrachys): if import is put in global, circular
-            # import failure occurs
-            from neutron import manager
-            f = getattr(manager.NeutronManager.get_instance().plugin,
-                        'get_%s' % parent_res)
-            # f *must* exist, if not found it is better to let neutron
-            # explode. Check will be performed with admin context
-            context = importutils.import_module('neutron.context')
-            try:
-                data = f(context.get_admin_context(),
-                         target[parent_foreign_key],
-                         fields=[parent_field])
-                target[self.target_field] = data[parent_field]
-            except Exception:
-                with excutils.save_and_reraise_exception():
-                    LOG.exception(_LE('Policy check error while calling %s!'),
-                                  f)
+            parent_res, parent_field, parent_foreign_key = (
+                self._get_parent_resource())
+            target[self.target_field] = _get_parent_field(
+                parent_res, target[parent_foreign_key], parent_field)
         match = self.match % target
         if self.kind in creds:
             return match == unicode(creds[self.kind])
         return False
 
 
+def _get_plugin():
+    # FIXME(ihrachys): if import is put in global, circular
+    # import failure occurs
+    from neutron import manager
+    return manager.NeutronManager.get_instance().plugin
+
+
+def _get_parent_field(parent_res, parent_id, parent_field):
+    parents = getattr(_REQUEST_CACHE, 'parents', None)
+    key = (parent_res, parent_id)
+    if parents is not None and parent_field in parents.get(key, {}):
+        return parents[key][parent_field]
+    # NOTE(salv-orlando): This check currently assumes the parent
+    # resource is handled by the core plugin. It might be worth
+    # having a way to map resources to plugins so to make this
+    # check more general
+    f = getattr(_get_plugin(), 'get_%s' % parent_res)
+    # f *must* exist, if not found it is better to let neutron
+    # explode. Check will be performed with admin context
+    context = importutils.import_module('neutron.context')
+    try:
+        data = f(context.get_admin_context(), parent_id,
+                 fields=[parent_field])
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            LOG.exception(_LE('Policy check error while calling %s!'), f)
+    if parents is not None:
+        parents.setdefault(key, {})[parent_field] = data[parent_field]
+    return data[parent_field]
+
+
+@contextlib.contextmanager
+def parent_resources_cache():
+    """Cache the parent resources looked up by ownership checks.
+
+    Meant to wrap the processing of an API request, so that the checks of
+    the items of a list or of a bulk request fetch each parent resource
+    once, see also prefetch_parent_resources.
+    """
+    if getattr(_REQUEST_CACHE, 'parents', None) is not None:
+        # Already cached by an enclosing call
+        yield
+        return
+    _REQUEST_CACHE.parents = {}
+    try:
+        yield
+    finally:
+        _REQUEST_CACHE.parents = None
+
+
+def _find_owner_checks(rule, owner_checks):
+    if isinstance(rule, OwnerCheck):
+        owner_checks.append(rule)
+    elif isinstance(rule, policy.NotCheck):
+        _find_owner_checks(rule.rule, owner_checks)
+    elif hasattr(rule, 'rules'):
+        for sub_rule in rule.rules:
+            _find_owner_checks(sub_rule, owner_checks)
+    return owner_checks
+
+
+def prefetch_parent_resources(context, action, targets):
+    """Fetch the parent resources the checks of action on targets need.
+
+    Ownership checks on the parent resources of the targets, such as
+    tenant_id:%(network:tenant_id)s, then cost one query per parent
+    resource type rather than one per target. Does nothing unless the
+    parent resources are cached, see parent_resources_cache.
+    """
+    parents = getattr(_REQUEST_CACHE, 'parents', None)
+    if parents is None or not targets:
+        return
+    credentials = context.to_dict()
+    roles = frozenset(role.lower() for role in credentials['roles'])
+    # (parent resource, field) -> ids of the parents to fetch
+    to_fetch = collections.defaultdict(set)
+    for target in targets:
+        compiled = _compile_rule(_build_match_rule(action, target), roles)
+        if isinstance(compiled, bool):
+            continue
+        for owner_check in _find_owner_checks(compiled, []):
+            if owner_check.target_field in target:
+                continue
+            try:
+                parent_res, parent_field, parent_foreign_key = (
+                    owner_check._get_parent_resource())
+            except exceptions.PolicyCheckError:
+                # Reported when the target is checked
+                continue
+            parent_id = target.get(parent_foreign_key)
+            if (parent_id is not None and parent_field not in
+                    parents.get((parent_res, parent_id), {})):
+                to_fetch[parent_res, parent_field].add(parent_id)
+
+    admin_context = importutils.import_module(
+        'neutron.context').get_admin_context()
+    for (parent_res, parent_field), parent_ids in to_fetch.items():
+        f = getattr(_get_plugin(), 'get_%ss' % parent_res, None)
+        if not f:
+            continue
+        for data in f(admin_context, filters={'id': list(parent_ids)},
+                      fields=['id', parent_field]):
+            parents.setdefault((parent_res, data['id']), {})[
+                parent_field] = data[parent_field]
+
+
 @policy.register('field')
 class FieldCheck(policy.Check):
     def __init__(self, kind, match):
@@ -348,14 +449,98 @@ class FieldCheck(policy.Check):
         return target_value == self.value
 
 
-def _prepare_check(context, action, target):
-    """Prepare rule, target, and credentials for the policy engine."""
+def _get_compiled_rules():
+    """Return the compiled rules cache of the rules in use."""
+    global _COMPILED_RULES
+    global _COMPILED_RULES_SOURCE
+    if _COMPILED_RULES_SOURCE is not policy._rules:
+        _COMPILED_RULES = {}
+        _COMPILED_RULES_SOURCE = policy._rules
+    return _COMPILED_RULES
+
+
+def _combine_compiled(check_class, rules, empty):
+    if not rules:
+        return empty
+    if len(rules) == 1:
+        return rules[0]
+    return check_class(rules)
+
+
+def _compile_rule(rule, roles):
+    """Partially evaluate a rule for a caller having the given roles.
+
+    Role checks and references to other rules are resolved, so that the
+    result is True or False when the rule does not depend on the target or
+    on other credentials, or else the check reduced to its remaining parts.
+
+    :param roles: the lowercase roles of the caller, as a frozenset.
+    """
+    if isinstance(rule, policy.TrueCheck):
+        return True
+    elif isinstance(rule, policy.FalseCheck):
+        return False
+    elif isinstance(rule, policy.RoleCheck):
+        return rule.match.lower() in roles
+    elif isinstance(rule, policy.RuleCheck):
+        return _compile_named_rule(rule.match, roles)
+    elif isinstance(rule, policy.NotCheck):
+        compiled = _compile_rule(rule.rule, roles)
+        if isinstance(compiled, bool):
+            return not compiled
+        return policy.NotCheck(compiled)
+    elif isinstance(rule, policy.AndCheck):
+        rules = []
+        for sub_rule in rule.rules:
+            compiled = _compile_rule(sub_rule, roles)
+            if compiled is False:
+                return False
+            if compiled is not True:
+                rules.append(compiled)
+        return _combine_compiled(policy.AndCheck, rules, True)
+    elif isinstance(rule, policy.OrCheck):
+        rules = []
+        for sub_rule in rule.rules:
+            compiled = _compile_rule(sub_rule, roles)
+            if compiled is True:
+                return True
+            if compiled is not False:
+                rules.append(compiled)
+        return _combine_compiled(policy.OrCheck, rules, False)
+    # Target dependent check
+    return rule
+
+
+def _compile_named_rule(name, roles):
+    compiled_rules = _get_compiled_rules()
+    key = (name, roles)
+    if key not in compiled_rules:
+        try:
+            rule = policy._rules[name]
+        except (KeyError, TypeError):
+            # Like RuleCheck, fail closed when the rule does not exist
+            compiled_rules[key] = False
+        else:
+            compiled_rules[key] = _compile_rule(rule, roles)
+    return compiled_rules[key]
+
+
+def _check(context, action, target):
+    """Evaluate the rule of action with the rules compiled for context.
+
+    Rules granted to or denied by the roles of the caller, e.g. all the
+    rules for an admin, are answered without looking at the target.
+    """
     # Compare with None to distinguish case in which target is {}
     if target is None:
         target = {}
     match_rule = _build_match_rule(action, target)
     credentials = context.to_dict()
-    return match_rule, target, credentials
+    roles = frozenset(role.lower() for role in credentials['roles'])
+    compiled = _compile_rule(match_rule, roles)
+    if isinstance(compiled, bool):
+        return compiled
+    return compiled(target, credentials)
 
 
 def check(context, action, target, plugin=None, might_not_exist=False):
@@ -377,7 +562,7 @@ def check(context, action, target, plugin=None, might_not_exist=False):
     """
     if might_not_exist and not (policy._rules and action in policy._rules):
         return True
-    return policy.check(*(_prepare_check(context, action, target)))
+    return _check(context, action, target)
 
 
 def enforce(context, action, target, plugin=None):
@@ -395,8 +580,7 @@ def enforce(context, action, target, plugin=None):
     :raises neutron.exceptions.PolicyNotAuthorized: if verification fails.
     """
 
-    rule, target, credentials = _prepare_check(context, action, target)
-    result = policy.check(rule, target, credentials, action=action)
+    result = _check(context, action, target)
     if not result:
         LOG.debug(_("Failed policy check for '%s'"), action)
         raise exceptions.PolicyNotAuthorized(action=action)
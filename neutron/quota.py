@@ -52,6 +52,16 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default=QUOTA_DB_DRIVER,
                help=_('Default driver to use for quota checks')),
+    cfg.IntOpt('reservation_expiration',
+               default=120,
+               help=_('Number of seconds after which the resources reserved '
+                      'for a request that did not complete are released.')),
+    cfg.IntOpt('usage_resync_interval',
+               default=60,
+               help=_('Number of seconds after which the usage of a '
+                      'resource by a tenant is counted again. It corrects '
+                      'the resources created or deleted without a quota '
+                      'reservation, e.g. by agents.')),
 ]
 # Register the configuration options
 cfg.CONF.register_opts(quota_opts, 'QUOTAS')
@@ -297,6 +307,61 @@ class QuotaEngine(object):
         return self.get_driver().limit_check(context, tenant_id,
                                              self._resources, values)
 
+    def make_reservation(self, context, tenant_id, deltas, *args, **kwargs):
+        """Reserve resources before creating them.
+
+        The usage of the resources is read from the usage kept by the
+        driver, their count function is only called when this usage is
+        missing or must be resynchronized. Arguments following deltas are
+        passed directly to the count function of the resources.
+
+        This method will raise a QuotaResourceUnknown exception if a
+        given resource is unknown, and an OverQuota exception if the
+        deltas would put resources over their quota.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id the resources are reserved for.
+        :param deltas: A dictionary of the amounts to reserve, by resource.
+        :returns: The id of the reservation, to be committed once the
+                  resources are created or cancelled otherwise. None when
+                  the driver does not support reservations.
+        """
+
+        def count(resource):
+            return self.count(context, resource, *args, **kwargs)
+
+        driver = self.get_driver()
+        if tenant_id is None or not hasattr(driver, 'make_reservation'):
+            # Fall back to checking the new totals, the usage of resources
+            # without tenant is not kept
+            values = dict((resource, count(resource) + delta)
+                          for resource, delta in deltas.items())
+            driver.limit_check(context, tenant_id, self._resources, values)
+            return
+        return driver.make_reservation(context, tenant_id, self._resources,
+                                       deltas, count)
+
+    def commit_reservation(self, context, reservation_id):
+        """Account the resources of a reservation as used."""
+        if reservation_id is not None:
+            self.get_driver().commit_reservation(context, reservation_id)
+
+    def cancel_reservation(self, context, reservation_id):
+        """Release the resources of a reservation."""
+        if reservation_id is not None:
+            self.get_driver().cancel_reservation(context, reservation_id)
+
+    def mark_dirty(self, context, tenant_id, resources):
+        """Have the usage of resources counted again on next reservation.
+
+        Used when resources are deleted, unknown resources are ignored.
+        """
+        driver = self.get_driver()
+        resources = [resource for resource in resources
+                     if resource in self._resources]
+        if resources and hasattr(driver, 'mark_dirty'):
+            driver.mark_dirty(context, tenant_id, resources)
+
     @property
     def resources(self):
         return self._resources
@@ -43,7 +43,8 @@ class IpsetBase(base.BaseIPVethTestCase):
             root_helper=self.root_helper,
             namespace=dst_ns.namespace)
 
-        ipset.create_ipset_chain(chain_name, IPSET_ETHERTYPE)
+        ipset.set_members(chain_name, IPSET_ETHERTYPE, [])
+        ipset.apply()
         return ipset
 
     @staticmethod
@@ -60,33 +61,45 @@ class IpsetBase(base.BaseIPVethTestCase):
 
 class IpsetManagerTestCase(IpsetBase):
 
+    def _set_members(self, member_ips):
+        self.ipset.set_members(IPSET_CHAIN, IPSET_ETHERTYPE, member_ips)
+        self.ipset.apply()
+
     def test_add_member_allows_ping(self):
         self.pinger.assert_no_ping_from_ns(self.src_ns, self.DST_ADDRESS)
-        self.ipset.add_member_to_ipset_chain(IPSET_CHAIN, self.SRC_ADDRESS)
+        self._set_members([self.SRC_ADDRESS])
         self.pinger.assert_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
     def test_del_member_denies_ping(self):
-        self.ipset.add_member_to_ipset_chain(IPSET_CHAIN, self.SRC_ADDRESS)
+        self._set_members([self.SRC_ADDRESS])
         self.pinger.assert_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
-        self.ipset.del_ipset_chain_member(IPSET_CHAIN, self.SRC_ADDRESS)
+        self._set_members([])
         self.pinger.assert_no_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
-    def test_refresh_ipset_allows_ping(self):
-        self.ipset.refresh_ipset_chain_by_name(IPSET_CHAIN, [UNRELATED_IP],
-                                               IPSET_ETHERTYPE)
+    def test_set_members_allows_ping(self):
+        self._set_members([UNRELATED_IP])
         self.pinger.assert_no_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
-        self.ipset.refresh_ipset_chain_by_name(
-            IPSET_CHAIN, [UNRELATED_IP, self.SRC_ADDRESS], IPSET_ETHERTYPE)
+        self._set_members([UNRELATED_IP, self.SRC_ADDRESS])
+        self.pinger.assert_ping_from_ns(self.src_ns, self.DST_ADDRESS)
+
+        self._set_members([self.SRC_ADDRESS, UNRELATED_IP])
         self.pinger.assert_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
-        self.ipset.refresh_ipset_chain_by_name(
-            IPSET_CHAIN, [self.SRC_ADDRESS, UNRELATED_IP], IPSET_ETHERTYPE)
+    def test_new_manager_replaces_stale_members(self):
+        self._set_members([self.SRC_ADDRESS])
         self.pinger.assert_ping_from_ns(self.src_ns, self.DST_ADDRESS)
 
+        # i.e. an agent restart while the set holds a stale member
+        self.ipset = self._create_ipset_manager_and_chain(self.dst_ns,
+                                                          IPSET_CHAIN)
+        self.pinger.assert_no_ping_from_ns(self.src_ns, self.DST_ADDRESS)
+
     def test_destroy_ipset_chain(self):
-        self.assertRaises(RuntimeError,
-                          self.ipset.destroy_ipset_chain_by_name, IPSET_CHAIN)
+        self.ipset.destroy_sets([IPSET_CHAIN])
+        self.assertRaises(RuntimeError, self.ipset.apply)
         self._remove_iptables_ipset_rules(self.dst_iptables)
-        self.ipset.destroy_ipset_chain_by_name(IPSET_CHAIN)
+        self._set_members([])
+        self.ipset.destroy_sets([IPSET_CHAIN])
+        self.ipset.apply()
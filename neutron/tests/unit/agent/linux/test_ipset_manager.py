@@ -0,0 +1,108 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.agent.linux import ipset_manager
+from neutron.tests import base
+
+
+class BaseIpsetManagerTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(BaseIpsetManagerTest, self).setUp()
+        self.execute = mock.Mock()
+        self.ipset = ipset_manager.IpsetManager(execute=self.execute,
+                                                root_helper='sudo')
+
+    def _assert_restored(self, *process_inputs):
+        calls = [mock.call(['ipset', 'restore', '-exist'],
+                           root_helper='sudo',
+                           process_input='\n'.join(process_input))
+                 for process_input in process_inputs]
+        self.assertEqual(calls, self.execute.call_args_list)
+
+    def _load_set(self, member_ips):
+        self.ipset.set_members('IPv4sg', 'IPv4', member_ips)
+        self.ipset.apply()
+        self.execute.reset_mock()
+
+
+class IpsetManagerTestCase(BaseIpsetManagerTest):
+
+    def test_set_members_creates_new_set_by_swapping(self):
+        self.assertFalse(self.ipset.set_exists('IPv6sg'))
+        self.ipset.set_members('IPv6sg', 'IPv6', ['fe80::2', 'fe80::1'])
+        self.assertTrue(self.ipset.set_exists('IPv6sg'))
+        self.assertFalse(self.execute.called)
+        self.ipset.apply()
+        self._assert_restored(['create IPv6sg hash:ip family inet6',
+                               'create IPv6sg-new hash:ip family inet6',
+                               'add IPv6sg-new fe80::1',
+                               'add IPv6sg-new fe80::2',
+                               'swap IPv6sg-new IPv6sg',
+                               'destroy IPv6sg-new'])
+
+    def test_set_members_applies_differences_only(self):
+        self._load_set(['10.0.0.1', '10.0.0.2'])
+        self.ipset.set_members('IPv4sg', 'IPv4', ['10.0.0.2', '10.0.0.3'])
+        self.ipset.apply()
+        self._assert_restored(['add IPv4sg 10.0.0.3',
+                               'del IPv4sg 10.0.0.1'])
+
+    def test_apply_batches_changes_of_all_sets(self):
+        self._load_set(['10.0.0.1'])
+        self.ipset.set_members('IPv4sg', 'IPv4', ['10.0.0.2'])
+        self.ipset.set_members('IPv4sg2', 'IPv4', [])
+        self.ipset.destroy_sets(['IPv4sg', 'IPv4unknown'])
+        self.ipset.apply()
+        self._assert_restored(['add IPv4sg 10.0.0.2',
+                               'del IPv4sg 10.0.0.1',
+                               'create IPv4sg2 hash:ip family inet',
+                               'create IPv4sg2-new hash:ip family inet',
+                               'swap IPv4sg2-new IPv4sg2',
+                               'destroy IPv4sg2-new',
+                               'destroy IPv4sg'])
+        self.assertFalse(self.ipset.set_exists('IPv4sg'))
+
+    def test_apply_without_changes(self):
+        self._load_set(['10.0.0.1'])
+        self.ipset.set_members('IPv4sg', 'IPv4', ['10.0.0.1'])
+        self.ipset.apply()
+        self.assertFalse(self.execute.called)
+
+    def test_apply_failure_forgets_sets(self):
+        self._load_set(['10.0.0.1'])
+        self.ipset.set_members('IPv4sg', 'IPv4', ['10.0.0.2'])
+        self.execute.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError, self.ipset.apply)
+        self.assertFalse(self.ipset.set_exists('IPv4sg'))
+
+        # The set is entirely rebuilt on the next update
+        self.execute.reset_mock()
+        self.execute.side_effect = None
+        self.ipset.set_members('IPv4sg', 'IPv4', ['10.0.0.2'])
+        self.ipset.apply()
+        self._assert_restored(['create IPv4sg hash:ip family inet',
+                               'create IPv4sg-new hash:ip family inet',
+                               'add IPv4sg-new 10.0.0.2',
+                               'swap IPv4sg-new IPv4sg',
+                               'destroy IPv4sg-new'])
+
+    def test_apply_in_namespace(self):
+        self.ipset.namespace = 'qrouter'
+        self.ipset.set_members('IPv4sg', 'IPv4', [])
+        self.ipset.apply()
+        self.assertEqual(['ip', 'netns', 'exec', 'qrouter',
+                          'ipset', 'restore', '-exist'],
+                         self.execute.call_args[0][0])
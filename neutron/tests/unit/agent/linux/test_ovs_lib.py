@@ -18,6 +18,7 @@ from oslo.config import cfg
 import testtools
 
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import jsonutils
@@ -536,30 +537,31 @@ class OVS_Lib_Test(base.BaseTestCase):
 
     def _test_get_vif_ports(self, is_xen=False):
         pname = "tap99"
-        ofport = "6"
+        ofport = 6
         vif_id = uuidutils.generate_uuid()
         mac = "ca:fe:de:ad:be:ef"
 
         if is_xen:
-            external_ids = ('{xs-vif-uuid="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {"xs-vif-uuid": vif_id, "attached-mac": mac}
         else:
-            external_ids = ('{iface-id="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {"iface-id": vif_id, "attached-mac": mac}
+        headings = ['name', 'external_ids', 'ofport']
+        data = [
+            [pname, external_ids, ofport],
+            # An interface on another bridge
+            ['tap88', {'iface-id': 'tap88id', 'attached-mac': mac}, 1],
+        ]
 
         # Each element is a tuple of (expected mock call, return_value)
         expected_calls_and_values = [
             (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
                        root_helper=self.root_helper),
              "%s\n" % pname),
-            (mock.call(["ovs-vsctl", self.TO, "get",
-                        "Interface", pname, "external_ids"],
-                       root_helper=self.root_helper),
-             external_ids),
-            (mock.call(["ovs-vsctl", self.TO, "get",
-                        "Interface", pname, "ofport"],
+            (mock.call(["ovs-vsctl", self.TO, "--format=json",
+                        "--", "--columns=name,external_ids,ofport",
+                        "list", "Interface"],
                        root_helper=self.root_helper),
-             ofport),
+             self._encode_ovs_json(headings, data)),
         ]
         if is_xen:
             expected_calls_and_values.append(
@@ -573,7 +575,7 @@ class OVS_Lib_Test(base.BaseTestCase):
         ports = self.br.get_vif_ports()
         self.assertEqual(1, len(ports))
         self.assertEqual(ports[0].port_name, pname)
-        self.assertEqual(ports[0].ofport, ofport)
+        self.assertEqual(ports[0].ofport, str(ofport))
         self.assertEqual(ports[0].vif_id, vif_id)
         self.assertEqual(ports[0].vif_mac, mac)
         self.assertEqual(ports[0].switch.br_name, self.BR_NAME)
@@ -604,7 +606,7 @@ class OVS_Lib_Test(base.BaseTestCase):
         else:
             id_key = 'iface-id'
 
-        headings = ['name', 'external_ids']
+        headings = ['name', 'external_ids', 'ofport']
         data = [
             # A vif port on this bridge:
             ['tap99', {id_key: 'tap99id', 'attached-mac': 'tap99mac'}, 1],
@@ -724,6 +726,80 @@ class OVS_Lib_Test(base.BaseTestCase):
              u'tape1400310-e6': 1}
         )
 
+    def test_db_list(self):
+        headings = ['name', 'external_ids', 'tag']
+        data = [
+            ['tap99', {'iface-id': 'tap99id'}, 1],
+            ['tap98', {}, set()],
+            ['tap97', {'iface-id': 'tap97id'}, 2],
+        ]
+        self.execute.return_value = self._encode_ovs_json(headings, data)
+
+        rows = self.br.db_list('Port', records=['tap99', 'tap98'],
+                               columns=['external_ids', 'tag'])
+        self.assertEqual(
+            [{'name': 'tap99', 'external_ids': {'iface-id': 'tap99id'},
+              'tag': 1},
+             {'name': 'tap98', 'external_ids': {}, 'tag': []}],
+            rows)
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", self.TO, "--format=json", "--",
+             "--columns=name,external_ids,tag", "list", "Port"],
+            root_helper=self.root_helper)
+
+    def test_db_list_no_result(self):
+        self.execute.return_value = ''
+        self.assertEqual([], self.br.db_list('Port'))
+
+    def test_get_ports_attributes_no_port(self):
+        self.execute.return_value = ''
+        self.assertEqual([], self.br.get_ports_attributes('Interface'))
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
+            root_helper=self.root_helper)
+
+    def test_deferred_vsctl(self):
+        with self.br.deferred_vsctl() as deferred_br:
+            deferred_br.add_port('tap1')
+            deferred_br.set_db_attribute('Port', 'tap1', 'tag', 3)
+            deferred_br.clear_db_attribute('Port', 'tap2', 'tag')
+            deferred_br.delete_port('tap3')
+            self.assertFalse(self.execute.called)
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", self.TO,
+             "--", "--may-exist", "add-port", self.BR_NAME, "tap1",
+             "--", "set", "Port", "tap1", "tag=3",
+             "--", "clear", "Port", "tap2", "tag",
+             "--", "--if-exists", "del-port", self.BR_NAME, "tap3"],
+            root_helper=self.root_helper)
+
+    def test_deferred_vsctl_add_tunnel_port(self):
+        with self.br.deferred_vsctl() as deferred_br:
+            deferred_br.add_tunnel_port('gre-1', '9.9.9.9', '1.1.1.1')
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", self.TO,
+             "--", "--may-exist", "add-port", self.BR_NAME, "gre-1",
+             "--", "set", "Interface", "gre-1", "type=gre",
+             "options:df_default=true", "options:remote_ip=9.9.9.9",
+             "options:local_ip=1.1.1.1", "options:in_key=flow",
+             "options:out_key=flow"],
+            root_helper=self.root_helper)
+
+    def test_deferred_vsctl_nothing_to_apply(self):
+        with self.br.deferred_vsctl():
+            pass
+        self.assertFalse(self.execute.called)
+
+    def test_deferred_vsctl_not_applied_on_error(self):
+        try:
+            with self.br.deferred_vsctl() as deferred_br:
+                deferred_br.add_port('tap1')
+                raise Exception()
+        except Exception:
+            self.assertFalse(self.execute.called)
+        else:
+            self.fail('Exception would be reraised')
+
     def test_clear_db_attribute(self):
         pname = "tap77"
         self.br.clear_db_attribute("Port", pname, "tag")
@@ -888,6 +964,83 @@ class OVS_Lib_Test(base.BaseTestCase):
                                                         "br-ext"))
 
 
+class OVS_Lib_Native_Test(base.BaseTestCase):
+
+    def setUp(self):
+        super(OVS_Lib_Native_Test, self).setUp()
+        cfg.CONF.set_override('ovsdb_interface', 'native')
+        self.replica = ovsdb_client.OvsdbReplica('unix:/fake')
+        self.replica.apply_table_updates({
+            'Bridge': {
+                'br1': {'new': {'name': 'br-int',
+                                'ports': ['set', [['uuid', 'p1'],
+                                                  ['uuid', 'p2'],
+                                                  ['uuid', 'p3']]]}},
+                'br2': {'new': {'name': 'br-ex', 'ports': ['uuid', 'p4']}},
+            },
+            'Port': {
+                'p1': {'new': {'name': 'tap1', 'interfaces': ['uuid', 'i1'],
+                               'tag': 1}},
+                'p2': {'new': {'name': 'tap2', 'interfaces': ['uuid', 'i2'],
+                               'tag': ['set', []]}},
+                'p3': {'new': {'name': 'tap3', 'interfaces': ['uuid', 'i3'],
+                               'tag': 2}},
+                'p4': {'new': {'name': 'tap4', 'interfaces': ['uuid', 'i4'],
+                               'tag': ['set', []]}},
+            },
+            'Interface': {
+                'i1': {'new': {'name': 'tap1', 'ofport': 1,
+                               'external_ids': [
+                                   'map', [['iface-id', 'tap1id'],
+                                           ['attached-mac', 'mac1']]]}},
+                'i2': {'new': {'name': 'tap2', 'ofport': ['set', []],
+                               'external_ids': [
+                                   'map', [['iface-id', 'tap2id'],
+                                           ['attached-mac', 'mac2']]]}},
+                'i3': {'new': {'name': 'tap3', 'ofport': 3,
+                               'external_ids': ['map', []]}},
+                'i4': {'new': {'name': 'tap4', 'ofport': 4,
+                               'external_ids': [
+                                   'map', [['iface-id', 'tap4id'],
+                                           ['attached-mac', 'mac4']]]}},
+            },
+        })
+        self.replica.is_ready = True
+        mock.patch.object(ovsdb_client, 'get_replica',
+                          return_value=self.replica).start()
+        self.execute = mock.patch.object(
+            utils, "execute", spec=utils.execute).start()
+        self.br = ovs_lib.OVSBridge('br-int', 'sudo')
+
+    def test_get_vif_port_set(self):
+        self.assertEqual(set(['tap1id']), self.br.get_vif_port_set())
+        self.assertFalse(self.execute.called)
+
+    def test_get_port_tag_dict(self):
+        self.assertEqual({'tap1': 1, 'tap2': [], 'tap3': 2},
+                         self.br.get_port_tag_dict())
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_by_id(self):
+        vif_port = self.br.get_vif_port_by_id('tap1id')
+        self.assertEqual('tap1', vif_port.port_name)
+        self.assertEqual(1, vif_port.ofport)
+        self.assertEqual('mac1', vif_port.vif_mac)
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_by_id_invalid_ofport(self):
+        self.assertIsNone(self.br.get_vif_port_by_id('tap2id'))
+
+    def test_get_vif_port_by_id_other_bridge(self):
+        self.assertIsNone(self.br.get_vif_port_by_id('tap4id'))
+
+    def test_falls_back_to_vsctl_when_replica_not_ready(self):
+        self.replica.is_ready = False
+        self.execute.return_value = ''
+        self.assertEqual(set(), self.br.get_vif_port_set())
+        self.assertTrue(self.execute.called)
+
+
 class TestDeferredOVSBridge(base.BaseTestCase):
 
     def setUp(self):
@@ -0,0 +1,252 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import socket
+
+import eventlet
+import mock
+
+from neutron.agent.linux import ovsdb_client
+from neutron.openstack.common import jsonutils
+from neutron.tests import base
+
+
+BR_UUID = 'br-uuid'
+BR_LOCAL_PORT_UUID = 'br-port-uuid'
+PORT_UUID = 'port-uuid'
+IFACE_UUID = 'iface-uuid'
+
+
+def _initial_state():
+    return {
+        'Bridge': {
+            BR_UUID: {'new': {
+                'name': 'br-int',
+                'ports': ['set', [['uuid', BR_LOCAL_PORT_UUID],
+                                  ['uuid', PORT_UUID]]]}},
+        },
+        'Port': {
+            BR_LOCAL_PORT_UUID: {'new': {
+                'name': 'br-int', 'interfaces': ['uuid', 'br-iface-uuid'],
+                'tag': ['set', []]}},
+            PORT_UUID: {'new': {
+                'name': 'tap1', 'interfaces': ['uuid', IFACE_UUID],
+                'tag': 1}},
+        },
+        'Interface': {
+            IFACE_UUID: {'new': {
+                'name': 'tap1',
+                'external_ids': ['map', [['iface-id', 'port1'],
+                                         ['attached-mac', 'mac1']]],
+                'ofport': 3}},
+        },
+    }
+
+
+class TestOvsdbValueToPy(base.BaseTestCase):
+
+    def test_atom(self):
+        self.assertEqual(1, ovsdb_client.ovsdb_value_to_py(1))
+        self.assertEqual('foo', ovsdb_client.ovsdb_value_to_py('foo'))
+
+    def test_set(self):
+        self.assertEqual([], ovsdb_client.ovsdb_value_to_py(['set', []]))
+        self.assertEqual(['a', 'b'],
+                         ovsdb_client.ovsdb_value_to_py(
+                             ['set', [['uuid', 'a'], ['uuid', 'b']]]))
+
+    def test_map(self):
+        self.assertEqual({'a': '1'},
+                         ovsdb_client.ovsdb_value_to_py(
+                             ['map', [['a', '1']]]))
+
+    def test_uuid(self):
+        self.assertEqual('a', ovsdb_client.ovsdb_value_to_py(['uuid', 'a']))
+
+
+class TestJsonMessageStream(base.BaseTestCase):
+
+    def test_feed_splits_messages(self):
+        msgs = [{'id': 1, 'result': {'a': ['b', {'c': 'd}{'}]}},
+                {'id': 2, 'result': 'with "escaped" quote and \\ ]'},
+                {'id': 3, 'result': []}]
+        data = '  '.join(jsonutils.dumps(msg) for msg in msgs) + '\n'
+        stream = ovsdb_client.JsonMessageStream()
+        self.assertEqual(msgs, stream.feed(data))
+
+    def test_feed_byte_by_byte(self):
+        msgs = [{'id': 1, 'result': 'a "quoted" \\" string {'},
+                {'id': 2, 'result': ['[', ']']}]
+        data = ''.join(jsonutils.dumps(msg) for msg in msgs)
+        stream = ovsdb_client.JsonMessageStream()
+        received = []
+        for char in data:
+            received.extend(stream.feed(char))
+        self.assertEqual(msgs, received)
+
+    def test_incomplete_message_is_decoded_once(self):
+        stream = ovsdb_client.JsonMessageStream()
+        with mock.patch.object(jsonutils, 'loads',
+                               wraps=jsonutils.loads) as loads:
+            self.assertEqual([], stream.feed('{"id": 1, "res'))
+            self.assertEqual([], stream.feed('ult": [1, 2'))
+            self.assertEqual([{'id': 1, 'result': [1, 2]}],
+                             stream.feed(']}'))
+        self.assertEqual(1, loads.call_count)
+
+
+class TestOvsdbReplica(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvsdbReplica, self).setUp()
+        self.replica = ovsdb_client.OvsdbReplica('unix:/fake/db.sock')
+        self.replica._sock = mock.Mock()
+
+    def _load_initial_state(self):
+        self.replica._monitor_id = 1
+        self.replica._handle_message({'id': 1, 'error': None,
+                                      'result': _initial_state()})
+
+    def test_monitor_reply_makes_replica_ready(self):
+        self.assertFalse(self.replica.is_ready)
+        self._load_initial_state()
+        self.assertTrue(self.replica.is_ready)
+        self.assertEqual(1, len(self.replica.tables['Interface']))
+
+    def test_monitor_error_raises(self):
+        self.replica._monitor_id = 1
+        self.assertRaises(ovsdb_client.OvsdbClientError,
+                          self.replica._handle_message,
+                          {'id': 1, 'error': 'unknown database',
+                           'result': None})
+
+    def test_echo_is_answered(self):
+        self.replica._handle_message({'method': 'echo', 'params': [],
+                                      'id': 'echo'})
+        sent = self.replica._sock.sendall.call_args[0][0]
+        self.assertEqual({'id': 'echo', 'result': [], 'error': None},
+                         jsonutils.loads(sent))
+
+    def test_get_port_name_list_excludes_bridge_local_port(self):
+        self._load_initial_state()
+        self.assertEqual(['tap1'], self.replica.get_port_name_list('br-int'))
+        self.assertEqual([], self.replica.get_port_name_list('br-ex'))
+
+    def test_get_bridge_for_iface(self):
+        self._load_initial_state()
+        self.assertEqual('br-int', self.replica.get_bridge_for_iface('tap1'))
+        self.assertIsNone(self.replica.get_bridge_for_iface('tap2'))
+
+    def test_update_modifies_and_deletes_rows(self):
+        self._load_initial_state()
+        self.replica.consume_interface_updates()
+        self.replica._handle_message({
+            'method': 'update', 'id': None,
+            'params': [None, {'Port': {
+                PORT_UUID: {'old': {'tag': 1},
+                            'new': {'name': 'tap1',
+                                    'interfaces': ['uuid', IFACE_UUID],
+                                    'tag': 2}}}}]})
+        self.assertEqual(2, self.replica.tables['Port'][PORT_UUID]['tag'])
+        self.assertFalse(self.replica.consume_interface_updates())
+
+        self.replica._handle_message({
+            'method': 'update', 'id': None,
+            'params': [None, {'Interface': {
+                IFACE_UUID: {'old': {'name': 'tap1'}}}}]})
+        self.assertEqual({}, self.replica.tables['Interface'])
+        self.assertTrue(self.replica.consume_interface_updates())
+        self.assertFalse(self.replica.consume_interface_updates())
+
+    def test_consume_interface_updates_true_when_not_ready(self):
+        self.replica.consume_interface_updates()
+        self.assertTrue(self.replica.consume_interface_updates())
+
+    def test_consume_interface_events(self):
+        self.assertIsNone(self.replica.consume_interface_events())
+        self._load_initial_state()
+        # The initial state is not reported as events
+        self.assertIsNone(self.replica.consume_interface_events())
+        self.assertEqual([], self.replica.consume_interface_events())
+
+        new_row = {'name': 'tap1',
+                   'external_ids': ['map', [['iface-id', 'port2'],
+                                            ['attached-mac', 'mac2']]],
+                   'ofport': 3}
+        self.replica._handle_message({
+            'method': 'update', 'id': None,
+            'params': [None, {'Interface': {
+                IFACE_UUID: {'old': {'external_ids': ['map', []]},
+                             'new': new_row}}}]})
+        self.replica._handle_message({
+            'method': 'update', 'id': None,
+            'params': [None, {'Interface': {
+                IFACE_UUID: {'old': new_row}}}]})
+        old = {'name': 'tap1', 'ofport': 3,
+               'external_ids': {'iface-id': 'port1', 'attached-mac': 'mac1'}}
+        new = {'name': 'tap1', 'ofport': 3,
+               'external_ids': {'iface-id': 'port2', 'attached-mac': 'mac2'}}
+        self.assertEqual([(ovsdb_client.ROW_DELETED, old),
+                          (ovsdb_client.ROW_UPDATED, new),
+                          (ovsdb_client.ROW_DELETED, new)],
+                         self.replica.consume_interface_events())
+        self.assertEqual([], self.replica.consume_interface_events())
+
+    def test_consume_interface_events_none_after_disconnect(self):
+        self._load_initial_state()
+        self.replica.consume_interface_events()
+        self.replica._disconnect()
+        self.assertIsNone(self.replica.consume_interface_events())
+
+    def test_read_messages_handles_split_and_joined_messages(self):
+        msg1 = jsonutils.dumps({'method': 'echo', 'params': [], 'id': 'e1'})
+        msg2 = jsonutils.dumps({'method': 'echo', 'params': [], 'id': 'e2'})
+        data = msg1 + msg2
+        self.replica._sock.recv.side_effect = [data[:5], data[5:], '']
+        with mock.patch.object(self.replica,
+                               '_handle_message') as handle_message:
+            self.assertRaises(ovsdb_client.OvsdbClientError,
+                              self.replica._read_messages)
+        handle_message.assert_has_calls([
+            mock.call({'method': 'echo', 'params': [], 'id': 'e1'}),
+            mock.call({'method': 'echo', 'params': [], 'id': 'e2'})])
+
+    def test_run_logs_lost_connection_once_and_backs_off(self):
+        attempts = []
+
+        def connect():
+            attempts.append(None)
+            if len(attempts) == 5:
+                self.replica._stopped = True
+            raise socket.error()
+
+        with contextlib.nested(
+            mock.patch.object(self.replica, '_connect', side_effect=connect),
+            mock.patch.object(eventlet, 'sleep'),
+            mock.patch.object(ovsdb_client.LOG, 'exception')
+        ) as (_connect, sleep, log_exception):
+            self.replica._run()
+        self.assertEqual(1, log_exception.call_count)
+        self.assertEqual([mock.call(2), mock.call(4), mock.call(8),
+                          mock.call(16)], sleep.call_args_list)
+
+    def test_disconnect_clears_replica(self):
+        self._load_initial_state()
+        sock = self.replica._sock
+        self.replica._disconnect()
+        self.assertFalse(self.replica.is_ready)
+        self.assertEqual({}, self.replica.tables['Bridge'])
+        sock.close.assert_called_once_with()
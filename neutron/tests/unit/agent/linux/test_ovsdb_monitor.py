@@ -12,10 +12,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import eventlet.event
 import mock
 
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import ovsdb_monitor
+from neutron.openstack.common import jsonutils
 from neutron.tests import base
 
 
@@ -101,3 +105,99 @@ class TestSimpleInterfaceMonitor(base.BaseTestCase):
                 return_value=output):
             self.monitor._read_stdout()
         self.assertFalse(self.monitor.data_received)
+
+    def _get_events(self, *updates):
+        target = ('neutron.agent.linux.ovsdb_monitor.SimpleInterfaceMonitor'
+                  '.is_active')
+        lines = [jsonutils.dumps(
+            {'headings': ['row', 'action', 'name', 'ofport', 'external_ids'],
+             'data': data}) for data in updates]
+        with contextlib.nested(
+            mock.patch(target,
+                       new_callable=mock.PropertyMock(return_value=True)),
+            mock.patch.object(self.monitor, 'iter_stdout',
+                              return_value=lines)
+        ):
+            # The first call only reports that a full scan is required
+            self.assertIsNone(self.monitor.get_events())
+            self.assertTrue(self.monitor.has_updates)
+            return self.monitor.get_events()
+
+    def test_get_events_returns_parsed_rows(self):
+        ext_ids = ['map', [['iface-id', 'port1'], ['attached-mac', 'mac1']]]
+        events = self._get_events(
+            [['uuid1', 'insert', 'tap1', ['set', []], ext_ids]],
+            [['uuid1', 'old', '', ['set', []], ''],
+             ['', 'new', 'tap1', 5, ext_ids]],
+            [['uuid1', 'delete', 'tap1', 5, ext_ids]])
+        ext_ids = {'iface-id': 'port1', 'attached-mac': 'mac1'}
+        self.assertEqual(
+            [(ovsdb_client.ROW_UPDATED,
+              {'row': 'uuid1', 'name': 'tap1', 'ofport': [],
+               'external_ids': ext_ids}),
+             (ovsdb_client.ROW_UPDATED,
+              {'row': '', 'name': 'tap1', 'ofport': 5,
+               'external_ids': ext_ids}),
+             (ovsdb_client.ROW_DELETED,
+              {'row': 'uuid1', 'name': 'tap1', 'ofport': 5,
+               'external_ids': ext_ids})],
+            events)
+
+    def test_get_events_reports_old_external_ids_as_deleted(self):
+        ext_ids = ['map', [['iface-id', 'port1'], ['attached-mac', 'mac1']]]
+        events = self._get_events(
+            [['uuid1', 'old', '', '', ext_ids]])
+        self.assertEqual(ovsdb_client.ROW_DELETED, events[0][0])
+
+    def test_get_events_requires_full_scan_on_invalid_output(self):
+        target = ('neutron.agent.linux.ovsdb_monitor.SimpleInterfaceMonitor'
+                  '.is_active')
+        with contextlib.nested(
+            mock.patch(target,
+                       new_callable=mock.PropertyMock(return_value=True)),
+            mock.patch.object(self.monitor, 'iter_stdout',
+                              return_value=['garbage'])
+        ):
+            self.monitor.get_events()
+            self.assertTrue(self.monitor.has_updates)
+            self.assertIsNone(self.monitor.get_events())
+
+    def test_get_events_requires_full_scan_after_kill(self):
+        self.monitor._events = []
+        with mock.patch(
+                'neutron.agent.linux.ovsdb_monitor.OvsdbMonitor._kill'):
+            self.monitor._kill()
+        self.assertIsNone(self.monitor.get_events())
+
+
+class TestReplicaInterfaceMonitor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestReplicaInterfaceMonitor, self).setUp()
+        self.replica = mock.Mock()
+        mock.patch.object(ovsdb_client, 'get_replica',
+                          return_value=self.replica).start()
+        self.monitor = ovsdb_monitor.ReplicaInterfaceMonitor()
+
+    def test_has_updates_is_true_if_not_started(self):
+        self.assertTrue(self.monitor.has_updates)
+
+    def test_has_updates_consumes_replica_updates(self):
+        self.replica.consume_interface_updates.return_value = False
+        self.monitor.start()
+        self.assertFalse(self.monitor.has_updates)
+        self.replica.consume_interface_updates.assert_called_once_with()
+
+    def test_is_active(self):
+        self.replica.is_ready = True
+        self.assertFalse(self.monitor.is_active)
+        self.monitor.start()
+        self.assertTrue(self.monitor.is_active)
+        self.monitor.stop()
+        self.assertFalse(self.monitor.is_active)
+
+    def test_get_events(self):
+        self.assertIsNone(self.monitor.get_events())
+        self.replica.consume_interface_events.return_value = []
+        self.monitor.start()
+        self.assertEqual([], self.monitor.get_events())
@@ -13,7 +13,9 @@
 #    under the License.
 
 import mock
+from oslo.config import cfg
 
+from neutron.agent.linux import ovsdb_monitor
 from neutron.agent.linux import polling
 from neutron.tests import base
 
@@ -87,6 +89,10 @@ class TestAlwaysPoll(base.BaseTestCase):
         pm = polling.AlwaysPoll()
         self.assertTrue(pm.is_polling_required)
 
+    def test_get_events_requires_full_scan(self):
+        pm = polling.AlwaysPoll()
+        self.assertIsNone(pm.get_events())
+
 
 class TestInterfacePollingMinimizer(base.BaseTestCase):
 
@@ -99,6 +105,12 @@ class TestInterfacePollingMinimizer(base.BaseTestCase):
             self.pm.start()
         mock_start.assert_called_with()
 
+    def test_native_ovsdb_interface_uses_replica_monitor(self):
+        cfg.CONF.set_override('ovsdb_interface', 'native')
+        pm = polling.InterfacePollingMinimizer()
+        self.assertIsInstance(pm._monitor,
+                              ovsdb_monitor.ReplicaInterfaceMonitor)
+
     def test_stop_calls_monitor_stop(self):
         with mock.patch.object(self.pm._monitor, 'stop') as mock_stop:
             self.pm.stop()
@@ -115,3 +127,9 @@ class TestInterfacePollingMinimizer(base.BaseTestCase):
     def test__is_polling_required_returns_when_updates_are_present(self):
         with self.mock_has_updates(True):
             self.assertTrue(self.pm._is_polling_required())
+
+    def test_get_events_returns_monitor_events(self):
+        with mock.patch.object(self.pm._monitor, 'get_events',
+                               return_value=[]) as get_events:
+            self.assertEqual([], self.pm.get_events())
+        get_events.assert_called_once_with()
@@ -0,0 +1,222 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import netaddr
+from oslo.config import cfg
+
+from neutron import context
+from neutron.db import ipam
+from neutron.db import models_v2
+from neutron.tests import base
+from neutron.tests.unit import test_db_plugin
+
+
+FREE_RANGES_DRIVER = 'neutron.db.ipam.FreeRangesIpamDriver'
+
+
+def _lowest_free_ip(free_ranges):
+    if len(free_ranges):
+        return free_ranges._firsts[0]
+
+
+class TestFreeRanges(base.BaseTestCase):
+
+    def _ranges(self, free_ranges):
+        return zip(free_ranges._firsts, free_ranges._lasts)
+
+    def test_build(self):
+        free_ranges = ipam.FreeRanges([(100, 120), (3, 10)],
+                                      [3, 78, 7, 110, 11, 4, 111, 120])
+        self.assertEqual([(5, 6), (8, 10), (100, 109), (112, 119)],
+                         self._ranges(free_ranges))
+        self.assertEqual([(3, 10), (100, 120)], free_ranges.pools)
+
+    def test_build_merges_adjacent_pools(self):
+        free_ranges = ipam.FreeRanges([(1, 5), (6, 10)], [])
+        self.assertEqual([(1, 10)], self._ranges(free_ranges))
+
+    def test_take(self):
+        free_ranges = ipam.FreeRanges([(1, 10)], [])
+        self.assertTrue(free_ranges.take(5))
+        self.assertFalse(free_ranges.take(5))
+        self.assertFalse(free_ranges.take(11))
+        self.assertTrue(free_ranges.take(1))
+        self.assertTrue(free_ranges.take(10))
+        self.assertEqual([(2, 4), (6, 9)], self._ranges(free_ranges))
+        for ip in (2, 3, 4):
+            free_ranges.take(ip)
+        self.assertEqual([(6, 9)], self._ranges(free_ranges))
+
+    def test_release(self):
+        free_ranges = ipam.FreeRanges([(1, 10)], [2, 4, 5, 8, 10])
+        self.assertTrue(free_ranges.release(2))
+        self.assertTrue(free_ranges.release(8))
+        self.assertTrue(free_ranges.release(5))
+        self.assertFalse(free_ranges.release(5))
+        self.assertFalse(free_ranges.release(11))
+        self.assertEqual([(1, 3), (5, 9)], self._ranges(free_ranges))
+        self.assertTrue(free_ranges.release(4))
+        self.assertTrue(free_ranges.release(10))
+        self.assertEqual([(1, 10)], self._ranges(free_ranges))
+
+    def test_random(self):
+        free_ranges = ipam.FreeRanges([(1, 3), (7, 9)], [2, 8])
+        self.assertIn(free_ranges.random(), (1, 3, 7, 9))
+        for ip in (1, 3, 7, 9):
+            free_ranges.take(ip)
+        self.assertIsNone(free_ranges.random())
+        self.assertEqual(0, len(free_ranges))
+
+
+class FreeRangesIpamDriverTestMixin(object):
+
+    def setUp(self, *args, **kwargs):
+        cfg.CONF.set_override('ipam_driver', FREE_RANGES_DRIVER)
+        # Allocate the lowest free address, as the tests expect
+        mock.patch.object(ipam.FreeRanges, 'random',
+                          new=_lowest_free_ip).start()
+        super(FreeRangesIpamDriverTestMixin, self).setUp(*args, **kwargs)
+
+
+class TestFreeRangesIpamDriverPorts(FreeRangesIpamDriverTestMixin,
+                                    test_db_plugin.TestPortsV2):
+    pass
+
+
+class TestFreeRangesIpamDriverSubnets(FreeRangesIpamDriverTestMixin,
+                                      test_db_plugin.TestSubnetsV2):
+    pass
+
+
+class TestFreeRangesIpamDriver(FreeRangesIpamDriverTestMixin,
+                               test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(TestFreeRangesIpamDriver, self).setUp()
+        self.driver = ipam.get_driver()
+        self.context = context.get_admin_context()
+
+    def test_get_driver(self):
+        self.assertIsInstance(self.driver, ipam.FreeRangesIpamDriver)
+        self.assertIs(self.driver, ipam.get_driver())
+
+    def test_no_availability_range_created(self):
+        with self.subnet():
+            self.assertEqual(
+                0, self.context.session.query(
+                    models_v2.IPAvailabilityRange).count())
+
+    def test_generate_ip_skips_ips_allocated_by_other_servers(self):
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet) as port:
+                self.assertEqual('10.0.0.2',
+                                 port['port']['fixed_ips'][0]['ip_address'])
+                # Allocated by another server, unknown from the free ranges
+                with self.context.session.begin():
+                    self.context.session.add(models_v2.IPAllocation(
+                        ip_address='10.0.0.3',
+                        subnet_id=subnet['subnet']['id'],
+                        network_id=subnet['subnet']['network_id']))
+                with self.port(subnet=subnet) as port2:
+                    self.assertEqual(
+                        '10.0.0.4',
+                        port2['port']['fixed_ips'][0]['ip_address'])
+
+    def test_generate_ip_recycles_released_ips(self):
+        data = {'subnet': {'allocation_pools': [{'start': '10.0.0.2',
+                                                 'end': '10.0.0.3'}]}}
+        with self.subnet() as subnet:
+            req = self.new_update_request('subnets', data,
+                                          subnet['subnet']['id'])
+            req.get_response(self.api)
+            with self.port(subnet=subnet):
+                port = self._make_port(self.fmt,
+                                       subnet['subnet']['network_id'])
+                self._delete('ports', port['port']['id'])
+                # The deleted port address is not known as free, the free
+                # ranges are rebuilt once the pool seems exhausted
+                with self.port(subnet=subnet) as port3:
+                    self.assertEqual(
+                        '10.0.0.3',
+                        port3['port']['fixed_ips'][0]['ip_address'])
+
+    def test_generate_ips_skips_ips_allocated_by_other_servers(self):
+        with self.subnet() as subnet:
+            # Builds the free ranges and reserves 10.0.0.2
+            self.driver.generate_ip(self.context, [subnet['subnet']])
+            # Allocated by another server, unknown from the free ranges
+            with self.context.session.begin():
+                self.context.session.add(models_v2.IPAllocation(
+                    ip_address='10.0.0.3',
+                    subnet_id=subnet['subnet']['id'],
+                    network_id=subnet['subnet']['network_id']))
+            with mock.patch.object(
+                    self.driver, '_get_allocated',
+                    wraps=self.driver._get_allocated) as get_allocated:
+                res = self._create_port_bulk(self.fmt, 3,
+                                             subnet['subnet']['network_id'],
+                                             'test', True)
+            ports = self.deserialize(self.fmt, res)['ports']
+            self.assertEqual(['10.0.0.4', '10.0.0.5', '10.0.0.6'],
+                             [p['fixed_ips'][0]['ip_address']
+                              for p in ports])
+            # The candidates of an attempt are checked with one query
+            self.assertEqual(2, get_allocated.call_count)
+            for p in ports:
+                self._delete('ports', p['id'])
+
+    def test_rollback_releases_taken_ips(self):
+        with self.subnet() as subnet:
+            try:
+                with self.context.session.begin():
+                    ip = self.driver.generate_ip(self.context,
+                                                 [subnet['subnet']])
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.assertEqual('10.0.0.2', ip['ip_address'])
+            with self.port(subnet=subnet) as port:
+                self.assertEqual('10.0.0.2',
+                                 port['port']['fixed_ips'][0]['ip_address'])
+
+    def test_rebuild_keeps_uncommitted_ips_taken(self):
+        with self.subnet() as subnet:
+            subnet_id = subnet['subnet']['id']
+            with self.context.session.begin():
+                ip = self.driver.generate_ip(self.context,
+                                             [subnet['subnet']])
+                free_ranges = self.driver._build_free_ranges(
+                    self.context, subnet_id,
+                    self.driver._free_ranges[subnet_id].pools)
+            self.assertEqual('10.0.0.2', ip['ip_address'])
+            self.assertNotIn(int(netaddr.IPAddress('10.0.0.2')), free_ranges)
+
+    def test_create_port_retries_concurrently_allocated_ip(self):
+        with self.subnet() as subnet:
+            self.driver._get_free_ranges(self.context, subnet['subnet']['id'])
+            # Being allocated by another server when the candidates are
+            # checked, committed before this server flushes
+            with self.context.session.begin():
+                self.context.session.add(models_v2.IPAllocation(
+                    ip_address='10.0.0.2',
+                    subnet_id=subnet['subnet']['id'],
+                    network_id=subnet['subnet']['network_id']))
+            with mock.patch.object(self.driver, '_get_allocated',
+                                   return_value=set()):
+                with self.port(subnet=subnet) as port:
+                    self.assertEqual(
+                        '10.0.0.3',
+                        port['port']['fixed_ips'][0]['ip_address'])
@@ -13,10 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
+import mock
+from oslo.config import cfg
+
 from neutron.common import exceptions
 from neutron import context
 from neutron.db import db_base_plugin_v2 as base_plugin
 from neutron.db import quota_db
+from neutron.openstack.common import timeutils
 from neutron.tests.unit import testlib_api
 
 
@@ -144,3 +150,90 @@ class TestDbQuotaDriver(testlib_api.SqlTestCase):
         self.assertRaises(exceptions.QuotaResourceUnknown,
                           self.plugin.limit_check, context.get_admin_context(),
                           PROJECT, resources, values)
+
+
+class TestDbQuotaDriverReservations(testlib_api.SqlTestCase):
+    def setUp(self):
+        super(TestDbQuotaDriverReservations, self).setUp()
+        self.plugin = FakePlugin()
+        self.context = context.get_admin_context()
+        self.resources = {RESOURCE: TestResource(RESOURCE, 4)}
+        self.in_use = 0
+        self.count = mock.Mock(side_effect=lambda resource: self.in_use)
+
+    def _reserve(self, amount):
+        return self.plugin.make_reservation(
+            self.context, PROJECT, self.resources, {RESOURCE: amount},
+            self.count)
+
+    def _get_usage(self):
+        return self.context.session.query(quota_db.QuotaUsage).filter_by(
+            tenant_id=PROJECT, resource=RESOURCE).one()
+
+    def _create(self, amount):
+        self.plugin.commit_reservation(self.context, self._reserve(amount))
+        self.in_use += amount
+
+    def test_make_reservation_counts_usage_once(self):
+        self._create(1)
+        self._create(2)
+        self.assertEqual(1, self.count.call_count)
+        self.assertEqual(3, self._get_usage().in_use)
+
+    def test_make_reservation_over_quota(self):
+        self._create(3)
+        self.assertRaises(exceptions.OverQuota, self._reserve, 2)
+
+    def test_make_reservation_counts_reserved_resources(self):
+        self._reserve(3)
+        self.assertRaises(exceptions.OverQuota, self._reserve, 2)
+
+    def test_make_reservation_negative_delta(self):
+        self.assertRaises(exceptions.InvalidQuotaValue, self._reserve, -1)
+
+    def test_make_reservation_unlimited_does_not_count(self):
+        self.plugin.update_quota_limit(self.context, PROJECT, RESOURCE, -1)
+        self.assertIsNotNone(self._reserve(100))
+        self.assertFalse(self.count.called)
+
+    def test_make_reservation_unknown_resource(self):
+        self.assertRaises(exceptions.QuotaResourceUnknown,
+                          self.plugin.make_reservation, self.context,
+                          PROJECT, self.resources, {'unknown': 1},
+                          self.count)
+
+    def test_cancel_reservation_releases_resources(self):
+        self.plugin.cancel_reservation(self.context, self._reserve(3))
+        self._create(4)
+        self.assertEqual(4, self._get_usage().in_use)
+
+    def test_expired_reservation_releases_resources(self):
+        self._reserve(3)
+        expired = timeutils.utcnow() + datetime.timedelta(
+            seconds=cfg.CONF.QUOTAS.reservation_expiration)
+        with mock.patch.object(timeutils, 'utcnow', return_value=expired):
+            self._reserve(4)
+
+    def test_make_reservation_near_quota_counts_usage_again(self):
+        self._create(4)
+        # Resources deleted without marking the usage dirty
+        self.in_use = 1
+        self._create(3)
+        self.assertEqual(2, self.count.call_count)
+        self.assertEqual(4, self._get_usage().in_use)
+
+    def test_mark_dirty_counts_usage_again(self):
+        self._create(2)
+        self.in_use = 0
+        self.plugin.mark_dirty(self.context, PROJECT, [RESOURCE])
+        self._create(1)
+        self.assertEqual(2, self.count.call_count)
+        self.assertEqual(1, self._get_usage().in_use)
+
+    def test_usage_counted_again_after_resync_interval(self):
+        self._create(1)
+        resync = timeutils.utcnow() + datetime.timedelta(
+            seconds=cfg.CONF.QUOTAS.usage_resync_interval + 1)
+        with mock.patch.object(timeutils, 'utcnow', return_value=resync):
+            self._create(1)
+        self.assertEqual(2, self.count.call_count)
@@ -109,43 +109,32 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                                                                           0,
                                                                           None)
 
-    def test_treat_devices_removed_with_existed_device(self):
+    def _test_treat_devices_removed(self, failed_devices_down):
         agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
                                                                      0,
                                                                      None)
-        devices = [DEVICE_1]
-        with contextlib.nested(
-            mock.patch.object(agent.plugin_rpc, "update_device_down"),
-            mock.patch.object(agent, "remove_devices_filter")
-        ) as (fn_udd, fn_rdf):
-            fn_udd.return_value = {'device': DEVICE_1,
-                                   'exists': True}
-            with mock.patch.object(linuxbridge_neutron_agent.LOG,
-                                   'info') as log:
-                resync = agent.treat_devices_removed(devices)
-                self.assertEqual(2, log.call_count)
-                self.assertFalse(resync)
-                self.assertTrue(fn_udd.called)
-                self.assertTrue(fn_rdf.called)
-
-    def test_treat_devices_removed_with_not_existed_device(self):
-        agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
-                                                                     0,
-                                                                     None)
-        devices = [DEVICE_1]
+        devices = set([DEVICE_1])
         with contextlib.nested(
-            mock.patch.object(agent.plugin_rpc, "update_device_down"),
-            mock.patch.object(agent, "remove_devices_filter")
-        ) as (fn_udd, fn_rdf):
-            fn_udd.return_value = {'device': DEVICE_1,
-                                   'exists': False}
-            with mock.patch.object(linuxbridge_neutron_agent.LOG,
-                                   'debug') as log:
-                resync = agent.treat_devices_removed(devices)
-                self.assertEqual(1, log.call_count)
-                self.assertFalse(resync)
-                self.assertTrue(fn_udd.called)
-                self.assertTrue(fn_rdf.called)
+            mock.patch.object(agent.plugin_rpc, "update_device_list"),
+            mock.patch.object(agent, "remove_devices_filter"),
+            mock.patch.object(agent, "br_mgr")
+        ) as (fn_udl, fn_rdf, br_mgr):
+            fn_udl.return_value = {
+                'devices_up': [], 'failed_devices_up': [],
+                'devices_down': list(devices - set(failed_devices_down)),
+                'failed_devices_down': failed_devices_down}
+            resync = agent.treat_devices_removed(devices)
+            fn_udl.assert_called_once_with(agent.context, [], [DEVICE_1],
+                                           agent.agent_id, cfg.CONF.host)
+            fn_rdf.assert_called_once_with(devices)
+            br_mgr.remove_empty_bridges.assert_called_once_with()
+        return resync
+
+    def test_treat_devices_removed(self):
+        self.assertFalse(self._test_treat_devices_removed([]))
+
+    def test_treat_devices_removed_with_failed_device(self):
+        self.assertTrue(self._test_treat_devices_removed([DEVICE_1]))
 
     def test_treat_devices_removed_failed(self):
         agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
@@ -153,16 +142,16 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                                                                      None)
         devices = [DEVICE_1]
         with contextlib.nested(
-            mock.patch.object(agent.plugin_rpc, "update_device_down"),
+            mock.patch.object(agent.plugin_rpc, "update_device_list"),
             mock.patch.object(agent, "remove_devices_filter")
-        ) as (fn_udd, fn_rdf):
-            fn_udd.side_effect = Exception()
+        ) as (fn_udl, fn_rdf):
+            fn_udl.side_effect = Exception()
             with mock.patch.object(linuxbridge_neutron_agent.LOG,
                                    'debug') as log:
                 resync = agent.treat_devices_removed(devices)
-                self.assertEqual(2, log.call_count)
+                self.assertEqual(1, log.call_count)
                 self.assertTrue(resync)
-                self.assertTrue(fn_udd.called)
+                self.assertTrue(fn_udl.called)
                 self.assertTrue(fn_rdf.called)
 
     def _test_scan_devices(self, previous, updated,
@@ -312,6 +301,9 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                         'physical_network': 'physnet1'}
         agent.plugin_rpc = mock.Mock()
         agent.plugin_rpc.get_devices_details_list.return_value = [mock_details]
+        agent.plugin_rpc.update_device_list.return_value = {
+            'devices_up': ['dev123'], 'failed_devices_up': [],
+            'devices_down': [], 'failed_devices_down': []}
         agent.br_mgr = mock.Mock()
         agent.br_mgr.add_interface.return_value = True
         resync_needed = agent.treat_devices_added_updated(set(['tap1']))
@@ -320,7 +312,53 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
         agent.br_mgr.add_interface.assert_called_with('net123', 'vlan',
                                                       'physnet1', 100,
                                                       'port123')
-        self.assertTrue(agent.plugin_rpc.update_device_up.called)
+        agent.plugin_rpc.update_device_list.assert_called_once_with(
+            agent.context, ['dev123'], [], agent.agent_id, cfg.CONF.host)
+
+    def test_treat_devices_added_updated_batches_status_updates(self):
+        agent = self.agent
+        details = [{'device': dev, 'port_id': dev, 'network_id': net,
+                    'admin_state_up': True, 'network_type': 'vlan',
+                    'segmentation_id': 100, 'physical_network': 'physnet1'}
+                   for dev, net in (('dev1', 'net1'), ('dev2', 'net2'),
+                                    ('dev3', 'net1'))]
+        agent.plugin_rpc = mock.Mock()
+        agent.plugin_rpc.get_devices_details_list.return_value = details
+        agent.plugin_rpc.update_device_list.return_value = {
+            'devices_up': ['dev1', 'dev3'], 'failed_devices_up': [],
+            'devices_down': ['dev2'], 'failed_devices_down': []}
+        agent.br_mgr = mock.Mock()
+        agent.br_mgr.add_interface.side_effect = (
+            lambda net, net_type, physnet, seg_id, port_id: port_id != 'dev2')
+        resync_needed = agent.treat_devices_added_updated(
+            set(['dev1', 'dev2', 'dev3']))
+
+        self.assertFalse(resync_needed)
+        self.assertEqual(1, agent.plugin_rpc.update_device_list.call_count)
+        args = agent.plugin_rpc.update_device_list.call_args[0]
+        self.assertEqual(['dev1', 'dev3'], sorted(args[1]))
+        self.assertEqual(['dev2'], args[2])
+        # Devices of a same network are plugged in order
+        port_ids = [c[0][4] for c in agent.br_mgr.add_interface.call_args_list]
+        self.assertLess(port_ids.index('dev1'), port_ids.index('dev3'))
+
+    def test_treat_devices_added_updated_failed_status_update(self):
+        agent = self.agent
+        mock_details = {'device': 'dev123',
+                        'port_id': 'port123',
+                        'network_id': 'net123',
+                        'admin_state_up': True,
+                        'network_type': 'vlan',
+                        'segmentation_id': 100,
+                        'physical_network': 'physnet1'}
+        agent.plugin_rpc = mock.Mock()
+        agent.plugin_rpc.get_devices_details_list.return_value = [mock_details]
+        agent.plugin_rpc.update_device_list.return_value = {
+            'devices_up': [], 'failed_devices_up': ['dev123'],
+            'devices_down': [], 'failed_devices_down': []}
+        agent.br_mgr = mock.Mock()
+        agent.br_mgr.add_interface.return_value = True
+        self.assertTrue(agent.treat_devices_added_updated(set(['tap1'])))
 
     def test_treat_devices_added_updated_admin_state_up_false(self):
         agent = self.agent
@@ -338,7 +376,7 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
 
         self.assertFalse(resync_needed)
         agent.remove_port_binding.assert_called_with('net123', 'port123')
-        self.assertFalse(agent.plugin_rpc.update_device_up.called)
+        self.assertFalse(agent.plugin_rpc.update_device_list.called)
 
 
 class TestLinuxBridgeManager(base.BaseTestCase):
@@ -24,6 +24,7 @@ from neutron.extensions import providernet as pnet
 from neutron import manager
 from neutron.openstack.common import timeutils
 from neutron.plugins.ml2 import config as config
+from neutron.plugins.ml2.drivers.l2pop import rpc as l2pop_rpc
 from neutron.plugins.ml2 import managers
 from neutron.plugins.ml2 import rpc
 from neutron.tests.unit import test_db_plugin as test_plugin
@@ -202,6 +203,48 @@ class TestL2PopulationRpcTestCase(test_plugin.NeutronDbPluginV2TestCase):
                     self.mock_fanout.assert_called_with(
                         mock.ANY, expected, topic=self.fanout_topic)
 
+    def test_fdb_add_coalesced_for_device_list(self):
+        self._register_ml2_agents()
+
+        with self.subnet(network=self._network) as subnet:
+            host_arg = {portbindings.HOST_ID: HOST}
+            with self.port(subnet=subnet,
+                           device_owner=DEVICE_OWNER_COMPUTE,
+                           arg_list=(portbindings.HOST_ID,),
+                           **host_arg) as port1:
+                with self.port(subnet=subnet,
+                               device_owner=DEVICE_OWNER_COMPUTE,
+                               arg_list=(portbindings.HOST_ID,),
+                               **host_arg) as port2:
+                    p1 = port1['port']
+                    p2 = port2['port']
+
+                    self.mock_fanout.reset_mock()
+                    res = self.callbacks.update_device_list(
+                        self.adminContext, agent_id=HOST, host=HOST,
+                        devices_up=['tap' + p1['id'], 'tap' + p2['id']],
+                        devices_down=[])
+                    self.assertEqual(2, len(res['devices_up']))
+
+                    p1_ips = [p['ip_address'] for p in p1['fixed_ips']]
+                    p2_ips = [p['ip_address'] for p in p2['fixed_ips']]
+                    expected = {'args':
+                                {'fdb_entries':
+                                 {p1['network_id']:
+                                  {'ports':
+                                   {'20.0.0.1': [constants.FLOODING_ENTRY,
+                                                 [p1['mac_address'],
+                                                  p1_ips[0]],
+                                                 [p2['mac_address'],
+                                                  p2_ips[0]]]},
+                                   'network_type': 'vxlan',
+                                   'segment_id': 1}}},
+                                'namespace': None,
+                                'method': 'add_fdb_entries'}
+
+                    self.mock_fanout.assert_called_once_with(
+                        mock.ANY, expected, topic=self.fanout_topic)
+
     def test_fdb_add_not_called_type_local(self):
         self._register_ml2_agents()
 
@@ -794,3 +837,19 @@ class TestL2PopulationRpcTestCase(test_plugin.NeutronDbPluginV2TestCase):
 
                     self.mock_fanout.assert_called_with(
                         mock.ANY, expected, topic=self.fanout_topic)
+
+    def test_coalesced_fanouts_are_sent_despite_failures(self):
+        notifier = l2pop_rpc.L2populationAgentNotifyAPI()
+        fdb_entries = {'net1': {'ports': {'20.0.0.1': []}},
+                       'net2': {'ports': {'20.0.0.2': []}}}
+        with mock.patch.object(notifier, 'fanout_cast',
+                               side_effect=[Exception(), None]) as cast:
+            with l2pop_rpc.coalesce_fanout_notifications():
+                notifier.add_fdb_entries(self.adminContext, fdb_entries)
+        # Each network is notified by its own fanout
+        notified = [c[0][1]['args']['fdb_entries'].keys()
+                    for c in cast.call_args_list]
+        self.assertEqual(set(['net1', 'net2']),
+                         set(network_id for network_ids in notified
+                             for network_id in network_ids))
+        self.assertEqual(2, len(notified))
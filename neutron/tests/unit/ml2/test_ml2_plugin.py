@@ -132,6 +132,56 @@ class TestMl2PortsV2(test_plugin.TestPortsV2, Ml2PluginV2TestCase):
             self.assertEqual('DOWN', port['port']['status'])
             self.assertEqual('DOWN', self.port_create_status)
 
+    def _test_create_ports_bulk_plugin_failure(self):
+        # The native bulk creation does not call create_port, the fault is
+        # injected in the processing of each port
+        plugin = manager.NeutronManager.get_plugin()
+        orig = plugin._process_port_create
+        with mock.patch.object(plugin,
+                               '_process_port_create') as patched_plugin:
+
+            def side_effect(*args, **kwargs):
+                return self._fail_second_call(patched_plugin, orig,
+                                              *args, **kwargs)
+
+            patched_plugin.side_effect = side_effect
+            with self.network() as net:
+                res = self._create_port_bulk(self.fmt, 2,
+                                             net['network']['id'],
+                                             'test', True)
+                # We expect a 500 as we injected a fault in the plugin
+                self._validate_behavior_on_bulk_failure(
+                    res, 'ports', webob.exc.HTTPServerError.code)
+
+    def test_create_ports_bulk_emulated_plugin_failure(self):
+        self._test_create_ports_bulk_plugin_failure()
+
+    def test_create_ports_bulk_native_plugin_failure(self):
+        self._test_create_ports_bulk_plugin_failure()
+
+    def test_create_ports_bulk_calls_mechanism_drivers_per_port(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with contextlib.nested(
+            mock.patch.object(plugin, 'create_port'),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_port_precommit'),
+            mock.patch.object(plugin.mechanism_manager,
+                              'create_port_postcommit')
+        ) as (create_port, precommit, postcommit):
+            with self.subnet() as subnet:
+                res = self._create_port_bulk(self.fmt, 3,
+                                             subnet['subnet']['network_id'],
+                                             'test', True)
+                ports = self.deserialize(self.fmt, res)['ports']
+                self.assertEqual(3, len(ports))
+                for port in ports:
+                    self.assertEqual('DOWN', port['status'])
+                    self.assertEqual(1, len(port['fixed_ips']))
+                    self._delete('ports', port['id'])
+        self.assertFalse(create_port.called)
+        self.assertEqual(3, precommit.call_count)
+        self.assertEqual(3, postcommit.call_count)
+
     def test_update_non_existent_port(self):
         ctx = context.get_admin_context()
         plugin = manager.NeutronManager.get_plugin()
@@ -13,9 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import mock
+from sqlalchemy import event
 
+from neutron.common import constants
 from neutron import context
+from neutron.db import api as db_api
 from neutron.extensions import portbindings
 from neutron import manager
 from neutron.plugins.ml2 import config as config
@@ -98,6 +103,97 @@ class PortBindingTestCase(test_plugin.NeutronDbPluginV2TestCase):
                                 portbindings.VIF_TYPE_OVS,
                                 True, True, 'ACTIVE')
 
+    def test_get_devices_details_list(self):
+        host_arg = {portbindings.HOST_ID: 'host-ovs-no_filter'}
+        with self.subnet() as subnet:
+            with contextlib.nested(
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg)
+            ) as (port1, port2):
+                # Devices only hold a prefix of the port ids
+                devices = [port1['port']['id'][:11], port2['port']['id'][:11],
+                           'fake_device']
+                neutron_context = context.get_admin_context()
+                callbacks = self.plugin.endpoints[0]
+                expected = [callbacks.get_device_details(
+                    neutron_context, agent_id="theAgentId", device=device)
+                    for device in devices]
+                details = callbacks.get_devices_details_list(
+                    neutron_context, agent_id="theAgentId", devices=devices)
+                self.assertEqual(expected, details)
+                self.assertEqual(port1['port']['mac_address'],
+                                 details[0]['mac_address'])
+                self.assertEqual('local', details[1]['network_type'])
+                self.assertEqual({'device': 'fake_device'}, details[2])
+
+    def test_get_devices_details_list_updates_statuses_at_once(self):
+        host_arg = {portbindings.HOST_ID: 'host-ovs-no_filter'}
+        with self.subnet() as subnet:
+            with contextlib.nested(
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg)
+            ) as (port1, port2):
+                # Full port ids and prefixes may be mixed
+                port_ids = [port1['port']['id'], port2['port']['id']]
+                devices = [port_ids[0], port_ids[1][:11]]
+                neutron_context = context.get_admin_context()
+                callbacks = self.plugin.endpoints[0]
+                with contextlib.nested(
+                    mock.patch.object(self.plugin, 'update_port_status'),
+                    mock.patch.object(self.plugin.mechanism_manager,
+                                      'update_port_postcommit')
+                ) as (update_port_status, update_port_postcommit):
+                    details = callbacks.get_devices_details_list(
+                        neutron_context, agent_id="theAgentId",
+                        devices=devices)
+                self.assertEqual(devices, [d['port_id'] for d in details])
+                self.assertFalse(update_port_status.called)
+                self.assertEqual(2, update_port_postcommit.call_count)
+                for port_id in port_ids:
+                    port = self.plugin.get_port(neutron_context, port_id)
+                    self.assertEqual(constants.PORT_STATUS_BUILD,
+                                     port['status'])
+
+    def _update_ports_status_with_query_count(self, ports, status):
+        statements = []
+
+        def _count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', _count_statement)
+        try:
+            self.plugin.update_ports_status(
+                context.get_admin_context(),
+                dict((port['port']['id'], status) for port in ports))
+        finally:
+            event.remove(engine, 'before_cursor_execute', _count_statement)
+        # Ports are updated one by one so that the nova notifier sees
+        # their status changes, the other statements must not grow
+        updates = [statement for statement in statements
+                   if statement.startswith('UPDATE ports ')]
+        self.assertEqual(len(ports), len(updates))
+        return len(statements) - len(updates)
+
+    def test_update_ports_status_query_count_is_constant(self):
+        with self.subnet() as subnet:
+            ports = [self._make_port(self.fmt, subnet['subnet']['network_id'])
+                     for i in range(4)]
+            query_count = self._update_ports_status_with_query_count(
+                ports[:1], constants.PORT_STATUS_ACTIVE)
+            more_query_count = self._update_ports_status_with_query_count(
+                ports[1:], constants.PORT_STATUS_ACTIVE)
+            self.assertEqual(query_count, more_query_count)
+            for port in ports:
+                port = self.plugin.get_port(context.get_admin_context(),
+                                            port['port']['id'])
+                self.assertEqual(constants.PORT_STATUS_ACTIVE,
+                                 port['status'])
+
     def _test_update_port_binding(self, host, new_host=None):
         with mock.patch.object(self.plugin,
                                '_notify_port_updated') as notify_mock:
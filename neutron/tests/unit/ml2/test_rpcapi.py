@@ -112,24 +112,49 @@ class RpcCallbacksTestCase(base.BaseTestCase):
                                  not self.plugin.update_port_status.called)
 
     def test_get_devices_details_list(self):
-        devices = [1, 2, 3, 4, 5]
+        devices = ['tap1', 'tap2', 'tap3']
         kwargs = {'host': 'fake_host', 'agent_id': 'fake_agent_id'}
-        with mock.patch.object(self.callbacks, 'get_device_details',
-                               side_effect=devices) as f:
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        contexts = {'1': None, '2': mock.Mock(), '3': mock.Mock()}
+        self.plugin.get_bound_ports_contexts.return_value = contexts
+        with mock.patch.object(self.callbacks, '_get_device_details',
+                               side_effect=['r1', 'r2', 'r3']) as f:
             res = self.callbacks.get_devices_details_list('fake_context',
                                                           devices=devices,
                                                           **kwargs)
-            self.assertEqual(devices, res)
-            self.assertEqual(len(devices), f.call_count)
-            calls = [mock.call('fake_context', device=i, **kwargs)
-                     for i in devices]
-            f.assert_has_calls(calls)
+        self.assertEqual(['r1', 'r2', 'r3'], res)
+        self.plugin.get_bound_ports_contexts.assert_called_once_with(
+            'fake_context', ['1', '2', '3'], 'fake_host')
+        self.assertFalse(self.plugin.get_bound_port_context.called)
+        f.assert_has_calls([
+            mock.call('fake_context', self.plugin, 'tap%s' % i, i,
+                      contexts[i], 'fake_agent_id', 'fake_host', {})
+            for i in ('1', '2', '3')])
+        self.plugin.update_ports_status.assert_called_once_with(
+            'fake_context', {}, 'fake_host')
+
+    def test_get_devices_details_list_updates_statuses_at_once(self):
+        contexts = {}
+        for i, status in (('1', constants.PORT_STATUS_DOWN),
+                          ('2', constants.PORT_STATUS_BUILD)):
+            port = collections.defaultdict(lambda: 'fake')
+            port.update({'id': i + '-full', 'admin_state_up': True,
+                         'status': status})
+            segment = collections.defaultdict(lambda: 'fake', id='fake')
+            contexts[i] = mock.Mock(current=port, bound_segment=segment)
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        self.plugin.get_bound_ports_contexts.return_value = contexts
+        self.callbacks.get_devices_details_list(
+            'fake_context', devices=['tap1', 'tap2'], host='fake_host')
+        self.assertFalse(self.plugin.update_port_status.called)
+        self.plugin.update_ports_status.assert_called_once_with(
+            'fake_context', {'1-full': constants.PORT_STATUS_BUILD},
+            'fake_host')
 
     def test_get_devices_details_list_with_empty_devices(self):
-        with mock.patch.object(self.callbacks, 'get_device_details') as f:
-            res = self.callbacks.get_devices_details_list('fake_context')
-            self.assertFalse(f.called)
-            self.assertEqual([], res)
+        res = self.callbacks.get_devices_details_list('fake_context')
+        self.assertFalse(self.plugin.get_bound_ports_contexts.called)
+        self.assertEqual([], res)
 
     def _test_update_device_not_bound_to_host(self, func):
         self.plugin.port_bound_to_host.return_value = False
@@ -162,6 +187,35 @@ class RpcCallbacksTestCase(base.BaseTestCase):
             'fake_context', 'fake_port_id', constants.PORT_STATUS_DOWN,
             'fake_host')
 
+    def test_update_device_list(self):
+        self.l3plugin.supported_extension_aliases = ['router']
+        self.plugin._device_to_port_id.side_effect = lambda device: device
+        self.plugin.port_bound_to_host.return_value = True
+
+        def update_port_status(context, port_id, status, host):
+            if port_id == 'fail_device':
+                raise Exception()
+            return port_id
+        self.plugin.update_port_status.side_effect = update_port_status
+        with mock.patch.object(plugin_rpc.l2pop_rpc,
+                               'coalesce_fanout_notifications') as coalesce:
+            res = self.callbacks.update_device_list(
+                'fake_context', devices_up=['dev1', 'fail_device'],
+                devices_down=['dev2'], agent_id='fake_agent_id',
+                host='fake_host')
+        self.assertEqual({'devices_up': ['dev1'],
+                          'failed_devices_up': ['fail_device'],
+                          'devices_down': ['dev2'],
+                          'failed_devices_down': []}, res)
+        self.plugin.update_port_status.assert_has_calls([
+            mock.call('fake_context', 'dev1', constants.PORT_STATUS_ACTIVE,
+                      'fake_host'),
+            mock.call('fake_context', 'fail_device',
+                      constants.PORT_STATUS_ACTIVE, 'fake_host'),
+            mock.call('fake_context', 'dev2', constants.PORT_STATUS_DOWN,
+                      'fake_host')])
+        coalesce.assert_called_once_with()
+
 
 class RpcApiTestCase(base.BaseTestCase):
 
@@ -243,6 +297,15 @@ class RpcApiTestCase(base.BaseTestCase):
                            agent_id='fake_agent_id',
                            host='fake_host')
 
+    def test_update_device_list(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_rpc_api(rpcapi, None,
+                           'update_device_list', rpc_method='call',
+                           devices_up=['fake_device1'],
+                           devices_down=['fake_device2'],
+                           agent_id='fake_agent_id', host='fake_host',
+                           version='1.4')
+
     def test_tunnel_sync(self):
         rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
         self._test_rpc_api(rpcapi, None,
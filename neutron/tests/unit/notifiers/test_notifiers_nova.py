@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 
 import mock
 from novaclient import exceptions as nova_exceptions
@@ -224,13 +225,15 @@ class TestNovaNotify(base.BaseTestCase):
         with mock.patch.object(
             self.nova_notifier.nclient.server_external_events,
                 'create') as nclient_create:
-            nclient_create.side_effect = nova_exceptions.NotFound
+            nclient_create.side_effect = nova_exceptions.NotFound(404)
             self.nova_notifier.send_events()
 
     def test_nova_send_events_raises(self):
-        with mock.patch.object(
-            self.nova_notifier.nclient.server_external_events,
-                'create') as nclient_create:
+        with contextlib.nested(
+            mock.patch.object(
+                self.nova_notifier.nclient.server_external_events, 'create'),
+            mock.patch('eventlet.sleep')
+        ) as (nclient_create, sleep):
             nclient_create.side_effect = Exception
             self.nova_notifier.send_events()
 
@@ -296,10 +299,128 @@ class TestNovaNotify(base.BaseTestCase):
             self.assertEqual(1, spawn_n.call_count)
 
     def test_queue_event_call_send_events(self):
-        with mock.patch.object(self.nova_notifier,
-                               'send_events') as send_events:
+        def send_events():
+            del self.nova_notifier.pending_events[:]
+
+        with mock.patch.object(self.nova_notifier, 'send_events',
+                               side_effect=send_events) as send_events:
             with mock.patch('eventlet.spawn_n') as spawn_n:
                 spawn_n.side_effect = lambda func: func()
                 self.nova_notifier.queue_event(mock.Mock())
                 self.assertFalse(self.nova_notifier._waiting_to_send)
                 send_events.assert_called_once_with()
+
+    def test_events_queued_during_retries_are_sent_after_them(self):
+        old_event = self._event(nova.VIF_PLUGGED, 'vm1', 'port1', 'failed')
+        new_event = self._event(nova.VIF_PLUGGED, 'vm1', 'port1',
+                                'completed')
+
+        def create(events):
+            if nclient_create.call_count == 1:
+                # An event is queued while the first batch is retried
+                self.nova_notifier.queue_event(new_event)
+                raise Exception()
+            return []
+
+        with contextlib.nested(
+            mock.patch.object(
+                self.nova_notifier.nclient.server_external_events, 'create',
+                side_effect=create),
+            mock.patch('eventlet.spawn_n'),
+            mock.patch('eventlet.sleep')
+        ) as (nclient_create, spawn_n, sleep):
+            self.nova_notifier.queue_event(old_event)
+            spawn_n.call_args[0][0]()
+        # No other sender was started, the new event is sent last
+        self.assertEqual(1, spawn_n.call_count)
+        self.assertEqual([mock.call([old_event]), mock.call([old_event]),
+                          mock.call([new_event])],
+                         nclient_create.call_args_list)
+        self.assertFalse(self.nova_notifier._waiting_to_send)
+
+    def _event(self, name, server_uuid, tag=None, status=None):
+        event = {'name': name, 'server_uuid': server_uuid}
+        if tag:
+            event['tag'] = tag
+        if status:
+            event['status'] = status
+        return event
+
+    def test_send_events_coalesces_duplicate_events(self):
+        events = [self._event('network-changed', 'vm1'),
+                  self._event(nova.VIF_PLUGGED, 'vm1', 'port1', 'failed'),
+                  self._event('network-changed', 'vm2'),
+                  self._event('network-changed', 'vm1'),
+                  self._event(nova.VIF_PLUGGED, 'vm1', 'port1', 'completed'),
+                  self._event(nova.VIF_PLUGGED, 'vm1', 'port2', 'completed')]
+        with mock.patch.object(
+            self.nova_notifier.nclient.server_external_events,
+                'create') as nclient_create:
+            nclient_create.return_value = []
+            for event in events:
+                self.nova_notifier.queue_event(event)
+            self.nova_notifier.send_events()
+        nclient_create.assert_called_once_with(
+            [events[2], events[3], events[4], events[5]])
+        self.assertEqual({'queued': 6, 'sent': 4, 'dropped': 2},
+                         self.nova_notifier.counters)
+
+    def test_send_events_in_batches(self):
+        cfg.CONF.set_override('send_events_batch_size', 2)
+        events = [self._event('network-changed', 'vm%d' % i)
+                  for i in range(5)]
+        self.nova_notifier.pending_events.extend(events)
+        with mock.patch.object(
+            self.nova_notifier.nclient.server_external_events,
+                'create') as nclient_create:
+            nclient_create.return_value = []
+            self.nova_notifier.send_events()
+        self.assertEqual([mock.call(events[0:2]), mock.call(events[2:4]),
+                          mock.call(events[4:])],
+                         nclient_create.call_args_list)
+        self.assertEqual(5, self.nova_notifier.counters['sent'])
+
+    def test_send_events_retries_with_backoff(self):
+        cfg.CONF.set_override('send_events_interval', 1)
+        event = self._event('network-changed', 'vm1')
+        self.nova_notifier.pending_events.append(event)
+        with contextlib.nested(
+            mock.patch.object(
+                self.nova_notifier.nclient.server_external_events, 'create'),
+            mock.patch('eventlet.sleep')
+        ) as (nclient_create, sleep):
+            nclient_create.side_effect = [Exception, Exception, []]
+            self.nova_notifier.send_events()
+        self.assertEqual(3, nclient_create.call_count)
+        self.assertEqual([mock.call(1), mock.call(2)], sleep.call_args_list)
+        self.assertEqual(1, self.nova_notifier.counters['sent'])
+        self.assertEqual(0, self.nova_notifier.counters['dropped'])
+
+    def test_send_events_drops_events_after_retries(self):
+        cfg.CONF.set_override('send_events_batch_size', 1)
+        cfg.CONF.set_override('send_events_retries', 2)
+        self.nova_notifier.pending_events.extend(
+            [self._event('network-changed', 'vm1'),
+             self._event('network-changed', 'vm2')])
+        with contextlib.nested(
+            mock.patch.object(
+                self.nova_notifier.nclient.server_external_events, 'create'),
+            mock.patch('eventlet.sleep')
+        ) as (nclient_create, sleep):
+            nclient_create.side_effect = Exception
+            self.nova_notifier.send_events()
+        # The second batch is not tried once nova failed to answer
+        self.assertEqual(3, nclient_create.call_count)
+        self.assertEqual(0, self.nova_notifier.counters['sent'])
+        self.assertEqual(2, self.nova_notifier.counters['dropped'])
+
+    def test_send_events_not_found_is_not_retried(self):
+        self.nova_notifier.pending_events.append(
+            self._event('network-changed', 'vm1'))
+        with mock.patch.object(
+            self.nova_notifier.nclient.server_external_events,
+                'create') as nclient_create:
+            nclient_create.side_effect = nova_exceptions.NotFound(404)
+            self.nova_notifier.send_events()
+        self.assertEqual(1, nclient_create.call_count)
+        self.assertEqual(1, self.nova_notifier.counters['dropped'])
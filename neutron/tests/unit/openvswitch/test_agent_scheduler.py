@@ -867,6 +867,22 @@ class OvsAgentSchedulerTestCase(OvsAgentSchedulerTestCaseBase):
             self.assertIn(router_ids[0], [r['id'] for r in ret_a])
             self.assertIn(router_ids[2], [r['id'] for r in ret_a])
 
+    def test_rpc_get_router_ids(self):
+        l3_rpc_cb = l3_rpc.L3RpcCallback()
+        self._register_agent_states()
+        self.assertEqual([], l3_rpc_cb.get_router_ids(self.adminContext,
+                                                      host=L3_HOSTA))
+
+        with contextlib.nested(self.router(),
+                               self.router()) as routers:
+            router_ids = [r['router']['id'] for r in routers]
+            ret_a = l3_rpc_cb.get_router_ids(self.adminContext,
+                                             host=L3_HOSTA)
+            self.assertEqual(set(router_ids), set(ret_a))
+            ret_b = l3_rpc_cb.get_router_ids(self.adminContext,
+                                             host=L3_HOSTB)
+            self.assertEqual([], ret_b)
+
     def test_router_auto_schedule_for_specified_routers(self):
 
         def _sync_router_with_ids(router_ids, exp_synced, exp_hosted, host_id):
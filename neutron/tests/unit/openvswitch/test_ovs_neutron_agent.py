@@ -15,6 +15,7 @@
 import contextlib
 import sys
 
+import eventlet
 import mock
 import netaddr
 from oslo.config import cfg
@@ -23,6 +24,8 @@ import testtools
 from neutron.agent.linux import async_process
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
+from neutron.agent.linux import polling
 from neutron.agent.linux import utils
 from neutron.common import constants as n_const
 from neutron.openstack.common import log
@@ -40,6 +43,11 @@ FAKE_IP1 = '10.0.0.1'
 FAKE_IP2 = '10.0.0.2'
 
 
+def _update_device_list(context, devices_up, devices_down, agent_id, host):
+    return {'devices_up': devices_up, 'failed_devices_up': [],
+            'devices_down': devices_down, 'failed_devices_down': []}
+
+
 class CreateAgentConfigMap(base.BaseTestCase):
 
     def test_create_agent_config_map_succeeds(self):
@@ -369,8 +377,8 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
             mock.patch.object(self.agent.dvr_agent.int_br, 'delete_flows'),
             mock.patch.object(self.agent.dvr_agent.tun_br,
                               'delete_flows')) as (reclaim_vlan_fn,
@@ -424,8 +432,8 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
             mock.patch.object(self.agent.dvr_agent.int_br,
                               'delete_flows')) as (reclaim_vlan_fn,
                                                    update_dev_down_fn,
@@ -481,8 +489,8 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
             mock.patch.object(self.agent.dvr_agent.int_br,
                               'delete_flows')) as (reclaim_vlan_fn,
                                                    update_dev_down_fn,
@@ -540,6 +548,36 @@ class TestOvsNeutronAgent(base.BaseTestCase):
     def test_port_dead_with_port_already_dead(self):
         self._test_port_dead(ovs_neutron_agent.DEAD_VLAN_TAG)
 
+    def test_port_tags_are_set_by_one_transaction(self):
+        bound_port = mock.Mock(port_name='tap1', ofport=1)
+        dead_port = mock.Mock(port_name='tap2', ofport=2)
+        unchanged_port = mock.Mock(port_name='tap3', ofport=3)
+        self.agent._port_tag_batch = {}
+        self.agent._update_port_tag(bound_port, '1')
+        self.agent._update_port_tag(dead_port,
+                                    ovs_neutron_agent.DEAD_VLAN_TAG)
+        self.agent._update_port_tag(unchanged_port, '2')
+        port_tags, self.agent._port_tag_batch = (
+            self.agent._port_tag_batch, None)
+        with contextlib.nested(
+            mock.patch.object(self.agent.int_br, 'get_port_tag_dict',
+                              return_value={'tap1': [], 'tap2': 1,
+                                            'tap3': 2}),
+            mock.patch.object(self.agent.int_br, 'run_vsctl'),
+            mock.patch.object(self.agent.int_br, 'db_get_val'),
+            mock.patch.object(self.agent.int_br, 'do_action_flows')
+        ) as (get_port_tag_dict, run_vsctl, db_get_val, do_action_flows):
+            self.agent._apply_port_tags(port_tags)
+        self.assertFalse(db_get_val.called)
+        run_vsctl.assert_called_once_with(
+            ['--', 'set', 'Port', 'tap1', 'tag=1',
+             '--', 'set', 'Port', 'tap2',
+             'tag=%s' % ovs_neutron_agent.DEAD_VLAN_TAG], check_error=True)
+        do_action_flows.assert_has_calls(
+            [mock.call('add', [{'priority': 2, 'in_port': 2,
+                                'actions': 'drop'}]),
+             mock.call('del', [{'in_port': 1}])])
+
     def mock_scan_ports(self, vif_port_set=None, registered_ports=None,
                         updated_ports=None, port_tags_dict=None):
         if port_tags_dict is None:  # Because empty dicts evaluate as False.
@@ -621,6 +659,113 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                 vif_port_set, registered_ports, port_tags_dict=port_tags_dict)
         self.assertEqual(expected, actual)
 
+    def _iface_row(self, name, port_id, ofport=1):
+        return {'name': name, 'ofport': ofport,
+                'external_ids': {'iface-id': port_id,
+                                 'attached-mac': 'fa:16:3e:00:00:01'}}
+
+    def mock_scan_ports_from_events(self, events, registered_ports,
+                                    updated_ports=None, int_br_ports=None,
+                                    vif_ports=None):
+        vif_ports = vif_ports or {}
+        with contextlib.nested(
+            mock.patch.object(self.agent.int_br, 'get_port_name_list',
+                              return_value=int_br_ports or []),
+            mock.patch.object(self.agent.int_br, 'get_port_tag_dict',
+                              return_value={}),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
+                              side_effect=vif_ports.get),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_set')
+        ) as (get_port_name_list, get_port_tag_dict, get_vif_port_by_id,
+              get_vif_port_set):
+            port_info = self.agent.scan_ports_from_events(
+                registered_ports, events, updated_ports)
+        self.assertFalse(get_vif_port_set.called)
+        return port_info, get_port_name_list
+
+    def test_scan_ports_from_events_returns_port_changes(self):
+        events = [
+            (ovsdb_client.ROW_UPDATED, self._iface_row('tap3', 'port3')),
+            (ovsdb_client.ROW_DELETED, self._iface_row('tap2', 'port2')),
+            # not yet ready
+            (ovsdb_client.ROW_UPDATED, self._iface_row('tap4', 'port4', [])),
+            # not on the integration bridge
+            (ovsdb_client.ROW_UPDATED, self._iface_row('qg-5', 'port5'))]
+        port_info, _get_port_name_list = self.mock_scan_ports_from_events(
+            events, set(['port1', 'port2']), set(['port1', 'port2']),
+            int_br_ports=['tap1', 'tap3', 'tap4'])
+        self.assertEqual({'current': set(['port1', 'port3']),
+                          'added': set(['port3']),
+                          'removed': set(['port2']),
+                          'updated': set(['port1'])}, port_info)
+        self.assertEqual(2, self.agent.int_br_device_count)
+
+    def test_scan_ports_from_events_keeps_port_with_new_interface(self):
+        # The new interface of port1 was plugged before the old one was
+        # deleted, in the same polling interval or in a previous one
+        vif_port = ovs_lib.VifPort('tap1-new', 2, 'port1', 'mac', None)
+        for events in ([(ovsdb_client.ROW_UPDATED,
+                         self._iface_row('tap1-new', 'port1', 2)),
+                        (ovsdb_client.ROW_DELETED,
+                         self._iface_row('tap1', 'port1'))],
+                       [(ovsdb_client.ROW_DELETED,
+                         self._iface_row('tap1', 'port1'))]):
+            port_info, _get_port_name_list = (
+                self.mock_scan_ports_from_events(
+                    events, set(['port1']), int_br_ports=['tap1-new'],
+                    vif_ports={'port1': vif_port}))
+            self.assertEqual({'current': set(['port1']),
+                              'updated': set(['port1'])}, port_info)
+
+    def test_scan_ports_from_events_removes_failed_port(self):
+        events = [(ovsdb_client.ROW_UPDATED,
+                   self._iface_row('tap1', 'port1', -1))]
+        port_info, _get_port_name_list = self.mock_scan_ports_from_events(
+            events, set(['port1']), int_br_ports=['tap1'])
+        self.assertEqual({'current': set(),
+                          'added': set(),
+                          'removed': set(['port1'])}, port_info)
+
+    def test_scan_ports_from_events_without_events(self):
+        port_info, get_port_name_list = self.mock_scan_ports_from_events(
+            [], set(['port1']))
+        self.assertEqual({'current': set(['port1'])}, port_info)
+        self.assertFalse(get_port_name_list.called)
+
+    def _test_get_interface_events(self, full_scan_required=False,
+                                   last_full_scan=100, interval=300,
+                                   events=None):
+        self.agent.port_full_scan_interval = interval
+        self.agent._last_full_scan = last_full_scan
+        polling_manager = mock.Mock()
+        polling_manager.get_events.return_value = events
+        with mock.patch('time.time', return_value=200):
+            result = self.agent._get_interface_events(polling_manager,
+                                                      full_scan_required)
+        polling_manager.get_events.assert_called_once_with()
+        return result
+
+    def test_get_interface_events(self):
+        self.assertEqual([], self._test_get_interface_events(events=[]))
+        self.assertEqual(100, self.agent._last_full_scan)
+
+    def test_get_interface_events_full_scan_required(self):
+        self.assertIsNone(self._test_get_interface_events(
+            full_scan_required=True, events=[]))
+        self.assertEqual(200, self.agent._last_full_scan)
+
+    def test_get_interface_events_unknown_changes(self):
+        self.assertIsNone(self._test_get_interface_events())
+        self.assertEqual(200, self.agent._last_full_scan)
+
+    def test_get_interface_events_full_scan_interval_elapsed(self):
+        self.assertIsNone(self._test_get_interface_events(
+            interval=100, events=[]))
+
+    def test_get_interface_events_disabled(self):
+        self.assertIsNone(self._test_get_interface_events(
+            interval=0, events=[]))
+
     def test_treat_devices_added_returns_raises_for_missing_device(self):
         with contextlib.nested(
             mock.patch.object(self.agent.plugin_rpc,
@@ -646,10 +791,10 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[details]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=port),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
             mock.patch.object(self.agent, func_name)
-        ) as (get_dev_fn, get_vif_func, upd_dev_up, upd_dev_down, func):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, func):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should not raise
             self.assertFalse(skip_devs)
@@ -690,18 +835,15 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[dev_mock]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=None),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list'),
             mock.patch.object(self.agent, 'treat_vif_port')
-        ) as (get_dev_fn, get_vif_func, upd_dev_up,
-              upd_dev_down, treat_vif_port):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should return False for resync and no device
             # processed
             self.assertEqual(['the_skipped_one'], skip_devs)
             self.assertFalse(treat_vif_port.called)
-            self.assertFalse(upd_dev_down.called)
-            self.assertFalse(upd_dev_up.called)
+            self.assertFalse(upd_dev_list.called)
 
     def test_treat_devices_added_updated_put_port_down(self):
         fake_details_dict = {'admin_state_up': False,
@@ -722,35 +864,152 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[fake_details_dict]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=mock.MagicMock()),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
             mock.patch.object(self.agent, 'treat_vif_port')
-        ) as (get_dev_fn, get_vif_func, upd_dev_up,
-              upd_dev_down, treat_vif_port):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should return False for resync
             self.assertFalse(skip_devs)
             self.assertTrue(treat_vif_port.called)
-            self.assertTrue(upd_dev_down.called)
+            upd_dev_list.assert_called_once_with(
+                self.agent.context, [], ['xxx'], self.agent.agent_id,
+                cfg.CONF.host)
+
+    def test_treat_devices_added_updated_batches_status_updates(self):
+        details = [{'admin_state_up': True, 'port_id': dev, 'device': dev,
+                    'network_id': net, 'physical_network': 'foo',
+                    'segmentation_id': 'bar', 'network_type': 'baz',
+                    'fixed_ips': [], 'device_owner': 'compute:None'}
+                   for dev, net in (('d1', 'n1'), ('d2', 'n2'),
+                                    ('d3', 'n1'), ('d4', 'n1'))]
+
+        def update_device_list(context, devices_up, devices_down, agent_id,
+                               host):
+            return {'devices_up': devices_up[1:],
+                    'failed_devices_up': devices_up[:1],
+                    'devices_down': devices_down, 'failed_devices_down': []}
+
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=details),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
+                              side_effect=lambda dev: (None if dev == 'd4'
+                                                       else mock.Mock())),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=update_device_list),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
+            skip_devs = self.agent.treat_devices_added_or_updated(
+                ['d1', 'd2', 'd3', 'd4'], False)
+        # d4 is not on the bridge, d1 status update failed and is retried
+        self.assertEqual(['d4'], skip_devs)
+        self.assertEqual(set(['d1']), self.agent.devices_to_retry)
+        self.assertEqual(1, upd_dev_list.call_count)
+        self.assertEqual(set(['d1', 'd2', 'd3']),
+                         set(upd_dev_list.call_args[0][1]))
+        # Devices of a same network are processed in order
+        port_ids = [c[0][1] for c in treat_vif_port.call_args_list]
+        self.assertLess(port_ids.index('d1'), port_ids.index('d3'))
+
+    def test_treat_devices_added_updated_clears_retried_devices(self):
+        self.agent.devices_to_retry = set(['d1', 'd2'])
+        details = [{'admin_state_up': True, 'port_id': 'd1', 'device': 'd1',
+                    'network_id': 'n1', 'physical_network': 'foo',
+                    'segmentation_id': 'bar', 'network_type': 'baz',
+                    'fixed_ips': [], 'device_owner': 'compute:None'}]
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=details),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'devices_up': ['d1'],
+                                            'failed_devices_up': [],
+                                            'devices_down': [],
+                                            'failed_devices_down': []}),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ):
+            self.agent.treat_devices_added_or_updated(['d1'], False)
+        self.assertEqual(set(['d2']), self.agent.devices_to_retry)
+
+    def test_add_devices_to_retry(self):
+        self.agent.devices_to_retry = set(['d1', 'd2'])
+        port_info = {'current': set(['d1', 'd3']), 'added': set(['d3'])}
+        self.agent._add_devices_to_retry(port_info)
+        self.assertEqual(set(['d1', 'd3']), port_info['added'])
+        # d2 left the bridge
+        self.assertEqual(set(['d1']), self.agent.devices_to_retry)
+        self.assertTrue(self.agent._agent_has_updates(mock.Mock(
+            is_polling_required=False)))
+
+    def test_treat_devices_added_updated_serializes_port_bound(self):
+        details = [{'admin_state_up': True, 'port_id': dev, 'device': dev,
+                    'network_id': net, 'physical_network': 'foo',
+                    'segmentation_id': 'bar', 'network_type': 'baz',
+                    'fixed_ips': [], 'device_owner': 'compute:None'}
+                   for dev, net in (('d1', 'n1'), ('d2', 'n2'))]
+        calls = []
+
+        def provision_local_vlan(net_uuid, network_type, physical_network,
+                                 segmentation_id):
+            calls.append(('start', net_uuid))
+            # Let the other devices be treated meanwhile
+            eventlet.sleep(0)
+            self.agent.local_vlan_map[net_uuid] = (
+                ovs_neutron_agent.LocalVLANMapping(1, network_type,
+                                                   physical_network,
+                                                   segmentation_id))
+            calls.append(('end', net_uuid))
+
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=details),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
+                              return_value=mock.Mock(ofport=1)),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': [],
+                                            'failed_devices_down': []}),
+            mock.patch.object(self.agent, 'provision_local_vlan',
+                              side_effect=provision_local_vlan),
+            mock.patch.object(self.agent.dvr_agent, 'bind_port_to_dvr'),
+            mock.patch.object(self.agent, '_apply_port_tags')
+        ):
+            self.agent.treat_devices_added_or_updated(['d1', 'd2'], False)
+        self.assertEqual(4, len(calls))
+        for start, end in (calls[:2], calls[2:]):
+            self.assertEqual(('start', 'end'), (start[0], end[0]))
+            self.assertEqual(start[1], end[1])
 
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
             self.assertTrue(self.agent.treat_devices_removed([{}]))
 
-    def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
-            with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
-        self.assertTrue(port_unbound.called)
+    def test_treat_devices_removed_returns_true_for_failed_device(self):
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'devices_down': ['dev1'],
+                                            'failed_devices_down': ['dev2']}),
+            mock.patch.object(self.agent, 'port_unbound')
+        ) as (upd_dev_list, port_unbound):
+            self.assertTrue(self.agent.treat_devices_removed(['dev1',
+                                                              'dev2']))
+        port_unbound.assert_called_once_with('dev1')
 
     def test_treat_devices_removed_unbinds_port(self):
-        self._mock_treat_devices_removed(True)
-
-    def test_treat_devices_removed_ignores_missing_port(self):
-        self._mock_treat_devices_removed(False)
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              side_effect=_update_device_list),
+            mock.patch.object(self.agent, 'port_unbound')
+        ) as (upd_dev_list, port_unbound):
+            self.assertFalse(self.agent.treat_devices_removed(['dev1']))
+        port_unbound.assert_called_once_with('dev1')
+        upd_dev_list.assert_called_once_with(
+            self.agent.context, [], ['dev1'], self.agent.agent_id,
+            cfg.CONF.host)
 
     def _test_process_network_ports(self, port_info):
         with contextlib.nested(
@@ -1403,6 +1662,53 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         setup_int_br.assert_has_calls([mock.call()])
         setup_phys_br.assert_has_calls([mock.call({})])
 
+    def test_rpc_loop_full_scan_after_skipped_devices(self):
+        class FakePollingManager(polling.BasePollingManager):
+            def _is_polling_required(self):
+                return False
+
+            def get_events(self):
+                return []
+
+        def process_network_ports(port_info, ovs_restarted):
+            if process_network_ports.called:
+                raise Exception('Fake exception to get out of the loop')
+            process_network_ports.called = True
+            # tap2 was not found on the server
+            port_info['current'].discard('tap2')
+            return False
+        process_network_ports.called = False
+
+        self.agent.port_full_scan_interval = 600
+        with contextlib.nested(
+            mock.patch.object(log.ContextAdapter, 'exception'),
+            mock.patch.object(self.agent, 'scan_ports'),
+            mock.patch.object(self.agent, 'scan_ports_from_events'),
+            mock.patch.object(self.agent, 'process_network_ports',
+                              side_effect=process_network_ports),
+            mock.patch.object(self.agent, 'check_ovs_restart',
+                              return_value=False)
+        ) as (log_exception, scan_ports, scan_ports_from_events,
+              process_network_ports_fn, check_ovs_restart):
+            log_exception.side_effect = Exception(
+                'Fake exception to get out of the loop')
+            scan_ports.side_effect = [
+                {'current': set(['tap1', 'tap2']),
+                 'added': set(['tap1', 'tap2']),
+                 'removed': set()},
+                {'current': set(['tap1', 'tap2']),
+                 'added': set(['tap2']),
+                 'removed': set()}]
+            # This will exit after the second loop
+            try:
+                self.agent.rpc_loop(FakePollingManager())
+            except Exception:
+                pass
+
+        # tap2 is looked for again by the next iteration
+        self.assertEqual(2, scan_ports.call_count)
+        self.assertFalse(scan_ports_from_events.called)
+
 
 class AncillaryBridgesTest(base.BaseTestCase):
 
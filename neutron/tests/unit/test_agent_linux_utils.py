@@ -14,8 +14,10 @@
 
 import fixtures
 import mock
+from oslo.config import cfg
 import testtools
 
+from neutron.agent.common import config
 from neutron.agent.linux import utils
 from neutron.tests import base
 
@@ -119,6 +121,59 @@ class AgentUtilsExecuteTest(base.BaseTestCase):
                 self.assertTrue(log.debug.called)
 
 
+class AgentUtilsExecuteRootwrapDaemonTest(base.BaseTestCase):
+    def setUp(self):
+        super(AgentUtilsExecuteRootwrapDaemonTest, self).setUp()
+        config.register_root_helper(cfg.CONF)
+        cfg.CONF.set_override('root_helper_daemon', 'sudo rootwrap-daemon',
+                              group='AGENT')
+        self.addCleanup(utils.RootwrapDaemonHelper.reset)
+        client_p = mock.patch.object(utils.client, 'Client')
+        self.client = client_p.start().return_value
+        self.create_process_p = mock.patch.object(utils, 'create_process')
+        self.create_process = self.create_process_p.start()
+
+    def test_execute_through_daemon(self):
+        self.client.execute.return_value = (0, 'out', '')
+        result = utils.execute(['ls'], root_helper='sudo',
+                               process_input='in')
+        self.assertEqual('out', result)
+        self.client.execute.assert_called_once_with(['ls'], env=None,
+                                                    stdin='in')
+        self.assertFalse(self.create_process.called)
+
+    def test_execute_through_daemon_with_addl_env(self):
+        self.client.execute.return_value = (0, '', '')
+        utils.execute(['ls'], root_helper='sudo', addl_env={'foo': 'bar'},
+                      process_input='in')
+        self.client.execute.assert_called_once_with(
+            ['ls'], env={'foo': 'bar'}, stdin='in')
+
+    def test_execute_through_daemon_raises_on_failure(self):
+        self.client.execute.return_value = (1, '', 'err')
+        self.assertRaises(RuntimeError, utils.execute, ['ls'],
+                          root_helper='sudo')
+        self.assertFalse(self.create_process.called)
+
+    def test_execute_without_root_helper_skips_daemon(self):
+        self.create_process.return_value = FakeCreateProcess(0), ['ls']
+        utils.execute(['ls'])
+        self.assertFalse(self.client.execute.called)
+
+    def test_execute_falls_back_when_daemon_fails(self):
+        self.client.execute.side_effect = EOFError
+        self.create_process.return_value = FakeCreateProcess(0), ['ls']
+        utils.execute(['ls'], root_helper='sudo')
+        self.create_process.assert_called_once_with(
+            ['ls'], root_helper='sudo', addl_env=None)
+
+    def test_execute_does_not_run_command_again_on_daemon_error(self):
+        self.client.execute.side_effect = ValueError
+        self.assertRaises(ValueError, utils.execute, ['ls'],
+                          root_helper='sudo')
+        self.assertFalse(self.create_process.called)
+
+
 class AgentUtilsGetInterfaceMAC(base.BaseTestCase):
     def test_get_interface_mac(self):
         expect_val = '01:02:03:04:05:06'
@@ -56,6 +56,32 @@ class AgentRPCPluginApi(base.BaseTestCase):
     def test_update_device_down(self):
         self._test_rpc_call('update_device_down')
 
+    def test_update_device_list(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        expect_val = {'devices_up': ['dev1'], 'failed_devices_up': [],
+                      'devices_down': ['dev2'], 'failed_devices_down': []}
+        with mock.patch('neutron.common.rpc.RpcProxy.call',
+                        return_value=expect_val) as rpc_call:
+            actual_val = agent.update_device_list(
+                ctxt, ['dev1'], ['dev2'], 'fake_agent_id', 'fake_host')
+        self.assertEqual(expect_val, actual_val)
+        self.assertEqual(1, rpc_call.call_count)
+        self.assertEqual('1.4', rpc_call.call_args[1]['version'])
+
+    def test_update_device_list_unsupported(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = context.RequestContext('fake_user', 'fake_project')
+        with mock.patch('neutron.common.rpc.RpcProxy.call') as rpc_call:
+            rpc_call.side_effect = [messaging.UnsupportedVersion('1.4'),
+                                    None, Exception(), None]
+            actual_val = agent.update_device_list(
+                ctxt, ['dev1', 'dev2'], ['dev3'], 'fake_agent_id')
+        self.assertEqual({'devices_up': ['dev1'],
+                          'failed_devices_up': ['dev2'],
+                          'devices_down': ['dev3'],
+                          'failed_devices_down': []}, actual_val)
+
     def test_tunnel_sync(self):
         self._test_rpc_call('tunnel_sync')
 
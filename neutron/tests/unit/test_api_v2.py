@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import os
 
 import mock
@@ -31,6 +32,7 @@ from neutron.api.v2 import router
 from neutron.common import exceptions as n_exc
 from neutron import context
 from neutron import manager
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import policy as common_policy
 from neutron.openstack.common import uuidutils
 from neutron import policy
@@ -494,6 +496,34 @@ class APIv2TestCase(APIv2TestBase):
                                                        'page_reverse'])
         instance.get_networks.assert_called_once_with(mock.ANY, **kwargs)
 
+    def _test_list_streamed(self, params, expected_calls):
+        cfg.CONF.set_override('list_batch_size', 2)
+        api = webtest.TestApp(router.APIRouter())
+        instance = self.plugin.return_value
+        nets = [{'id': _uuid(), 'tenant_id': _uuid()} for i in range(3)]
+        instance.get_networks.side_effect = [nets[:2], nets[2:]]
+        res = api.get(_get_path('networks', fmt='json'), params,
+                      extra_environ={'neutron.context':
+                                     context.get_admin_context()})
+        self.assertEqual(
+            [net['id'] for net in nets[:len(expected_calls) * 2]],
+            [net['id'] for net in jsonutils.loads(res.body)['networks']])
+        self.assertEqual(expected_calls,
+                         instance.get_networks.call_args_list)
+        return nets
+
+    def test_list_streamed(self):
+        kwargs = self._get_collection_kwargs(sorts=[('id', True)], limit=2)
+        nets = self._test_list_streamed({}, [mock.call(mock.ANY, **kwargs),
+                                             mock.call(mock.ANY, **kwargs)])
+        marker = self.plugin.return_value.get_networks.call_args[1]['marker']
+        self.assertEqual(nets[1]['id'], marker)
+
+    def test_list_not_streamed_when_paginated(self):
+        kwargs = self._get_collection_kwargs(limit=1)
+        self._test_list_streamed({'limit': 1},
+                                 [mock.call(mock.ANY, **kwargs)])
+
     def test_native_pagination_without_native_sorting(self):
         instance = self.plugin.return_value
         instance._NeutronPluginBaseV2__native_sorting_support = False
@@ -550,6 +580,18 @@ class JSONV2TestCase(APIv2TestBase, testlib_api.WebTestCase):
             # expect no results
             self.assertEqual(len(res['networks']), 0)
 
+    def test_list_prefetches_parent_resources(self):
+        instance = self.plugin.return_value
+        instance.get_networks.return_value = [{'id': _uuid(),
+                                               'tenant_id': _uuid()}]
+        env = {'neutron.context': context.Context('', _uuid())}
+        with mock.patch.object(policy, 'prefetch_parent_resources',
+                               wraps=policy.prefetch_parent_resources) as p:
+            self.api.get(_get_path('networks', fmt=self.fmt),
+                         extra_environ=env)
+        p.assert_called_once_with(
+            mock.ANY, 'get_network', instance.get_networks.return_value)
+
     def test_list_noauth(self):
         self._test_list(None, _uuid())
 
@@ -863,6 +905,32 @@ class JSONV2TestCase(APIv2TestBase, testlib_api.WebTestCase):
                             content_type='application/' + self.fmt)
         self.assertEqual(res.status_int, exc.HTTPCreated.code)
 
+    def test_create_bulk_prefetches_parent_resources(self):
+        data = {'networks': [{'name': 'net1',
+                              'admin_state_up': True,
+                              'tenant_id': _uuid()},
+                             {'name': 'net2',
+                              'admin_state_up': True,
+                              'tenant_id': _uuid()}]}
+
+        def side_effect(context, network):
+            net = network.copy()
+            net['network'].update({'subnets': []})
+            return net['network']
+
+        instance = self.plugin.return_value
+        instance.create_network.side_effect = side_effect
+        instance.get_networks_count.return_value = 0
+        with mock.patch.object(policy, 'prefetch_parent_resources',
+                               wraps=policy.prefetch_parent_resources) as p:
+            res = self.api.post(_get_path('networks', fmt=self.fmt),
+                                self.serialize(data),
+                                content_type='application/' + self.fmt)
+        self.assertEqual(res.status_int, exc.HTTPCreated.code)
+        p.assert_called_once_with(mock.ANY, 'create_network', mock.ANY)
+        self.assertEqual(['net1', 'net2'],
+                         [item['name'] for item in p.call_args[0][2]])
+
     def _test_create_failure_bad_request(self, resource, data, **kwargs):
         res = self.api.post(_get_path(resource, fmt=self.fmt),
                             self.serialize(data),
@@ -1369,6 +1437,48 @@ class QuotaTest(APIv2TestBase):
             _get_path('networks'), initial_input)
         self.assertEqual(res.status_int, exc.HTTPCreated.code)
 
+    def _test_create_network_reservation(self, create_side_effect=None):
+        tenant_id = _uuid()
+        initial_input = {'network': {'name': 'net1', 'tenant_id': tenant_id}}
+        instance = self.plugin.return_value
+        instance.create_network.return_value = {'id': _uuid(),
+                                                'tenant_id': tenant_id}
+        instance.create_network.side_effect = create_side_effect
+        with contextlib.nested(
+            mock.patch.object(quota.QUOTAS, 'make_reservation',
+                              return_value='reservation'),
+            mock.patch.object(quota.QUOTAS, 'commit_reservation'),
+            mock.patch.object(quota.QUOTAS, 'cancel_reservation')
+        ) as (make_reservation, commit_reservation, cancel_reservation):
+            self.api.post_json(_get_path('networks'), initial_input,
+                               expect_errors=True)
+        make_reservation.assert_called_once_with(
+            mock.ANY, tenant_id, {'network': 1}, mock.ANY, 'networks',
+            tenant_id)
+        return commit_reservation, cancel_reservation
+
+    def test_create_network_commits_reservation(self):
+        commit_reservation, cancel_reservation = (
+            self._test_create_network_reservation())
+        commit_reservation.assert_called_once_with(mock.ANY, 'reservation')
+        self.assertFalse(cancel_reservation.called)
+
+    def test_create_network_failure_cancels_reservation(self):
+        commit_reservation, cancel_reservation = (
+            self._test_create_network_reservation(
+                n_exc.NeutronException()))
+        cancel_reservation.assert_called_once_with(mock.ANY, 'reservation')
+        self.assertFalse(commit_reservation.called)
+
+    def test_delete_network_marks_usage_dirty(self):
+        tenant_id = _uuid()
+        instance = self.plugin.return_value
+        instance.get_network.return_value = {'id': _uuid(),
+                                             'tenant_id': tenant_id}
+        with mock.patch.object(quota.QUOTAS, 'mark_dirty') as mark_dirty:
+            self.api.delete(_get_path('networks', id=_uuid()))
+        mark_dirty.assert_called_once_with(mock.ANY, tenant_id, ['network'])
+
 
 class ExtensionTestCase(base.BaseTestCase, testlib_plugin.PluginSetupHelper):
     def setUp(self):
@@ -543,3 +543,52 @@ class TestDvrServices(base.BaseTestCase):
 
     def test_is_dvr_serviced_with_vm_port(self):
         self._test_is_dvr_serviced('compute:', True)
+
+
+class TestDhcpNetworkDigest(base.BaseTestCase):
+    def _network(self):
+        return {'id': 'net1',
+                'name': 'net',
+                'subnets': [{'id': 'sub1', 'cidr': '10.0.0.0/24',
+                             'enable_dhcp': True, 'ip_version': 4,
+                             'gateway_ip': '10.0.0.1',
+                             'dns_nameservers': ['8.8.8.8'],
+                             'host_routes': []},
+                            {'id': 'sub2', 'cidr': '10.0.1.0/24',
+                             'enable_dhcp': False, 'ip_version': 4}],
+                'ports': [{'id': 'port1', 'mac_address': 'aa:aa',
+                           'device_owner': 'compute:nova',
+                           'device_id': 'vm1', 'status': 'ACTIVE',
+                           'fixed_ips': [{'subnet_id': 'sub1',
+                                          'ip_address': '10.0.0.2'}]},
+                          {'id': 'port2', 'mac_address': 'bb:bb',
+                           'device_owner': 'network:dhcp',
+                           'device_id': 'dhcp1',
+                           'fixed_ips': [{'subnet_id': 'sub1',
+                                          'ip_address': '10.0.0.3'}]}]}
+
+    def test_digest_ignores_order_and_unused_fields(self):
+        network = self._network()
+        digest = utils.get_dhcp_network_digest(network)
+        network['ports'].reverse()
+        network['ports'][0]['status'] = 'DOWN'
+        network['name'] = 'renamed'
+        del network['subnets'][1]
+        self.assertEqual(digest, utils.get_dhcp_network_digest(network))
+
+    def test_digest_changes_with_dhcp_configuration(self):
+        digest = utils.get_dhcp_network_digest(self._network())
+        for update in (
+                lambda n: n['ports'].pop(),
+                lambda n: n['ports'][0]['fixed_ips'][0].update(
+                    ip_address='10.0.0.4'),
+                lambda n: n['ports'][0].update(
+                    extra_dhcp_opts=[{'opt_name': 'bootfile-name',
+                                      'opt_value': 'pxelinux.0'}]),
+                lambda n: n['subnets'][0].update(
+                    dns_nameservers=['8.8.4.4']),
+                lambda n: n['subnets'][1].update(enable_dhcp=True)):
+            network = self._network()
+            update(network)
+            self.assertNotEqual(digest,
+                                utils.get_dhcp_network_digest(network))
@@ -34,6 +34,7 @@ from neutron.common import test_lib
 from neutron.common import utils
 from neutron import context
 from neutron.db import db_base_plugin_v2
+from neutron.db import ipam
 from neutron.db import models_v2
 from neutron import manager
 from neutron.openstack.common import importutils
@@ -921,6 +922,54 @@ class TestPortsV2(NeutronDbPluginV2TestCase):
                 self._validate_behavior_on_bulk_failure(
                     res, 'ports', webob.exc.HTTPServerError.code)
 
+    def test_create_ports_bulk_allocates_addresses(self):
+        with self.subnet() as subnet:
+            fixed_ips = [{'subnet_id': subnet['subnet']['id'],
+                          'ip_address': '10.0.0.10'}]
+            res = self._create_port_bulk(self.fmt, 3,
+                                         subnet['subnet']['network_id'],
+                                         'test', True,
+                                         override={1: {'fixed_ips':
+                                                       fixed_ips}})
+            self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+            ports = self.deserialize(self.fmt, res)['ports']
+            self.assertEqual(['test_0', 'test_1', 'test_2'],
+                             [p['name'] for p in ports])
+            ip_addresses = [p['fixed_ips'][0]['ip_address'] for p in ports]
+            self.assertEqual('10.0.0.10', ip_addresses[1])
+            self.assertEqual(3, len(set(ip_addresses)))
+            self.assertEqual(3, len(set(p['mac_address'] for p in ports)))
+            for p in ports:
+                port = self._show('ports', p['id'])['port']
+                self.assertEqual(p['fixed_ips'], port['fixed_ips'])
+                self._delete('ports', p['id'])
+
+    def test_create_ports_bulk_duplicate_mac(self):
+        with self.network() as net:
+            overrides = {0: {'mac_address': '00:11:22:33:44:55'},
+                         1: {'mac_address': '00:11:22:33:44:55'}}
+            res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                         'test', True, override=overrides)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPConflict.code)
+
+    def test_create_ports_bulk_ip_exhaustion(self):
+        with self.network() as net:
+            allocation_pools = [{'start': '10.0.0.2', 'end': '10.0.0.3'}]
+            with self.subnet(network=net,
+                             allocation_pools=allocation_pools):
+                res = self._create_port_bulk(self.fmt, 3,
+                                             net['network']['id'],
+                                             'test', True)
+                self._validate_behavior_on_bulk_failure(
+                    res, 'ports', webob.exc.HTTPConflict.code)
+                res = self._create_port_bulk(self.fmt, 2,
+                                             net['network']['id'],
+                                             'test', True)
+                self._validate_behavior_on_bulk_success(res, 'ports')
+                for p in self.deserialize(self.fmt, res)['ports']:
+                    self._delete('ports', p['id'])
+
     def test_list_ports(self):
         # for this test we need to enable overlapping ips
         cfg.CONF.set_default('allow_overlapping_ips', True)
@@ -1003,6 +1052,53 @@ fixed_ips=ip_address%%3D%s&fixed_ips=ip_address%%3D%s&fixed_ips=subnet_id%%3D%s
                                             (port1, port2, port3),
                                             ('mac_address', 'asc'), 2, 2)
 
+    def test_list_ports_streamed(self):
+        if self._skip_native_pagination:
+            self.skipTest("Skip test for not implemented pagination feature")
+        cfg.CONF.set_override('list_batch_size', 2)
+        self.api = router.APIRouter()
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as ports:
+                expected = sorted(port['port']['id'] for port in ports)
+                res = self._list('ports')
+                self.assertEqual(expected,
+                                 [port['id'] for port in res['ports']])
+                res = self._list('ports', query_params='fields=mac_address')
+                self.assertEqual(
+                    [port['port']['mac_address'] for port in
+                     sorted(ports, key=lambda port: port['port']['id'])],
+                    [port['mac_address'] for port in res['ports']])
+                self.assertEqual(['mac_address'], res['ports'][0].keys())
+
+    def test_list_ports_with_unknown_marker_native(self):
+        if self._skip_native_pagination:
+            self.skipTest("Skip test for not implemented pagination feature")
+        with self.port():
+            req = self.new_list_request(
+                'ports', params='limit=2&marker=%s' % (
+                    '00000000-0000-0000-0000-000000000000'))
+            res = req.get_response(self.api)
+            self.assertEqual(webob.exc.HTTPNotFound.code, res.status_int)
+
+    def test_list_ports_with_marker_of_other_tenant_native(self):
+        if self._skip_native_pagination:
+            self.skipTest("Skip test for not implemented pagination feature")
+        with self.network(shared=True) as network:
+            with self.subnet(network) as subnet:
+                with contextlib.nested(self.port(subnet, tenant_id='tenant_1'),
+                                       self.port(subnet, tenant_id='tenant_2')
+                                       ) as (port1, port2):
+                    req = self.new_list_request(
+                        'ports',
+                        params='limit=2&marker=%s' % port1['port']['id'])
+                    req.environ['neutron.context'] = context.Context(
+                        '', 'tenant_2')
+                    res = req.get_response(self.api)
+                    self.assertEqual(webob.exc.HTTPNotFound.code,
+                                     res.status_int)
+
     def test_list_ports_with_pagination_emulated(self):
         helper_patcher = mock.patch(
             'neutron.api.v2.base.Controller._get_pagination_helper',
@@ -3891,9 +3987,9 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
     """Unit Tests for NeutronDbPluginV2 IPAM Logic."""
 
     def test_generate_ip(self):
-        with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+        with mock.patch.object(ipam.AvailabilityRangeIpamDriver,
                                '_try_generate_ip') as generate:
-            with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+            with mock.patch.object(ipam.AvailabilityRangeIpamDriver,
                                    '_rebuild_availability_ranges') as rebuild:
 
                 db_base_plugin_v2.NeutronDbPluginV2._generate_ip('c', 's')
@@ -3902,9 +3998,9 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         self.assertEqual(0, rebuild.call_count)
 
     def test_generate_ip_exhausted_pool(self):
-        with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+        with mock.patch.object(ipam.AvailabilityRangeIpamDriver,
                                '_try_generate_ip') as generate:
-            with mock.patch.object(db_base_plugin_v2.NeutronDbPluginV2,
+            with mock.patch.object(ipam.AvailabilityRangeIpamDriver,
                                    '_rebuild_availability_ranges') as rebuild:
 
                 exception = n_exc.IpAddressGenerationFailure(net_id='n')
@@ -3915,6 +4011,62 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         self.assertEqual(2, generate.call_count)
         rebuild.assert_called_once_with('c', 's')
 
+    def test_generate_ips_exhausted_pool(self):
+        driver = ipam.AvailabilityRangeIpamDriver()
+        with mock.patch.object(driver, '_try_generate_ips') as generate:
+            with mock.patch.object(driver,
+                                   '_rebuild_availability_ranges') as rebuild:
+
+                exception = n_exc.IpAddressGenerationFailure(net_id='n')
+                generate.side_effect = [exception, ['ips']]
+                self.assertEqual(['ips'], driver.generate_ips('c', 's', 2))
+
+        generate.assert_called_with('c', 's', 2)
+        self.assertEqual(2, generate.call_count)
+        rebuild.assert_called_once_with('c', 's')
+
+    def test_generate_macs(self):
+        context = mock.Mock()
+        plugin = db_base_plugin_v2.NeutronDbPluginV2
+        with mock.patch.object(plugin, '_get_used_macs',
+                               return_value=set()) as get_used_macs:
+            macs = plugin._generate_macs(context, 'n', 3)
+
+        self.assertEqual(3, len(set(macs)))
+        get_used_macs.assert_called_once_with(context, 'n', set(macs))
+
+    def test_generate_macs_skips_used_macs(self):
+        context = mock.Mock()
+        plugin = db_base_plugin_v2.NeutronDbPluginV2
+
+        used = []
+
+        def get_used_macs(context, network_id, mac_addresses):
+            # One of the candidates of the first attempt is used
+            if not used:
+                used.append(sorted(mac_addresses)[0])
+                return set(used)
+            return set()
+
+        with mock.patch.object(plugin, '_get_used_macs',
+                               side_effect=get_used_macs) as used_macs:
+            macs = plugin._generate_macs(context, 'n', 2)
+
+        self.assertEqual(2, len(set(macs)))
+        self.assertNotIn(used[0], macs)
+        self.assertEqual(2, used_macs.call_count)
+        # Only the missing mac is generated again
+        self.assertEqual(1, len(used_macs.call_args[0][2]))
+
+    def test_generate_macs_failure(self):
+        cfg.CONF.set_override('mac_generation_retries', 2)
+        self.addCleanup(cfg.CONF.clear_override, 'mac_generation_retries')
+        plugin = db_base_plugin_v2.NeutronDbPluginV2
+        with mock.patch.object(plugin, '_get_used_macs',
+                               side_effect=lambda c, n, macs: macs):
+            self.assertRaises(n_exc.MacAddressGenerationFailure,
+                              plugin._generate_macs, mock.Mock(), 'n', 2)
+
     def test_rebuild_availability_ranges(self):
         pools = [{'id': 'a',
                   'first_ip': '192.168.1.3',
@@ -3950,7 +4102,7 @@ class TestNeutronDbPluginV2(base.BaseTestCase):
         context.session.query.side_effect = return_queries_side_effect
         subnets = [mock.MagicMock()]
 
-        db_base_plugin_v2.NeutronDbPluginV2._rebuild_availability_ranges(
+        ipam.AvailabilityRangeIpamDriver._rebuild_availability_ranges(
             context, subnets)
 
         actual = [[args[0].allocation_pool_id,
@@ -3997,6 +4149,75 @@ class NeutronDbPluginV2AsMixinTestCase(testlib_api.SqlTestCase):
         net = self.plugin.create_network(self.context, self.net_data)
         self.assertEqual(net['status'], 'BUILD')
 
+    def _create_ports(self, count):
+        self.plugin.create_network(self.context, self.net_data)
+        subnet_data = {'network_id': 'fake-id',
+                       'tenant_id': 'test-tenant',
+                       'name': '',
+                       'cidr': '10.0.0.0/24',
+                       'ip_version': 4,
+                       'enable_dhcp': False}
+        for attr in ('gateway_ip', 'allocation_pools', 'dns_nameservers',
+                     'host_routes', 'ipv6_ra_mode', 'ipv6_address_mode'):
+            subnet_data[attr] = attributes.ATTR_NOT_SPECIFIED
+        self.plugin.create_subnet(self.context, {'subnet': subnet_data})
+        port_data = {'network_id': 'fake-id',
+                     'tenant_id': 'test-tenant',
+                     'name': '',
+                     'admin_state_up': True,
+                     'device_id': '',
+                     'device_owner': '',
+                     'mac_address': attributes.ATTR_NOT_SPECIFIED,
+                     'fixed_ips': attributes.ATTR_NOT_SPECIFIED}
+        return [self.plugin.create_port(self.context,
+                                        {'port': dict(port_data)})
+                for i in range(count)]
+
+    def _test_get_by_columns(self, resources, fields, by_columns):
+        getter = getattr(self.plugin, 'get_%s' % resources)
+        expected = [dict((field, item[field]) for field in fields)
+                    for item in getter(self.context)]
+        dict_func = '_make_%s_dict' % resources[:-1]
+        with mock.patch.object(self.plugin, dict_func,
+                               wraps=getattr(self.plugin, dict_func)
+                               ) as make_dict:
+            items = getter(self.context, fields=fields)
+        self.assertEqual(sorted(expected), sorted(items))
+        self.assertEqual(not by_columns, make_dict.called)
+
+    def test_get_networks_by_columns(self):
+        self._create_ports(1)
+        self._test_get_by_columns('networks', ['id', 'name'], True)
+
+    def test_get_networks_with_relationship_field(self):
+        self._create_ports(1)
+        self._test_get_by_columns('networks', ['name', 'subnets'], False)
+
+    def test_get_subnets_by_columns(self):
+        self._create_ports(1)
+        self._test_get_by_columns('subnets', ['cidr'], True)
+
+    def test_get_ports_by_columns(self):
+        self._create_ports(2)
+        self._test_get_by_columns('ports', ['device_id', 'mac_address'], True)
+
+    def test_get_ports_by_columns_with_fixed_ips(self):
+        ports = self._create_ports(2)
+        self._test_get_by_columns('ports', ['fixed_ips'], True)
+        items = self.plugin.get_ports(
+            self.context, filters={'id': [ports[0]['id']]},
+            fields=['id', 'fixed_ips'])
+        self.assertEqual([{'id': ports[0]['id'],
+                           'fixed_ips': ports[0]['fixed_ips']}], items)
+
+    def test_get_ports_with_extension_field(self):
+        self._create_ports(1)
+        self._test_get_by_columns('ports', ['id', 'status'], True)
+        with mock.patch.object(self.plugin, '_make_port_dict',
+                               return_value={}) as make_dict:
+            self.plugin.get_ports(self.context, fields=['id', 'binding:foo'])
+        self.assertTrue(make_dict.called)
+
 
 class TestBasicGetXML(TestBasicGet):
     fmt = 'xml'
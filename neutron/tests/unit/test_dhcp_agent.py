@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import copy
 import sys
 import uuid
@@ -20,6 +21,7 @@ import uuid
 import eventlet
 import mock
 from oslo.config import cfg
+from oslo import messaging
 import testtools
 
 from neutron.agent.common import config
@@ -30,6 +32,7 @@ from neutron.common import config as common_config
 from neutron.common import constants as const
 from neutron.common import exceptions
 from neutron.common import rpc as n_rpc
+from neutron.common import utils
 from neutron.tests import base
 
 
@@ -186,6 +189,20 @@ class TestDhcpAgent(base.BaseTestCase):
                              mock.call().report_state(mock.ANY, mock.ANY,
                                                       mock.ANY)])
 
+    def test_report_state_includes_event_queue_state(self):
+        with mock.patch('neutron.agent.rpc.PluginReportStateAPI') as state:
+            agent = dhcp_agent.DhcpAgentWithStateReport(HOSTNAME)
+            with contextlib.nested(
+                mock.patch.object(agent, 'run'),
+                mock.patch.object(agent._event_queue, 'get_state',
+                                  return_value={'pending_events': 1})
+            ):
+                agent._report_state()
+        configurations = state().report_state.call_args[0][1][
+            'configurations']
+        self.assertEqual(1, configurations['pending_events'])
+        self.assertIn('networks', configurations)
+
     def test_dhcp_agent_main_agent_manager(self):
         logging_str = 'neutron.agent.common.config.setup_logging'
         launcher_str = 'neutron.openstack.common.service.ServiceLauncher'
@@ -261,7 +278,9 @@ class TestDhcpAgent(base.BaseTestCase):
     def _test_sync_state_helper(self, known_networks, active_networks):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.return_value = active_networks
+            mock_plugin.get_active_networks_delta.return_value = (
+                set(getattr(net, 'id', net) for net in active_networks),
+                active_networks)
             plug.return_value = mock_plugin
 
             dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
@@ -312,7 +331,7 @@ class TestDhcpAgent(base.BaseTestCase):
     def test_sync_state_plugin_error(self):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.side_effect = Exception
+            mock_plugin.get_active_networks_delta.side_effect = Exception
             plug.return_value = mock_plugin
 
             with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
@@ -324,6 +343,74 @@ class TestDhcpAgent(base.BaseTestCase):
                     self.assertTrue(log.called)
                     self.assertTrue(schedule_resync.called)
 
+    def test_sync_state_only_configures_changed_networks(self):
+        with mock.patch(DHCP_PLUGIN) as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks_delta.return_value = (
+                set([fake_network.id, fake_down_network.id]),
+                [fake_down_network])
+            plug.return_value = mock_plugin
+            agent = dhcp_agent.DhcpAgent(HOSTNAME)
+            deleted_network = dhcp.NetModel(
+                True, dict(id='12345678-eeee-eeee-1234567890ab',
+                           subnets=[], ports=[]))
+            agent.cache.put(fake_network)
+            agent.cache.put(deleted_network)
+            agent.schedule_resync('reason', deleted_network.id)
+
+            attrs_to_mock = dict(
+                [(a, mock.DEFAULT) for a in
+                 ['safe_configure_dhcp_for_network', 'disable_dhcp_helper']])
+            with mock.patch.multiple(agent, **attrs_to_mock) as mocks:
+                agent.sync_state()
+
+        digests = mock_plugin.get_active_networks_delta.call_args[0][0]
+        self.assertEqual({fake_network.id: utils.get_dhcp_network_digest(
+            fake_network)}, digests)
+        mocks['safe_configure_dhcp_for_network'].assert_called_once_with(
+            fake_down_network)
+        mocks['disable_dhcp_helper'].assert_called_once_with(
+            deleted_network.id)
+        self.assertEqual(set(), agent.needs_resync_network_ids)
+
+    def test_sync_state_applies_events_received_during_fetch(self):
+        with mock.patch(DHCP_PLUGIN) as plug:
+            mock_plugin = mock.Mock()
+            plug.return_value = mock_plugin
+            agent = dhcp_agent.DhcpAgent(HOSTNAME)
+            agent.cache.put(copy.deepcopy(fake_network))
+
+            def get_active_networks_delta(digests):
+                # A port is created after the network info is read
+                agent.port_create_end(None, dict(port=dict(fake_port2)))
+                eventlet.sleep(0)
+                return (set([fake_network.id]),
+                        [copy.deepcopy(fake_network)])
+
+            mock_plugin.get_active_networks_delta.side_effect = (
+                get_active_networks_delta)
+            with contextlib.nested(
+                mock.patch.object(agent, 'call_driver', return_value=True),
+                mock.patch.object(agent, 'enable_isolated_metadata_proxy')
+            ):
+                agent.sync_state()
+                agent._event_queue._pool.waitall()
+        network = agent.cache.get_network_by_id(fake_network.id)
+        self.assertEqual(set([fake_port1.id, fake_port2.id]),
+                         set(port.id for port in network.ports))
+
+    def test_sync_state_failure_keeps_networks_to_resync(self):
+        with mock.patch(DHCP_PLUGIN) as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks_delta.side_effect = Exception
+            plug.return_value = mock_plugin
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp.schedule_resync('reason', fake_network.id)
+            with mock.patch.object(dhcp_agent.LOG, 'exception'):
+                dhcp.sync_state()
+        self.assertEqual(set([fake_network.id]),
+                         dhcp.needs_resync_network_ids)
+
     def test_periodic_resync(self):
         dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
         with mock.patch.object(dhcp_agent.eventlet, 'spawn') as spawn:
@@ -493,6 +580,9 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
                                'check_version') as check_v:
             check_v.return_value = dhcp.Dnsmasq.MINIMUM_VERSION
             self.dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+        # Process the queued events synchronously
+        mock.patch.object(self.dhcp._event_queue._pool, 'spawn_n',
+                          side_effect=lambda func: func()).start()
         self.call_driver_p = mock.patch.object(self.dhcp, 'call_driver')
         self.call_driver = self.call_driver_p.start()
         self.schedule_resync_p = mock.patch.object(self.dhcp,
@@ -869,6 +959,140 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.cache.assert_has_calls([mock.call.get_port_by_id('unknown')])
         self.assertEqual(self.call_driver.call_count, 0)
 
+    def test_port_events_delayed_reload_is_coalesced(self):
+        cfg.CONF.set_override('reload_allocations_delay', 2)
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = fake_port2
+        with mock.patch.object(dhcp_agent.eventlet,
+                               'spawn_after') as spawn_after:
+            self.dhcp.port_update_end(None, dict(port=fake_port1))
+            self.dhcp.port_update_end(None, dict(port=fake_port2))
+            self.dhcp.port_delete_end(None, dict(port_id=fake_port2.id))
+        spawn_after.assert_called_once_with(2, self.dhcp._reload_pending,
+                                            fake_network.id)
+        self.assertFalse(self.call_driver.called)
+
+        self.dhcp._reload_pending(fake_network.id)
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        # The next event schedules a new reload
+        with mock.patch.object(dhcp_agent.eventlet,
+                               'spawn_after') as spawn_after:
+            self.dhcp.port_update_end(None, dict(port=fake_port1))
+        self.assertTrue(spawn_after.called)
+
+    def test_delayed_reload_of_deleted_network(self):
+        self.cache.get_network_by_id.return_value = None
+        self.dhcp._reload_pending(fake_network.id)
+        self.assertFalse(self.call_driver.called)
+
+    def test_port_delete_end_of_pending_port(self):
+        self.cache.get_port_by_id.return_value = None
+        with mock.patch.object(self.dhcp._event_queue, 'add') as add:
+            self.dhcp.port_update_end(None, dict(port=fake_port2))
+            add.reset_mock()
+            with mock.patch.object(self.dhcp._event_queue, 'get_network_id',
+                                   return_value=fake_network.id):
+                self.dhcp.port_delete_end(None,
+                                          dict(port_id=fake_port2.id))
+        add.assert_called_once_with(
+            fake_network.id, ('port', fake_port2.id),
+            self.dhcp._process_network_event, fake_network.id,
+            self.dhcp._port_delete, fake_port2.id)
+
+
+class TestNetworkEventQueue(base.BaseTestCase):
+    def setUp(self):
+        super(TestNetworkEventQueue, self).setUp()
+        self.queue = dhcp_agent.NetworkEventQueue(2)
+        self.processed = []
+
+    def _event(self, name):
+        self.processed.append(name)
+
+    def test_events_of_network_are_merged(self):
+        self.queue.add('net1', 'reload', self._event, 'reload1')
+        self.queue.add('net1', 'port', self._event, 'port')
+        self.queue.add('net1', 'reload', self._event, 'reload2')
+        self.assertEqual(2, self.queue.get_state()['pending_events'])
+        self.queue._pool.waitall()
+        self.assertEqual(['port', 'reload2'], self.processed)
+
+    def test_network_events_are_processed_in_order(self):
+        def event(name):
+            self.processed.append(name)
+            if name == 'a1':
+                # Events queued while the network is processed
+                self.queue.add('a', 'a2', self._event, 'a2')
+                self.queue.add('a', 'a3', self._event, 'a3')
+                eventlet.sleep(0)
+
+        self.queue.add('a', 'a1', event, 'a1')
+        self.queue.add('b', 'b1', self._event, 'b1')
+        self.queue._pool.waitall()
+        self.assertEqual(['a1', 'b1', 'a2', 'a3'], self.processed)
+
+    def test_networks_wait_for_a_free_worker(self):
+        for network_id in ('a', 'b', 'c'):
+            self.queue.add(network_id, 'event', self._event, network_id)
+        self.assertEqual(0, self.queue._pool.free())
+        self.queue._pool.waitall()
+        self.assertEqual(['a', 'b', 'c'], self.processed)
+        self.assertEqual({}, self.queue._events)
+
+    def test_failed_event_does_not_stop_processing(self):
+        with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
+            self.queue.add('a', 'fail', mock.Mock(side_effect=ValueError))
+            self.queue.add('a', 'event', self._event, 'event')
+            self.queue._pool.waitall()
+        self.assertTrue(log.called)
+        self.assertEqual(['event'], self.processed)
+
+    def test_paused_queue_holds_events(self):
+        self.queue.pause()
+        self.queue.add('a', 'event', self._event, 'a')
+        self.queue.add('b', 'event', self._event, 'b')
+        self.queue._pool.waitall()
+        self.assertEqual([], self.processed)
+        self.assertEqual(2, self.queue.get_state()['pending_events'])
+        self.queue.resume()
+        self.queue._pool.waitall()
+        self.assertEqual(['a', 'b'], self.processed)
+        self.assertEqual({}, self.queue._events)
+
+    def test_pause_while_processing_network(self):
+        def event(name):
+            self.processed.append(name)
+            self.queue.add('a', 'a2', self._event, 'a2')
+            self.queue.pause()
+
+        self.queue.add('a', 'a1', event, 'a1')
+        self.queue._pool.waitall()
+        self.assertEqual(['a1'], self.processed)
+        self.queue.resume()
+        self.queue._pool.waitall()
+        self.assertEqual(['a1', 'a2'], self.processed)
+
+    def test_get_network_id(self):
+        self.queue.add('a', ('port', 'p1'), self._event, 'p1')
+        self.assertEqual('a', self.queue.get_network_id(('port', 'p1')))
+        self.assertIsNone(self.queue.get_network_id(('port', 'p2')))
+        self.queue._pool.waitall()
+        self.assertIsNone(self.queue.get_network_id(('port', 'p1')))
+
+    def test_get_state(self):
+        with mock.patch.object(dhcp_agent, 'time') as time:
+            time.time.side_effect = [10, 11, 12.5, 13]
+            self.queue.add('a', 'a1', self._event, 'a1')
+            self.queue.add('a', 'a2', self._event, 'a2')
+            self.queue._pool.waitall()
+        self.assertEqual({'pending_events': 0,
+                          'processed_events': 2,
+                          'event_avg_latency': 2.25,
+                          'event_max_latency': 2.5},
+                         self.queue.get_state())
+        self.assertEqual(0, self.queue.get_state()['processed_events'])
+
 
 class TestDhcpPluginApiProxy(base.BaseTestCase):
     def setUp(self):
@@ -881,6 +1105,28 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
         self.make_msg_p = mock.patch.object(self.proxy, 'make_msg')
         self.make_msg = self.make_msg_p.start()
 
+    def test_get_active_networks_delta(self):
+        self.call.return_value = {'network_ids': ['a', 'b'],
+                                  'networks': [{'id': 'b'}]}
+        network_ids, networks = self.proxy.get_active_networks_delta(
+            {'a': 'digest'})
+        self.make_msg.assert_called_once_with('get_active_networks_delta',
+                                              digests={'a': 'digest'},
+                                              host='foo')
+        self.assertEqual('1.2', self.call.call_args[1]['version'])
+        self.assertEqual(set(['a', 'b']), network_ids)
+        self.assertEqual(['b'], [network.id for network in networks])
+        self.assertIsInstance(networks[0], dhcp.NetModel)
+
+    def test_get_active_networks_delta_unsupported(self):
+        self.call.side_effect = [messaging.UnsupportedVersion('1.2'),
+                                 [{'id': 'a'}]]
+        network_ids, networks = self.proxy.get_active_networks_delta({})
+        self.make_msg.assert_called_with('get_active_networks_info',
+                                         host='foo')
+        self.assertEqual(set(['a']), network_ids)
+        self.assertEqual(['a'], [network.id for network in networks])
+
     def test_get_network_info(self):
         self.call.return_value = dict(a=1)
         retval = self.proxy.get_network_info('netid')
@@ -1077,6 +1323,15 @@ class TestNetworkCache(base.BaseTestCase):
         nc.put(fake_network)
         self.assertEqual(nc.get_port_by_id(fake_port1.id), fake_port1)
 
+    def test_get_digests(self):
+        nc = dhcp_agent.NetworkCache()
+        nc.put(fake_network)
+        digest = utils.get_dhcp_network_digest(fake_network)
+        self.assertEqual({fake_network.id: digest}, nc.get_digests())
+        nc.put_port(fake_port2)
+        self.assertNotEqual(digest, nc.get_digests()[fake_network.id])
+        nc.remove_port(fake_port2)
+
 
 class FakePort1:
     id = 'eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee'
@@ -19,6 +19,7 @@ from oslo.db import exception as db_exc
 from neutron.api.rpc.handlers import dhcp_rpc
 from neutron.common import constants
 from neutron.common import exceptions as n_exc
+from neutron.common import utils
 from neutron.tests import base
 
 
@@ -47,6 +48,24 @@ class TestDhcpRpcCallback(base.BaseTestCase):
 
         self.assertEqual(len(self.log.mock_calls), 1)
 
+    def test_get_active_networks_delta(self):
+        networks = [dict(id='a'), dict(id='b')]
+        self.plugin.get_networks.return_value = networks
+        self.plugin.get_ports.return_value = [
+            dict(id='p1', network_id='b', mac_address='aa:aa',
+                 fixed_ips=[])]
+        self.plugin.get_subnets.return_value = []
+        unchanged = utils.get_dhcp_network_digest(
+            dict(id='a', subnets=[], ports=[]))
+
+        delta = self.callbacks.get_active_networks_delta(
+            mock.Mock(), host='host', digests={'a': unchanged, 'b': 'old'})
+
+        self.assertEqual(['a', 'b'], delta['network_ids'])
+        self.assertEqual(['b'],
+                         [network['id'] for network in delta['networks']])
+        self.assertEqual('p1', delta['networks'][0]['ports'][0]['id'])
+
     def _test__port_action_with_failures(self, exc=None, action=None):
         port = {
             'network_id': 'foo_network_id',
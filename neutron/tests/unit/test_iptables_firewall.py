@@ -1235,7 +1235,7 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
 class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
     def setUp(self):
         super(IptablesFirewallEnhancedIpsetTestCase, self).setUp()
-        self.firewall.ipset = mock.Mock()
+        self.firewall.enable_ipset = True
 
     def _fake_port(self):
         return {'device': 'tapfake_dev',
@@ -1247,123 +1247,107 @@ class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
 
     def _fake_sg_rule(self):
         return {'fake_sgid': [
-            {'direction': 'ingress', 'remote_group_id': 'fake_sgid'}]}
+            {'direction': 'ingress', 'remote_group_id': 'fake_sgid',
+             'ethertype': 'IPv4'},
+            {'direction': 'ingress', 'remote_group_id': 'fake_sgid',
+             'ethertype': 'IPv6'}]}
+
+    def _set_ipset_members(self, sg_members):
+        for ethertype, member_ips in sg_members.items():
+            self.firewall.ipset.set_members(ethertype + 'fake_sgid',
+                                            ethertype, member_ips)
+        self.firewall.ipset.apply()
+        self.utils_exec.reset_mock()
+
+    def _assert_ipset_restored(self, *process_inputs):
+        calls = [mock.call(['ipset', 'restore', '-exist'],
+                           root_helper=mock.ANY,
+                           process_input='\n'.join(process_input))
+                 for process_input in process_inputs]
+        self.assertEqual(calls, self.utils_exec.call_args_list)
 
     def test_prepare_port_filter_with_default_sg(self):
         self.firewall.sg_rules = self._fake_sg_rule()
         self.firewall.sg_members = {'fake_sgid': {
             'IPv4': ['10.0.0.1', '10.0.0.2'], 'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {}
         port = self._fake_port()
         self.firewall.prepare_port_filter(port)
-        calls = [mock.call.create_ipset_chain('IPv4fake_sgid', 'IPv4'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv4fake_sgid', ['10.0.0.1', '10.0.0.2'], 'IPv4'),
-                 mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls)
-
-    def test_prepare_port_filter_with_add_members_beyond_4(self):
+        self._assert_ipset_restored([
+            'create IPv4fake_sgid hash:ip family inet',
+            'create IPv4fake_sgid-new hash:ip family inet',
+            'add IPv4fake_sgid-new 10.0.0.1',
+            'add IPv4fake_sgid-new 10.0.0.2',
+            'swap IPv4fake_sgid-new IPv4fake_sgid',
+            'destroy IPv4fake_sgid-new',
+            'create IPv6fake_sgid hash:ip family inet6',
+            'create IPv6fake_sgid-new hash:ip family inet6',
+            'add IPv6fake_sgid-new fe80::1',
+            'swap IPv6fake_sgid-new IPv6fake_sgid',
+            'destroy IPv6fake_sgid-new'])
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev', '-m set --match-set IPv4fake_sgid src -j RETURN')
+        self.v6filter_inst.add_rule.assert_any_call(
+            'ifake_dev', '-m set --match-set IPv6fake_sgid src -j RETURN')
+
+    def test_prepare_port_filter_with_member_changes(self):
         self.firewall.sg_rules = self._fake_sg_rule()
+        self._set_ipset_members({'IPv4': ['10.0.0.2', '10.0.0.6'],
+                                 'IPv6': ['fe80::1']})
         self.firewall.sg_members = {'fake_sgid': {
             'IPv4': TEST_IP_RANGE[:5],
             'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {}
         port = self._fake_port()
         self.firewall.prepare_port_filter(port)
-        calls = [mock.call.create_ipset_chain('IPv4fake_sgid', 'IPv4'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv4fake_sgid', TEST_IP_RANGE[:5], 'IPv4'),
-                 mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls)
-
-    def test_prepare_port_filter_with_ipset_chain_exist(self):
+        # Only the differences are applied, in a single ipset process
+        self._assert_ipset_restored([
+            'add IPv4fake_sgid 10.0.0.1',
+            'add IPv4fake_sgid 10.0.0.3',
+            'add IPv4fake_sgid 10.0.0.4',
+            'add IPv4fake_sgid 10.0.0.5',
+            'del IPv4fake_sgid 10.0.0.6'])
+
+    def test_prepare_port_filter_without_member_changes(self):
         self.firewall.sg_rules = self._fake_sg_rule()
-        self.firewall.ipset_chains = {'IPv4fake_sgid': ['10.0.0.2']}
+        self._set_ipset_members({'IPv4': TEST_IP_RANGE[:5],
+                                 'IPv6': ['fe80::1']})
         self.firewall.sg_members = {'fake_sgid': {
             'IPv4': TEST_IP_RANGE[:5],
             'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {'fake_sgid': {
-            'IPv4': ['10.0.0.2'],
-            'IPv6': ['fe80::1']}}
-        port = self._fake_port()
-        self.firewall.prepare_port_filter(port)
-        calls = [
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.1'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.3'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.4'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.5'),
-            mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-            mock.call.refresh_ipset_chain_by_name(
-                'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls, True)
-
-    def test_prepare_port_filter_with_del_member(self):
-        self.firewall.sg_rules = self._fake_sg_rule()
-        self.firewall.ipset_chains = {'IPv4fake_sgid': ['10.0.0.2']}
-        self.firewall.sg_members = {'fake_sgid': {
-            'IPv4': [
-                '10.0.0.1', '10.0.0.3', '10.0.0.4', '10.0.0.5'],
-            'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {'fake_sgid': {
-            'IPv4': ['10.0.0.2'],
-            'IPv6': ['fe80::1']}}
         port = self._fake_port()
         self.firewall.prepare_port_filter(port)
-        calls = [
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.1'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.3'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.4'),
-            mock.call.add_member_to_ipset_chain('IPv4fake_sgid', '10.0.0.5'),
-            mock.call.del_ipset_chain_member('IPv4fake_sgid', '10.0.0.2'),
-            mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-            mock.call.refresh_ipset_chain_by_name(
-                'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls, True)
-
-    def test_prepare_port_filter_change_beyond_9(self):
-        self.firewall.sg_rules = self._fake_sg_rule()
-        self.firewall.ipset_chains = {'IPv4fake_sgid': TEST_IP_RANGE[5:]}
-        self.firewall.sg_members = {'fake_sgid': {
-            'IPv4': TEST_IP_RANGE[:5],
-            'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {'fake_sgid': {
-            'IPv4': TEST_IP_RANGE[5:],
-            'IPv6': ['fe80::1']}}
-        port = self._fake_port()
-        self.firewall.prepare_port_filter(port)
-        calls = [
-            mock.call.refresh_ipset_chain_by_name('IPv4fake_sgid',
-                                                  TEST_IP_RANGE[:5], 'IPv4'),
-            mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-            mock.call.refresh_ipset_chain_by_name(
-                'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls)
+        self.assertFalse(self.utils_exec.called)
 
     def test_prepare_port_filter_with_sg_no_member(self):
         self.firewall.sg_rules = self._fake_sg_rule()
         self.firewall.sg_rules['fake_sgid'].append(
-            {'direction': 'ingress', 'remote_group_id': 'fake_sgid2'})
-        self.firewall.sg_rules.update()
+            {'direction': 'ingress', 'remote_group_id': 'fake_sgid2',
+             'ethertype': 'IPv4'})
         self.firewall.sg_members = {'fake_sgid': {
             'IPv4': ['10.0.0.1', '10.0.0.2'], 'IPv6': ['fe80::1']}}
-        self.firewall.pre_sg_members = {}
         port = self._fake_port()
         port['security_group_source_groups'].append('fake_sgid2')
         self.firewall.prepare_port_filter(port)
-        calls = [mock.call.create_ipset_chain('IPv4fake_sgid', 'IPv4'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv4fake_sgid', ['10.0.0.1', '10.0.0.2'], 'IPv4'),
-                 mock.call.create_ipset_chain('IPv6fake_sgid', 'IPv6'),
-                 mock.call.refresh_ipset_chain_by_name(
-                     'IPv6fake_sgid', ['fe80::1'], 'IPv6')]
-
-        self.firewall.ipset.assert_has_calls(calls)
+        self.assertNotIn(
+            mock.call('ifake_dev',
+                      '-m set --match-set IPv4fake_sgid2 src -j RETURN'),
+            self.v4filter_inst.add_rule.call_args_list)
+        self.assertTrue(self.firewall.ipset.set_exists('IPv4fake_sgid'))
+        self.assertFalse(self.firewall.ipset.set_exists('IPv4fake_sgid2'))
+        self.assertFalse(self.firewall.ipset.set_exists('IPv6fake_sgid2'))
+        self.assertEqual(1, self.utils_exec.call_count)
+
+    def test_filter_defer_apply_off_destroys_unused_sets(self):
+        self.firewall.sg_rules = self._fake_sg_rule()
+        self.firewall.sg_members = {'fake_sgid': {
+            'IPv4': ['10.0.0.1'], 'IPv6': ['fe80::1']}}
+        port = self._fake_port()
+        with self.firewall.defer_apply():
+            self.firewall.prepare_port_filter(port)
+        self.utils_exec.reset_mock()
+
+        with self.firewall.defer_apply():
+            self.firewall.remove_port_filter(port)
+        self._assert_ipset_restored(['destroy IPv4fake_sgid',
+                                     'destroy IPv6fake_sgid'])
+        self.assertFalse(self.firewall.ipset.set_exists('IPv4fake_sgid'))
+        self.assertNotIn('fake_sgid', self.firewall.sg_members)
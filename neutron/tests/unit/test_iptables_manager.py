@@ -15,8 +15,11 @@
 
 import inspect
 import os
+import time
 
 import mock
+from oslo.config import cfg
+from testtools import content
 
 from neutron.agent.linux import iptables_manager
 from neutron.tests import base
@@ -907,29 +910,59 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
     def test_get_traffic_counters_with_zero_with_ipv6(self):
         self._test_get_traffic_counters_with_zero_helper(True)
 
-    def _test_find_last_entry(self, find_str):
-        filter_list = [':neutron-filter-top - [0:0]',
-                       ':%(bn)s-FORWARD - [0:0]',
-                       ':%(bn)s-INPUT - [0:0]',
-                       ':%(bn)s-local - [0:0]',
-                       ':%(wrap)s - [0:0]',
-                       ':%(bn)s-OUTPUT - [0:0]',
-                       '[0:0] -A FORWARD -j neutron-filter-top',
-                       '[0:0] -A OUTPUT -j neutron-filter-top'
-                       % IPTABLES_ARG]
-
-        return self.iptables._find_last_entry(filter_list, find_str)
-
-    def test_find_last_entry_old_dup(self):
-        find_str = 'neutron-filter-top'
-        match_str = '[0:0] -A OUTPUT -j neutron-filter-top'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertEqual(ret_str, match_str)
-
-    def test_find_last_entry_none(self):
-        find_str = 'neutron-filter-NOTFOUND'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertIsNone(ret_str)
+    def test_index_last_entries(self):
+        lines = [':neutron-filter-top - [0:0]',
+                 ':%(bn)s-FORWARD - [0:0]' % IPTABLES_ARG,
+                 ':%(bn)s-FORWARD - [1:2]' % IPTABLES_ARG,
+                 '[0:0] -A FORWARD -j neutron-filter-top',
+                 '[5:6] -A FORWARD -j neutron-filter-top',
+                 'COMMIT']
+        entries = iptables_manager._index_last_entries(lines)
+        self.assertEqual(
+            {':neutron-filter-top': ':neutron-filter-top - [0:0]',
+             ':%(bn)s-FORWARD' % IPTABLES_ARG:
+             ':%(bn)s-FORWARD - [1:2]' % IPTABLES_ARG,
+             '-A FORWARD -j neutron-filter-top':
+             '[5:6] -A FORWARD -j neutron-filter-top',
+             'COMMIT': 'COMMIT'},
+            entries)
+
+    def test_modify_rules_matches_exact_rules_only(self):
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        current_lines = [
+            '# Generated by iptables-save',
+            '*filter',
+            ':INPUT ACCEPT [0:0]',
+            ':%(bn)s-INPUT - [0:0]' % IPTABLES_ARG,
+            '[7:8] -A %(bn)s-INPUT -j DROPPED' % IPTABLES_ARG,
+            '[3:4] -A %(bn)s-INPUT -j DROP' % IPTABLES_ARG,
+            'COMMIT',
+            '# Completed']
+        new_lines = self.iptables._modify_rules(
+            current_lines, self.iptables.ipv4['filter'], 'filter')
+        self.assertIn('[3:4] -A %(bn)s-INPUT -j DROP' % IPTABLES_ARG,
+                      new_lines)
+        self.assertNotIn('[7:8] -A %(bn)s-INPUT -j DROPPED' % IPTABLES_ARG,
+                         new_lines)
+
+    def test_modify_rules_flushes_remove_lists(self):
+        table = self.iptables.ipv4['filter']
+        table.add_chain('unwrapped', wrap=False)
+        table.add_rule('unwrapped', '-j DROP', wrap=False)
+        table.add_rule('unwrapped', '-j ACCEPT', wrap=False)
+        table.remove_chain('unwrapped', wrap=False)
+        current_lines = ['*filter',
+                         ':unwrapped - [0:0]',
+                         '[0:0] -A unwrapped -j DROP',
+                         '[0:0] -A unwrapped -j ACCEPT',
+                         'COMMIT']
+        new_lines = self.iptables._modify_rules(current_lines, table,
+                                                'filter')
+        self.assertNotIn(':unwrapped - [0:0]', new_lines)
+        self.assertNotIn('[0:0] -A unwrapped -j DROP', new_lines)
+        self.assertNotIn('[0:0] -A unwrapped -j ACCEPT', new_lines)
+        self.assertEqual([], table.remove_rules)
+        self.assertEqual(set(), table.remove_chains)
 
 
 class IptablesManagerStateLessTestCase(base.BaseTestCase):
@@ -940,3 +973,160 @@ class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def test_nat_not_found(self):
         self.assertNotIn('nat', self.iptables.ipv4)
+
+
+class IptablesManagerModifyRulesBenchmarkTestCase(base.BaseTestCase):
+    """Guard the scalability of IptablesManager._modify_rules.
+
+    A synthetic iptables-save dump of about 50k lines, half of them being
+    rules owned by the manager, is processed. With linear scans of the dump
+    per rule this takes minutes, with the hashed indexes it takes well under
+    a second; the bound below leaves a large margin for slow test nodes.
+    """
+
+    NUM_CHAINS = 500
+    RULES_PER_CHAIN = 50
+    MAX_SECONDS = 15
+
+    def setUp(self):
+        super(IptablesManagerModifyRulesBenchmarkTestCase, self).setUp()
+        self.iptables = iptables_manager.IptablesManager(state_less=True)
+        self.table = self.iptables.ipv4['filter']
+        bn = iptables_manager.binary_name
+        chain_lines = [':foreign-%d - [0:0]' % i
+                       for i in range(self.NUM_CHAINS)]
+        rule_lines = []
+        for i in range(self.NUM_CHAINS):
+            chain = 'sg-%d' % i
+            self.table.add_chain(chain)
+            chain_lines.append(':%s-%s - [0:0]' % (bn, chain))
+            for j in range(self.RULES_PER_CHAIN):
+                rule = '-s 10.%d.%d.0/24 -j RETURN' % (i % 256, j)
+                self.table.add_rule(chain, rule)
+                rule_lines.append('[%d:%d] -A %s-%s %s' % (j, j, bn, chain,
+                                                          rule))
+                rule_lines.append('[0:0] -A foreign-%d %s' % (i, rule))
+        self.current_lines = (['# Generated by iptables-save', '*filter',
+                               ':INPUT ACCEPT [0:0]',
+                               ':FORWARD ACCEPT [0:0]',
+                               ':OUTPUT ACCEPT [0:0]'] +
+                              chain_lines + rule_lines +
+                              ['COMMIT', '# Completed'])
+
+    def test_modify_rules_50k_lines(self):
+        self.assertTrue(len(self.current_lines) > 50000)
+        start = time.time()
+        new_lines = self.iptables._modify_rules(self.current_lines,
+                                                self.table, 'filter')
+        elapsed = time.time() - start
+        self.addDetail('elapsed_seconds',
+                       content.text_content('%.3f' % elapsed))
+        # Every line is kept (plus our chains and rules not in the dump)
+        # and the counters of our rules are preserved.
+        self.assertTrue(len(new_lines) >= len(self.current_lines))
+        self.assertIn('[49:49] -A %s-sg-0 -s 10.0.49.0/24 -j RETURN' %
+                      iptables_manager.binary_name, new_lines)
+        self.assertTrue(elapsed < self.MAX_SECONDS,
+                        '_modify_rules took %.1fs' % elapsed)
+
+
+class IptablesManagerIncrementalApplyTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerIncrementalApplyTestCase, self).setUp()
+        cfg.CONF.set_override('iptables_incremental_apply', True)
+        self.root_helper = 'sudo'
+        self.iptables = iptables_manager.IptablesManager(
+            root_helper=self.root_helper, state_less=True)
+        self.execute = mock.patch.object(self.iptables, "execute").start()
+        self.execute.return_value = ''
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+    def _restore_call(self, process_input):
+        return mock.call(['iptables-restore', '-n'],
+                         process_input=process_input,
+                         root_helper=self.root_helper)
+
+    def test_first_apply_is_full(self):
+        self.iptables = iptables_manager.IptablesManager(
+            root_helper=self.root_helper, state_less=True)
+        self.execute = mock.patch.object(self.iptables, "execute").start()
+        self.execute.return_value = ''
+        self.iptables.apply()
+        self.assertEqual(
+            [mock.call(['iptables-save', '-c'],
+                       root_helper=self.root_helper),
+             mock.call(['iptables-restore', '-c'],
+                       process_input=mock.ANY,
+                       root_helper=self.root_helper)],
+            self.execute.mock_calls)
+
+    def test_apply_without_changes_does_nothing(self):
+        self.iptables.apply()
+        self.assertFalse(self.execute.called)
+
+    def test_apply_only_changed_chains(self):
+        self.iptables.ipv4['filter'].add_chain('sg-1')
+        self.iptables.ipv4['filter'].add_rule('sg-1', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('FORWARD', '-j $sg-1')
+        self.iptables.apply()
+        self.assertEqual(
+            [self._restore_call(
+                '*filter\n'
+                ':%(bn)s-FORWARD - [0:0]\n'
+                ':%(bn)s-sg-1 - [0:0]\n'
+                '-A %(bn)s-FORWARD -j %(bn)s-sg-1\n'
+                '-A %(bn)s-sg-1 -j DROP\n'
+                'COMMIT\n' % IPTABLES_ARG)],
+            self.execute.mock_calls)
+
+    def test_apply_removed_chain(self):
+        self.iptables.ipv4['filter'].add_chain('sg-1')
+        self.iptables.ipv4['filter'].add_rule('FORWARD', '-j $sg-1')
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].remove_chain('sg-1')
+        self.iptables.apply()
+        self.assertEqual(
+            [self._restore_call(
+                '*filter\n'
+                ':%(bn)s-FORWARD - [0:0]\n'
+                ':%(bn)s-sg-1 - [0:0]\n'
+                '-X %(bn)s-sg-1\n'
+                'COMMIT\n' % IPTABLES_ARG)],
+            self.execute.mock_calls)
+
+    def test_unwrapped_change_applies_full_ruleset(self):
+        self.iptables.ipv4['filter'].add_rule('neutron-filter-top',
+                                              '-j DROP', wrap=False)
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-c'],
+                                     root_helper=self.root_helper)
+
+    def test_incremental_failure_applies_full_ruleset(self):
+        self.iptables.ipv4['filter'].add_chain('sg-1')
+        self.execute.side_effect = [RuntimeError(), '', None]
+        self.iptables.apply()
+        self.assertEqual(
+            [self._restore_call(mock.ANY),
+             mock.call(['iptables-save', '-c'],
+                       root_helper=self.root_helper),
+             mock.call(['iptables-restore', '-c'],
+                       process_input=mock.ANY,
+                       root_helper=self.root_helper)],
+            self.execute.mock_calls)
+
+    def test_full_apply_interval_expired(self):
+        self.iptables._last_full_apply['iptables'] = 0
+        self.iptables.ipv4['filter'].add_chain('sg-1')
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-c'],
+                                     root_helper=self.root_helper)
+
+    def test_incremental_apply_disabled(self):
+        cfg.CONF.set_override('iptables_incremental_apply', False)
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-c'],
+                                     root_helper=self.root_helper)
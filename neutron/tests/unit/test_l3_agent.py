@@ -429,6 +429,101 @@ class TestBasicRouterOperations(base.BaseTestCase):
             agent._sync_routers_task(agent.context)
         self.assertTrue(f.called)
 
+    def _test__sync_routers_task_by_chunks(self):
+        self.conf.set_override('use_namespaces', True)
+        self.conf.set_override('sync_routers_chunk_size', 2)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        routers = [{'id': router_id} for router_id in ('r1', 'r2', 'r3')]
+        self.plugin_api.get_router_ids.return_value = ['r1', 'r2', 'r3']
+        self.plugin_api.get_routers.side_effect = [routers[:2], routers[2:]]
+        with contextlib.nested(
+            mock.patch.object(agent, '_cleanup_namespaces'),
+            mock.patch.object(agent._queue, 'add')
+        ) as (cleanup, add):
+            agent._sync_routers_task(agent.context)
+        return agent, add
+
+    def test__sync_routers_task_by_chunks(self):
+        agent, add = self._test__sync_routers_task_by_chunks()
+        self.plugin_api.get_routers.assert_has_calls(
+            [mock.call(agent.context, ['r1', 'r2']),
+             mock.call(agent.context, ['r3'])])
+        self.assertEqual(['r1', 'r2', 'r3'],
+                         [call[0][0].id for call in add.call_args_list])
+        self.assertFalse(agent.fullsync)
+        self.assertEqual(3, agent.sync_routers_total)
+        self.assertEqual(3, agent.sync_routers_fetched)
+
+    def test__sync_routers_task_by_chunks_unsupported(self):
+        self.conf.set_override('use_namespaces', True)
+        self.conf.set_override('sync_routers_chunk_size', 2)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_router_ids.side_effect = (
+            messaging.UnsupportedVersion('1.5'))
+        self.plugin_api.get_routers.return_value = [{'id': 'r1'}]
+        with mock.patch.object(agent, '_cleanup_namespaces'):
+            agent._sync_routers_task(agent.context)
+        self.plugin_api.get_routers.assert_called_once_with(agent.context,
+                                                            None)
+        self.assertEqual(1, agent.sync_routers_total)
+
+    def test__sync_routers_task_chunk_failure(self):
+        self.conf.set_override('use_namespaces', True)
+        self.conf.set_override('sync_routers_chunk_size', 2)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        self.plugin_api.get_router_ids.return_value = ['r1', 'r2', 'r3']
+        self.plugin_api.get_routers.side_effect = [[{'id': 'r1'}],
+                                                   Exception()]
+        with mock.patch.object(agent, '_cleanup_namespaces') as cleanup:
+            agent._sync_routers_task(agent.context)
+        self.assertTrue(agent.fullsync)
+        self.assertFalse(cleanup.called)
+        self.assertEqual(1, agent._queue.qsize())
+
+    def test_report_state_includes_sync_progress(self):
+        agent_config.register_agent_state_opts_helper(cfg.CONF)
+        with mock.patch('neutron.agent.rpc.PluginReportStateAPI') as state:
+            agent = l3_agent.L3NATAgentWithStateReport(HOSTNAME, self.conf)
+            agent.sync_routers_total = 10
+            agent.sync_routers_fetched = 4
+            agent._queue.add(l3_agent.RouterUpdate('r1',
+                                                   l3_agent.PRIORITY_RPC))
+            agent._report_state()
+        configurations = state().report_state.call_args[0][1][
+            'configurations']
+        self.assertEqual(10, configurations['sync_routers_total'])
+        self.assertEqual(4, configurations['sync_routers_fetched'])
+        self.assertEqual(1, configurations['router_updates_pending'])
+
+    def test_get_sync_priority(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        active_port = {'status': l3_constants.PORT_STATUS_ACTIVE}
+        down_port = {'status': l3_constants.PORT_STATUS_DOWN}
+        self.assertEqual(
+            l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+            agent._get_sync_priority(
+                {l3_constants.FLOATINGIP_KEY: [{'id': 'fip'}]}))
+        self.assertEqual(
+            l3_agent.PRIORITY_SYNC_ACTIVE_ROUTERS,
+            agent._get_sync_priority(
+                {l3_constants.INTERFACE_KEY: [down_port, active_port]}))
+        self.assertEqual(
+            l3_agent.PRIORITY_SYNC_IDLE_ROUTERS,
+            agent._get_sync_priority(
+                {l3_constants.INTERFACE_KEY: [down_port]}))
+
+    def test_sync_routers_with_floating_ips_first(self):
+        queue = l3_agent.RouterProcessingQueue()
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        agent._queue = queue
+        self.plugin_api.get_routers.return_value = [
+            {'id': 'idle'},
+            {'id': 'fip', l3_constants.FLOATINGIP_KEY: [{'id': 'fip1'}]}]
+        with mock.patch.object(agent, '_cleanup_namespaces'):
+            agent._sync_routers_task(agent.context)
+        updates = [queue._queue.get(), queue._queue.get()]
+        self.assertEqual(['fip', 'idle'], [u.id for u in updates])
+
     def test_router_info_create(self):
         id = _uuid()
         ri = l3_agent.RouterInfo(id, self.conf.root_helper,
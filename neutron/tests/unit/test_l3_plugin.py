@@ -20,6 +20,7 @@ import copy
 import mock
 import netaddr
 from oslo.config import cfg
+from sqlalchemy import event
 from webob import exc
 
 from neutron.api.rpc.agentnotifiers import l3_rpc_agent_api
@@ -28,6 +29,7 @@ from neutron.api.v2 import attributes
 from neutron.common import constants as l3_constants
 from neutron.common import exceptions as n_exc
 from neutron import context
+from neutron.db import api as db_api
 from neutron.db import common_db_mixin
 from neutron.db import db_base_plugin_v2
 from neutron.db import external_net_db
@@ -1871,6 +1873,52 @@ class L3AgentDbTestCaseBase(L3NatTestCaseMixin):
             self.assertIsNotNone(floatingips[0]['fixed_ip_address'])
             self.assertIsNotNone(floatingips[0]['router_id'])
 
+    def _make_sync_router(self, ext_net_id, cidr):
+        """Creates a router with a gateway, an interface and a floating IP."""
+        router = self._make_router(self.fmt, self._tenant_id,
+                                   external_gateway_info={
+                                       'network_id': ext_net_id})
+        network = self._make_network(self.fmt, 'net', True)
+        subnet = self._make_subnet(self.fmt, network,
+                                   str(netaddr.IPNetwork(cidr)[1]), cidr)
+        self._router_interface_action('add', router['router']['id'],
+                                      subnet['subnet']['id'], None)
+        port = self._make_port(self.fmt, network['network']['id'])
+        self._make_floatingip(self.fmt, ext_net_id, port['port']['id'])
+
+    def _get_sync_data_with_query_count(self):
+        statements = []
+
+        def _count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', _count_statement)
+        try:
+            routers = self.plugin.get_sync_data(context.get_admin_context())
+        finally:
+            event.remove(engine, 'before_cursor_execute', _count_statement)
+        return routers, len(statements)
+
+    def test_l3_agent_routers_query_count_is_constant(self):
+        ext_net = self._make_network(self.fmt, 'ext_net', True)
+        self._make_subnet(self.fmt, ext_net, '11.0.0.1', '11.0.0.0/24')
+        self._set_net_external(ext_net['network']['id'])
+        self._make_sync_router(ext_net['network']['id'], '10.0.0.0/24')
+        routers, query_count = self._get_sync_data_with_query_count()
+        self.assertEqual(1, len(routers))
+
+        for i in range(1, 4):
+            self._make_sync_router(ext_net['network']['id'],
+                                   '10.0.%d.0/24' % i)
+        routers, more_query_count = self._get_sync_data_with_query_count()
+        self.assertEqual(4, len(routers))
+        for router in routers:
+            self.assertIn('gw_port', router)
+            self.assertEqual(1, len(router[l3_constants.INTERFACE_KEY]))
+            self.assertEqual(1, len(router[l3_constants.FLOATINGIP_KEY]))
+        self.assertEqual(query_count, more_query_count)
+
     def _test_notify_op_agent(self, target_func, *args):
         l3_rpc_agent_api_str = (
             'neutron.api.rpc.agentnotifiers.l3_rpc_agent_api.L3AgentNotifyAPI')
@@ -723,6 +723,10 @@ class TestDhcpLocalProcess(TestBase):
 
 
 class TestDnsmasq(TestBase):
+    def setUp(self):
+        super(TestDnsmasq, self).setUp()
+        self.addCleanup(dhcp.Dnsmasq._network_states.clear)
+
     def _test_spawn(self, extra_options, network=FakeDualNetwork(),
                     max_leases=16777216, lease_duration=86400,
                     has_static=True):
@@ -1234,6 +1238,78 @@ tag:tag0,option:router""".lstrip()
         dnsmasq._release_lease.assert_has_calls([mock.call(mac2, ip2)],
                                                 any_order=True)
 
+    def _reload_incrementally(self, network):
+        self.conf.set_override('dhcp_incremental_reload', True)
+        dm = dhcp.Dnsmasq(self.conf, network,
+                          version=dhcp.Dnsmasq.MINIMUM_VERSION)
+        with contextlib.nested(
+            mock.patch.object(dhcp.Dnsmasq, 'active'),
+            mock.patch.object(dhcp.Dnsmasq, 'pid'),
+            mock.patch.object(dhcp.Dnsmasq, 'interface_name'),
+            mock.patch.object(dhcp.Dnsmasq, '_make_subnet_interface_ip_map',
+                              return_value={}),
+            mock.patch.object(dhcp.Dnsmasq, '_read_hosts_file_leases',
+                              return_value=set()),
+            mock.patch.object(dhcp.Dnsmasq, '_release_lease'),
+            mock.patch.object(dm, 'device_manager')
+        ) as (active, pid, interface_name, ip_map, read_leases,
+              release_lease, device_manager):
+            active.__get__ = mock.Mock(return_value=True)
+            pid.__get__ = mock.Mock(return_value=5)
+            interface_name.__get__ = mock.Mock(return_value='tap12345678-12')
+            dm.reload_allocations()
+        return release_lease, device_manager
+
+    def test_reload_allocations_incremental_unchanged(self):
+        self._reload_incrementally(FakeDualNetwork())
+        self.safe.reset_mock()
+        self.execute.reset_mock()
+
+        release_lease, device_manager = self._reload_incrementally(
+            FakeDualNetwork())
+
+        self.assertFalse(self.safe.called)
+        self.assertFalse(self.execute.called)
+        self.assertFalse(device_manager.update.called)
+        self.assertFalse(release_lease.called)
+
+    def test_reload_allocations_incremental_port_removed(self):
+        (exp_host_name, exp_host_data,
+         exp_addn_name, exp_addn_data,
+         exp_opt_name, exp_opt_data,) = self._test_reload_allocation_data
+        network = FakeDualNetworkGatewayRoute()
+        removed_port = network.ports[0]
+        network.ports = network.ports[1:]
+        self._reload_incrementally(FakeDualNetworkGatewayRoute())
+        self.safe.reset_mock()
+        self.execute.reset_mock()
+
+        with mock.patch.object(dhcp.Dnsmasq,
+                               '_make_port_host_entry') as make_entry:
+            release_lease, device_manager = self._reload_incrementally(
+                network)
+
+        # The entries of the other ports are reused
+        self.assertFalse(make_entry.called)
+        release_lease.assert_called_once_with(
+            removed_port.mac_address, removed_port.fixed_ips[0].ip_address)
+        self.assertEqual([mock.call(exp_host_name, mock.ANY),
+                          mock.call(exp_addn_name, mock.ANY)],
+                         self.safe.call_args_list)
+        self.assertNotIn(removed_port.mac_address,
+                         self.safe.call_args_list[0][0][1])
+        self.execute.assert_called_once_with(['kill', '-HUP', 5], 'sudo')
+        self.assertTrue(device_manager.update.called)
+
+    def test_disable_forgets_incremental_state(self):
+        network = FakeDualNetwork()
+        self._reload_incrementally(network)
+        self.assertIn(network.id, dhcp.Dnsmasq._network_states)
+        dm = dhcp.Dnsmasq(self.conf, network)
+        with mock.patch('shutil.rmtree'):
+            dm._remove_config_files()
+        self.assertNotIn(network.id, dhcp.Dnsmasq._network_states)
+
     def test_read_hosts_file_leases(self):
         filename = '/path/to/file'
         with mock.patch('os.path.exists') as mock_exists:
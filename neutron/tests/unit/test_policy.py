@@ -15,6 +15,7 @@
 
 """Test of Policy Engine For Neutron"""
 
+import contextlib
 import urllib2
 
 import fixtures
@@ -440,6 +441,63 @@ class NeutronPolicyTestCase(base.BaseTestCase):
             result = policy.enforce(self.context, action, target)
             self.assertTrue(result)
 
+    def test_enforce_tenant_id_check_parent_resource_cached(self):
+        plugin = manager.NeutronManager.get_instance().plugin
+        action = "create_port:mac"
+        with mock.patch.object(plugin, 'get_network',
+                               return_value={'tenant_id': 'fake'}) as get:
+            with policy.parent_resources_cache():
+                for i in range(2):
+                    target = {'network_id': 'whatever'}
+                    self.assertTrue(
+                        policy.enforce(self.context, action, target))
+            get.assert_called_once_with(mock.ANY, 'whatever',
+                                        fields=['tenant_id'])
+            # The cache only lasts for the enclosed calls
+            policy.enforce(self.context, action, {'network_id': 'whatever'})
+            self.assertEqual(2, get.call_count)
+
+    def test_prefetch_parent_resources(self):
+        plugin = manager.NeutronManager.get_instance().plugin
+        action = "create_port:mac"
+        targets = [{'network_id': 'net1'}, {'network_id': 'net2'},
+                   {'network_id': 'net1'}]
+        networks = [{'id': 'net1', 'tenant_id': 'fake'},
+                    {'id': 'net2', 'tenant_id': 'another'}]
+        with contextlib.nested(
+            mock.patch.object(plugin, 'get_networks', create=True,
+                              return_value=networks),
+            mock.patch.object(plugin, 'get_network', create=True)
+        ) as (get_networks, get_network):
+            with policy.parent_resources_cache():
+                policy.prefetch_parent_resources(self.context, action,
+                                                 targets)
+                self.assertTrue(
+                    policy.enforce(self.context, action, targets[0]))
+                self.assertRaises(exceptions.PolicyNotAuthorized,
+                                  policy.enforce,
+                                  self.context, action, targets[1])
+        self.assertFalse(get_network.called)
+        get_networks.assert_called_once_with(mock.ANY, filters=mock.ANY,
+                                             fields=['id', 'tenant_id'])
+        self.assertEqual(
+            ['net1', 'net2'],
+            sorted(get_networks.call_args[1]['filters']['id']))
+
+    def test_prefetch_parent_resources_not_needed(self):
+        plugin = manager.NeutronManager.get_instance().plugin
+        targets = [{'network_id': 'net1'}]
+        with mock.patch.object(plugin, 'get_networks',
+                               create=True) as get_networks:
+            # Parent resources are not cached
+            policy.prefetch_parent_resources(self.context, 'create_port:mac',
+                                             targets)
+            with policy.parent_resources_cache():
+                # The rule is a constant for an admin
+                policy.prefetch_parent_resources(
+                    context.get_admin_context(), 'create_port:mac', targets)
+        self.assertFalse(get_networks.called)
+
     def test_enforce_plugin_failure(self):
 
         def fakegetnetwork(*args, **kwargs):
@@ -496,6 +554,50 @@ class NeutronPolicyTestCase(base.BaseTestCase):
     def test_enforce_tenant_id_check_invalid_parent_resource_raises(self):
         self._test_enforce_tenant_id_raises('tenant_id:%(foobaz_tenant_id)s')
 
+    def test_compile_rule_constant_for_roles(self):
+        policy.init()
+        admin_roles = frozenset(['admin'])
+        self.assertIs(True, policy._compile_rule(
+            common_policy.RuleCheck('rule', 'get_network'), admin_roles))
+        self.assertIs(False, policy._compile_rule(
+            common_policy.RuleCheck('rule', 'admin_only'),
+            frozenset(['user'])))
+        self.assertIs(False, policy._compile_rule(
+            common_policy.RuleCheck('rule', 'not_a_rule'), admin_roles))
+
+    def test_compile_rule_keeps_target_checks(self):
+        policy.init()
+        compiled = policy._compile_rule(
+            common_policy.RuleCheck('rule', 'get_network'),
+            frozenset(['user']))
+        self.assertIsInstance(compiled, common_policy.OrCheck)
+        self.assertEqual(['tenant_id', 'field', 'field'],
+                         [rule.kind for rule in compiled.rules])
+
+    def test_compile_rule_not_check(self):
+        policy.init()
+        rule = common_policy.parse_rule('not rule:admin_only')
+        self.assertIs(False, policy._compile_rule(rule, frozenset(['admin'])))
+        rule = common_policy.parse_rule('not tenant_id:%(tenant_id)s')
+        self.assertIsInstance(policy._compile_rule(rule, frozenset()),
+                              common_policy.NotCheck)
+
+    def test_enforce_with_constant_rule_skips_target_checks(self):
+        admin_context = context.get_admin_context()
+        with mock.patch.object(policy.OwnerCheck, '__call__') as owner_check:
+            self.assertTrue(policy.enforce(admin_context, 'get_network',
+                                           {'tenant_id': 'somebody_else'}))
+            self.assertFalse(owner_check.called)
+
+    def test_compiled_rules_reset_with_rules(self):
+        policy.init()
+        roles = frozenset(['user'])
+        self.assertIs(True, policy._compile_named_rule('regular_user', roles))
+        self.rules['regular_user'] = common_policy.parse_rule('role:other')
+        policy.init()
+        self.assertIs(False, policy._compile_named_rule('regular_user',
+                                                        roles))
+
     def test_get_roles_context_is_admin_rule_missing(self):
         rules = dict((k, common_policy.parse_rule(v)) for k, v in {
             "some_other_rule": "role:admin",
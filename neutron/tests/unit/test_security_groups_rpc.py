@@ -393,8 +393,9 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
                              'remote_group_id': sg2_id,
                              'security_group_id': sg1_id},
                             ]
-                self.assertEqual(port_rpc['security_group_rules'],
-                                 expected)
+                # Rules are grouped by security group
+                self.assertEqual(sorted(expected),
+                                 sorted(port_rpc['security_group_rules']))
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
@@ -964,16 +965,251 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
                              'source_ip_prefix': fake_gateway,
                              'source_port_range_min': const.ICMPV6_TYPE_RA},
                             ]
-                self.assertEqual(port_rpc['security_group_rules'],
-                                 expected)
+                # Rules are grouped by security group
+                self.assertEqual(sorted(expected),
+                                 sorted(port_rpc['security_group_rules']))
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
+    def test_security_group_info_for_devices_with_server_cache(self):
+        cfg.CONF.set_override('enable_server_cache', True,
+                              group='SECURITYGROUP')
+        plugin = manager.NeutronManager.get_plugin()
+        cache = plugin.security_group_info_cache
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group(),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1,
+                                                              sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                rule1 = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_TCP, '24', '25',
+                    remote_group_id=sg2_id)
+                self._create_security_group_rule(self.fmt, rule1)
+                res1 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg1_id])
+                port_id1 = self.deserialize(self.fmt, res1)['port']['id']
+                res2 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg2_id])
+                port_id2 = self.deserialize(self.fmt, res2)['port']['id']
+                ctx = context.get_admin_context()
+
+                def get_info():
+                    ports = {port_id1: plugin.get_port(ctx, port_id1)}
+                    return plugin.security_group_info_for_ports(ctx, ports)
+
+                first_info = get_info()
+                with contextlib.nested(
+                    mock.patch.object(cache, '_select_rules'),
+                    mock.patch.object(cache, '_select_member_ips')
+                ) as (select_rules, select_member_ips):
+                    self.assertEqual(first_info, get_info())
+                self.assertFalse(select_rules.called)
+                self.assertFalse(select_member_ips.called)
+
+                # Member changes
+                res3 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg2_id])
+                port_id3 = self.deserialize(self.fmt, res3)['port']['id']
+                self.assertEqual(
+                    ['10.0.0.3', '10.0.0.4'],
+                    sorted(get_info()['sg_member_ips'][sg2_id]['IPv4']))
+                self._delete('ports', port_id2)
+                self.assertEqual(
+                    ['10.0.0.4'],
+                    get_info()['sg_member_ips'][sg2_id]['IPv4'])
+
+                # Rule changes
+                rule2 = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_UDP, '53', '53')
+                self._create_security_group_rule(self.fmt, rule2)
+                self.assertIn({'direction': 'ingress',
+                               'ethertype': const.IPv4,
+                               'protocol': const.PROTO_NAME_UDP,
+                               'port_range_min': 53,
+                               'port_range_max': 53},
+                              get_info()['security_groups'][sg1_id])
+                self._delete('ports', port_id1)
+                self._delete('ports', port_id3)
+
+    def test_server_cache_of_other_processes_is_invalidated(self):
+        cfg.CONF.set_override('enable_server_cache', True,
+                              group='SECURITYGROUP')
+        plugin = manager.NeutronManager.get_plugin()
+        # The cache of another server process
+        other_cache = sg_db_rpc.SecurityGroupInfoCache()
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1):
+                sg1_id = sg1['security_group']['id']
+                ctx = context.get_admin_context()
+                self.assertEqual(2, len(other_cache.get_rules(
+                    ctx, [sg1_id])[sg1_id]))
+                self.assertEqual({sg1_id: []},
+                                 other_cache.get_member_ips(ctx, [sg1_id]))
+
+                rule1 = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_TCP, '22', '22')
+                self._create_security_group_rule(self.fmt, rule1)
+                res1 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg1_id])
+                port_id1 = self.deserialize(self.fmt, res1)['port']['id']
+                self.assertIsNot(other_cache,
+                                 plugin.security_group_info_cache)
+                self.assertEqual(3, len(other_cache.get_rules(
+                    ctx, [sg1_id])[sg1_id]))
+                self.assertEqual({sg1_id: ['10.0.0.2']},
+                                 other_cache.get_member_ips(ctx, [sg1_id]))
+                self._delete('ports', port_id1)
+                self.assertEqual({sg1_id: []},
+                                 other_cache.get_member_ips(ctx, [sg1_id]))
+
+    def test_revisions_are_bumped_after_the_transaction_commits(self):
+        plugin = manager.NeutronManager.get_plugin()
+        cache = plugin.security_group_info_cache
+        with self.security_group() as sg1:
+            sg1_id = sg1['security_group']['id']
+            ctx = context.get_admin_context()
+            revision = cache._select_revisions(ctx, [sg1_id])[sg1_id]
+            with ctx.session.begin():
+                cache.invalidate(ctx, [sg1_id])
+                self.assertEqual(
+                    {sg1_id: revision},
+                    cache._select_revisions(context.get_admin_context(),
+                                            [sg1_id]))
+            self.assertEqual({sg1_id: revision + 1},
+                             cache._select_revisions(ctx, [sg1_id]))
+
+            def invalidate_and_fail():
+                with ctx.session.begin():
+                    cache.invalidate(ctx, [sg1_id])
+                    raise ValueError()
+
+            self.assertRaises(ValueError, invalidate_and_fail)
+            self.assertEqual({sg1_id: revision + 1},
+                             cache._select_revisions(ctx, [sg1_id]))
+
+    def test_notify_security_group_member_deltas(self):
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet, sg):
+                sg_id = sg['security_group']['id']
+                res = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg_id])
+                port_id = self.deserialize(self.fmt, res)['port']['id']
+                member_updated = self.notifier.security_groups_member_updated
+                member_updated.assert_called_with(
+                    mock.ANY, [sg_id],
+                    member_deltas={sg_id: {'added': ['10.0.0.2'],
+                                           'removed': []}})
+                self._delete('ports', port_id)
+                member_updated.assert_called_with(
+                    mock.ANY, [sg_id],
+                    member_deltas={sg_id: {'added': [],
+                                           'removed': ['10.0.0.2']}})
+
+    def test_security_group_member_deltas_keep_used_addresses(self):
+        plugin = manager.NeutronManager.get_plugin()
+        port = {'id': 'fake_port_id',
+                'fixed_ips': [{'ip_address': '10.0.0.3'}],
+                'allowed_address_pairs': [{'ip_address': '10.0.0.4'}],
+                ext_sg.SECURITYGROUPS: ['fake_sgid']}
+        with mock.patch.object(plugin.security_group_info_cache,
+                               'get_member_ips',
+                               return_value={'fake_sgid': ['10.0.0.3']}):
+            deltas = plugin._get_security_group_member_deltas(
+                context.get_admin_context(), port)
+        self.assertEqual({'fake_sgid': {'added': [],
+                                        'removed': ['10.0.0.4']}}, deltas)
+
 
 class SGServerRpcCallBackTestCaseXML(SGServerRpcCallBackTestCase):
     fmt = 'xml'
 
 
+class SecurityGroupInfoCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupInfoCacheTestCase, self).setUp()
+        cfg.CONF.set_override('enable_server_cache', True,
+                              group='SECURITYGROUP')
+        self.cache = sg_db_rpc.SecurityGroupInfoCache()
+        self.revisions = {'sg1': 0, 'sg2': 0}
+        self.select_revisions = mock.patch.object(
+            self.cache, '_select_revisions',
+            side_effect=lambda context, sg_ids: dict(
+                (sg_id, self.revisions[sg_id])
+                for sg_id in sg_ids if sg_id in self.revisions)).start()
+        self.select_rules = mock.patch.object(
+            self.cache, '_select_rules',
+            side_effect=lambda context, sg_ids: dict(
+                (sg_id, [{'security_group_id': sg_id}])
+                for sg_id in sg_ids)).start()
+
+    def test_get_rules_selects_missing_groups(self):
+        self.cache.get_rules(None, ['sg1'])
+        rules = self.cache.get_rules(None, ['sg1', 'sg2'])
+        self.assertEqual({'sg1': [{'security_group_id': 'sg1'}],
+                          'sg2': [{'security_group_id': 'sg2'}]}, rules)
+        self.select_rules.assert_has_calls([mock.call(None, set(['sg1'])),
+                                            mock.call(None, set(['sg2']))])
+
+    def test_get_rules_with_revisions(self):
+        self.cache.get_rules(None, ['sg1'], {'sg1': 0})
+        self.cache.get_rules(None, ['sg1'], {'sg1': 0})
+        self.assertFalse(self.select_revisions.called)
+        self.assertEqual(1, self.select_rules.call_count)
+
+    def test_changed_revision_selects_again(self):
+        self.cache.get_rules(None, ['sg1', 'sg2'])
+        # Another server process changed the group
+        self.revisions['sg1'] += 1
+        self.select_rules.reset_mock()
+        self.cache.get_rules(None, ['sg1', 'sg2'])
+        self.select_rules.assert_called_once_with(None, set(['sg1']))
+
+    def test_revision_changed_during_select_is_not_used(self):
+        def select_rules(context, sg_ids):
+            self.revisions['sg1'] += 1
+            return {'sg1': []}
+
+        self.select_rules.side_effect = select_rules
+        self.cache.get_rules(None, ['sg1'])
+        self.cache.get_rules(None, ['sg1'])
+        self.assertEqual(2, self.select_rules.call_count)
+
+    def test_deleted_group_is_not_cached(self):
+        del self.revisions['sg1']
+        self.cache.get_rules(None, ['sg1'])
+        self.cache.get_rules(None, ['sg1'])
+        self.assertEqual(2, self.select_rules.call_count)
+
+    def test_invalidate(self):
+        context = mock.MagicMock()
+        context.session.transaction = None
+        self.cache.get_rules(None, ['sg1', 'sg2'])
+        self.cache.invalidate(context, ['sg1'])
+        self.assertTrue(context.session.query.return_value.filter.
+                        return_value.update.called)
+        self.select_rules.reset_mock()
+        self.cache.get_rules(None, ['sg1', 'sg2'])
+        self.select_rules.assert_called_once_with(None, set(['sg1']))
+
+    def test_disabled_cache(self):
+        cfg.CONF.set_override('enable_server_cache', False,
+                              group='SECURITYGROUP')
+        self.cache.get_rules(None, ['sg1'])
+        self.cache.get_rules(None, ['sg1'])
+        self.assertEqual(2, self.select_rules.call_count)
+
+
 class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
     def setUp(self):
         super(SGAgentRpcCallBackMixinTestCase, self).setUp()
@@ -992,6 +1228,16 @@ class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
         self.rpc.sg_agent.assert_has_calls(
             [mock.call.security_groups_member_updated(['fake_sgid'])])
 
+    def test_security_groups_member_updated_with_deltas(self):
+        member_deltas = {'fake_sgid': {'added': ['10.0.0.1'],
+                                       'removed': []}}
+        self.rpc.security_groups_member_updated(
+            None, security_groups=['fake_sgid'],
+            member_deltas=member_deltas, sender='fake_sender', sequence=1)
+        self.rpc.sg_agent.assert_has_calls(
+            [mock.call.security_groups_member_deltas_updated(
+                ['fake_sgid'], member_deltas, 'fake_sender', 1)])
+
     def test_security_groups_provider_updated(self):
         self.rpc.security_groups_provider_updated(None)
         self.rpc.sg_agent.assert_has_calls(
@@ -1034,6 +1280,13 @@ class BaseSecurityGroupAgentRpcTestCase(base.BaseTestCase):
                                                       'fake_sgid2'}]}
         self.firewall.ports = {'fake_device': self.fake_device}
 
+    def _member_deltas_updated(self, sequence, sg_id='fake_sgid2',
+                               added=(), removed=()):
+        self.agent.security_groups_member_deltas_updated(
+            [sg_id], {sg_id: {'added': list(added),
+                              'removed': list(removed)}},
+            'fake_sender', sequence)
+
 
 class SecurityGroupAgentRpcTestCase(BaseSecurityGroupAgentRpcTestCase):
     def setUp(self, defer_refresh_firewall=False):
@@ -1083,6 +1336,13 @@ class SecurityGroupAgentRpcTestCase(BaseSecurityGroupAgentRpcTestCase):
         self.agent.security_groups_member_updated(['fake_sgid3', 'fake_sgid4'])
         self.assertFalse(self.agent.refresh_firewall.called)
 
+    def test_security_groups_member_deltas_updated(self):
+        self.agent.refresh_firewall = mock.Mock()
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self._member_deltas_updated(1, added=['10.0.0.1'])
+        self.agent.refresh_firewall.assert_has_calls(
+            [mock.call.refresh_firewall([self.fake_device['device']])])
+
     def test_security_groups_provider_updated(self):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.security_groups_provider_updated()
@@ -1177,6 +1437,52 @@ class SecurityGroupAgentEnhancedRpcTestCase(
             ['fake_sgid3', 'fake_sgid4'])
         self.assertFalse(self.agent.refresh_firewall.called)
 
+    def test_security_groups_member_deltas_updated_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.agent.refresh_firewall = mock.Mock()
+        self.agent.plugin_rpc.reset_mock()
+        self.firewall.reset_mock()
+        self._member_deltas_updated(1, added=['10.0.0.1', 'fe80::1'])
+        self._member_deltas_updated(2, added=['10.0.0.2'],
+                                    removed=['10.0.0.1'])
+        self.firewall.assert_has_calls([
+            mock.call.defer_apply(),
+            mock.call.update_security_group_members(
+                'fake_sgid2', {'IPv4': ['10.0.0.1'], 'IPv6': ['fe80::1']}),
+            mock.call.defer_apply(),
+            mock.call.update_security_group_members(
+                'fake_sgid2', {'IPv4': ['10.0.0.2'], 'IPv6': ['fe80::1']})])
+        self.assertFalse(self.agent.refresh_firewall.called)
+        self.assertFalse(self.agent.plugin_rpc.called)
+
+    def test_security_groups_member_deltas_not_updated_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.firewall.reset_mock()
+        self._member_deltas_updated(1, sg_id='fake_sgid3',
+                                    added=['10.0.0.1'])
+        self.assertFalse(self.firewall.update_security_group_members.called)
+
+    def test_security_groups_member_deltas_gap_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.agent.refresh_firewall = mock.Mock()
+        self._member_deltas_updated(1, added=['10.0.0.1'])
+        self.assertFalse(self.agent.refresh_firewall.called)
+        self._member_deltas_updated(3, added=['10.0.0.3'])
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
+        # The sequence continues after the missed updates
+        self._member_deltas_updated(4, added=['10.0.0.4'])
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
+
+    def test_security_groups_member_deltas_unknown_sender_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.agent.refresh_firewall = mock.Mock()
+        self._member_deltas_updated(5, sg_id='fake_sgid3',
+                                    added=['10.0.0.1'])
+        # Only the devices using the updated security groups are refreshed
+        self.assertFalse(self.agent.refresh_firewall.called)
+        self._member_deltas_updated(6, added=['10.0.0.2'])
+        self.assertFalse(self.agent.refresh_firewall.called)
+
     def test_security_groups_provider_updated_enhanced_rpc(self):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.security_groups_provider_updated()
@@ -1228,6 +1534,53 @@ class SecurityGroupAgentEnhancedRpcTestCase(
         self.assertFalse(self.firewall.called)
 
 
+class SecurityGroupAgentEnhancedRpcWithDeferredRefreshTestCase(
+    BaseSecurityGroupAgentRpcTestCase):
+
+    def setUp(self):
+        super(SecurityGroupAgentEnhancedRpcWithDeferredRefreshTestCase,
+              self).setUp(defer_refresh_firewall=True)
+        fake_sg_info = {
+            'security_groups': {
+                'fake_sgid1': [
+                    {'remote_group_id': 'fake_sgid2'}], 'fake_sgid2': []},
+            'sg_member_ips': {'fake_sgid2': {'IPv4': [], 'IPv6': []}},
+            'devices': self.firewall.ports}
+        self.agent.plugin_rpc.security_group_info_for_devices.return_value = (
+            fake_sg_info)
+
+    def test_security_groups_member_deltas_updated_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.firewall.reset_mock()
+        self._member_deltas_updated(1, added=['10.0.0.1'])
+        self._member_deltas_updated(2, added=['10.0.0.2'])
+        self.assertFalse(self.firewall.update_security_group_members.called)
+        self.assertTrue(self.agent.firewall_refresh_needed())
+        self.agent.setup_port_filters(set(), set())
+        self.firewall.update_security_group_members.assert_called_once_with(
+            'fake_sgid2', {'IPv4': ['10.0.0.1', '10.0.0.2'], 'IPv6': []})
+        self.assertFalse(self.agent.firewall_refresh_needed())
+
+    def test_security_groups_member_deltas_gap_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_port_id'])
+        self.agent.refresh_firewall = mock.Mock()
+        self.firewall.reset_mock()
+        self._member_deltas_updated(1, added=['10.0.0.1'])
+        self._member_deltas_updated(3, added=['10.0.0.3'])
+        self.assertFalse(self.agent.global_refresh_firewall)
+        self.assertEqual(set(['fake_device']), self.agent.devices_to_refilter)
+        self.agent.setup_port_filters(set(), set())
+        self.agent.refresh_firewall.assert_called_once_with(
+            set(['fake_device']))
+        # The deltas received in sequence are still applied
+        self.assertEqual([], self.agent.pending_member_deltas)
+
+    def test_security_groups_member_deltas_unknown_sender_enhanced_rpc(self):
+        self._member_deltas_updated(5, added=['10.0.0.1'])
+        self.assertFalse(self.agent.global_refresh_firewall)
+        self.assertEqual(set(['fake_device']), self.agent.devices_to_refilter)
+
+
 class SecurityGroupAgentRpcWithDeferredRefreshTestCase(
     SecurityGroupAgentRpcTestCase):
 
@@ -1283,6 +1636,10 @@ class SecurityGroupAgentRpcWithDeferredRefreshTestCase(
         self.agent.security_groups_member_updated(['fake_sgid2', 'fake_sgid3'])
         self.assertIn('fake_device', self.agent.devices_to_refilter)
 
+    def test_security_groups_member_deltas_updated(self):
+        self._member_deltas_updated(1, added=['10.0.0.1'])
+        self.assertIn('fake_device', self.agent.devices_to_refilter)
+
     def test_multiple_security_groups_member_updated_same_port(self):
         with self.add_fake_device(device='fake_device_2',
                                   sec_groups=['fake_sgid1', 'fake_sgid1B'],
@@ -1488,6 +1845,35 @@ class SecurityGroupAgentRpcApiTestCase(base.BaseTestCase):
                        version=sg_rpc.SG_RPC_VERSION,
                        topic='fake-security_group-update')])
 
+    def test_security_groups_member_updated_with_deltas(self):
+        member_deltas = {'fake_sgid': {'added': ['10.0.0.1'],
+                                       'removed': []}}
+        for i in range(2):
+            self.notifier.security_groups_member_updated(
+                None, security_groups=['fake_sgid'],
+                member_deltas=member_deltas)
+        sender, sequence = sg_rpc._get_member_update_sender()
+        sequences = []
+        for call in self.notifier.fanout_cast.call_args_list:
+            args = call[0][1]['args']
+            self.assertEqual(member_deltas, args['member_deltas'])
+            self.assertEqual(sender, args['sender'])
+            sequences.append(args['sequence'])
+        self.assertEqual(sequences[0] + 1, sequences[1])
+
+    def test_member_update_sender_by_process(self):
+        with mock.patch.object(sg_rpc, '_member_update_senders', {}):
+            with mock.patch('os.getpid', return_value=1):
+                sender1, sequence1 = sg_rpc._get_member_update_sender()
+                self.assertEqual(1, next(sequence1))
+                self.assertEqual((sender1, sequence1),
+                                 sg_rpc._get_member_update_sender())
+            # A forked worker process
+            with mock.patch('os.getpid', return_value=2):
+                sender2, sequence2 = sg_rpc._get_member_update_sender()
+        self.assertNotEqual(sender1, sender2)
+        self.assertEqual(1, next(sequence2))
+
     def test_security_groups_rule_not_updated(self):
         self.notifier.security_groups_rule_updated(
             None, security_groups=[])
@@ -2693,7 +3079,7 @@ class SGNotificationTestMixin():
                     self._delete('ports', port['port']['id'])
                     self.notifier.assert_has_calls(
                         [mock.call.security_groups_member_updated(
-                            mock.ANY, [mock.ANY])])
+                            mock.ANY, [mock.ANY], member_deltas=mock.ANY)])
 
 
 class TestSecurityGroupAgentWithOVSIptables(
@@ -26,6 +26,7 @@ import webob.exc
 from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as exception
+from neutron.openstack.common import jsonutils
 from neutron.tests import base
 from neutron import wsgi
 
@@ -606,6 +607,41 @@ class JSONDictSerializerTest(base.BaseTestCase):
 
         self.assertEqual(result, expected_json)
 
+    def test_json_with_generator(self):
+        input_dict = {'servers': (server for server in ['a', 'b'])}
+        serializer = wsgi.JSONDictSerializer()
+        self.assertEqual('{"servers": ["a", "b"]}',
+                         serializer.serialize(input_dict))
+
+    def test_serialize_iter_streams_generators(self):
+        serializer = wsgi.JSONDictSerializer()
+        serializer.chunk_size = 20
+        servers = [{'id': 'server%d' % i} for i in range(3)]
+        produced = []
+
+        def _servers():
+            for server in servers:
+                produced.append(server)
+                yield server
+
+        chunks = serializer.serialize_iter({'servers': _servers()})
+        self.assertEqual([], produced)
+        first_chunk = next(chunks)
+        self.assertEqual(servers[:1], produced)
+        self.assertEqual({'servers': servers},
+                         jsonutils.loads(first_chunk + ''.join(chunks)))
+
+    def test_serialize_iter_empty_generator(self):
+        serializer = wsgi.JSONDictSerializer()
+        chunks = serializer.serialize_iter(
+            {'servers': (server for server in [])})
+        self.assertEqual({'servers': []}, jsonutils.loads(''.join(chunks)))
+
+    def test_serialize_iter_without_generator(self):
+        serializer = wsgi.JSONDictSerializer()
+        self.assertEqual(['{"servers": []}'],
+                         serializer.serialize_iter({'servers': []}))
+
 
 class TextDeserializerTest(base.BaseTestCase):
 
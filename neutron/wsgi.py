@@ -24,6 +24,7 @@ import socket
 import ssl
 import sys
 import time
+import types
 from xml.etree import ElementTree as etree
 from xml.parsers import expat
 
@@ -375,12 +376,26 @@ class ActionDispatcher(object):
         raise NotImplementedError()
 
 
+def is_streamed(data):
+    """Returns whether data holds lists produced as they are serialized."""
+    return isinstance(data, dict) and any(
+        isinstance(value, types.GeneratorType) for value in data.itervalues())
+
+
 class DictSerializer(ActionDispatcher):
     """Default request body serialization."""
 
     def serialize(self, data, action='default'):
+        if is_streamed(data):
+            data = dict((key, list(value)
+                         if isinstance(value, types.GeneratorType) else value)
+                        for key, value in data.iteritems())
         return self.dispatch(data, action=action)
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize data into an iterable of body chunks."""
+        return [self.serialize(data, action)]
+
     def default(self, data):
         return ""
 
@@ -388,11 +403,54 @@ class DictSerializer(ActionDispatcher):
 class JSONDictSerializer(DictSerializer):
     """Default JSON request body serialization."""
 
+    # Size from which the serialized items of a streamed list are sent
+    chunk_size = 65536
+
     def default(self, data):
         def sanitizer(obj):
             return unicode(obj)
         return jsonutils.dumps(data, default=sanitizer)
 
+    def serialize_iter(self, data, action='default'):
+        """Serialize data into an iterable of body chunks.
+
+        The lists of data produced by generators are consumed as the chunks
+        are, so that the whole list never needs to be held in memory.
+        """
+        if action != 'default' or not is_streamed(data):
+            return super(JSONDictSerializer, self).serialize_iter(
+                data, action)
+        return self._iter_chunks(data)
+
+    def _iter_chunks(self, data):
+        chunk = []
+        chunk_len = 0
+        for part in self._iter_parts(data):
+            chunk.append(part)
+            chunk_len += len(part)
+            if chunk_len >= self.chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                chunk_len = 0
+        yield ''.join(chunk)
+
+    def _iter_parts(self, data):
+        separator = ''
+        yield '{'
+        for key, value in data.iteritems():
+            yield '%s%s: ' % (separator, self.default(key))
+            if isinstance(value, types.GeneratorType):
+                yield '['
+                item_separator = ''
+                for item in value:
+                    yield item_separator + self.default(item)
+                    item_separator = ', '
+                yield ']'
+            else:
+                yield self.default(value)
+            separator = ', '
+        yield '}'
+
 
 class XMLDictSerializer(DictSerializer):
 